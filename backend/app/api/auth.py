@@ -8,6 +8,7 @@ from sqlalchemy.orm import Session
 from typing import Dict, Any
 
 from ..core.database import get_db, get_supabase
+from ..core.supabase import supabase_manager
 from ..core.auth import get_current_user, log_user_action
 from ..core.security import (
     verify_password, get_password_hash, create_access_token,
@@ -55,10 +56,10 @@ async def register(
     try:
         # 使用Supabase进行用户注册
         supabase = get_supabase()
-        auth_response = supabase.auth.sign_up({
+        auth_response = await supabase_manager.run("sign_up", lambda: supabase.auth.sign_up({
             "email": user_data.email,
             "password": user_data.password
-        })
+        }))
         
         if auth_response.user is None:
             raise HTTPException(
@@ -109,10 +110,10 @@ async def login(
     try:
         # 使用Supabase进行用户认证
         supabase = get_supabase()
-        auth_response = supabase.auth.sign_in_with_password({
+        auth_response = await supabase_manager.run("sign_in", lambda: supabase.auth.sign_in_with_password({
             "email": login_data.email,
             "password": login_data.password
-        })
+        }))
         
         if auth_response.user is None:
             raise HTTPException(
@@ -3,15 +3,22 @@
 处理AI图片生成请求和任务管理，集成硅基流动服务
 """
 
-from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks, Request
+from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks, Request, WebSocket, WebSocketDisconnect, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from typing import Dict, Any, List, Optional
 import uuid
 from datetime import datetime, timedelta
 import logging
 
-from ..core.database import get_db
-from ..core.auth import get_current_user, check_rate_limit, log_user_action
+from ..core.database import get_db, get_async_db, AsyncSessionLocal
+from ..core.auth import get_current_user, check_rate_limit, log_user_action, verify_token
+from ..core.pagination import (
+    COUNT_APPROXIMATE, COUNT_MODE_PATTERN, InvalidCursorError,
+    count_cache, fetch_keyset_page
+)
 from ..schemas.generation import (
     GenerationRequest, GenerationResponse, GenerationTask,
     GenerationHistory, ModelsResponse, GenerationStats
@@ -23,6 +30,13 @@ from ..models.user import User
 from ..models.image import Image
 from ..services.ai_service_manager import ai_service_manager
 from ..services.siliconflow_service import siliconflow_service, SiliconFlowError
+from ..services.replicate_service import replicate_service, ReplicateError
+from ..services.quota_ledger import quota_ledger
+from ..services.task_state import transition_task
+from ..services.progress_stream import progress_hub, progress_topic, task_topic, task_event, sse_events
+from ..services.user_stats import user_stats
+from ..services.image_ingestion import image_ingestion
+from ..services.model_registry import model_registry, CATALOG_ALL
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -63,19 +77,29 @@ async def create_simple_generation(
 async def process_generation_task(
     task_id: str,
     request: GenerationRequest,
-    db: Session
+    db: Session,
+    final_attempt: bool = True
 ):
     """
     后台处理图片生成任务
+    
+    由任务队列worker调用，final_attempt为False时失败会保留任务并抛出异常以便重试
     """
     task = db.query(GenerationTaskModel).filter(GenerationTaskModel.id == task_id).first()
     if not task:
         return
     
+    topic = task_topic(task_id)
+    topic_token = progress_topic.set(topic)
+    
     try:
-        # 更新任务状态为处理中
-        task.status = "processing"
+        # 更新任务状态为处理中（排队期间已取消的任务不再处理）
+        if not transition_task(db, task_id, "processing"):
+            db.rollback()
+            logger.info(f"任务 {task_id} 已结束，跳过处理")
+            return
         db.commit()
+        await progress_hub.publish(topic, task_event(task_id, "processing", model=request.ai_model.value))
         
         # 调用AI服务生成图片
         result = await ai_service_manager.generate_image_with_fallback(
@@ -91,7 +115,18 @@ async def process_generation_task(
         )
         
         if result["success"] and result["images"]:
+            # 更新任务状态，处理期间已被取消时不保存结果
+            if not transition_task(
+                db, task_id, "completed",
+                result_url=result["images"][0],  # 主要结果URL
+                completed_at=datetime.now()
+            ):
+                db.rollback()
+                logger.info(f"任务 {task_id} 已取消，丢弃生成结果")
+                return
+            
             # 保存生成的图片到数据库
+            images = []
             for image_url in result["images"]:
                 image = Image(
                     user_id=task.user_id,
@@ -105,11 +140,7 @@ async def process_generation_task(
                     status="completed"
                 )
                 db.add(image)
-            
-            # 更新任务状态
-            task.status = "completed"
-            task.result_url = result["images"][0]  # 主要结果URL
-            task.completed_at = datetime.now()
+                images.append(image)
             
             # 更新用户生成计数
             user = db.query(User).filter(User.id == task.user_id).first()
@@ -117,31 +148,54 @@ async def process_generation_task(
                 user.generation_count += len(result["images"])
                 user.last_generation_at = datetime.now()
             
+            db.flush()
+            ingest = [(image.id, image.image_url) for image in images]
+            owner = task.user_id
             db.commit()
+            image_ingestion.submit(ingest, task_id=task_id, user_id=owner)
+            await progress_hub.publish(topic, task_event(
+                task_id, "completed", images=result["images"], result_url=result["images"][0]
+            ))
             
         else:
             raise Exception("生成结果为空")
             
     except Exception as e:
-        # 更新任务状态为失败
-        task.status = "failed"
-        task.error_message = str(e)
-        task.completed_at = datetime.now()
+        db.rollback()
+        if not final_attempt:
+            # 保留任务等待队列重试（已取消的任务不再重试）
+            if not transition_task(db, task_id, "pending", error_message=str(e)):
+                db.rollback()
+                return
+            db.commit()
+            await progress_hub.publish(topic, task_event(task_id, "retrying", error=str(e)))
+            raise
+        
+        # 更新任务状态为失败，只有本次转换成功时才归还配额
+        if not transition_task(db, task_id, "failed", error_message=str(e), completed_at=datetime.now()):
+            db.rollback()
+            return
         db.commit()
+        await quota_ledger.release_task(task)
+        await progress_hub.publish(topic, task_event(task_id, "failed", error=str(e)))
+    finally:
+        progress_topic.reset(topic_token)
 
 @router.get("/tasks/{task_id}", response_model=GenerationTask)
 async def get_generation_task(
     task_id: str,
     current_user: Dict[str, Any] = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     获取生成任务状态
     """
-    task = db.query(GenerationTaskModel).filter(
-        GenerationTaskModel.id == task_id,
-        GenerationTaskModel.user_id == current_user["id"]
-    ).first()
+    task = (await db.execute(
+        select(GenerationTaskModel).where(
+            GenerationTaskModel.id == task_id,
+            GenerationTaskModel.user_id == current_user["id"]
+        )
+    )).scalar_one_or_none()
     
     if not task:
         raise HTTPException(
@@ -151,99 +205,148 @@ async def get_generation_task(
     
     return GenerationTask.from_orm(task)
 
+def _task_snapshot_event(task: GenerationTaskModel) -> Optional[Dict[str, Any]]:
+    """已结束任务的状态事件，订阅时直接返回而无需等待推送"""
+    if task.status == "completed":
+        return task_event(task.id, "completed", result_url=task.result_url)
+    if task.status in ("failed", "cancelled"):
+        return task_event(task.id, task.status, error=task.error_message)
+    return None
+
+async def _task_events(task_id: str, snapshot: Optional[Dict[str, Any]]):
+    if snapshot is not None:
+        yield snapshot
+        return
+    async for event in progress_hub.subscribe(task_topic(task_id)):
+        yield event
+
+@router.get("/tasks/{task_id}/events")
+async def stream_generation_task_events(
+    task_id: str,
+    current_user: Dict[str, Any] = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    以Server-Sent Events推送生成任务进度，替代客户端轮询任务状态
+    """
+    task = (await db.execute(
+        select(GenerationTaskModel).where(
+            GenerationTaskModel.id == task_id,
+            GenerationTaskModel.user_id == current_user["id"]
+        )
+    )).scalar_one_or_none()
+    
+    if not task:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="任务不存在"
+        )
+    
+    return StreamingResponse(
+        sse_events(_task_events(task_id, _task_snapshot_event(task))),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.websocket("/tasks/{task_id}/ws")
+async def generation_task_websocket(
+    websocket: WebSocket,
+    task_id: str,
+    token: str = Query(...)
+):
+    """
+    以WebSocket推送生成任务进度（令牌通过查询参数传递）
+    """
+    try:
+        payload = verify_token(token)
+    except HTTPException:
+        await websocket.close(code=1008)
+        return
+    
+    # 长连接不占用请求级数据库会话，只在校验任务归属时短暂使用
+    async with AsyncSessionLocal() as db:
+        task = (await db.execute(
+            select(GenerationTaskModel).where(
+                GenerationTaskModel.id == task_id,
+                GenerationTaskModel.user_id == payload.get("sub")
+            )
+        )).scalar_one_or_none()
+        snapshot = _task_snapshot_event(task) if task else None
+    
+    if not task:
+        await websocket.close(code=1008)
+        return
+    
+    await websocket.accept()
+    events = _task_events(task_id, snapshot)
+    try:
+        async for event in events:
+            await websocket.send_json(event)
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        await events.aclose()
+
 @router.get("/tasks", response_model=GenerationHistory)
 async def get_generation_history(
-    page: int = 1,
-    size: int = 20,
+    page: int = Query(1, ge=1, description="页码（兼容旧客户端，深分页请使用cursor）"),
+    size: int = Query(20, ge=1, le=100, description="每页数量"),
+    cursor: Optional[str] = Query(None, description="分页游标，取上一页返回的next_cursor"),
+    count: str = Query(COUNT_APPROXIMATE, pattern=COUNT_MODE_PATTERN, description="总数: exact/approximate/none"),
     current_user: Dict[str, Any] = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     获取用户的生成历史
     """
-    offset = (page - 1) * size
-    
-    # 查询任务
-    tasks_query = db.query(GenerationTaskModel).filter(
-        GenerationTaskModel.user_id == current_user["id"]
-    ).order_by(GenerationTaskModel.created_at.desc())
+    stmt = select(GenerationTaskModel).where(GenerationTaskModel.user_id == current_user["id"])
     
-    total = tasks_query.count()
-    tasks = tasks_query.offset(offset).limit(size).all()
+    try:
+        tasks, next_cursor = await fetch_keyset_page(
+            db, stmt, GenerationTaskModel.created_at, GenerationTaskModel.id,
+            cursor=cursor, size=size, offset=(page - 1) * size
+        )
+    except InvalidCursorError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    total = await count_cache.count(db, ("tasks", current_user["id"]), stmt, count)
     
     return GenerationHistory(
         items=[GenerationTask.from_orm(task) for task in tasks],
         total=total,
-        page=page,
+        page=None if cursor else page,
         size=size,
-        pages=(total + size - 1) // size
+        pages=(total + size - 1) // size if total is not None else None,
+        next_cursor=next_cursor,
+        has_more=next_cursor is not None
     )
 
 @router.get("/models", response_model=ModelsResponse)
-async def get_available_models():
+async def get_available_models(request: Request):
     """
-    获取可用的AI模型列表
+    获取可用的AI模型列表（预序列化，支持ETag条件请求）
     """
-    try:
-        models = await ai_service_manager.get_all_models()
-        return ModelsResponse(
-            models=models,
-            total=len(models)
-        )
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"获取模型列表失败: {str(e)}"
-        )
+    return model_registry.catalog_response(request, CATALOG_ALL)
 
 @router.get("/stats", response_model=GenerationStats)
 async def get_generation_stats(
     current_user: Dict[str, Any] = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     获取用户的生成统计信息
     """
-    user_id = current_user["id"]
-    
-    # 统计任务数量
-    total_generations = db.query(GenerationTaskModel).filter(
-        GenerationTaskModel.user_id == user_id
-    ).count()
-    
-    successful_generations = db.query(GenerationTaskModel).filter(
-        GenerationTaskModel.user_id == user_id,
-        GenerationTaskModel.status == "completed"
-    ).count()
-    
-    failed_generations = db.query(GenerationTaskModel).filter(
-        GenerationTaskModel.user_id == user_id,
-        GenerationTaskModel.status == "failed"
-    ).count()
-    
-    pending_generations = db.query(GenerationTaskModel).filter(
-        GenerationTaskModel.user_id == user_id,
-        GenerationTaskModel.status.in_(["pending", "processing"])
-    ).count()
-    
-    # 最常用的模型
-    most_used_model_result = db.query(
-        GenerationTaskModel.ai_model,
-        db.func.count(GenerationTaskModel.ai_model).label('count')
-    ).filter(
-        GenerationTaskModel.user_id == user_id
-    ).group_by(GenerationTaskModel.ai_model).order_by(
-        db.func.count(GenerationTaskModel.ai_model).desc()
-    ).first()
-    
-    most_used_model = most_used_model_result[0] if most_used_model_result else None
+    stats = await user_stats.get(db, current_user["id"])
     
     return GenerationStats(
-        total_generations=total_generations,
-        successful_generations=successful_generations,
-        failed_generations=failed_generations,
-        pending_generations=pending_generations,
-        most_used_model=most_used_model
+        total_generations=stats["total_tasks"],
+        successful_generations=stats["successful_generations"],
+        failed_generations=stats["failed_generations"],
+        pending_generations=stats["pending_generations"],
+        most_used_model=stats["most_used_model"]
     )
 
 @router.delete("/tasks/{task_id}", response_model=SuccessResponse)
@@ -266,16 +369,25 @@ async def cancel_generation_task(
             detail="任务不存在"
         )
     
-    if task.status in ["completed", "failed"]:
+    # 条件更新：与完成/失败并发时只有一方生效，配额只归还一次
+    if not transition_task(db, task_id, "cancelled", completed_at=datetime.now()):
+        db.rollback()
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="任务已完成，无法取消"
         )
     
     try:
-        task.status = "cancelled"
-        task.completed_at = datetime.now()
         db.commit()
+        await quota_ledger.release_task(task)
+        await progress_hub.publish(task_topic(task_id), task_event(task_id, "cancelled"))
+        
+        if task.external_task_id and task.ai_model.startswith("replicate-"):
+            # 停止仍在运行的预测，避免继续计费（结果即使返回也不会再保存）
+            try:
+                await replicate_service.cancel_prediction(task.external_task_id)
+            except ReplicateError as e:
+                logger.warning(f"取消预测 {task.external_task_id} 失败: {e.message}")
         
         return SuccessResponse(message="任务已取消")
         
@@ -293,33 +405,3 @@ async def cancel_generation_task(
 # SiliconFlow specific endpoints removed for now
 
 # Service status endpoint removed for now
-
-# 辅助函数
-async def _validate_user_generation_permissions(user: User, db: Session):
-    """验证用户生成权限"""
-    
-    # 检查账户状态
-    if not hasattr(user, 'is_active') or not user.is_active:
-        raise ValueError("账户已被禁用")
-    
-    # 检查每日限制
-    daily_limits = {
-        "free": 10,
-        "premium": 100,
-        "pro": 500
-    }
-    
-    daily_limit = daily_limits.get(user.subscription_type, 10)
-    
-    # 计算今日生成次数
-    today = datetime.now().date()
-    today_count = db.query(GenerationTaskModel).filter(
-        GenerationTaskModel.user_id == user.id,
-        GenerationTaskModel.created_at >= today,
-        GenerationTaskModel.status.in_(["completed", "processing"])
-    ).count()
-    
-    if today_count >= daily_limit:
-        raise ValueError(f"已达到每日生成限制 ({daily_limit} 次)，请升级订阅或明天再试")
-    
-    return True
@@ -3,14 +3,20 @@
 处理图片的CRUD操作、分享、收藏等功能
 """
 
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from typing import Dict, Any, List, Optional
 import uuid
 from datetime import datetime, timedelta
 
-from ..core.database import get_db
+from ..core.database import get_db, get_async_db
 from ..core.auth import get_current_user, verify_user_access
+from ..core.pagination import (
+    COUNT_APPROXIMATE, COUNT_MODE_PATTERN, InvalidCursorError,
+    count_cache, fetch_keyset_page
+)
 from ..schemas.image import (
     ImageResponse, ImageUpdate, ImageList, ImageSearch,
     ImageShare, ImageShareResponse, ImageFavorite, ImageTag
@@ -20,59 +26,98 @@ from ..models.image import Image
 from ..models.user_favorite import UserFavorite
 from ..models.system_log import ImageShare as ImageShareModel
 from ..models.user import User
+from ..services.gallery_feed import gallery_feed
+from ..services.prompt_search import prompt_search, SORT_RELEVANCE, SORT_PATTERN
 
 router = APIRouter()
 
+async def _paginate_images(
+    db: AsyncSession,
+    stmt,
+    count_key: tuple,
+    page: int,
+    size: int,
+    cursor: Optional[str],
+    count: str,
+    rank=None
+) -> ImageList:
+    """执行图片列表查询，默认按 (created_at, id) 键集分页；提供相关度表达式时按相关度排序并按页码分页"""
+    if rank is not None:
+        rows = (await db.execute(
+            stmt.order_by(rank.desc(), Image.created_at.desc(), Image.id.desc())
+            .offset((page - 1) * size).limit(size + 1)
+        )).scalars().all()
+        images, next_cursor = rows[:size], None
+        has_more = len(rows) > size
+        cursor = None
+    else:
+        try:
+            images, next_cursor = await fetch_keyset_page(
+                db, stmt, Image.created_at, Image.id,
+                cursor=cursor, size=size, offset=(page - 1) * size
+            )
+        except InvalidCursorError as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=str(e)
+            )
+        has_more = next_cursor is not None
+    total = await count_cache.count(db, count_key, stmt, count)
+    
+    return ImageList(
+        images=[ImageResponse.from_orm(img) for img in images],
+        total=total,
+        page=None if cursor else page,
+        per_page=size,
+        total_pages=(total + size - 1) // size if total is not None else None,
+        next_cursor=next_cursor,
+        has_more=has_more
+    )
+
 @router.get("/", response_model=ImageList)
 async def get_user_images(
-    page: int = Query(1, ge=1, description="页码"),
+    page: int = Query(1, ge=1, description="页码（兼容旧客户端，深分页请使用cursor）"),
     size: int = Query(20, ge=1, le=100, description="每页数量"),
+    cursor: Optional[str] = Query(None, description="分页游标，取上一页返回的next_cursor"),
+    count: str = Query(COUNT_APPROXIMATE, pattern=COUNT_MODE_PATTERN, description="总数: exact/approximate/none"),
     search: Optional[str] = Query(None, description="搜索关键词"),
+    sort: str = Query(SORT_RELEVANCE, pattern=SORT_PATTERN, description="搜索结果排序: relevance/recent"),
     ai_model: Optional[str] = Query(None, description="AI模型筛选"),
     is_public: Optional[bool] = Query(None, description="是否公开"),
     current_user: Dict[str, Any] = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """获取用户的图片列表"""
     
     # 构建查询
-    query = db.query(Image).filter(Image.user_id == current_user["id"])
-    
-    # 添加搜索条件
-    if search:
-        query = query.filter(Image.prompt.ilike(f"%{search}%"))
+    stmt = select(Image).where(Image.user_id == current_user["id"])
     
     if ai_model:
-        query = query.filter(Image.ai_model == ai_model)
+        stmt = stmt.where(Image.ai_model == ai_model)
     
     if is_public is not None:
-        query = query.filter(Image.is_public == is_public)
+        stmt = stmt.where(Image.is_public == is_public)
     
-    # 排序
-    query = query.order_by(Image.created_at.desc())
-    
-    # 分页
-    total = query.count()
-    offset = (page - 1) * size
-    images = query.offset(offset).limit(size).all()
+    # 添加搜索条件
+    rank = None
+    if search:
+        stmt, rank = await prompt_search.apply(db, stmt, search)
     
-    return ImageList(
-        images=[ImageResponse.from_orm(img) for img in images],
-        total=total,
-        page=page,
-        per_page=size,
-        total_pages=(total + size - 1) // size
+    count_key = ("images", current_user["id"], search, ai_model, is_public)
+    return await _paginate_images(
+        db, stmt, count_key, page, size, cursor, count,
+        rank=rank if sort == SORT_RELEVANCE else None
     )
 
 @router.get("/{image_id}", response_model=ImageResponse)
 async def get_image_detail(
     image_id: str,
     current_user: Dict[str, Any] = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """获取图片详情"""
     
-    image = db.query(Image).filter(Image.id == image_id).first()
+    image = (await db.execute(select(Image).where(Image.id == image_id))).scalar_one_or_none()
     if not image:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -116,6 +161,7 @@ async def update_image(
     try:
         db.commit()
         db.refresh(image)
+        gallery_feed.on_image_changed(image)
         return ImageResponse.from_orm(image)
     except Exception as e:
         db.rollback()
@@ -146,6 +192,7 @@ async def delete_image(
     try:
         db.delete(image)
         db.commit()
+        gallery_feed.on_image_deleted(image_id, image.ai_model)
         return SuccessResponse(message="图片删除成功")
     except Exception as e:
         db.rollback()
@@ -156,36 +203,62 @@ async def delete_image(
 
 @router.get("/public/gallery", response_model=ImageList)
 async def get_public_gallery(
-    page: int = Query(1, ge=1, description="页码"),
+    request: Request,
+    response: Response,
+    page: int = Query(1, ge=1, description="页码（兼容旧客户端，深分页请使用cursor）"),
     size: int = Query(20, ge=1, le=100, description="每页数量"),
+    cursor: Optional[str] = Query(None, description="分页游标，取上一页返回的next_cursor"),
+    count: str = Query(COUNT_APPROXIMATE, pattern=COUNT_MODE_PATTERN, description="总数: exact/approximate/none"),
     search: Optional[str] = Query(None, description="搜索关键词"),
+    sort: str = Query(SORT_RELEVANCE, pattern=SORT_PATTERN, description="搜索结果排序: relevance/recent"),
     ai_model: Optional[str] = Query(None, description="AI模型筛选"),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """获取公开图片画廊"""
+    """获取公开图片画廊；无搜索条件时由预计算信息流提供，并支持ETag/Last-Modified条件请求"""
     
     # 构建查询 - 只显示公开图片
-    query = db.query(Image).filter(Image.is_public == True)
-    
-    # 添加搜索条件
-    if search:
-        query = query.filter(Image.prompt.ilike(f"%{search}%"))
+    stmt = select(Image).where(Image.is_public == True)
     
     if ai_model:
-        query = query.filter(Image.ai_model == ai_model)
+        stmt = stmt.where(Image.ai_model == ai_model)
     
-    # 排序
-    query = query.order_by(Image.created_at.desc())
+    # 添加搜索条件
+    if search:
+        stmt, rank = await prompt_search.apply(db, stmt, search)
+        return await _paginate_images(
+            db, stmt, ("gallery", search, ai_model), page, size, cursor, count,
+            rank=rank if sort == SORT_RELEVANCE else None
+        )
     
-    # 分页
-    total = query.count()
-    offset = (page - 1) * size
-    images = query.offset(offset).limit(size).all()
+    count_key = ("gallery", None, ai_model)
+    try:
+        feed_page = await gallery_feed.get_page(db, ai_model, cursor, (page - 1) * size, size)
+    except InvalidCursorError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    if feed_page is None:
+        # 超出信息流范围的深分页查询数据库
+        return await _paginate_images(db, stmt, count_key, page, size, cursor, count)
     
-    return ImageList(
-        images=[ImageResponse.from_orm(img) for img in images],
+    images, next_cursor, facet = feed_page
+    total = await count_cache.count(db, count_key, stmt, count)
+    result = ImageList(
+        images=images,
         total=total,
-        page=page,
+        page=None if cursor else page,
         per_page=size,
-        total_pages=(total + size - 1) // size
-    )
\ No newline at end of file
+        total_pages=(total + size - 1) // size if total is not None else None,
+        next_cursor=next_cursor,
+        has_more=next_cursor is not None
+    )
+    
+    etag = gallery_feed.etag(result.dict())
+    headers = gallery_feed.cache_headers(etag, facet.last_modified)
+    if gallery_feed.is_not_modified(request.headers, etag, facet.last_modified):
+        gallery_feed.stats["not_modified"] += 1
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    
+    response.headers.update(headers)
+    return result
@@ -3,7 +3,10 @@ Replicate专用API路由 - 增强版
 基于Replicate官方文档实现完整功能
 """
 
-from fastapi import APIRouter, Depends, HTTPException, status, Request, BackgroundTasks, Header
+from fastapi import APIRouter, Depends, HTTPException, status, Request, BackgroundTasks, Header, WebSocket, WebSocketDisconnect, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from typing import Dict, Any, List, Optional
 import uuid
@@ -11,18 +14,31 @@ from datetime import datetime
 import logging
 import json
 
-from ..core.database import get_db
-from ..core.auth import get_current_user, check_rate_limit, log_user_action
+from ..core.config import settings
+from ..core.database import get_async_db, AsyncSessionLocal
+from ..core.auth import get_current_user, check_rate_limit, log_user_action, verify_token
 from ..schemas.generation import GenerationResponse, GenerationTask
 from ..schemas.common import SuccessResponse
 from ..schemas.replicate import ReplicateWebhookPayload
 from ..models.generation_task import GenerationTask as GenerationTaskModel
 from ..models.user import User
 from ..models.image import Image
-from ..services.replicate_service import replicate_service, ReplicateError
+from ..services.replicate_service import replicate_service, ReplicateError, TaskPrediction, task_prediction
+from ..services.prediction_registry import prediction_registry
+from ..services.job_queue import generation_queue
+from ..services.quota_ledger import (
+    quota_ledger, QuotaExceededError, QuotaUnavailableError, get_daily_limit, SCOPE_REPLICATE
+)
+from ..services.progress_stream import progress_hub, progress_topic, task_topic, task_event, sse_events
+from ..services.image_ingestion import image_ingestion
+from ..services.model_registry import model_registry, CATALOG_REPLICATE
+from ..services.task_state import transition_task
+from ..services.user_stats import user_stats
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
+# Replicate回调路由，与ReplicateService.create_webhook_url生成的地址一致
+webhook_router = APIRouter()
 
 @router.post("/generate", response_model=GenerationResponse)
 async def generate_image(
@@ -43,42 +59,50 @@ async def generate_image(
     style_preset: Optional[str] = None,
     use_webhook: bool = False,
     current_user: Dict[str, Any] = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """通用图片生成接口 - 支持所有Replicate模型"""
     
     # 检查速率限制
-    check_rate_limit(request, current_user)
+    await check_rate_limit(request, current_user)
     
     # 获取用户信息
-    user = db.query(User).filter(User.id == current_user["id"]).first()
+    user = (await db.execute(select(User).where(User.id == current_user["id"]))).scalar_one_or_none()
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="用户不存在"
         )
     
-    # 验证用户权限
+    # 验证模型
     try:
-        await _validate_user_generation_permissions(user, db)
-    except ValueError as e:
+        model_info = await replicate_service.get_model_info(model)
+    except ReplicateError as e:
         raise HTTPException(
-            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            status_code=status.HTTP_400_BAD_REQUEST,
             detail=str(e)
         )
     
-    # 验证模型
+    # 验证用户权限并预占当日配额
     try:
-        model_info = await replicate_service.get_model_info(model)
-    except ReplicateError as e:
+        await _reserve_generation_quota(user)
+    except ValueError as e:
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
             detail=str(e)
         )
+    except QuotaUnavailableError:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="配额服务暂时不可用，请稍后重试"
+        )
     
     # 增强吉卜力风格提示词
     enhanced_prompt = await replicate_service.enhance_ghibli_prompt(prompt)
     
+    # 任务交给处理流程后，失败时由处理流程归还配额
+    dispatched = False
+    
     try:
         # 创建生成任务记录
         task_id = str(uuid.uuid4())
@@ -105,8 +129,7 @@ async def generate_image(
         )
         
         db.add(task)
-        db.commit()
-        db.refresh(task)
+        await db.commit()
         
         # 记录用户操作
         log_user_action(
@@ -127,20 +150,33 @@ async def generate_image(
         
         # 异步处理生成任务
         task.status = "processing"
-        db.commit()
+        await db.commit()
         
         if use_webhook:
-            # 使用webhook模式
-            webhook_url = f"{request.base_url}api/webhooks/replicate/{task_id}"
-            background_tasks.add_task(
-                _process_generation_with_webhook,
-                task_id,
-                enhanced_prompt,
-                model,
-                task.parameters,
-                webhook_url,
-                db
+            # 使用webhook模式，提交到持久化任务队列由worker进程处理
+            webhook_url = await replicate_service.create_webhook_url(
+                str(request.base_url).rstrip("/"), task_id
             )
+            try:
+                await generation_queue.enqueue(task_id, "replicate_generation", {
+                    "prompt": enhanced_prompt,
+                    "model": model,
+                    "parameters": task.parameters,
+                    "webhook_url": webhook_url
+                })
+            except Exception as e:
+                logger.error(f"提交生成任务到队列失败: {e}")
+                task.status = "failed"
+                task.error_message = "任务队列不可用"
+                task.completed_at = datetime.now()
+                await db.commit()
+                dispatched = True
+                await quota_ledger.release(user.id, SCOPE_REPLICATE)
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="任务队列暂时不可用，请稍后重试"
+                )
+            dispatched = True
             
             return GenerationResponse(
                 task_id=task.id,
@@ -149,6 +185,7 @@ async def generate_image(
             )
         else:
             # 同步处理
+            dispatched = True
             try:
                 result = await _process_generation_sync(
                     task_id,
@@ -166,11 +203,7 @@ async def generate_image(
                 )
                 
             except ReplicateError as e:
-                task.status = "failed"
-                task.error_message = e.message
-                task.completed_at = datetime.now()
-                db.commit()
-                
+                # 任务状态与配额已由处理流程更新
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
                     detail=f"图片生成失败: {e.message}"
@@ -179,7 +212,9 @@ async def generate_image(
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
+        if not dispatched:
+            await quota_ledger.release(user.id, SCOPE_REPLICATE)
         logger.error(f"Replicate generation failed: {e}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -198,7 +233,7 @@ async def generate_with_flux_schnell(
     output_quality: int = 90,
     request: Request = None,
     current_user: Dict[str, Any] = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """使用FLUX Schnell模型生成图片（快速版本）"""
     
@@ -230,7 +265,7 @@ async def generate_with_sdxl(
     style_preset: Optional[str] = None,
     request: Request = None,
     current_user: Dict[str, Any] = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """使用Stable Diffusion XL模型生成图片"""
     
@@ -261,7 +296,7 @@ async def generate_with_flux(
     num_outputs: int = 1,
     request: Request = None,
     current_user: Dict[str, Any] = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """使用FLUX模型生成图片"""
     
@@ -281,41 +316,26 @@ async def generate_with_flux(
 
 @router.get("/models")
 async def get_replicate_models(
+    request: Request,
     current_user: Dict[str, Any] = Depends(get_current_user)
 ):
     """获取Replicate支持的模型列表"""
-    try:
-        models = replicate_service.get_supported_models()
-        return {
-            "models": models,
-            "total": len(models),
-            "provider": "replicate"
-        }
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"获取模型列表失败: {str(e)}"
-        )
+    return model_registry.catalog_response(request, CATALOG_REPLICATE)
 
 @router.get("/models/{model_id}")
 async def get_model_details(
     model_id: str,
+    request: Request,
     current_user: Dict[str, Any] = Depends(get_current_user)
 ):
     """获取特定模型的详细信息"""
-    try:
-        model_info = await replicate_service.get_model_info(model_id)
-        return model_info
-    except ReplicateError as e:
+    response = model_registry.model_response(request, model_id, provider="replicate")
+    if response is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
-            detail=str(e)
-        )
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"获取模型详情失败: {str(e)}"
+            detail=f"未找到模型: {model_id}"
         )
+    return response
 
 @router.get("/account")
 async def get_replicate_account_info(
@@ -382,19 +402,107 @@ async def cancel_prediction(
             detail=f"取消预测失败: {str(e)}"
         )
 
+async def _get_prediction_task(db: AsyncSession, prediction_id: str, user_id: str) -> Optional[GenerationTaskModel]:
+    """查询用户自己的、对应该预测的生成任务"""
+    return (await db.execute(
+        select(GenerationTaskModel).where(
+            GenerationTaskModel.external_task_id == prediction_id,
+            GenerationTaskModel.user_id == user_id
+        )
+    )).scalars().first()
+
+@router.get("/predictions/{prediction_id}/events")
+async def stream_prediction_events(
+    prediction_id: str,
+    current_user: Dict[str, Any] = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """以Server-Sent Events推送预测进度，同一预测的多个连接共享一次上游轮询"""
+    if not await _get_prediction_task(db, prediction_id, current_user["id"]):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="预测不存在"
+        )
+    
+    events = progress_hub.subscribe(f"prediction:{prediction_id}", prediction_id=prediction_id)
+    return StreamingResponse(
+        sse_events(events),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.websocket("/predictions/{prediction_id}/ws")
+async def prediction_events_websocket(
+    websocket: WebSocket,
+    prediction_id: str,
+    token: str = Query(...)
+):
+    """以WebSocket推送预测进度（浏览器WebSocket无法设置请求头，令牌通过查询参数传递）"""
+    try:
+        payload = verify_token(token)
+    except HTTPException:
+        await websocket.close(code=1008)
+        return
+    
+    # 只允许订阅自己任务的预测
+    async with AsyncSessionLocal() as db:
+        task = await _get_prediction_task(db, prediction_id, payload.get("sub"))
+    if not task:
+        await websocket.close(code=1008)
+        return
+    
+    await websocket.accept()
+    events = progress_hub.subscribe(f"prediction:{prediction_id}", prediction_id=prediction_id)
+    try:
+        async for event in events:
+            await websocket.send_json(event)
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        await events.aclose()
+
+@webhook_router.post("/{task_id}")
 @router.post("/webhook/{task_id}")
 async def handle_replicate_webhook(
     task_id: str,
-    payload: ReplicateWebhookPayload,
     request: Request,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db),
+    webhook_id: Optional[str] = Header(None),
+    webhook_timestamp: Optional[str] = Header(None),
+    webhook_signature: Optional[str] = Header(None)
 ):
-    """处理Replicate webhook通知"""
+    """处理Replicate webhook通知（校验签名后才处理）"""
+    body = await request.body()
+    if not settings.REPLICATE_WEBHOOK_SECRET or not await replicate_service.verify_webhook_signature(
+        body, webhook_signature, settings.REPLICATE_WEBHOOK_SECRET, webhook_id, webhook_timestamp
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="webhook签名无效"
+        )
+    
+    try:
+        payload = ReplicateWebhookPayload.parse_raw(body)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="webhook数据格式错误"
+        )
+    
+    # 唤醒本进程内等待该预测的协程，结果由等待方负责持久化
+    if prediction_registry.resolve(payload.id, payload.dict()):
+        return {"status": "resolved"}
+    
+    if task_id == "sync":
+        # 等待方在其它进程，其轮询调度器会取得结果；返回2xx避免Replicate重试
+        return {"status": "ignored"}
+    
     try:
         # 验证任务存在
-        task = db.query(GenerationTaskModel).filter(
-            GenerationTaskModel.id == task_id
-        ).first()
+        task = (await db.execute(
+            select(GenerationTaskModel).where(GenerationTaskModel.id == task_id)
+        )).scalar_one_or_none()
         
         if not task:
             raise HTTPException(
@@ -408,38 +516,57 @@ async def handle_replicate_webhook(
             output = payload.output or []
             if isinstance(output, str):
                 output = [output]
+            result_url = output[0] if output else None
             
+            # 更新任务状态，任务已取消或已由其它路径完成时忽略
+            if not await db.run_sync(
+                transition_task, task_id, "completed", result_url=result_url, completed_at=datetime.now()
+            ):
+                await db.rollback()
+                return {"status": "ignored"}
+            
+            images = []
             for image_url in output:
                 image = Image(
                     user_id=task.user_id,
                     prompt=task.prompt,
                     ai_model=task.ai_model,
                     image_url=image_url,
-                    generation_params=task.parameters,
+                    generation_params=task.generation_params,
                     status="completed"
                 )
                 db.add(image)
-            
-            # 更新任务状态
-            task.status = "completed"
-            task.result_url = output[0] if output else None
-            task.completed_at = datetime.now()
+                images.append(image)
             
             # 更新用户统计
-            user = db.query(User).filter(User.id == task.user_id).first()
+            user = (await db.execute(select(User).where(User.id == task.user_id))).scalar_one_or_none()
             if user:
                 user.generation_count += len(output)
                 user.last_generation_at = datetime.now()
+            
+            await db.flush()
+            ingest = [(image.id, image.image_url) for image in images]
+            owner = task.user_id
+            await db.commit()
+            image_ingestion.submit(ingest, task_id=task_id, user_id=owner)
+            await progress_hub.publish(task_topic(task_id), task_event(
+                task_id, "completed", images=output, result_url=result_url
+            ))
                 
         elif payload.status == "failed":
-            task.status = "failed"
-            task.error_message = payload.error
-            task.completed_at = datetime.now()
-        
-        db.commit()
+            if not await db.run_sync(
+                transition_task, task_id, "failed", error_message=payload.error, completed_at=datetime.now()
+            ):
+                await db.rollback()
+                return {"status": "ignored"}
+            await db.commit()
+            await quota_ledger.release_task(task)
+            await progress_hub.publish(task_topic(task_id), task_event(task_id, "failed", error=payload.error))
         
         return {"status": "processed"}
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"处理webhook失败: {e}")
         raise HTTPException(
@@ -474,7 +601,7 @@ async def batch_generate_images(
     requests: List[Dict[str, Any]],
     request: Request = None,
     current_user: Dict[str, Any] = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """批量生成图片"""
     
@@ -485,10 +612,10 @@ async def batch_generate_images(
         )
     
     # 检查速率限制
-    check_rate_limit(request, current_user)
+    await check_rate_limit(request, current_user)
     
     # 获取用户信息
-    user = db.query(User).filter(User.id == current_user["id"]).first()
+    user = (await db.execute(select(User).where(User.id == current_user["id"]))).scalar_one_or_none()
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -509,8 +636,7 @@ async def batch_generate_images(
                 "results": results
             },
             request=request,
-            current_user=current_user,
-            db=db
+            current_user=current_user
         )
         
         return {
@@ -527,6 +653,39 @@ async def batch_generate_images(
             detail=f"批量生成失败: {str(e)}"
         )
 
+@router.post("/batch-generate/stream")
+async def stream_batch_generate_images(
+    requests: List[Dict[str, Any]],
+    request: Request = None,
+    current_user: Dict[str, Any] = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """批量生成图片 - 以NDJSON逐项推送已完成的结果"""
+    
+    if len(requests) > 5:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="批量请求不能超过5个"
+        )
+    
+    # 检查速率限制
+    await check_rate_limit(request, current_user)
+    
+    user = (await db.execute(select(User).where(User.id == current_user["id"]))).scalar_one_or_none()
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="用户不存在"
+        )
+    
+    batch_id = str(uuid.uuid4())
+    
+    async def result_stream():
+        async for item in replicate_service.stream_batch_generate(requests):
+            yield json.dumps({"batch_id": batch_id, **item}, ensure_ascii=False, default=str) + "\n"
+    
+    return StreamingResponse(result_stream(), media_type="application/x-ndjson")
+
 @router.get("/estimate-time")
 async def estimate_generation_time(
     model: str,
@@ -562,49 +721,38 @@ async def estimate_generation_time(
         )
 
 # 辅助函数
-async def _validate_user_generation_permissions(user: User, db: Session):
-    """验证用户生成权限"""
+async def _reserve_generation_quota(user: User) -> str:
+    """验证用户生成权限并预占Replicate当日配额，返回配额日期"""
     
     # 检查账户状态
     if not hasattr(user, 'is_active') or not user.is_active:
         raise ValueError("账户已被禁用")
     
-    # 检查每日限制
-    daily_limits = {
-        "free": 5,      # 免费用户每日5次
-        "premium": 50,  # 付费用户每日50次
-        "pro": 200      # 专业用户每日200次
-    }
-    
-    daily_limit = daily_limits.get(user.subscription_type, 5)
-    
-    # 计算今日生成次数
-    today = datetime.now().date()
-    today_count = db.query(GenerationTaskModel).filter(
-        GenerationTaskModel.user_id == user.id,
-        GenerationTaskModel.created_at >= today,
-        GenerationTaskModel.status.in_(["completed", "processing"]),
-        GenerationTaskModel.ai_model.like("replicate-%")
-    ).count()
-    
-    if today_count >= daily_limit:
+    daily_limit = get_daily_limit(SCOPE_REPLICATE, user.subscription_type)
+    try:
+        return await quota_ledger.reserve(user.id, SCOPE_REPLICATE, daily_limit)
+    except QuotaExceededError:
         raise ValueError(f"已达到Replicate每日生成限制 ({daily_limit} 次)，请升级订阅或明天再试")
-    
-    return True
 
 async def _process_generation_sync(
     task_id: str,
     prompt: str,
     model: str,
     parameters: Dict[str, Any],
-    db: Session
+    db: AsyncSession
 ) -> Dict[str, Any]:
     """同步处理生成任务"""
     
-    task = db.query(GenerationTaskModel).filter(GenerationTaskModel.id == task_id).first()
+    task = (await db.execute(
+        select(GenerationTaskModel).where(GenerationTaskModel.id == task_id)
+    )).scalar_one_or_none()
     if not task:
         raise ReplicateError("任务不存在")
     
+    topic = task_topic(task_id)
+    topic_token = progress_topic.set(topic)
+    await progress_hub.publish(topic, task_event(task_id, "processing", model=model))
+    
     try:
         # 根据模型选择生成方法
         if model == "replicate-flux-schnell":
@@ -630,13 +778,20 @@ async def _process_generation_sync(
         else:
             raise ReplicateError(f"不支持的模型: {model}")
         
-        # 保存结果
-        task.status = "completed"
-        task.result_url = result["images"][0] if result["images"] else None
-        task.completed_at = datetime.now()
+        # 保存结果，任务已被取消时丢弃
+        result_url = result["images"][0] if result["images"] else None
+        if not await db.run_sync(
+            transition_task, task_id, "completed",
+            result_url=result_url,
+            external_task_id=result.get("prediction_id"),
+            completed_at=datetime.now()
+        ):
+            await db.rollback()
+            raise ReplicateError("任务已取消")
         
         # 保存图片记录
-        user = db.query(User).filter(User.id == task.user_id).first()
+        user = (await db.execute(select(User).where(User.id == task.user_id))).scalar_one_or_none()
+        images = []
         if user:
             for image_url in result["images"]:
                 image = Image(
@@ -650,20 +805,36 @@ async def _process_generation_sync(
                     status="completed"
                 )
                 db.add(image)
+                images.append(image)
             
             user.generation_count += len(result["images"])
             user.last_generation_at = datetime.now()
         
-        db.commit()
+        await db.flush()
+        ingest = [(image.id, image.image_url) for image in images]
+        owner = task.user_id
+        await db.commit()
+        image_ingestion.submit(ingest, task_id=task_id, user_id=owner)
+        await progress_hub.publish(topic, task_event(
+            task_id, "completed", images=result["images"], result_url=result_url
+        ))
         
         return result
         
     except Exception as e:
-        task.status = "failed"
-        task.error_message = str(e)
-        task.completed_at = datetime.now()
-        db.commit()
+        await db.rollback()
+        # 只有本次转换成功时才归还配额（已取消的任务不会被覆盖为失败）
+        if await db.run_sync(transition_task, task_id, "failed", error_message=str(e), completed_at=datetime.now()):
+            await db.commit()
+            # 回滚会使已加载的属性过期，异步会话不能隐式加载
+            await db.refresh(task)
+            await quota_ledger.release_task(task)
+            await progress_hub.publish(topic, task_event(task_id, "failed", error=str(e)))
+        else:
+            await db.rollback()
         raise
+    finally:
+        progress_topic.reset(topic_token)
 
 async def _process_generation_with_webhook(
     task_id: str,
@@ -671,15 +842,30 @@ async def _process_generation_with_webhook(
     model: str,
     parameters: Dict[str, Any],
     webhook_url: str,
-    db: Session
+    db: Session,
+    final_attempt: bool = True
 ):
-    """使用webhook异步处理生成任务"""
+    """
+    使用webhook异步处理生成任务（由任务队列worker调用）
+    
+    预测以任务级webhook创建，webhook与本函数的轮询先到者完成任务；
+    预测ID创建后立即记录，任务重新投递时续接同一个预测
+    """
     
     task = db.query(GenerationTaskModel).filter(GenerationTaskModel.id == task_id).first()
     if not task:
         logger.error(f"任务不存在: {task_id}")
         return
     
+    topic = task_topic(task_id)
+    topic_token = progress_topic.set(topic)
+    prediction_token = task_prediction.set(TaskPrediction(
+        webhook=webhook_url,
+        prediction_id=task.external_task_id,
+        on_created=lambda prediction_id: _record_prediction(db, task_id, prediction_id)
+    ))
+    await progress_hub.publish(topic, task_event(task_id, "processing", model=model))
+    
     try:
         # 根据模型选择生成方法
         if model == "replicate-flux-schnell":
@@ -705,13 +891,16 @@ async def _process_generation_with_webhook(
         else:
             raise ReplicateError(f"不支持的模型: {model}")
         
-        # 保存结果
-        task.status = "completed"
-        task.result_url = result["images"][0] if result["images"] else None
-        task.completed_at = datetime.now()
+        # 保存结果，任务已被取消或已由webhook完成时丢弃
+        result_url = result["images"][0] if result["images"] else None
+        if not transition_task(db, task_id, "completed", result_url=result_url, completed_at=datetime.now()):
+            db.rollback()
+            logger.info(f"任务 {task_id} 已结束，丢弃本次结果")
+            return
         
         # 保存图片记录
         user = db.query(User).filter(User.id == task.user_id).first()
+        images = []
         if user:
             for image_url in result["images"]:
                 image = Image(
@@ -725,15 +914,51 @@ async def _process_generation_with_webhook(
                     status="completed"
                 )
                 db.add(image)
+                images.append(image)
             
             user.generation_count += len(result["images"])
             user.last_generation_at = datetime.now()
         
+        db.flush()
+        ingest = [(image.id, image.image_url) for image in images]
+        owner = task.user_id
         db.commit()
+        image_ingestion.submit(ingest, task_id=task_id, user_id=owner)
+        await progress_hub.publish(topic, task_event(
+            task_id, "completed", images=result["images"], result_url=result_url
+        ))
         
     except Exception as e:
-        task.status = "failed"
-        task.error_message = str(e)
-        task.completed_at = datetime.now()
+        db.rollback()
+        if not final_attempt:
+            # 保留任务等待队列重试（已取消的任务不再重试）
+            if not transition_task(db, task_id, "processing", error_message=str(e)):
+                db.rollback()
+                return
+            db.commit()
+            await progress_hub.publish(topic, task_event(task_id, "retrying", error=str(e)))
+            raise
+        
+        if not transition_task(db, task_id, "failed", error_message=str(e), completed_at=datetime.now()):
+            db.rollback()
+            return
         db.commit()
+        await quota_ledger.release_task(task)
+        await progress_hub.publish(topic, task_event(task_id, "failed", error=str(e)))
         logger.error(f"webhook处理失败: {e}")
+    finally:
+        task_prediction.reset(prediction_token)
+        progress_topic.reset(topic_token)
+
+def _record_prediction(db: Session, task_id: str, prediction_id: str):
+    """记录任务对应的预测ID（立即提交，重新投递的任务据此续接）"""
+    user_id = db.execute(
+        update(GenerationTaskModel)
+        .where(GenerationTaskModel.id == task_id)
+        .values(external_task_id=prediction_id)
+        .returning(GenerationTaskModel.user_id)
+        .execution_options(synchronize_session=False)
+    ).scalar()
+    # 批量UPDATE不触发ORM事件，显式失效统计缓存
+    user_stats.mark_dirty(db, user_id)
+    db.commit()
@@ -4,26 +4,31 @@
 """
 
 from fastapi import APIRouter, Depends, HTTPException, status, Query
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from typing import Dict, Any, Optional
 
-from ..core.database import get_db
+from ..core.config import settings
+from ..core.database import get_db, get_async_db
 from ..core.auth import get_current_user, verify_user_access
 from ..schemas.user import UserUpdate, UserResponse, UserProfile, UserStats
 from ..schemas.common import SuccessResponse, PaginationParams
 from ..models.user import User
 from ..models.image import Image
-from ..models.user_favorite import UserFavorite
+from ..services.principal_cache import principal_cache
+from ..services.gallery_feed import gallery_feed
+from ..services.user_stats import user_stats
 
 router = APIRouter()
 
 @router.get("/profile", response_model=UserProfile)
 async def get_user_profile(
     current_user: Dict[str, Any] = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """获取用户详细资料"""
-    user = db.query(User).filter(User.id == current_user["id"]).first()
+    user = (await db.execute(select(User).where(User.id == current_user["id"]))).scalar_one_or_none()
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -31,13 +36,13 @@ async def get_user_profile(
         )
     
     # 获取用户统计信息
-    total_images = db.query(Image).filter(Image.user_id == user.id).count()
-    total_favorites = db.query(UserFavorite).filter(UserFavorite.user_id == user.id).count()
+    stats = await user_stats.get(db, user.id)
     
     # 获取最近活动（简化版本）
-    recent_images = db.query(Image).filter(
-        Image.user_id == user.id
-    ).order_by(Image.created_at.desc()).limit(5).all()
+    recent_images = (await db.execute(
+        select(Image).where(Image.user_id == user.id)
+        .order_by(Image.created_at.desc()).limit(5)
+    )).scalars().all()
     
     recent_activity = [
         {
@@ -53,8 +58,8 @@ async def get_user_profile(
     ]
     
     user_profile = UserProfile.from_orm(user)
-    user_profile.total_images = total_images
-    user_profile.total_favorites = total_favorites
+    user_profile.total_images = stats["total_images"]
+    user_profile.total_favorites = stats["total_favorites"]
     user_profile.recent_activity = recent_activity
     
     return user_profile
@@ -93,6 +98,7 @@ async def update_user_profile(
     try:
         db.commit()
         db.refresh(user)
+        await principal_cache.invalidate_user(user.id)
         return UserResponse.from_orm(user)
     except Exception as e:
         db.rollback()
@@ -104,10 +110,10 @@ async def update_user_profile(
 @router.get("/stats", response_model=UserStats)
 async def get_user_stats(
     current_user: Dict[str, Any] = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """获取用户统计信息"""
-    user = db.query(User).filter(User.id == current_user["id"]).first()
+    user = (await db.execute(select(User).where(User.id == current_user["id"]))).scalar_one_or_none()
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -115,23 +121,24 @@ async def get_user_stats(
         )
     
     # 计算统计数据
-    total_images = db.query(Image).filter(Image.user_id == user.id).count()
-    total_favorites = db.query(UserFavorite).filter(UserFavorite.user_id == user.id).count()
+    stats = await user_stats.get(db, user.id)
     
     # 根据订阅类型设置生成限制
-    generation_limits = {
-        "free": 50,
-        "premium": 500,
-        "pro": 2000
-    }
-    
-    generation_limit = generation_limits.get(user.subscription_type, 50)
+    generation_limits = settings.SUBSCRIPTION_GENERATION_LIMITS
+    generation_limit = generation_limits.get(user.subscription_type, generation_limits.get("free", 0))
     remaining_generations = max(0, generation_limit - user.generation_count)
     
     return UserStats(
         total_generations=user.generation_count,
-        total_images=total_images,
-        total_favorites=total_favorites,
+        successful_generations=stats["successful_generations"],
+        failed_generations=stats["failed_generations"],
+        pending_generations=stats["pending_generations"],
+        most_used_model=stats["most_used_model"],
+        total_images=stats["total_images"],
+        public_images=stats["public_images"],
+        total_favorites=stats["total_favorites"],
+        total_likes=stats["total_likes"],
+        total_views=stats["total_views"],
         subscription_type=user.subscription_type,
         generation_limit=generation_limit,
         remaining_generations=remaining_generations
@@ -173,6 +180,8 @@ async def delete_user_account(
         # 删除用户（级联删除相关数据）
         db.delete(user)
         db.commit()
+        await principal_cache.invalidate_user(current_user["id"])
+        gallery_feed.on_user_deleted(current_user["id"])
         
         return SuccessResponse(message="账户删除成功")
     except Exception as e:
@@ -180,4 +189,39 @@ async def delete_user_account(
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"删除账户时发生错误: {str(e)}"
-        )
\ No newline at end of file
+        )
+
+@router.put("/{user_id}/status", response_model=UserResponse)
+async def update_user_status(
+    user_id: str,
+    is_active: bool = Query(..., description="是否启用账户"),
+    current_user: Dict[str, Any] = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """启用或停用用户账户（仅管理员）"""
+    if not current_user.get("is_admin", False):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="需要管理员权限"
+        )
+    
+    user = db.query(User).filter(User.id == user_id).first()
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="用户不存在"
+        )
+    
+    try:
+        user.is_active = is_active
+        db.commit()
+        db.refresh(user)
+        # 停用后已签发的令牌立即失效，不等缓存过期
+        await principal_cache.invalidate_user(user.id)
+        return UserResponse.from_orm(user)
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"更新用户状态时发生错误: {str(e)}"
+        )
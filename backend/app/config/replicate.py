@@ -4,7 +4,7 @@ Replicate API配置文件
 """
 
 from pydantic_settings import BaseSettings
-from typing import Dict, List, Tuple, Optional
+from typing import Any, Dict, List, Tuple, Optional
 import os
 
 class ReplicateConfig(BaseSettings):
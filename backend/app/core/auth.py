@@ -7,13 +7,15 @@ from datetime import datetime, timedelta
 from typing import Dict, Any, Optional
 from fastapi import HTTPException, status, Depends, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-import time
+import math
 
 from .config import settings
-from .database import get_db
+from .database import get_async_db
 from ..models.user import User
-from ..models.system_log import SystemLog
+from ..services.audit_log import audit_logger
 
 security = HTTPBearer()
 
@@ -49,10 +51,16 @@ def verify_token(token: str) -> Dict[str, Any]:
 
 async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ) -> Dict[str, Any]:
-    """获取当前用户"""
+    """获取当前用户（命中认证缓存时不解码令牌也不查询数据库）"""
+    from ..services.principal_cache import principal_cache
+    
     token = credentials.credentials
+    cached = await principal_cache.get(token)
+    if cached is not None:
+        return dict(cached)
+    
     payload = verify_token(token)
     
     user_id = payload.get("sub")
@@ -63,7 +71,7 @@ async def get_current_user(
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    user = db.query(User).filter(User.id == user_id).first()
+    user = (await db.execute(select(User).where(User.id == user_id))).scalar_one_or_none()
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -78,13 +86,15 @@ async def get_current_user(
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    return {
+    principal = {
         "id": user.id,
         "email": user.email,
         "username": user.username,
         "is_admin": user.is_admin,
         "subscription_type": user.subscription_type
     }
+    await principal_cache.set(token, principal, expires_at=payload.get("exp"))
+    return principal
 
 def verify_user_access(user: Dict[str, Any], required_role: str = None) -> bool:
     """验证用户访问权限"""
@@ -95,33 +105,35 @@ def verify_user_access(user: Dict[str, Any], required_role: str = None) -> bool:
         )
     return True
 
-# 速率限制相关
-_rate_limit_cache = {}
+async def get_current_admin(
+    current_user: Dict[str, Any] = Depends(get_current_user)
+) -> Dict[str, Any]:
+    """获取当前管理员用户，非管理员返回403"""
+    verify_user_access(current_user, required_role="admin")
+    return current_user
 
-def check_rate_limit(request: Request, user: Dict[str, Any], limit: int = 60, window: int = 60):
-    """检查速率限制"""
-    user_id = user["id"]
-    current_time = time.time()
+# 速率限制相关
+async def check_rate_limit(
+    request: Request,
+    user: Dict[str, Any],
+    limit: Optional[int] = None,
+    window: Optional[int] = None,
+    scope: str = "default"
+):
+    """检查速率限制（GCRA，多worker共享），结果写入request.state供中间件输出RateLimit-*响应头"""
+    from ..services.rate_limiter import rate_limiter
     
-    # 清理过期的记录
-    for key in list(_rate_limit_cache.keys()):
-        if current_time - _rate_limit_cache[key]["start_time"] > window:
-            del _rate_limit_cache[key]
+    limit = limit or settings.RATE_LIMIT_DEFAULT
+    window = window or settings.RATE_LIMIT_WINDOW
+    result = await rate_limiter.check(f"{scope}:{user['id']}", limit, window)
+    request.state.rate_limit = result
     
-    # 检查当前用户的请求次数
-    if user_id not in _rate_limit_cache:
-        _rate_limit_cache[user_id] = {
-            "count": 1,
-            "start_time": current_time
-        }
-    else:
-        _rate_limit_cache[user_id]["count"] += 1
-        
-        if _rate_limit_cache[user_id]["count"] > limit:
-            raise HTTPException(
-                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-                detail=f"请求过于频繁，请在{window}秒后重试"
-            )
+    if not result.allowed:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=f"请求过于频繁，请在{math.ceil(result.retry_after)}秒后重试",
+            headers=result.headers()
+        )
 
 def log_user_action(
     action: str,
@@ -132,24 +144,16 @@ def log_user_action(
     current_user: Dict[str, Any] = None,
     db: Session = None
 ):
-    """记录用户操作日志"""
-    if db is None:
-        return
-    
-    try:
-        log_entry = SystemLog(
-            user_id=current_user.get("id") if current_user else None,
-            action=action,
-            resource_type=resource_type,
-            resource_id=resource_id,
-            details=details,
-            ip_address=request.client.host if request else None,
-            user_agent=request.headers.get("user-agent") if request else None
-        )
-        
-        db.add(log_entry)
-        db.commit()
-    except Exception as e:
-        # 日志记录失败不应该影响主要功能
-        print(f"Failed to log user action: {e}")
-        db.rollback()
\ No newline at end of file
+    """
+    记录用户操作日志
+    事件放入审计日志缓冲区后立即返回，由后台任务批量写入；不再使用也不提交调用方的db会话
+    """
+    audit_logger.log({
+        "user_id": current_user.get("id") if current_user else None,
+        "action": action,
+        "resource_type": resource_type,
+        "resource_id": resource_id,
+        "details": details,
+        "ip_address": request.client.host if request and request.client else None,
+        "user_agent": request.headers.get("user-agent") if request else None
+    })
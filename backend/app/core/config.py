@@ -1,5 +1,5 @@
 import os
-from typing import Optional
+from typing import Dict, Optional
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
@@ -7,6 +7,7 @@ class Settings(BaseSettings):
     APP_NAME: str = "Ghibli AI Platform"
     VERSION: str = "1.0.0"
     DEBUG: bool = False
+    WEB_CONCURRENCY: int = int(os.getenv("WEB_CONCURRENCY", "1"))  # Web worker进程数，uvicorn/gunicorn的--workers默认读取该变量
     
     # 数据库配置
     POSTGRES_URL: str = os.getenv("POSTGRES_URL", "")
@@ -16,11 +17,82 @@ class Settings(BaseSettings):
     POSTGRES_HOST: str = os.getenv("POSTGRES_HOST", "localhost")
     POSTGRES_DATABASE: str = os.getenv("POSTGRES_DATABASE", "postgres")
     
+    # 数据库连接池配置
+    # direct: 使用POSTGRES_URL_NON_POOLING直连；pgbouncer: 使用POSTGRES_URL经连接池代理（事务模式，禁用预处理语句缓存）
+    DB_POOL_MODE: str = "direct"
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30.0  # 等待空闲连接的最长时间（秒）
+    DB_POOL_RECYCLE: int = 300
+    DB_POOL_PRE_PING: bool = True
+    ASYNC_DB_POOL_SIZE: int = 5
+    ASYNC_DB_MAX_OVERFLOW: int = 10
+    DB_POOL_METRICS_WINDOW: int = 1000  # 借出耗时统计的样本窗口
+    
+    # 分页配置
+    PAGINATION_COUNT_CACHE_TTL: float = 60.0  # 近似总数的缓存时间（秒）
+    PAGINATION_COUNT_CACHE_MAX_ENTRIES: int = 10000
+    
+    # 公开画廊信息流配置
+    GALLERY_FEED_SIZE: int = 500  # 每个分面在内存中保留的最新公开图片数
+    GALLERY_FEED_REFRESH_SECONDS: float = 30.0  # 从数据库重建的间隔，决定其他worker写入的可见延迟
+    GALLERY_FEED_MAX_FACETS: int = 20
+    GALLERY_CACHE_CONTROL: str = "public, max-age=10, stale-while-revalidate=60"
+    
+    # 提示词搜索配置（非PostgreSQL环境的进程内倒排索引）
+    SEARCH_FALLBACK_REFRESH_SECONDS: float = 30.0
+    SEARCH_FALLBACK_MAX_RESULTS: int = 1000
+    
+    # 用户统计缓存配置
+    USER_STATS_CACHE_TTL: float = 60.0  # 秒；其他进程（worker）的写入不会失效本进程缓存，统计最多滞后该时长
+    USER_STATS_CACHE_MAX_ENTRIES: int = 10000
+    
+    # 审计日志配置
+    AUDIT_LOG_SINKS: str = "database"  # 逗号分隔: database, jsonl
+    AUDIT_LOG_JSONL_PATH: str = "audit_log.jsonl"
+    AUDIT_LOG_QUEUE_SIZE: int = 10000  # 缓冲区上限，超出时丢弃
+    AUDIT_LOG_BATCH_SIZE: int = 500
+    AUDIT_LOG_FLUSH_INTERVAL: float = 0.5  # 秒
+    
+    # 生成图片转存配置（AI服务返回的地址会过期）
+    IMAGE_INGESTION_ENABLED: bool = True
+    IMAGE_STORAGE_BACKEND: str = "supabase"  # supabase, local
+    IMAGE_STORAGE_BUCKET: str = "images"
+    IMAGE_STORAGE_PREFIX: str = "generated"
+    IMAGE_STORAGE_LOCAL_DIR: str = "storage"
+    IMAGE_STORAGE_LOCAL_BASE_URL: str = "/storage"
+    IMAGE_INGESTION_WORKERS: int = 4
+    IMAGE_INGESTION_QUEUE_SIZE: int = 1000
+    IMAGE_INGESTION_MAX_ATTEMPTS: int = 3
+    IMAGE_INGESTION_RETRY_BASE_DELAY: float = 1.0  # 秒，指数退避
+    IMAGE_INGESTION_CHUNK_SIZE: int = 64 * 1024
+    IMAGE_INGESTION_MAX_BYTES: int = 20 * 1024 * 1024
+    # 只从AI服务的交付域名（含子域名）转存，逗号分隔
+    IMAGE_INGESTION_ALLOWED_HOSTS: str = "replicate.delivery,siliconflow.cn,sc-maas.oss-cn-shanghai.aliyuncs.com"
+    
+    # 缩略图与响应式尺寸配置
+    IMAGE_VARIANTS_ENABLED: bool = True
+    IMAGE_VARIANT_WIDTHS: str = "256,512,1024"
+    IMAGE_VARIANT_FORMATS: str = "webp,avif"  # 第一个为缩略图格式；无法编码的格式自动跳过
+    IMAGE_VARIANT_QUALITY: int = 80
+    IMAGE_THUMBNAIL_WIDTH: int = 256
+    IMAGE_VARIANT_PROCESSES: int = 2
+    
+    # 模型目录配置
+    MODEL_CATALOG_CACHE_CONTROL: str = "public, max-age=300, stale-while-revalidate=86400"
+    MODEL_REGISTRY_REFRESH_INTERVAL: float = 0.0  # 秒，大于0时后台从服务商接口刷新
+    
     # Supabase配置
     SUPABASE_URL: str = os.getenv("SUPABASE_URL", "")
     SUPABASE_ANON_KEY: str = os.getenv("SUPABASE_ANON_KEY", "")
     SUPABASE_SERVICE_ROLE_KEY: str = os.getenv("SUPABASE_SERVICE_ROLE_KEY", "")
     SUPABASE_JWT_SECRET: str = os.getenv("SUPABASE_JWT_SECRET", "")
+    SUPABASE_THREAD_POOL_SIZE: int = 8  # 同步客户端调用的专用线程数
+    SUPABASE_CALL_TIMEOUT: float = 10.0  # 秒
+    SUPABASE_UPLOAD_TIMEOUT: float = 60.0  # 秒
+    SUPABASE_METRICS_WINDOW: int = 500  # 每个操作保留的耗时样本数
+    STORAGE_RECONCILE_INTERVAL: float = 3600.0  # 秒，存储用量全量校正间隔
+    STORAGE_LIST_PAGE_SIZE: int = 1000
     
     # JWT配置
     SECRET_KEY: str = os.getenv("SECRET_KEY", "your-secret-key-here")
@@ -35,10 +107,90 @@ class Settings(BaseSettings):
     # Replicate配置
     REPLICATE_WEBHOOK_URL: Optional[str] = os.getenv("REPLICATE_WEBHOOK_URL")
     REPLICATE_WEBHOOK_SECRET: Optional[str] = os.getenv("REPLICATE_WEBHOOK_SECRET")
+    REPLICATE_WEBHOOK_TOLERANCE: int = 300  # webhook-timestamp与当前时间的最大偏差（秒），防止重放
+    
+    # Replicate轮询调度配置
+    REPLICATE_POLL_FIRST_RATIO: float = 0.8  # 首次查询时间 = 模型预估耗时 * 该系数
+    REPLICATE_POLL_DEFAULT_EXPECTED: int = 20
+    REPLICATE_POLL_MIN_INTERVAL: float = 1.0
+    REPLICATE_POLL_MAX_INTERVAL: float = 15.0
+    REPLICATE_POLL_BACKOFF: float = 1.5
+    REPLICATE_POLL_BATCH_THRESHOLD: int = 5  # 同时到期的预测达到该数量时使用批量查询
     
+    # HTTP连接池配置（AI服务共享客户端）
+    HTTP_CLIENT_HTTP2: bool = False
+    HTTP_CLIENT_KEEPALIVE_EXPIRY: float = 30.0
+    REPLICATE_MAX_CONNECTIONS: int = 50
+    REPLICATE_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    SILICONFLOW_MAX_CONNECTIONS: int = 20
+    SILICONFLOW_MAX_KEEPALIVE_CONNECTIONS: int = 10
+    IMAGE_INGESTION_MAX_CONNECTIONS: int = 10
+    
+    # 批量生成并发配置
+    REPLICATE_BATCH_CONCURRENCY: int = 5
+    SILICONFLOW_BATCH_CONCURRENCY: int = 2
+    BATCH_ITEM_TIMEOUT: float = 180.0  # 单项超时（秒）
+    
+    # 确定性生成结果缓存配置
+    RESULT_CACHE_BACKEND: str = "memory"  # memory | redis | none
+    RESULT_CACHE_TTL: int = 600  # 缓存的是服务商临时输出链接（Replicate约1小时过期），须远小于链接有效期，命中后转存仍能下载
+    RESULT_CACHE_MAX_ENTRIES: int = 1000
+
+    # 服务商熔断与对冲请求配置
+    CIRCUIT_BREAKER_WINDOW_SECONDS: float = 60.0  # 错误率统计的滚动窗口
+    CIRCUIT_BREAKER_MIN_REQUESTS: int = 5  # 窗口内请求数不足时不判定熔断
+    CIRCUIT_BREAKER_ERROR_RATE: float = 0.5
+    CIRCUIT_BREAKER_OPEN_SECONDS: float = 60.0  # 打开后经过该时间进入半开
+    CIRCUIT_BREAKER_HALF_OPEN_MAX_CALLS: int = 1
+    GENERATION_HEDGING_ENABLED: bool = False  # 主服务超过p95延迟时向备用服务商发起对冲请求
+    GENERATION_HEDGE_MIN_SAMPLES: int = 20  # 延迟样本不足时不对冲
+    GENERATION_HEDGE_MIN_DELAY: float = 2.0  # 对冲等待时间下限（秒）
+    GENERATION_LATENCY_WINDOW: int = 200  # 每个服务商/模型保留的延迟样本数
+    
+    # 服务商路由配置
+    ROUTING_STRATEGY: str = "p2c"  # p2c（二选一）| least_latency | priority
+    GENERATION_LATENCY_SLO: float = 30.0  # 生成延迟目标（秒），p95超出时降低路由权重
+    ROUTING_COST_WEIGHT: float = 100.0  # 每美元成本折算的秒数
+    ROUTING_MIN_SAMPLES: int = 10  # 所有候选样本都足够时才按实时数据路由
+    ROUTING_EXPLORATION_RATE: float = 0.05  # 向样本不足的服务商探测的概率
+
+    # 生成进度推送配置
+    PROGRESS_PUBSUB_BACKEND: Optional[str] = None  # memory | redis；未设置时跟随JOB_QUEUE_BACKEND，redis队列的worker进程需经Redis推送
+    PROGRESS_LAST_EVENT_TTL: int = 3600  # 最近事件保留时间，供晚到的订阅者补发
+    PROGRESS_TERMINAL_EVENT_TTL: int = 300  # 进程内保留结束事件的时间，供完成后才订阅的客户端补发
+    PROGRESS_SUBSCRIBER_QUEUE_SIZE: int = 100
+    PROGRESS_HEARTBEAT_INTERVAL: float = 15.0  # SSE心跳间隔（秒）
+
     # Redis配置（用于异步任务）
     REDIS_URL: str = os.getenv("REDIS_URL", "redis://localhost:6379")
     
+    # 认证主体缓存配置
+    AUTH_CACHE_BACKEND: str = "memory"  # memory（仅限单worker）| redis（多worker时失效立即生效）| none
+    AUTH_CACHE_TTL: float = 60.0  # 上限，实际不超过令牌剩余有效期
+    AUTH_CACHE_MAX_ENTRIES: int = 10000
+    
+    # 速率限制配置
+    RATE_LIMIT_BACKEND: str = "redis"  # redis（多worker共享）| memory
+    RATE_LIMIT_DEFAULT: int = 60  # 每个窗口允许的请求数
+    RATE_LIMIT_WINDOW: int = 60  # 窗口长度（秒）
+    
+    # 订阅等级配额配置（环境变量使用JSON，如 GENERATION_DAILY_LIMITS='{"free": 10}'）
+    QUOTA_BACKEND: str = "redis"  # redis（多worker共享）| memory
+    # 配额后端故障时: deny（拒绝预占，返回503）| memory（退回进程内计数，每个进程各自计数，用户最多可得进程数倍的配额）
+    QUOTA_BACKEND_FALLBACK: str = "deny"
+    GENERATION_DAILY_LIMITS: Dict[str, int] = {"free": 10, "premium": 100, "pro": 500}
+    REPLICATE_DAILY_LIMITS: Dict[str, int] = {"free": 5, "premium": 50, "pro": 200}
+    SUBSCRIPTION_GENERATION_LIMITS: Dict[str, int] = {"free": 50, "premium": 500, "pro": 2000}  # 累计生成额度
+    
+    # 生成任务队列配置
+    JOB_QUEUE_BACKEND: str = "redis"  # redis | sqlite
+    JOB_QUEUE_SQLITE_PATH: str = "generation_jobs.db"
+    JOB_QUEUE_VISIBILITY_TIMEOUT: int = 600  # 领取后未确认的任务在该时间后重新投递
+    JOB_QUEUE_MAX_ATTEMPTS: int = 3
+    JOB_QUEUE_RETRY_BASE_DELAY: float = 5.0
+    JOB_QUEUE_RETRY_MAX_DELAY: float = 120.0
+    WORKER_CONCURRENCY: int = 4
+    
     # 文件存储配置
     UPLOAD_DIR: str = "uploads"
     MAX_FILE_SIZE: int = 10 * 1024 * 1024  # 10MB
@@ -1,34 +1,53 @@
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, text, String
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import QueuePool
+from sqlalchemy.types import TypeDecorator, NullType
+from typing import AsyncIterator
+from uuid import uuid4
 import logging
 
 from .config import settings
+from .pool_metrics import InstrumentedQueuePool, InstrumentedAsyncAdaptedQueuePool, instrument_engine
 from .supabase import get_supabase_client
 
 logger = logging.getLogger(__name__)
 
 # SQLAlchemy配置
-def create_database_engine():
-    """创建数据库引擎"""
+def _pgbouncer_mode() -> bool:
+    return settings.DB_POOL_MODE == "pgbouncer"
+
+def get_database_url() -> str:
+    """按连接池模式选择连接串：pgbouncer模式使用经连接池代理的POSTGRES_URL"""
+    if _pgbouncer_mode():
+        if not settings.POSTGRES_URL:
+            raise ValueError("DB_POOL_MODE=pgbouncer时需要设置POSTGRES_URL环境变量")
+        return settings.POSTGRES_URL
     if not settings.POSTGRES_URL_NON_POOLING:
         raise ValueError("POSTGRES_URL_NON_POOLING环境变量未设置")
+    return settings.POSTGRES_URL_NON_POOLING
+
+def create_database_engine():
+    """创建数据库引擎"""
+    url = get_database_url()
+    # pgbouncer不接受options启动参数，时区使用服务端默认值（UTC）
+    connect_args = {} if _pgbouncer_mode() else {"options": "-c timezone=utc"}
     
     engine = create_engine(
-        settings.POSTGRES_URL_NON_POOLING,
-        poolclass=QueuePool,
-        pool_size=5,
-        max_overflow=10,
-        pool_pre_ping=True,
-        pool_recycle=300,
+        url,
+        poolclass=InstrumentedQueuePool,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+        pool_recycle=settings.DB_POOL_RECYCLE,
         echo=settings.DEBUG,
-        connect_args={
-            "options": "-c timezone=utc"
-        }
+        connect_args=connect_args
     )
+    instrument_engine(engine, "sync")
     
-    logger.info("✅ 数据库引擎创建成功")
+    logger.info(f"✅ 数据库引擎创建成功（模式: {settings.DB_POOL_MODE}）")
     return engine
 
 # 创建引擎和会话
@@ -36,6 +55,23 @@ engine = create_database_engine()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+class StringId(TypeDecorator):
+    """
+    字符串形式的主键/外键列。
+    迁移脚本中这些列是UUID，create_all创建时是VARCHAR；asyncpg默认给字符串参数加 ::VARCHAR，
+    与UUID列比较会报错，因此asyncpg下不声明参数类型，由服务端按列类型推断，读取时统一转为str
+    """
+    impl = String
+    cache_ok = True
+    
+    def load_dialect_impl(self, dialect):
+        if dialect.driver == "asyncpg":
+            return NullType()
+        return dialect.type_descriptor(String())
+    
+    def process_result_value(self, value, dialect):
+        return str(value) if value is not None else None
+
 # 数据库依赖
 def get_db():
     """获取数据库会话"""
@@ -45,6 +81,78 @@ def get_db():
     finally:
         db.close()
 
+# 异步数据库（asyncpg），供高频只读路由使用，不阻塞事件循环
+_async_engine = None
+_AsyncSessionLocal = None
+
+def _to_async_url(url: str):
+    """将同步连接串转换为asyncpg连接串，sslmode等libpq参数改为asyncpg的连接参数；SQLite（开发/测试）使用aiosqlite"""
+    parsed = make_url(url)
+    if parsed.get_backend_name() == "sqlite":
+        return parsed.set(drivername="sqlite+aiosqlite"), None
+    query = dict(parsed.query)
+    ssl_mode = query.pop("sslmode", None)
+    parsed = parsed.set(drivername="postgresql+asyncpg", query=query)
+    return parsed, ssl_mode
+
+def create_async_database_engine():
+    """创建异步数据库引擎"""
+    url, ssl_mode = _to_async_url(get_database_url())
+    connect_args = {} if url.get_backend_name() == "sqlite" else {"server_settings": {"timezone": "utc"}}
+    if ssl_mode and ssl_mode != "disable":
+        connect_args["ssl"] = ssl_mode
+    if _pgbouncer_mode():
+        # 事务模式下同一会话的语句可能落在不同后端连接上，禁用asyncpg预处理语句缓存并使用唯一语句名
+        url = url.update_query_dict({"prepared_statement_cache_size": "0"})
+        connect_args["statement_cache_size"] = 0
+        connect_args["prepared_statement_name_func"] = lambda: f"__asyncpg_{uuid4()}__"
+    
+    async_engine = create_async_engine(
+        url,
+        poolclass=InstrumentedAsyncAdaptedQueuePool,
+        pool_size=settings.ASYNC_DB_POOL_SIZE,
+        max_overflow=settings.ASYNC_DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        echo=settings.DEBUG,
+        connect_args=connect_args
+    )
+    instrument_engine(async_engine.sync_engine, "async")
+    
+    logger.info("✅ 异步数据库引擎创建成功")
+    return async_engine
+
+def get_async_engine():
+    """获取异步数据库引擎（首次使用时创建，未安装asyncpg时不影响同步路径）"""
+    global _async_engine, _AsyncSessionLocal
+    if _async_engine is None:
+        _async_engine = create_async_database_engine()
+        _AsyncSessionLocal = async_sessionmaker(
+            _async_engine,
+            class_=AsyncSession,
+            autoflush=False,
+            expire_on_commit=False
+        )
+    return _async_engine
+
+def AsyncSessionLocal() -> AsyncSession:
+    """创建异步数据库会话"""
+    get_async_engine()
+    return _AsyncSessionLocal()
+
+async def get_async_db() -> AsyncIterator[AsyncSession]:
+    """获取异步数据库会话"""
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def dispose_async_engine():
+    """关闭异步连接池"""
+    global _async_engine
+    if _async_engine is not None:
+        await _async_engine.dispose()
+        _async_engine = None
+
 # 测试数据库连接
 def test_database_connection():
     """测试数据库连接"""
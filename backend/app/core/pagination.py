@@ -0,0 +1,144 @@
+"""
+键集分页
+按 (created_at, id) 倒序翻页，游标为上一页最后一条记录的位置，查询代价不随页深增长。
+总数默认取带TTL缓存的计数，避免每页都执行COUNT(*)
+"""
+
+import base64
+import json
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Hashable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import func, literal, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .config import settings
+
+# 总数模式
+COUNT_EXACT = "exact"
+COUNT_APPROXIMATE = "approximate"
+COUNT_NONE = "none"
+COUNT_MODE_PATTERN = r"^(exact|approximate|none)$"
+
+
+class InvalidCursorError(ValueError):
+    """无效的分页游标"""
+    pass
+
+
+def encode_cursor(created_at: datetime, row_id: Any) -> str:
+    """将记录位置编码为不透明游标"""
+    payload = json.dumps([created_at.isoformat(), str(row_id)], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """解析游标，格式不正确时抛出InvalidCursorError"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return datetime.fromisoformat(created_at), str(row_id)
+    except Exception:
+        raise InvalidCursorError("无效的分页游标")
+
+
+def apply_keyset(stmt, created_column, id_column, cursor: Optional[str] = None, size: int = 20):
+    """按 (created_at, id) 倒序排序，从游标之后开始，多取一条用于判断是否还有下一页"""
+    stmt = stmt.order_by(created_column.desc(), id_column.desc())
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        stmt = stmt.where(tuple_(created_column, id_column) < tuple_(
+            literal(created_at, created_column.type), literal(row_id, id_column.type)
+        ))
+    return stmt.limit(size + 1)
+
+
+def split_page(rows: Sequence[Any], size: int, created_attr: str = "created_at",
+               id_attr: str = "id") -> Tuple[List[Any], Optional[str]]:
+    """截取一页并生成下一页游标"""
+    rows = list(rows)
+    if len(rows) <= size:
+        return rows, None
+    rows = rows[:size]
+    last = rows[-1]
+    return rows, encode_cursor(getattr(last, created_attr), getattr(last, id_attr))
+
+
+async def fetch_keyset_page(db: AsyncSession, stmt, created_column, id_column,
+                            cursor: Optional[str] = None, size: int = 20,
+                            offset: int = 0) -> Tuple[List[Any], Optional[str]]:
+    """
+    执行键集分页查询，返回 (当前页记录, 下一页游标)。
+    未提供游标时可以用offset兼容旧的页码参数
+    """
+    stmt = apply_keyset(stmt, created_column, id_column, cursor, size)
+    if offset and not cursor:
+        stmt = stmt.offset(offset)
+    rows = (await db.execute(stmt)).scalars().all()
+    return split_page(rows, size, created_column.key, id_column.key)
+
+
+class CountCache:
+    """筛选条件对应总数的TTL缓存，近似总数最多滞后TTL秒"""
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Tuple[float, int]]" = OrderedDict()
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "exact_counts": 0
+        }
+
+    def get(self, key: Hashable) -> Optional[int]:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            self._entries.pop(key, None)
+            self.stats["misses"] += 1
+            return None
+        self._entries.move_to_end(key)
+        self.stats["hits"] += 1
+        return entry[1]
+
+    def set(self, key: Hashable, total: int):
+        self._entries[key] = (time.monotonic() + self.ttl, total)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        self._entries.pop(key, None)
+
+    async def count(self, db: AsyncSession, key: Hashable, stmt, mode: str = COUNT_APPROXIMATE) -> Optional[int]:
+        """
+        获取总数。
+        exact: 执行COUNT并刷新缓存；approximate: 优先使用缓存；none: 不计算总数
+        """
+        if mode == COUNT_NONE:
+            return None
+        if mode == COUNT_APPROXIMATE:
+            cached = self.get(key)
+            if cached is not None:
+                return cached
+
+        total = (await db.execute(
+            select(func.count()).select_from(stmt.order_by(None).subquery())
+        )).scalar_one()
+        self.stats["exact_counts"] += 1
+        self.set(key, total)
+        return total
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取计数缓存统计"""
+        return {
+            **self.stats,
+            "size": len(self._entries),
+            "ttl": self.ttl
+        }
+
+
+# 全局分页计数缓存
+count_cache = CountCache(settings.PAGINATION_COUNT_CACHE_TTL, settings.PAGINATION_COUNT_CACHE_MAX_ENTRIES)
@@ -0,0 +1,151 @@
+"""
+数据库连接池指标
+通过QueuePool子类记录借出耗时、等待与超时，配合连接池事件统计连接的创建、借出和归还，
+用于在/metrics中观察连接池耗尽
+"""
+
+import time
+from collections import deque
+from typing import Dict, Any
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+
+from .config import settings
+
+
+class PoolMetrics:
+    """单个连接池的指标"""
+
+    def __init__(self, name: str, window: int = 1000):
+        self.name = name
+        self.pool = None
+        self._checkout_latencies = deque(maxlen=window)
+        self._wait_times = deque(maxlen=window)
+        self.stats = {
+            "connects": 0,
+            "checkouts": 0,
+            "checkins": 0,
+            "invalidated": 0,
+            "waits": 0,  # 借出时连接池（含溢出）已满、需要排队的次数
+            "timeouts": 0,
+            "max_checked_out": 0
+        }
+
+    def bind(self, pool):
+        """挂载连接池事件"""
+        self.pool = pool
+        event.listen(pool, "connect", self._on_connect)
+        event.listen(pool, "checkout", self._on_checkout)
+        event.listen(pool, "checkin", self._on_checkin)
+        event.listen(pool, "invalidate", self._on_invalidate)
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        self.stats["connects"] += 1
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        self.stats["checkouts"] += 1
+        if self.pool is not None:
+            self.stats["max_checked_out"] = max(self.stats["max_checked_out"], self.pool.checkedout())
+
+    def _on_checkin(self, dbapi_connection, connection_record):
+        self.stats["checkins"] += 1
+
+    def _on_invalidate(self, dbapi_connection, connection_record, exception):
+        self.stats["invalidated"] += 1
+
+    def record_checkout(self, latency: float, waited: bool, timed_out: bool = False):
+        self._checkout_latencies.append(latency)
+        if waited:
+            self.stats["waits"] += 1
+            self._wait_times.append(latency)
+        if timed_out:
+            self.stats["timeouts"] += 1
+
+    @staticmethod
+    def _summary(samples) -> Dict[str, float]:
+        if not samples:
+            return {"p50_ms": 0.0, "p95_ms": 0.0, "max_ms": 0.0}
+        ordered = sorted(samples)
+        return {
+            "p50_ms": round(ordered[len(ordered) // 2] * 1000, 3),
+            "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 3),
+            "max_ms": round(ordered[-1] * 1000, 3)
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取连接池指标"""
+        gauges = {}
+        if self.pool is not None:
+            gauges = {
+                "size": self.pool.size(),
+                "checked_in": self.pool.checkedin(),
+                "checked_out": self.pool.checkedout(),
+                "overflow": self.pool.overflow(),
+                "max_overflow": getattr(self.pool, "_max_overflow", None),
+                "timeout": self.pool.timeout()
+            }
+        return {
+            **gauges,
+            **self.stats,
+            "checkout_latency": self._summary(self._checkout_latencies),
+            "wait_time": self._summary(self._wait_times)
+        }
+
+
+class InstrumentedPoolMixin:
+    """记录每次从连接池借出连接的耗时；连接数已达pool_size+max_overflow时记为等待"""
+
+    metrics: PoolMetrics = None
+
+    def _do_get(self):
+        waited = self._max_overflow > -1 and self._overflow >= self._max_overflow and self._pool.empty()
+        started = time.perf_counter()
+        try:
+            record = super()._do_get()
+        except exc.TimeoutError:
+            if self.metrics is not None:
+                self.metrics.record_checkout(time.perf_counter() - started, waited, timed_out=True)
+            raise
+        if self.metrics is not None:
+            self.metrics.record_checkout(time.perf_counter() - started, waited)
+        return record
+
+    def recreate(self):
+        # dispose()后SQLAlchemy会重建连接池，事件监听随之复制，只需更新指标指向的连接池
+        pool = super().recreate()
+        if self.metrics is not None:
+            pool.metrics = self.metrics
+            self.metrics.pool = pool
+        return pool
+
+
+class InstrumentedQueuePool(InstrumentedPoolMixin, QueuePool):
+    pass
+
+
+class InstrumentedAsyncAdaptedQueuePool(InstrumentedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def instrument_engine(engine, name: str) -> PoolMetrics:
+    """为引擎的连接池挂载指标并登记到全局注册表"""
+    pool = engine.pool
+    metrics = PoolMetrics(name, window=settings.DB_POOL_METRICS_WINDOW)
+    if isinstance(pool, InstrumentedPoolMixin):
+        pool.metrics = metrics
+    metrics.bind(pool)
+    pool_metrics_registry[name] = metrics
+    return metrics
+
+
+def get_pool_stats() -> Dict[str, Any]:
+    """所有已登记连接池的指标"""
+    return {
+        "mode": settings.DB_POOL_MODE,
+        "pools": {name: metrics.get_stats() for name, metrics in pool_metrics_registry.items()}
+    }
+
+
+# 全局连接池指标注册表
+pool_metrics_registry: Dict[str, PoolMetrics] = {}
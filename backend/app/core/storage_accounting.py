@@ -0,0 +1,166 @@
+"""
+存储用量增量统计
+上传/删除文件时增量更新各存储桶和各用户的字节数与对象数，统计查询只读取计数器；
+后台定期全量列举存储桶校正计数（也用于同步其他进程的写入）
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# 对象键: (存储桶, 路径)
+ObjectKey = Tuple[str, str]
+
+
+def _empty_usage() -> Dict[str, int]:
+    return {"objects": 0, "bytes": 0}
+
+
+class StorageAccounting:
+    """存储桶/用户级别的字节数与对象数计数器"""
+
+    def __init__(self, reconcile_interval: float = 3600.0):
+        self.reconcile_interval = reconcile_interval
+        # 对象大小与归属用户，用于删除和覆盖时计算差值
+        self._objects: Dict[ObjectKey, Tuple[int, Optional[str]]] = {}
+        self._buckets: Dict[str, Dict[str, int]] = {}
+        self._users: Dict[str, Dict[str, int]] = {}
+        self._totals = _empty_usage()
+        # 全量校正期间的写入，校正结果替换计数器后重放
+        self._journal: Optional[List[tuple]] = None
+        self._source = None
+        self._task: Optional[asyncio.Task] = None
+        self.reconciled_at: Optional[float] = None
+        self.stats = {
+            "uploads": 0,
+            "deletes": 0,
+            "reconciliations": 0,
+            "reconcile_errors": 0,
+            "last_drift_bytes": 0,  # 最近一次校正时计数与实际的字节差
+            "last_reconcile_seconds": 0.0
+        }
+
+    def _adjust(self, bucket: str, owner: Optional[str], objects: int, size: int):
+        for usage in (self._totals, self._buckets.setdefault(bucket, _empty_usage())):
+            usage["objects"] += objects
+            usage["bytes"] += size
+        if owner is not None:
+            usage = self._users.setdefault(owner, _empty_usage())
+            usage["objects"] += objects
+            usage["bytes"] += size
+
+    def _apply_upload(self, bucket: str, path: str, size: int, owner: Optional[str]):
+        previous = self._objects.get((bucket, path))
+        if previous is not None:
+            # 覆盖上传：扣除旧对象，归属保持不变
+            self._adjust(bucket, previous[1], -1, -previous[0])
+            owner = previous[1] if owner is None else owner
+        self._objects[(bucket, path)] = (size, owner)
+        self._adjust(bucket, owner, 1, size)
+
+    def _apply_delete(self, bucket: str, path: str):
+        previous = self._objects.pop((bucket, path), None)
+        if previous is not None:
+            self._adjust(bucket, previous[1], -1, -previous[0])
+
+    def record_upload(self, bucket: str, path: str, size: int, owner: Optional[str] = None):
+        """上传成功后调用"""
+        self.stats["uploads"] += 1
+        owner = str(owner) if owner is not None else None
+        self._apply_upload(bucket, path, size, owner)
+        if self._journal is not None:
+            self._journal.append(("upload", bucket, path, size, owner))
+
+    def record_delete(self, bucket: str, path: str):
+        """删除成功后调用"""
+        self.stats["deletes"] += 1
+        self._apply_delete(bucket, path)
+        if self._journal is not None:
+            self._journal.append(("delete", bucket, path))
+
+    def load(self, listing: Dict[str, Iterable[Tuple[str, int]]]):
+        """用全量列举结果 {存储桶: [(路径, 大小)]} 重建计数器，保留已知对象的归属用户"""
+        previous_objects = self._objects
+        previous_bytes = self._totals["bytes"]
+        self._objects = {}
+        self._buckets = {bucket: _empty_usage() for bucket in listing}
+        self._users = {}
+        self._totals = _empty_usage()
+        for bucket, objects in listing.items():
+            for path, size in objects:
+                owner = previous_objects.get((bucket, path), (0, None))[1]
+                self._apply_upload(bucket, path, size, owner)
+        self.stats["last_drift_bytes"] = self._totals["bytes"] - previous_bytes
+
+    async def reconcile(self, source=None):
+        """
+        全量列举并校正计数器。
+        source需提供 list_buckets() -> [名称] 与 list_objects(bucket) -> [(路径, 大小)] 两个协程方法
+        """
+        source = source or self._source
+        started = time.perf_counter()
+        self._journal = []
+        try:
+            buckets = await source.list_buckets()
+            listings = await asyncio.gather(*(source.list_objects(bucket) for bucket in buckets))
+            journal = self._journal
+            self._journal = None
+            self.load(dict(zip(buckets, listings)))
+            # 重放列举期间的写入（按对象覆盖，重复应用结果不变）
+            for entry in journal:
+                if entry[0] == "upload":
+                    self._apply_upload(*entry[1:])
+                else:
+                    self._apply_delete(*entry[1:])
+        except Exception:
+            self.stats["reconcile_errors"] += 1
+            raise
+        finally:
+            self._journal = None
+        self.reconciled_at = time.time()
+        self.stats["reconciliations"] += 1
+        self.stats["last_reconcile_seconds"] = round(time.perf_counter() - started, 3)
+
+    async def _run(self):
+        while True:
+            try:
+                await self.reconcile()
+            except Exception as e:
+                logger.error(f"存储用量校正失败: {e}")
+            await asyncio.sleep(self.reconcile_interval)
+
+    def start(self, source):
+        """启动后台校正（启动后立即执行一次）"""
+        self._source = source
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def get_user_usage(self, user_id: str) -> Dict[str, int]:
+        """用户存储用量"""
+        return dict(self._users.get(str(user_id), _empty_usage()))
+
+    def get_stats(self) -> Dict[str, Any]:
+        """存储统计，只读取计数器"""
+        return {
+            "buckets": len(self._buckets),
+            "files": self._totals["objects"],
+            "total_size": self._totals["bytes"],
+            "by_bucket": {bucket: dict(usage) for bucket, usage in self._buckets.items()},
+            "reconciled_at": self.reconciled_at,
+            **self.stats
+        }
+
+
+# 全局存储用量统计
+storage_accounting = StorageAccounting(settings.STORAGE_RECONCILE_INTERVAL)
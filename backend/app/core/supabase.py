@@ -1,27 +1,98 @@
 """
 Supabase配置和工具类
-提供完整的Supabase集成支持
+提供完整的Supabase集成支持。supabase-py客户端是同步的，所有网络调用都放到
+专用的有界线程池中执行并设置超时，避免阻塞事件循环
 """
 
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Tuple, Union, Callable, TypeVar
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import asyncio
+import os
+import threading
+import time
 from supabase import create_client, Client
 from supabase.lib.client_options import ClientOptions
 
 from .config import settings
+from .storage_accounting import storage_accounting
+
+T = TypeVar("T")
+
+
+class SupabaseTimeoutError(TimeoutError):
+    """Supabase调用超时"""
+    pass
+
+
+def _latency_summary(samples) -> Dict[str, float]:
+    if not samples:
+        return {"p50_ms": 0.0, "p95_ms": 0.0, "max_ms": 0.0}
+    ordered = sorted(samples)
+    return {
+        "p50_ms": round(ordered[len(ordered) // 2] * 1000, 3),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3)
+    }
+
 
 class SupabaseManager:
     """Supabase管理器 - 统一管理Supabase服务"""
     
-    def __init__(self):
+    def __init__(
+        self,
+        max_workers: int = 8,
+        timeout: float = 10.0,
+        upload_timeout: float = 60.0,
+        metrics_window: int = 500
+    ):
         self.client: Optional[Client] = None
         self.admin_client: Optional[Client] = None
         self._initialized = False
+        self._init_lock = threading.Lock()
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.upload_timeout = upload_timeout
+        self.metrics_window = metrics_window
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._in_flight = 0
+        self._latencies: Dict[str, deque] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+    
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="supabase")
+        return self._executor
+    
+    async def run(self, operation: str, func: Callable[[], T], timeout: Optional[float] = None) -> T:
+        """
+        在线程池中执行同步的Supabase调用并记录耗时。
+        超时后不再等待结果；尚未开始执行的调用会被取消，已开始的调用在后台线程中结束
+        """
+        stats = self._stats.setdefault(operation, {"calls": 0, "errors": 0, "timeouts": 0})
+        latencies = self._latencies.setdefault(operation, deque(maxlen=self.metrics_window))
+        stats["calls"] += 1
+        self._in_flight += 1
+        started = time.perf_counter()
+        future = asyncio.get_running_loop().run_in_executor(self._get_executor(), func)
+        try:
+            return await asyncio.wait_for(future, timeout=timeout or self.timeout)
+        except asyncio.TimeoutError:
+            stats["timeouts"] += 1
+            raise SupabaseTimeoutError(f"Supabase请求超时: {operation}")
+        except Exception:
+            stats["errors"] += 1
+            raise
+        finally:
+            self._in_flight -= 1
+            latencies.append(time.perf_counter() - started)
     
     def initialize(self):
-        """初始化Supabase客户端"""
-        if not self._initialized:
+        """初始化Supabase客户端（可能在线程池中首次调用，需要加锁）"""
+        with self._init_lock:
+            if self._initialized:
+                return
             # 普通客户端（用于前端认证）
             self.client = create_client(
                 settings.SUPABASE_URL,
@@ -59,13 +130,13 @@ class SupabaseManager:
     async def sign_up(self, email: str, password: str, metadata: Dict[str, Any] = None) -> Dict[str, Any]:
         """用户注册"""
         try:
-            response = self.get_admin_client().auth.sign_up({
+            response = await self.run("sign_up", lambda: self.get_admin_client().auth.sign_up({
                 "email": email,
                 "password": password,
                 "options": {
                     "data": metadata or {}
                 }
-            })
+            }))
             
             return {
                 "success": True,
@@ -81,10 +152,10 @@ class SupabaseManager:
     async def sign_in(self, email: str, password: str) -> Dict[str, Any]:
         """用户登录"""
         try:
-            response = self.get_client().auth.sign_in_with_password({
+            response = await self.run("sign_in", lambda: self.get_client().auth.sign_in_with_password({
                 "email": email,
                 "password": password
-            })
+            }))
             
             return {
                 "success": True,
@@ -101,7 +172,7 @@ class SupabaseManager:
         """用户登出"""
         try:
             # 使用管理员客户端撤销令牌
-            self.get_admin_client().auth.admin.sign_out(access_token)
+            await self.run("sign_out", lambda: self.get_admin_client().auth.admin.sign_out(access_token))
             return {"success": True}
         except Exception as e:
             return {"success": False, "error": str(e)}
@@ -109,7 +180,7 @@ class SupabaseManager:
     async def refresh_token(self, refresh_token: str) -> Dict[str, Any]:
         """刷新访问令牌"""
         try:
-            response = self.get_client().auth.refresh_session(refresh_token)
+            response = await self.run("refresh_token", lambda: self.get_client().auth.refresh_session(refresh_token))
             return {
                 "success": True,
                 "session": response.session
@@ -123,7 +194,7 @@ class SupabaseManager:
     async def get_user_by_id(self, user_id: str) -> Optional[Dict[str, Any]]:
         """根据ID获取用户信息"""
         try:
-            response = self.get_admin_client().auth.admin.get_user_by_id(user_id)
+            response = await self.run("get_user_by_id", lambda: self.get_admin_client().auth.admin.get_user_by_id(user_id))
             return response.user.model_dump() if response.user else None
         except Exception:
             return None
@@ -131,10 +202,10 @@ class SupabaseManager:
     async def update_user(self, user_id: str, updates: Dict[str, Any]) -> Dict[str, Any]:
         """更新用户信息"""
         try:
-            response = self.get_admin_client().auth.admin.update_user_by_id(
+            response = await self.run("update_user", lambda: self.get_admin_client().auth.admin.update_user_by_id(
                 user_id,
                 updates
-            )
+            ))
             return {
                 "success": True,
                 "user": response.user
@@ -148,7 +219,7 @@ class SupabaseManager:
     async def delete_user(self, user_id: str) -> Dict[str, Any]:
         """删除用户"""
         try:
-            self.get_admin_client().auth.admin.delete_user(user_id)
+            await self.run("delete_user", lambda: self.get_admin_client().auth.admin.delete_user(user_id))
             return {"success": True}
         except Exception as e:
             return {"success": False, "error": str(e)}
@@ -156,10 +227,10 @@ class SupabaseManager:
     async def list_users(self, page: int = 1, per_page: int = 50) -> Dict[str, Any]:
         """获取用户列表"""
         try:
-            response = self.get_admin_client().auth.admin.list_users({
+            response = await self.run("list_users", lambda: self.get_admin_client().auth.admin.list_users({
                 "page": page,
                 "per_page": per_page
-            })
+            }))
             
             return {
                 "success": True,
@@ -173,52 +244,65 @@ class SupabaseManager:
             }
     
     async def get_storage_stats(self) -> Dict[str, Any]:
-        """获取存储统计信息"""
-        try:
-            # 获取存储桶统计
-            buckets = self.get_admin_client().storage.list_buckets()
-            
-            total_size = 0
-            file_count = 0
-            
-            for bucket in buckets:
-                files = self.get_admin_client().storage.from_(bucket.name).list()
-                file_count += len(files)
-                # 计算总大小（需要遍历文件）
-                for file in files:
-                    if hasattr(file, 'metadata') and file.metadata:
-                        total_size += file.metadata.get('size', 0)
-            
-            return {
-                "success": True,
-                "buckets": len(buckets),
-                "files": file_count,
-                "total_size": total_size
-            }
-        except Exception as e:
-            return {
-                "success": False,
-                "error": str(e)
-            }
+        """获取存储统计信息（读取增量计数器，不列举文件）"""
+        return {"success": True, **storage_accounting.get_stats()}
+    
+    async def list_buckets(self) -> List[str]:
+        """列出全部存储桶名称"""
+        buckets = await self.run("list_buckets", self.get_admin_client().storage.list_buckets)
+        return [bucket.name for bucket in buckets]
+    
+    async def list_objects(self, bucket: str) -> List[Tuple[str, int]]:
+        """递归列出存储桶中的全部文件，返回 (路径, 大小)"""
+        storage = self.get_admin_client().storage
+        page_size = settings.STORAGE_LIST_PAGE_SIZE
+        objects = []
+        folders = [""]
+        while folders:
+            folder = folders.pop()
+            offset = 0
+            while True:
+                entries = await self.run("list_files", lambda: storage.from_(bucket).list(
+                    folder, {"limit": page_size, "offset": offset}
+                ))
+                for entry in entries:
+                    path = f"{folder}/{entry['name']}" if folder else entry["name"]
+                    if entry.get("id") is None:
+                        # 没有id的条目是目录
+                        folders.append(path)
+                    else:
+                        objects.append((path, int((entry.get("metadata") or {}).get("size", 0))))
+                if len(entries) < page_size:
+                    break
+                offset += page_size
+        return objects
     
     async def upload_file(
         self,
         bucket: str,
         path: str,
-        file_data: bytes,
-        content_type: str = "application/octet-stream"
+        file_data: Union[bytes, str],
+        content_type: str = "application/octet-stream",
+        file_options: Optional[Dict[str, str]] = None,
+        owner: Optional[str] = None
     ) -> Dict[str, Any]:
-        """上传文件到Supabase Storage"""
+        """
+        上传文件到Supabase Storage，file_data为本地文件路径时分块读取上传。
+        owner为计入存储用量的用户
+        """
         try:
-            response = self.get_admin_client().storage.from_(bucket).upload(
+            response = await self.run("upload_file", lambda: self.get_admin_client().storage.from_(bucket).upload(
                 path,
                 file_data,
-                {"content-type": content_type}
-            )
+                {"content-type": content_type, **(file_options or {})}
+            ), timeout=self.upload_timeout)
             
-            # 获取公开URL
+            # 获取公开URL（本地拼接，无网络请求）
             public_url = self.get_admin_client().storage.from_(bucket).get_public_url(path)
             
+            size = len(file_data) if isinstance(file_data, bytes) else os.path.getsize(file_data)
+            storage_accounting.record_upload(bucket, path, size, owner)
+            
             return {
                 "success": True,
                 "path": path,
@@ -233,7 +317,8 @@ class SupabaseManager:
     async def delete_file(self, bucket: str, path: str) -> Dict[str, Any]:
         """删除文件"""
         try:
-            self.get_admin_client().storage.from_(bucket).remove([path])
+            await self.run("delete_file", lambda: self.get_admin_client().storage.from_(bucket).remove([path]))
+            storage_accounting.record_delete(bucket, path)
             return {"success": True}
         except Exception as e:
             return {"success": False, "error": str(e)}
@@ -241,10 +326,10 @@ class SupabaseManager:
     async def create_bucket(self, bucket_name: str, public: bool = True) -> Dict[str, Any]:
         """创建存储桶"""
         try:
-            self.get_admin_client().storage.create_bucket(
+            await self.run("create_bucket", lambda: self.get_admin_client().storage.create_bucket(
                 bucket_name,
                 {"public": public}
-            )
+            ))
             return {"success": True}
         except Exception as e:
             return {"success": False, "error": str(e)}
@@ -253,7 +338,9 @@ class SupabaseManager:
         """检查Supabase服务健康状态"""
         try:
             # 测试数据库连接
-            response = self.get_admin_client().table('users').select("*").limit(1).execute()
+            response = await self.run(
+                "check_health", lambda: self.get_admin_client().table('users').select("*").limit(1).execute()
+            )
             
             return {
                 "success": True,
@@ -268,8 +355,61 @@ class SupabaseManager:
                 "error": str(e)
             }
 
+    async def test_connection(self) -> Dict[str, Any]:
+        """测试Supabase各项服务是否可访问"""
+        results = {
+            "client_connection": False,
+            "admin_connection": False,
+            "database_accessible": False,
+            "auth_accessible": False,
+            "storage_accessible": False
+        }
+        try:
+            self.initialize()
+            results["client_connection"] = self.client is not None
+            results["admin_connection"] = self.admin_client is not None
+        except Exception as e:
+            results["error"] = str(e)
+            return results
+        
+        admin = self.admin_client
+        checks = {
+            "database_accessible": lambda: admin.table('users').select("id").limit(1).execute(),
+            "auth_accessible": lambda: admin.auth.admin.list_users(),
+            "storage_accessible": lambda: admin.storage.list_buckets()
+        }
+        outcomes = await asyncio.gather(
+            *(self.run(f"test_{name}", check) for name, check in checks.items()),
+            return_exceptions=True
+        )
+        for name, outcome in zip(checks, outcomes):
+            results[name] = not isinstance(outcome, BaseException)
+        return results
+    
+    def shutdown(self):
+        """关闭线程池，不等待仍在执行的调用"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取各操作的调用次数与耗时"""
+        return {
+            "max_workers": self.max_workers,
+            "in_flight": self._in_flight,
+            "operations": {
+                operation: {**stats, **_latency_summary(self._latencies[operation])}
+                for operation, stats in self._stats.items()
+            }
+        }
+
 # 全局Supabase管理器实例
-supabase_manager = SupabaseManager()
+supabase_manager = SupabaseManager(
+    max_workers=settings.SUPABASE_THREAD_POOL_SIZE,
+    timeout=settings.SUPABASE_CALL_TIMEOUT,
+    upload_timeout=settings.SUPABASE_UPLOAD_TIMEOUT,
+    metrics_window=settings.SUPABASE_METRICS_WINDOW
+)
 
 # 快捷访问函数
 def get_supabase_client() -> Client:
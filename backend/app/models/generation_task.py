@@ -2,19 +2,23 @@
 生成任务数据模型
 """
 
-from sqlalchemy import Column, String, Text, DateTime, Integer, Boolean, JSON
+from sqlalchemy import Column, Index, String, Text, DateTime, Integer, Boolean, JSON
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 import uuid
 
-from ..core.database import Base
+from ..core.database import Base, StringId
 
 class GenerationTask(Base):
     """生成任务模型"""
     __tablename__ = "generation_tasks"
+    __table_args__ = (
+        # 键集分页索引，见 migrations/003_keyset_pagination_indexes.sql
+        Index("idx_generation_tasks_user_created_id", "user_id", "created_at", "id"),
+    )
 
-    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
-    user_id = Column(String, nullable=False, index=True)
+    id = Column(StringId, primary_key=True, default=lambda: str(uuid.uuid4()))
+    user_id = Column(StringId, nullable=False)
     prompt = Column(Text, nullable=False)
     negative_prompt = Column(Text, nullable=True)
     ai_model = Column(String, nullable=False)
@@ -2,24 +2,30 @@
 图片数据模型
 """
 
-from sqlalchemy import Column, String, Text, DateTime, Integer, Boolean, JSON, Float
+from sqlalchemy import Column, Index, String, Text, DateTime, Integer, Boolean, JSON, Float, text
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 import uuid
 
-from ..core.database import Base
+from ..core.database import Base, StringId
 
 class Image(Base):
     """图片模型"""
     __tablename__ = "images"
+    __table_args__ = (
+        # 键集分页索引，见 migrations/003_keyset_pagination_indexes.sql
+        Index("idx_images_public_created_id", "created_at", "id", postgresql_where=text("is_public = TRUE")),
+        Index("idx_images_user_created_id", "user_id", "created_at", "id"),
+    )
 
-    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
-    user_id = Column(String, nullable=False, index=True)
+    id = Column(StringId, primary_key=True, default=lambda: str(uuid.uuid4()))
+    user_id = Column(StringId, nullable=False)
     prompt = Column(Text, nullable=False)
     negative_prompt = Column(Text, nullable=True)
     ai_model = Column(String, nullable=False)
     image_url = Column(Text, nullable=False)
     thumbnail_url = Column(Text, nullable=True)
+    variants = Column(JSON, nullable=True)  # {格式: {宽度: 地址}}，见 app/services/image_variants.py
     width = Column(Integer, nullable=True)
     height = Column(Integer, nullable=True)
     generation_params = Column(JSON, nullable=True)
@@ -66,10 +66,12 @@ class GenerationTask(BaseModel):
 class GenerationHistory(BaseModel):
     """生成历史"""
     items: List[GenerationTask]
-    total: int
-    page: int
+    total: Optional[int] = None
+    page: Optional[int] = None
     size: int
-    pages: int
+    pages: Optional[int] = None
+    next_cursor: Optional[str] = None
+    has_more: bool = False
 
 class ModelInfo(BaseModel):
     """模型信息"""
@@ -82,6 +84,7 @@ class ModelInfo(BaseModel):
     max_steps: int
     supports_negative_prompt: bool
     estimated_time: int
+    available: bool = True
 
 class ModelsResponse(BaseModel):
     """模型列表响应"""
@@ -15,6 +15,7 @@ class ImageResponse(BaseModel):
     ai_model: str
     image_url: str
     thumbnail_url: Optional[str] = None
+    variants: Optional[Dict[str, Dict[str, str]]] = None
     width: Optional[int] = None
     height: Optional[int] = None
     generation_params: Optional[Dict[str, Any]] = None
@@ -33,10 +34,12 @@ class ImageUpdate(BaseModel):
 class ImageList(BaseModel):
     """图片列表响应"""
     images: List[ImageResponse]
-    total: int
-    page: int
+    total: Optional[int] = None  # count=approximate时为缓存值，count=none时不返回
+    page: Optional[int] = None  # 使用游标翻页时为空
     per_page: int
-    total_pages: int
+    total_pages: Optional[int] = None
+    next_cursor: Optional[str] = None
+    has_more: bool = False
 
 class ImageSearch(BaseModel):
     """图片搜索请求"""
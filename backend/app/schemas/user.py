@@ -3,7 +3,7 @@
 """
 
 from pydantic import BaseModel, Field, EmailStr, validator
-from typing import Optional
+from typing import Optional, List, Dict, Any
 from datetime import datetime
 
 class UserLogin(BaseModel):
@@ -58,6 +58,9 @@ class UserProfile(BaseModel):
     generation_count: int = 0
     created_at: datetime
     updated_at: datetime
+    total_images: int = 0
+    total_favorites: int = 0
+    recent_activity: List[Dict[str, Any]] = []
 
     class Config:
         from_attributes = True
@@ -65,11 +68,18 @@ class UserProfile(BaseModel):
 class UserStats(BaseModel):
     """用户统计信息"""
     total_generations: int
-    successful_generations: int
-    failed_generations: int
-    public_images: int
-    total_likes: int
-    total_views: int
+    successful_generations: int = 0
+    failed_generations: int = 0
+    pending_generations: int = 0
+    most_used_model: Optional[str] = None
+    total_images: int = 0
+    public_images: int = 0
+    total_favorites: int = 0
+    total_likes: int = 0
+    total_views: int = 0
+    subscription_type: str = "free"
+    generation_limit: int = 0
+    remaining_generations: int = 0
 
 class TokenResponse(BaseModel):
     """令牌响应"""
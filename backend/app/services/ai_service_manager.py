@@ -5,15 +5,28 @@ AI服务管理器 - 统一接口管理多个AI服务
 
 import asyncio
 import logging
+import time
 from typing import Dict, Any, List, Optional, Union
 from datetime import datetime, timedelta
-import random
 
+from ..core.config import settings
 from .replicate_service import replicate_service, ReplicateError
 from .siliconflow_service import siliconflow_service, SiliconFlowError
+from .batch_engine import batch_engine
+from .result_cache import result_cache
+from .circuit_breaker import CircuitBreaker
+from .provider_router import provider_router
 
 logger = logging.getLogger(__name__)
 
+# 请求未指定模型（或模型不属于该服务商）时使用的默认模型
+DEFAULT_MODELS = {
+    "replicate": "flux-schnell",
+    "siliconflow": "stabilityai/stable-diffusion-xl-base-1.0"
+}
+
+REPLICATE_MODELS = ("flux-schnell", "flux", "sdxl")
+
 class AIServiceError(Exception):
     """AI服务错误"""
     def __init__(self, message: str, service: str = None, error_code: str = None):
@@ -49,8 +62,22 @@ class AIServiceManager:
             }
         }
         self.health_check_interval = 300  # 5分钟
-        self.max_error_threshold = 5
-        self.circuit_breaker_timeout = 60  # 1分钟
+        self.max_error_threshold = settings.CIRCUIT_BREAKER_MIN_REQUESTS
+        self.circuit_breaker_timeout = settings.CIRCUIT_BREAKER_OPEN_SECONDS
+        
+        for service_name, config in self.services.items():
+            config["circuit_breaker"] = CircuitBreaker(
+                service_name,
+                min_requests=self.max_error_threshold,
+                open_seconds=self.circuit_breaker_timeout
+            )
+        
+        self.router = provider_router
+        self.stats = {
+            "hedged": 0,
+            "hedge_wins": 0,
+            "failovers": 0
+        }
     
     async def check_service_health(self, service_name: str) -> Dict[str, Any]:
         """检查单个服务健康状态"""
@@ -125,12 +152,39 @@ class AIServiceManager:
         available = []
         
         for service_name, config in self.services.items():
-            if config["enabled"] and config["health_status"] == "healthy":
+            if (config["enabled"] and config["health_status"] == "healthy"
+                    and config["circuit_breaker"].is_available()):
                 available.append(service_name)
         
         return available
     
-    async def select_best_service(self, preferred_service: Optional[str] = None) -> str:
+    def _supports_model(self, service_name: str, model: Optional[str]) -> bool:
+        if not model:
+            return False
+        if service_name == "replicate":
+            return model in REPLICATE_MODELS
+        if service_name == "siliconflow":
+            return any(m["id"] == model for m in siliconflow_service.get_supported_models())
+        return False
+    
+    def _model_for(self, service_name: str, model: Optional[str]) -> str:
+        """请求在该服务商上实际使用的模型"""
+        if self._supports_model(service_name, model):
+            return model
+        return DEFAULT_MODELS.get(service_name, "default")
+    
+    def _route(self, service_names: List[str], model: Optional[str]) -> str:
+        """按实时延迟、成功率和成本在候选服务商中选择"""
+        ordered = sorted(service_names, key=lambda name: self.services[name]["priority"])
+        candidates = [(name, self._model_for(name, model)) for name in ordered]
+        costs = {name: self._get_generation_cost(name, model_name) for name, model_name in candidates}
+        return self.router.choose(candidates, costs)[0]
+    
+    async def select_best_service(
+        self,
+        preferred_service: Optional[str] = None,
+        model: Optional[str] = None
+    ) -> str:
         """选择最佳服务"""
         available_services = self.get_available_services()
         
@@ -140,17 +194,208 @@ class AIServiceManager:
         if preferred_service and preferred_service in available_services:
             return preferred_service
         
-        # 按优先级排序
-        sorted_services = sorted(
-            [(name, config) for name, config in self.services.items() 
-             if name in available_services],
-            key=lambda x: (x[1]["priority"], x[1]["response_time"])
-        )
+        self.router.stats["routed"] += 1
+        return self._route(available_services, model)
+    
+    async def _get_result_cache_key(
+        self,
+        service_name: str,
+        prompt: str,
+        params: Dict[str, Any]
+    ) -> Optional[str]:
+        """计算生成结果缓存键，不可缓存时返回None"""
+        try:
+            if service_name == "replicate":
+                input_data = {k: v for k, v in params.items() if k != "model"}
+                input_data["prompt"] = prompt
+                return await replicate_service.get_cache_key(
+                    params.get("model", "flux-schnell"), input_data
+                )
+            elif service_name == "siliconflow":
+                return siliconflow_service.get_cache_key({**params, "prompt": prompt})
+        except Exception as e:
+            logger.warning(f"计算缓存键失败: {e}")
+        return None
+    
+    async def _get_cached_result(
+        self,
+        selected_service: str,
+        service: Optional[str],
+        prompt: str,
+        kwargs: Dict[str, Any],
+        cache_key: Optional[str]
+    ) -> Optional[Dict[str, Any]]:
+        """
+        查询结果缓存
+        
+        自动路由时同一请求可能由任一服务商生成，依次按所选服务商和其余可用服务商的缓存键查询，
+        命中与否不取决于本次路由的选择
+        """
+        candidates = [selected_service]
+        if service is None:
+            candidates += [name for name in self.get_available_services() if name != selected_service]
         
-        if not sorted_services:
-            raise AIServiceError("没有可用的AI服务")
+        for name in candidates:
+            params = self._params_for(name, kwargs)
+            key = cache_key if name == selected_service else await self._get_result_cache_key(name, prompt, params)
+            if not key:
+                continue
+            cached = await result_cache.get(
+                key,
+                cost=self._get_generation_cost(name, params.get("model"))
+            )
+            if cached is not None:
+                return cached
+        return None
+    
+    def _get_generation_cost(self, service_name: str, model: Optional[str]) -> float:
+        """获取单次生成成本"""
+        if service_name != "replicate":
+            return 0.0
+        model_id = f"replicate-{self._model_for(service_name, model)}"
+        for model_info in replicate_service.get_supported_models():
+            if model_info["id"] == model_id:
+                return model_info.get("cost_per_generation", 0.0)
+        return 0.0
+    
+    @staticmethod
+    def _is_provider_failure(error: Exception) -> bool:
+        """请求参数错误不代表服务商故障，不计入熔断统计"""
+        if isinstance(error, AIServiceError):
+            return False
+        return getattr(error, "status_code", None) not in (400, 404, 422)
+    
+    def _should_failover(self, error: Exception) -> bool:
+        if isinstance(error, AIServiceError):
+            return error.error_code == "circuit_open"
+        return self._is_provider_failure(error)
+    
+    async def _call_service(self, service_name: str, prompt: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        """按服务类型调用相应的生成方法"""
+        service_instance = self.services[service_name]["service"]
+        
+        if service_name == "replicate":
+            model = params.get("model", "flux-schnell")
+            options = {k: v for k, v in params.items() if k != "model"}
+            
+            if model == "flux-schnell":
+                return await service_instance.generate_image_flux_schnell(prompt=prompt, **options)
+            elif model == "flux":
+                return await service_instance.generate_image_flux(prompt=prompt, **options)
+            elif model == "sdxl":
+                return await service_instance.generate_image_sdxl(prompt=prompt, **options)
+            raise AIServiceError(f"不支持的Replicate模型: {model}", service=service_name)
+        
+        elif service_name == "siliconflow":
+            return await service_instance.generate_image(prompt=prompt, **params)
         
-        return sorted_services[0][0]
+        raise AIServiceError(f"不支持的服务: {service_name}", service=service_name)
+    
+    async def _execute(self, service_name: str, prompt: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        """经熔断器调用服务，记录结果和延迟"""
+        service_config = self.services[service_name]
+        breaker = service_config["circuit_breaker"]
+        if not breaker.allow_request():
+            raise AIServiceError(f"{service_name} 服务已熔断，暂停请求", service=service_name, error_code="circuit_open")
+        
+        model = self._model_for(service_name, params.get("model"))
+        started_at = time.monotonic()
+        try:
+            result = await self._call_service(service_name, prompt, params)
+        except asyncio.CancelledError:
+            # 对冲落败被取消，不代表服务故障
+            breaker.release()
+            raise
+        except Exception as e:
+            service_config["error_count"] += 1
+            if self._is_provider_failure(e):
+                breaker.record_failure()
+                self.router.record(service_name, model, None, False)
+            else:
+                breaker.release()
+            raise
+        
+        elapsed = time.monotonic() - started_at
+        breaker.record_success()
+        service_config["success_count"] += 1
+        self.router.record(service_name, model, elapsed, True)
+        return result
+    
+    def _get_secondary_service(self, primary: str, model: Optional[str]) -> Optional[str]:
+        """在其余可用服务商中选择备用服务"""
+        candidates = [name for name in self.get_available_services() if name != primary]
+        return self._route(candidates, model) if candidates else None
+    
+    def _params_for(self, service_name: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        """模型名不属于该服务商时（路由或回退到其它服务商）使用其默认模型"""
+        if "model" not in params or self._supports_model(service_name, params["model"]):
+            return params
+        return {k: v for k, v in params.items() if k != "model"}
+    
+    async def _generate_with_hedging(
+        self,
+        primary: str,
+        secondary: Optional[str],
+        prompt: str,
+        params: Dict[str, Any]
+    ) -> tuple:
+        """主服务超过p95延迟仍未返回时向备用服务发起对冲请求，先成功者胜出，取消另一方"""
+        hedge_delay = None
+        if secondary and settings.GENERATION_HEDGING_ENABLED:
+            p95 = self.router.percentile(
+                primary,
+                self._model_for(primary, params.get("model")),
+                0.95,
+                min_samples=settings.GENERATION_HEDGE_MIN_SAMPLES
+            )
+            if p95 is not None:
+                hedge_delay = max(p95, settings.GENERATION_HEDGE_MIN_DELAY)
+        
+        tasks = {asyncio.ensure_future(self._execute(primary, prompt, params)): primary}
+        errors: Dict[str, Exception] = {}
+        hedged = False
+        
+        try:
+            while tasks:
+                timeout = hedge_delay if not hedged and hedge_delay is not None else None
+                done, _ = await asyncio.wait(tasks.keys(), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                
+                if not done:
+                    # 主服务超过p95延迟，发起对冲请求
+                    hedged = True
+                    self.stats["hedged"] += 1
+                    logger.info(f"服务 {primary} 超过p95延迟 {hedge_delay:.1f}s，对冲请求 {secondary}")
+                    tasks[asyncio.ensure_future(
+                        self._execute(secondary, prompt, self._params_for(secondary, params))
+                    )] = secondary
+                    continue
+                
+                for task in done:
+                    service_name = tasks.pop(task)
+                    error = task.exception()
+                    if error is None:
+                        if service_name != primary:
+                            self.stats["hedge_wins"] += 1
+                        return service_name, task.result()
+                    errors[service_name] = error
+                    logger.warning(f"服务 {service_name} 生成失败: {error}")
+                
+                # 主服务在对冲前失败，直接切换到备用服务（参数错误换服务商也无济于事）
+                if (not tasks and secondary and not hedged
+                        and primary in errors and self._should_failover(errors[primary])):
+                    hedged = True
+                    self.stats["failovers"] += 1
+                    tasks[asyncio.ensure_future(
+                        self._execute(secondary, prompt, self._params_for(secondary, params))
+                    )] = secondary
+        finally:
+            for task in tasks:
+                task.cancel()
+        
+        primary_error = errors.get(primary)
+        if secondary in errors:
+            logger.error(f"回退服务 {secondary} 也失败: {errors[secondary]}")
+        raise primary_error or next(iter(errors.values()))
     
     async def generate_image(
         self,
@@ -161,84 +406,48 @@ class AIServiceManager:
         """统一图片生成接口"""
         
         # 选择服务
-        selected_service = await self.select_best_service(service)
+        selected_service = await self.select_best_service(service, kwargs.get("model"))
+        # 指定服务时按原样传参，由服务商校验模型；自动路由时模型名需适配所选服务商
+        params = kwargs if service else self._params_for(selected_service, kwargs)
+        
+        # 显式指定seed的确定性生成优先命中缓存
+        cache_key = await self._get_result_cache_key(selected_service, prompt, params)
+        cached = await self._get_cached_result(selected_service, service, prompt, kwargs, cache_key)
+        if cached is not None:
+            return {**cached, "cache_hit": True}
+        
+        # 指定服务时不做对冲和回退
+        secondary = self._get_secondary_service(selected_service, kwargs.get("model")) if service is None else None
         
         try:
-            service_config = self.services[selected_service]
-            service_instance = service_config["service"]
-            
-            # 根据服务类型调用相应方法
-            if selected_service == "replicate":
-                model = kwargs.get("model", "flux-schnell")
-                
-                if model == "flux-schnell":
-                    result = await service_instance.generate_image_flux_schnell(
-                        prompt=prompt,
-                        **{k: v for k, v in kwargs.items() if k != "model"}
-                    )
-                elif model == "flux":
-                    result = await service_instance.generate_image_flux(
-                        prompt=prompt,
-                        **{k: v for k, v in kwargs.items() if k != "model"}
-                    )
-                elif model == "sdxl":
-                    result = await service_instance.generate_image_sdxl(
-                        prompt=prompt,
-                        **{k: v for k, v in kwargs.items() if k != "model"}
-                    )
-                else:
-                    raise AIServiceError(f"不支持的Replicate模型: {model}")
-                    
-            elif selected_service == "siliconflow":
-                result = await service_instance.generate_image(
-                    prompt=prompt,
-                    **kwargs
-                )
-            else:
-                raise AIServiceError(f"不支持的服务: {selected_service}")
-            
-            # 更新成功计数
-            service_config["success_count"] += 1
-            
-            # 添加服务信息
-            result["service_used"] = selected_service
-            result["service_model"] = kwargs.get("model", "default")
-            
-            return result
-            
+            service_used, result = await self._generate_with_hedging(
+                selected_service, secondary, prompt, params
+            )
+        except AIServiceError:
+            raise
         except (ReplicateError, SiliconFlowError) as e:
-            # 更新错误计数
-            service_config["error_count"] += 1
-            
-            # 如果当前服务失败，尝试其他服务
-            if service is None:  # 自动选择模式
-                available_services = [s for s in self.get_available_services() 
-                                    if s != selected_service]
-                
-                if available_services:
-                    fallback_service = random.choice(available_services)
-                    logger.warning(f"服务 {selected_service} 失败，尝试 {fallback_service}: {e}")
-                    
-                    try:
-                        return await self.generate_image(
-                            prompt=prompt,
-                            service=fallback_service,
-                            **kwargs
-                        )
-                    except Exception as fallback_error:
-                        logger.error(f"回退服务 {fallback_service} 也失败: {fallback_error}")
-            
             raise AIServiceError(
                 f"{selected_service} 服务生成失败: {str(e)}",
                 service=selected_service
             )
-        
         except Exception as e:
-            service_config["error_count"] += 1
             raise AIServiceError(
                 f"生成图片失败: {str(e)}",
                 service=selected_service
             )
+        
+        if service_used != selected_service:
+            params = self._params_for(service_used, params)
+            cache_key = await self._get_result_cache_key(service_used, prompt, params)
+        
+        # 添加服务信息
+        result["service_used"] = service_used
+        result["service_model"] = params.get("model", "default")
+        
+        if cache_key:
+            await result_cache.set(cache_key, result)
+        
+        return result
     
     async def batch_generate(
         self,
@@ -259,19 +468,11 @@ class AIServiceManager:
             if selected_service == "replicate":
                 results = await replicate_service.batch_generate(requests)
             elif selected_service == "siliconflow":
-                # 硅基流动不支持批量，逐个处理
-                for request_data in requests:
-                    try:
-                        result = await siliconflow_service.generate_image(**request_data)
-                        results.append({
-                            "status": "succeeded",
-                            "result": result
-                        })
-                    except Exception as e:
-                        results.append({
-                            "status": "failed",
-                            "error": str(e)
-                        })
+                # 硅基流动无批量接口，按并发上限同时发起单张生成
+                async def generate_one(request_data: Dict[str, Any]) -> Dict[str, Any]:
+                    return await siliconflow_service.generate_image(**request_data)
+                
+                results = await batch_engine.run("siliconflow", requests, generate_one)
             else:
                 raise AIServiceError(f"不支持的服务: {selected_service}")
             
@@ -295,7 +496,20 @@ class AIServiceManager:
             "response_time": config["response_time"],
             "error_count": config["error_count"],
             "success_count": config["success_count"],
-            "last_check": config["last_check"].isoformat() if config["last_check"] else None
+            "last_check": config["last_check"].isoformat() if config["last_check"] else None,
+            "circuit_breaker": config["circuit_breaker"].get_stats(),
+            "latency": self.router.get_provider_stats(service_name)
+        }
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取熔断与对冲统计"""
+        return {
+            **self.stats,
+            "routing": self.router.get_stats(),
+            "circuit_breakers": {
+                name: config["circuit_breaker"].get_stats()
+                for name, config in self.services.items()
+            }
         }
     
     def get_all_services_info(self) -> Dict[str, Any]:
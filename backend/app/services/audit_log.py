@@ -0,0 +1,215 @@
+"""
+审计日志写后缓冲
+请求中只把日志事件放入有界缓冲区，后台任务按时间间隔或批量大小批量写入数据库（多行INSERT）
+或JSONL文件。缓冲区满时丢弃新事件并计数，审计写入不阻塞请求
+"""
+
+import asyncio
+import ipaddress
+import json
+import logging
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional
+
+from ..core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# 同一批次最多写入次数
+MAX_WRITE_ATTEMPTS = 3
+
+
+def _valid_uuid(value: Any) -> bool:
+    try:
+        uuid.UUID(str(value))
+        return True
+    except ValueError:
+        return False
+
+
+def _valid_ip(value: Any) -> bool:
+    try:
+        ipaddress.ip_address(value)
+        return True
+    except ValueError:
+        return False
+
+
+class DatabaseAuditSink:
+    """写入system_logs表，SQLAlchemy对executemany使用多行INSERT"""
+
+    name = "database"
+
+    @staticmethod
+    def _row(event: Dict[str, Any]) -> Dict[str, Any]:
+        # resource_id与ip_address在库中是UUID/INET类型，批量写入中一条非法值会使整批失败
+        row = dict(event)
+        if row.get("resource_id") is not None and not _valid_uuid(row["resource_id"]):
+            row["details"] = {**(row.get("details") or {}), "resource_id": row["resource_id"]}
+            row["resource_id"] = None
+        if row.get("ip_address") is not None and not _valid_ip(row["ip_address"]):
+            row["ip_address"] = None
+        return row
+
+    async def write(self, events: List[Dict[str, Any]]):
+        from sqlalchemy import insert
+        from ..core.database import get_async_engine
+        from ..models.system_log import SystemLog
+
+        async with get_async_engine().begin() as conn:
+            await conn.execute(insert(SystemLog.__table__), [self._row(event) for event in events])
+
+
+class JsonlAuditSink:
+    """追加写入JSONL文件，适用于本地运行"""
+
+    name = "jsonl"
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _append(self, lines: str):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(lines)
+
+    async def write(self, events: List[Dict[str, Any]]):
+        lines = "".join(json.dumps(event, ensure_ascii=False, default=str) + "\n" for event in events)
+        await asyncio.to_thread(self._append, lines)
+
+
+def create_audit_sinks() -> list:
+    sinks = []
+    for name in (part.strip() for part in settings.AUDIT_LOG_SINKS.split(",")):
+        if name == "database":
+            sinks.append(DatabaseAuditSink())
+        elif name == "jsonl":
+            sinks.append(JsonlAuditSink(settings.AUDIT_LOG_JSONL_PATH))
+        elif name:
+            logger.warning(f"未知的审计日志输出: {name}")
+    return sinks
+
+
+class AuditLogger:
+    """审计日志缓冲与后台批量写入"""
+
+    def __init__(self, sinks: Optional[list] = None, max_queue: int = 10000,
+                 batch_size: int = 500, flush_interval: float = 0.5):
+        self.sinks = sinks if sinks is not None else create_audit_sinks()
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffer: deque = deque()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+        self._failures = 0
+        self.stats = {
+            "enqueued": 0,
+            "written": 0,
+            "dropped": 0,
+            "flushes": 0,
+            "write_errors": 0
+        }
+
+    def log(self, event: Dict[str, Any]) -> bool:
+        """放入缓冲区，不等待写入；缓冲区已满时丢弃并返回False"""
+        if len(self._buffer) >= self.max_queue:
+            self.stats["dropped"] += 1
+            return False
+        event.setdefault("id", str(uuid.uuid4()))
+        event.setdefault("created_at", datetime.now(timezone.utc))
+        self._buffer.append(event)
+        self.stats["enqueued"] += 1
+        self._ensure_started()
+        if len(self._buffer) >= self.batch_size and self._wakeup is not None:
+            self._wakeup.set()
+        return True
+
+    def _ensure_started(self):
+        if self._task is not None or self._closing or not self.sinks:
+            return
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            # 没有事件循环（同步脚本）时等待下次在循环中调用或显式flush
+            return
+        self.start()
+
+    def start(self):
+        """启动后台写入任务"""
+        if self._task is None or self._task.done():
+            self._closing = False
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        """写出缓冲区中的全部事件"""
+        while self._buffer:
+            batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+            if not await self._write(batch):
+                break
+
+    async def _write(self, batch: List[Dict[str, Any]]) -> bool:
+        failed = False
+        for sink in self.sinks:
+            try:
+                await sink.write(batch)
+            except Exception as e:
+                failed = True
+                self.stats["write_errors"] += 1
+                logger.error(f"写入审计日志失败({sink.name}): {e}")
+        self.stats["flushes"] += 1
+        if not failed:
+            self._failures = 0
+            self.stats["written"] += len(batch)
+            return True
+
+        self._failures += 1
+        if self._failures >= MAX_WRITE_ATTEMPTS:
+            # 连续失败的批次丢弃，避免一批坏数据阻塞后续日志
+            self._failures = 0
+            self.stats["dropped"] += len(batch)
+            return False
+
+        # 放回缓冲区头部等待下次写入，超出容量的部分丢弃
+        room = self.max_queue - len(self._buffer)
+        requeued = batch[:max(room, 0)]
+        self._buffer.extendleft(reversed(requeued))
+        self.stats["dropped"] += len(batch) - len(requeued)
+        return False
+
+    async def stop(self):
+        """停止后台任务并写出剩余事件"""
+        self._closing = True
+        if self._task is not None:
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取审计日志统计"""
+        return {
+            **self.stats,
+            "queued": len(self._buffer),
+            "sinks": [sink.name for sink in self.sinks]
+        }
+
+
+# 全局审计日志
+audit_logger = AuditLogger(
+    max_queue=settings.AUDIT_LOG_QUEUE_SIZE,
+    batch_size=settings.AUDIT_LOG_BATCH_SIZE,
+    flush_interval=settings.AUDIT_LOG_FLUSH_INTERVAL
+)
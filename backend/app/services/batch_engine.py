@@ -0,0 +1,114 @@
+"""
+批量生成并发引擎
+按服务商限制并发，逐项超时，结果按完成顺序流式返回，遇到致命错误时取消其余任务
+"""
+
+import asyncio
+import logging
+from typing import Dict, Any, List, Optional, Callable, Awaitable, AsyncIterator
+
+from ..core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# 认证失败、余额不足、权限拒绝时同批次其余请求必然失败
+FATAL_STATUS_CODES = (401, 402, 403)
+
+BatchRunner = Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]
+
+
+def is_fatal_error(error: Exception) -> bool:
+    """判断错误是否应中止整个批次"""
+    return getattr(error, "status_code", None) in FATAL_STATUS_CODES
+
+
+class BatchEngine:
+    """进程级共享的批量执行引擎，同一服务商的所有批次共用并发上限"""
+
+    def __init__(self):
+        self.concurrency_limits = {
+            "replicate": settings.REPLICATE_BATCH_CONCURRENCY,
+            "siliconflow": settings.SILICONFLOW_BATCH_CONCURRENCY
+        }
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+
+    def _get_semaphore(self, provider: str) -> asyncio.Semaphore:
+        semaphore = self._semaphores.get(provider)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.concurrency_limits.get(provider, 2))
+            self._semaphores[provider] = semaphore
+        return semaphore
+
+    async def stream(
+        self,
+        provider: str,
+        requests: List[Dict[str, Any]],
+        runner: BatchRunner,
+        item_timeout: Optional[float] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """按完成顺序逐项产出结果"""
+        semaphore = self._get_semaphore(provider)
+        timeout = item_timeout or settings.BATCH_ITEM_TIMEOUT
+
+        async def run_item(index: int, request_data: Dict[str, Any]) -> Dict[str, Any]:
+            async with semaphore:
+                try:
+                    result = await asyncio.wait_for(runner(request_data), timeout=timeout)
+                    return {"index": index, "status": "succeeded", "result": result}
+                except asyncio.TimeoutError:
+                    logger.error(f"批量生成第{index}个请求超时")
+                    return {"index": index, "status": "failed", "error": f"生成超时（{timeout}秒）"}
+                except Exception as e:
+                    if is_fatal_error(e):
+                        raise
+                    logger.error(f"批量生成第{index}个请求失败: {e}")
+                    return {"index": index, "status": "failed", "error": str(e)}
+
+        pending = {
+            asyncio.create_task(run_item(index, request_data)): index
+            for index, request_data in enumerate(requests)
+        }
+
+        try:
+            while pending:
+                done, _ = await asyncio.wait(pending.keys(), return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    index = pending.pop(task)
+                    error = task.exception()
+                    if error is None:
+                        yield task.result()
+                        continue
+
+                    # 致命错误：取消同批次的其余请求
+                    logger.error(f"批量生成第{index}个请求遇到致命错误，取消其余请求: {error}")
+                    yield {"index": index, "status": "failed", "error": str(error), "fatal": True}
+                    for other in pending:
+                        other.cancel()
+                    await asyncio.gather(*pending.keys(), return_exceptions=True)
+                    for cancelled_index in sorted(pending.values()):
+                        yield {
+                            "index": cancelled_index,
+                            "status": "cancelled",
+                            "error": "批量任务因致命错误中止"
+                        }
+                    pending.clear()
+                    return
+        finally:
+            # 调用方提前停止消费时释放剩余任务
+            for task in pending:
+                task.cancel()
+
+    async def run(
+        self,
+        provider: str,
+        requests: List[Dict[str, Any]],
+        runner: BatchRunner,
+        item_timeout: Optional[float] = None
+    ) -> List[Dict[str, Any]]:
+        """执行整个批次，结果按请求顺序返回"""
+        results = [item async for item in self.stream(provider, requests, runner, item_timeout)]
+        return sorted(results, key=lambda item: item["index"])
+
+
+# 全局批量引擎
+batch_engine = BatchEngine()
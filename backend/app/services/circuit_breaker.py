@@ -0,0 +1,128 @@
+"""
+服务商熔断器
+按滚动时间窗口统计错误率：关闭 -> 打开（拒绝请求）-> 半开（放行少量探测请求）-> 关闭
+"""
+
+import logging
+import time
+from collections import deque
+from typing import Dict, Any, Deque, Optional, Tuple
+
+from ..core.config import settings
+
+logger = logging.getLogger(__name__)
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """单个服务商的熔断器"""
+
+    def __init__(
+        self,
+        name: str,
+        window_seconds: Optional[float] = None,
+        min_requests: Optional[int] = None,
+        error_rate_threshold: Optional[float] = None,
+        open_seconds: Optional[float] = None,
+        half_open_max_calls: Optional[int] = None
+    ):
+        self.name = name
+        self.window_seconds = window_seconds or settings.CIRCUIT_BREAKER_WINDOW_SECONDS
+        self.min_requests = min_requests or settings.CIRCUIT_BREAKER_MIN_REQUESTS
+        self.error_rate_threshold = error_rate_threshold or settings.CIRCUIT_BREAKER_ERROR_RATE
+        self.open_seconds = open_seconds or settings.CIRCUIT_BREAKER_OPEN_SECONDS
+        self.half_open_max_calls = half_open_max_calls or settings.CIRCUIT_BREAKER_HALF_OPEN_MAX_CALLS
+
+        self.state = STATE_CLOSED
+        self.opened_at = 0.0
+        self._outcomes: Deque[Tuple[float, bool]] = deque()
+        self._half_open_in_flight = 0
+        self.stats = {
+            "opened": 0,
+            "rejected": 0
+        }
+
+    def _trim(self, now: float):
+        while self._outcomes and self._outcomes[0][0] < now - self.window_seconds:
+            self._outcomes.popleft()
+
+    def _transition(self, state: str):
+        if state != self.state:
+            logger.warning(f"服务 {self.name} 熔断器状态 {self.state} -> {state}")
+            self.state = state
+
+    def allow_request(self) -> bool:
+        """判断是否放行请求，放行半开探测时占用一个探测名额"""
+        now = time.monotonic()
+        if self.state == STATE_OPEN:
+            if now - self.opened_at < self.open_seconds:
+                self.stats["rejected"] += 1
+                return False
+            self._transition(STATE_HALF_OPEN)
+            self._half_open_in_flight = 0
+
+        if self.state == STATE_HALF_OPEN:
+            if self._half_open_in_flight >= self.half_open_max_calls:
+                self.stats["rejected"] += 1
+                return False
+            self._half_open_in_flight += 1
+        return True
+
+    def is_available(self) -> bool:
+        """不占用探测名额地判断当前是否可能放行"""
+        if self.state == STATE_OPEN:
+            return time.monotonic() - self.opened_at >= self.open_seconds
+        if self.state == STATE_HALF_OPEN:
+            return self._half_open_in_flight < self.half_open_max_calls
+        return True
+
+    def _open(self, now: float):
+        self._transition(STATE_OPEN)
+        self.opened_at = now
+        self._half_open_in_flight = 0
+        self.stats["opened"] += 1
+
+    def record_success(self):
+        now = time.monotonic()
+        if self.state == STATE_HALF_OPEN:
+            # 探测成功，恢复并清空旧窗口
+            self._transition(STATE_CLOSED)
+            self._outcomes.clear()
+        self._outcomes.append((now, True))
+        self._trim(now)
+
+    def record_failure(self):
+        now = time.monotonic()
+        if self.state == STATE_HALF_OPEN:
+            self._open(now)
+            return
+        self._outcomes.append((now, False))
+        self._trim(now)
+        if self.state == STATE_CLOSED and len(self._outcomes) >= self.min_requests:
+            if self.error_rate() >= self.error_rate_threshold:
+                self._open(now)
+
+    def release(self):
+        """请求被取消（如对冲请求落败）时归还半开探测名额，不计入统计"""
+        if self.state == STATE_HALF_OPEN and self._half_open_in_flight > 0:
+            self._half_open_in_flight -= 1
+
+    def error_rate(self) -> float:
+        self._trim(time.monotonic())
+        if not self._outcomes:
+            return 0.0
+        failures = sum(1 for _, ok in self._outcomes if not ok)
+        return failures / len(self._outcomes)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取熔断器状态"""
+        self._trim(time.monotonic())
+        return {
+            **self.stats,
+            "state": self.state,
+            "window_requests": len(self._outcomes),
+            "error_rate": self.error_rate()
+        }
@@ -0,0 +1,251 @@
+"""
+公开画廊预计算信息流
+按模型分面在内存中保存最新N张公开图片，画廊首屏及前几页直接由内存返回。
+图片公开状态变化或删除时增量更新；定期从数据库重建以同步其他worker的写入
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..core.config import settings
+from ..core.pagination import count_cache, decode_cursor, encode_cursor
+from ..models.image import Image
+from ..schemas.image import ImageResponse
+
+logger = logging.getLogger(__name__)
+
+# 全部模型的分面
+ALL_MODELS = None
+
+
+def _sort_key(image: ImageResponse) -> Tuple[datetime, str]:
+    return image.created_at, image.id
+
+
+class FeedFacet:
+    """单个分面：按 (created_at, id) 倒序的最新公开图片"""
+
+    def __init__(self, ai_model: Optional[str], limit: int):
+        self.ai_model = ai_model
+        self.limit = limit
+        self.items: List[ImageResponse] = []
+        # 加载时公开图片不足limit张，说明items覆盖了该分面全部公开图片
+        self.exhaustive = False
+        self.loaded_at = 0.0
+        self.revision = 0  # 增量更新次数，用于发现与重建并发的写入
+        self.last_modified = datetime.now(timezone.utc).replace(microsecond=0)
+        self.lock = asyncio.Lock()
+
+    @property
+    def stale(self) -> bool:
+        return time.monotonic() - self.loaded_at >= settings.GALLERY_FEED_REFRESH_SECONDS
+
+    def _touch(self):
+        self.last_modified = datetime.now(timezone.utc).replace(microsecond=0)
+
+    def replace(self, items: List[ImageResponse]):
+        """重建分面，内容未变化时保留Last-Modified"""
+        if [(img.id, img.is_public) for img in items] != [(img.id, img.is_public) for img in self.items]:
+            self._touch()
+        self.items = items
+        self.exhaustive = len(items) < self.limit
+        self.loaded_at = time.monotonic()
+
+    def remove(self, image_id: str) -> bool:
+        for index, item in enumerate(self.items):
+            if item.id == image_id:
+                del self.items[index]
+                self.revision += 1
+                self._touch()
+                return True
+        return False
+
+    def insert(self, image: ImageResponse) -> bool:
+        """按排序位置插入；比末尾更旧且分面不完整时无法确定位置，交给下次重建"""
+        key = _sort_key(image)
+        if self.items and key < _sort_key(self.items[-1]) and not self.exhaustive:
+            return False
+        index = 0
+        while index < len(self.items) and _sort_key(self.items[index]) > key:
+            index += 1
+        self.items.insert(index, image)
+        if len(self.items) > self.limit:
+            self.items.pop()
+            self.exhaustive = False
+        self.revision += 1
+        self._touch()
+        return True
+
+    def page(self, cursor: Optional[str], offset: int, size: int):
+        """
+        从内存取一页，返回 (图片列表, 下一页游标)；
+        请求范围超出内存且分面不完整时返回None，由调用方查询数据库
+        """
+        if cursor:
+            created_at, row_id = decode_cursor(cursor)
+            start = 0
+            while start < len(self.items) and _sort_key(self.items[start]) >= (created_at, row_id):
+                start += 1
+        else:
+            start = offset
+
+        end = start + size
+        if end >= len(self.items) and not self.exhaustive:
+            # 需要第size+1条判断是否有下一页，内存中不足时回退数据库
+            return None
+        images = self.items[start:end]
+        next_cursor = None
+        if end < len(self.items) and images:
+            next_cursor = encode_cursor(images[-1].created_at, images[-1].id)
+        return images, next_cursor
+
+
+class GalleryFeed:
+    """公开画廊信息流"""
+
+    def __init__(self):
+        self.facets: Dict[Optional[str], FeedFacet] = {}
+        self.stats = {
+            "hits": 0,
+            "fallbacks": 0,
+            "rebuilds": 0,
+            "incremental_updates": 0,
+            "not_modified": 0
+        }
+
+    def _get_facet(self, ai_model: Optional[str]) -> Optional[FeedFacet]:
+        facet = self.facets.get(ai_model)
+        if facet is None:
+            # ai_model来自查询参数，限制分面数量防止内存无限增长
+            if ai_model is not ALL_MODELS and len(self.facets) > settings.GALLERY_FEED_MAX_FACETS:
+                return None
+            facet = self.facets[ai_model] = FeedFacet(ai_model, settings.GALLERY_FEED_SIZE)
+        return facet
+
+    async def _refresh(self, db: AsyncSession, facet: FeedFacet):
+        async with facet.lock:
+            if not facet.stale:
+                return
+            stmt = select(Image).where(Image.is_public == True)
+            if facet.ai_model is not ALL_MODELS:
+                stmt = stmt.where(Image.ai_model == facet.ai_model)
+            stmt = stmt.order_by(Image.created_at.desc(), Image.id.desc()).limit(facet.limit)
+            revision = facet.revision
+            images = (await db.execute(stmt)).scalars().all()
+            facet.replace([ImageResponse.from_orm(img) for img in images])
+            if facet.revision != revision:
+                # 查询期间有增量更新，结果可能不包含该写入，下次请求再重建
+                facet.loaded_at = 0.0
+            self.stats["rebuilds"] += 1
+
+    async def get_page(
+        self,
+        db: AsyncSession,
+        ai_model: Optional[str],
+        cursor: Optional[str],
+        offset: int,
+        size: int
+    ) -> Optional[Tuple[List[ImageResponse], Optional[str], FeedFacet]]:
+        """取画廊一页，无法由内存提供时返回None"""
+        facet = self._get_facet(ai_model)
+        if facet is None:
+            self.stats["fallbacks"] += 1
+            return None
+        if facet.stale:
+            await self._refresh(db, facet)
+
+        result = facet.page(cursor, offset, size)
+        if result is None:
+            self.stats["fallbacks"] += 1
+            return None
+        self.stats["hits"] += 1
+        images, next_cursor = result
+        return images, next_cursor, facet
+
+    def _invalidate_counts(self, *ai_models: Optional[str]):
+        # 与图片列表路由的计数缓存键保持一致（无搜索条件）
+        for ai_model in ai_models:
+            count_cache.invalidate(("gallery", None, ai_model))
+
+    def on_image_changed(self, image):
+        """图片更新后调用：公开则加入对应分面，取消公开则移除"""
+        entry = ImageResponse.from_orm(image)
+        for key in (ALL_MODELS, entry.ai_model):
+            facet = self.facets.get(key)
+            if facet is None:
+                continue
+            facet.remove(entry.id)
+            if entry.is_public:
+                facet.insert(entry)
+        self._invalidate_counts(ALL_MODELS, entry.ai_model)
+        self.stats["incremental_updates"] += 1
+
+    def on_image_deleted(self, image_id: str, ai_model: Optional[str] = None):
+        """图片删除后调用"""
+        for facet in self.facets.values():
+            facet.remove(image_id)
+        self._invalidate_counts(ALL_MODELS, ai_model)
+        self.stats["incremental_updates"] += 1
+
+    def on_user_deleted(self, user_id: str):
+        """用户删除后调用，其图片随账户级联删除"""
+        for facet in self.facets.values():
+            image_ids = [item.id for item in facet.items if item.user_id == user_id]
+            for image_id in image_ids:
+                facet.remove(image_id)
+        self._invalidate_counts(*self.facets.keys())
+        self.stats["incremental_updates"] += 1
+
+    @staticmethod
+    def etag(payload: Dict[str, Any]) -> str:
+        """按响应内容计算弱ETag，各worker对相同内容给出相同ETag"""
+        digest = hashlib.sha1(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+        return f'W/"{digest[:32]}"'
+
+    @staticmethod
+    def is_not_modified(headers, etag: str, last_modified: datetime) -> bool:
+        """按If-None-Match / If-Modified-Since判断客户端缓存是否仍然有效"""
+        if_none_match = headers.get("if-none-match")
+        if if_none_match is not None:
+            # 弱比较：忽略W/前缀
+            candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+            return "*" in candidates or etag.removeprefix("W/") in candidates
+
+        if_modified_since = headers.get("if-modified-since")
+        if if_modified_since:
+            try:
+                return last_modified <= parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    @staticmethod
+    def cache_headers(etag: str, last_modified: datetime) -> Dict[str, str]:
+        return {
+            "ETag": etag,
+            "Last-Modified": format_datetime(last_modified, usegmt=True),
+            "Cache-Control": settings.GALLERY_CACHE_CONTROL
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取信息流统计"""
+        return {
+            **self.stats,
+            "facets": {
+                key or "all": {"size": len(facet.items), "exhaustive": facet.exhaustive}
+                for key, facet in self.facets.items()
+            }
+        }
+
+
+# 全局画廊信息流
+gallery_feed = GalleryFeed()
@@ -0,0 +1,113 @@
+"""
+生成任务worker
+从持久化队列领取任务并在独立数据库会话中执行，与Web进程分开扩容
+"""
+
+import asyncio
+import logging
+from typing import Dict, Any, Optional
+
+from ..core.database import SessionLocal
+from ..models.generation_task import GenerationTask as GenerationTaskModel
+from ..schemas.generation import GenerationRequest
+from .job_queue import generation_queue, GenerationJobQueue
+
+logger = logging.getLogger(__name__)
+
+# 已结束的任务重复投递时直接确认；仍在处理中的任务续接已记录的预测
+FINISHED_STATUSES = ("completed", "failed", "cancelled")
+
+
+def _is_finished(db, task_id: str) -> bool:
+    """检查任务是否已处理完成（至少一次投递下的幂等保护）"""
+    task = db.query(GenerationTaskModel).filter(GenerationTaskModel.id == task_id).first()
+    return task is None or task.status in FINISHED_STATUSES
+
+
+async def handle_generation_job(task_id: str, payload: Dict[str, Any], final_attempt: bool):
+    """处理通用生成任务"""
+    from ..api.generate import process_generation_task
+
+    db = SessionLocal()
+    try:
+        if _is_finished(db, task_id):
+            logger.info(f"任务 {task_id} 已结束，跳过重复投递")
+            return
+        await process_generation_task(
+            task_id,
+            GenerationRequest(**payload),
+            db,
+            final_attempt=final_attempt
+        )
+    finally:
+        db.close()
+
+
+async def handle_replicate_generation_job(task_id: str, payload: Dict[str, Any], final_attempt: bool):
+    """处理Replicate生成任务"""
+    from ..api.replicate_api import _process_generation_with_webhook
+
+    db = SessionLocal()
+    try:
+        if _is_finished(db, task_id):
+            logger.info(f"任务 {task_id} 已结束，跳过重复投递")
+            return
+        await _process_generation_with_webhook(
+            task_id,
+            payload["prompt"],
+            payload["model"],
+            payload.get("parameters") or {},
+            payload.get("webhook_url"),
+            db,
+            final_attempt=final_attempt
+        )
+    finally:
+        db.close()
+
+
+generation_queue.register_handler("generation", handle_generation_job)
+generation_queue.register_handler("replicate_generation", handle_replicate_generation_job)
+
+
+class GenerationWorker:
+    """单进程内的并发任务消费者"""
+
+    def __init__(
+        self,
+        queue: GenerationJobQueue = generation_queue,
+        concurrency: int = 4,
+        idle_interval: float = 1.0
+    ):
+        self.queue = queue
+        self.concurrency = concurrency
+        self.idle_interval = idle_interval
+        self._stopping: Optional[asyncio.Event] = None
+
+    async def _consume(self, slot: int):
+        while not self._stopping.is_set():
+            try:
+                processed = await self.queue.process_next()
+            except Exception as e:
+                logger.error(f"worker槽位 {slot} 领取任务失败: {e}")
+                processed = False
+
+            if not processed:
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), timeout=self.idle_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def run(self):
+        """运行直到stop()被调用"""
+        self._stopping = asyncio.Event()
+        logger.info(f"🚀 生成任务worker启动，并发数: {self.concurrency}")
+        try:
+            await asyncio.gather(*(self._consume(i) for i in range(self.concurrency)))
+        finally:
+            await self.queue.close()
+            logger.info("🛑 生成任务worker已停止")
+
+    def stop(self):
+        """请求停止（正在执行的任务会先完成）"""
+        if self._stopping is not None:
+            self._stopping.set()
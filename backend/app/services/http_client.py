@@ -0,0 +1,150 @@
+"""
+共享HTTP客户端注册表
+为各AI服务提供进程级复用的httpx连接池，由应用生命周期统一开启和关闭
+"""
+
+import asyncio
+import importlib.util
+import logging
+from typing import Dict, Any, Optional
+
+import httpx
+
+from ..core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class HTTPClientRegistry:
+    """按服务名管理的共享AsyncClient注册表"""
+
+    def __init__(self):
+        self._configs: Dict[str, Dict[str, Any]] = {}
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+        self._lock = asyncio.Lock()
+        # HTTP/2 依赖 h2 包，未安装时自动降级为 HTTP/1.1
+        self.http2_available = importlib.util.find_spec("h2") is not None
+
+    def register(
+        self,
+        name: str,
+        max_connections: int,
+        max_keepalive_connections: int,
+        timeout: float = 60.0,
+        http2: Optional[bool] = None
+    ):
+        """注册服务的连接池配置"""
+        self._configs[name] = {
+            "max_connections": max_connections,
+            "max_keepalive_connections": max_keepalive_connections,
+            "timeout": timeout,
+            "http2": settings.HTTP_CLIENT_HTTP2 if http2 is None else http2
+        }
+        self._stats.setdefault(name, {
+            "requests": 0,
+            "new_connections": 0,
+            "reused_connections": 0,
+            "errors": 0
+        })
+
+    def _create_client(self, name: str) -> httpx.AsyncClient:
+        """根据注册配置创建客户端"""
+        config = self._configs.get(name)
+        if config is None:
+            raise KeyError(f"未注册的HTTP客户端: {name}")
+
+        use_http2 = config["http2"] and self.http2_available
+        if config["http2"] and not self.http2_available:
+            logger.warning(f"HTTP客户端 {name} 请求启用HTTP/2，但未安装h2，降级为HTTP/1.1")
+
+        stats = self._stats[name]
+
+        async def trace(event_name: str, info: Dict[str, Any]):
+            # httpcore仅在建立新连接时触发connect_tcp事件
+            if event_name == "connection.connect_tcp.complete":
+                stats["new_connections"] += 1
+
+        async def on_request(request: httpx.Request):
+            request.extensions["trace"] = trace
+
+        async def on_response(response: httpx.Response):
+            stats["requests"] += 1
+            stats["reused_connections"] = max(0, stats["requests"] - stats["new_connections"])
+
+        client = httpx.AsyncClient(
+            timeout=config["timeout"],
+            http2=use_http2,
+            limits=httpx.Limits(
+                max_connections=config["max_connections"],
+                max_keepalive_connections=config["max_keepalive_connections"],
+                keepalive_expiry=settings.HTTP_CLIENT_KEEPALIVE_EXPIRY
+            ),
+            event_hooks={"request": [on_request], "response": [on_response]}
+        )
+        logger.info(
+            f"HTTP客户端 {name} 已创建: max_connections={config['max_connections']}, "
+            f"keepalive={config['max_keepalive_connections']}, http2={use_http2}"
+        )
+        return client
+
+    def get_client(self, name: str) -> httpx.AsyncClient:
+        """获取共享客户端（未启动时按需创建，兼容脚本场景）"""
+        client = self._clients.get(name)
+        if client is None or client.is_closed:
+            client = self._create_client(name)
+            self._clients[name] = client
+        return client
+
+    def record_error(self, name: str):
+        """记录请求错误"""
+        if name in self._stats:
+            self._stats[name]["errors"] += 1
+
+    async def startup(self):
+        """应用启动时创建所有已注册的客户端"""
+        async with self._lock:
+            for name in self._configs:
+                self.get_client(name)
+
+    async def shutdown(self):
+        """应用关闭时释放所有连接"""
+        async with self._lock:
+            for name, client in list(self._clients.items()):
+                try:
+                    await client.aclose()
+                except Exception as e:
+                    logger.error(f"关闭HTTP客户端 {name} 失败: {e}")
+            self._clients.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取连接复用统计"""
+        return {
+            name: {
+                **stats,
+                "active": name in self._clients and not self._clients[name].is_closed,
+                "http2": self._configs[name]["http2"] and self.http2_available
+            }
+            for name, stats in self._stats.items()
+        }
+
+
+# 全局客户端注册表
+http_client_registry = HTTPClientRegistry()
+
+http_client_registry.register(
+    "replicate",
+    max_connections=settings.REPLICATE_MAX_CONNECTIONS,
+    max_keepalive_connections=settings.REPLICATE_MAX_KEEPALIVE_CONNECTIONS
+)
+http_client_registry.register(
+    "siliconflow",
+    max_connections=settings.SILICONFLOW_MAX_CONNECTIONS,
+    max_keepalive_connections=settings.SILICONFLOW_MAX_KEEPALIVE_CONNECTIONS,
+    timeout=120.0
+)
+http_client_registry.register(
+    "ingestion",
+    max_connections=settings.IMAGE_INGESTION_MAX_CONNECTIONS,
+    max_keepalive_connections=settings.IMAGE_INGESTION_MAX_CONNECTIONS
+)
@@ -0,0 +1,439 @@
+"""
+生成图片转存
+AI服务返回的图片地址会过期，生成结果入库后由后台worker将图片流式下载到临时文件，
+按内容哈希存入Supabase Storage（相同内容只上传一次），同时在进程池中生成缩略图和
+响应式尺寸存放在原图旁边，再以比较交换方式把 images.image_url 替换为持久地址并写入
+thumbnail_url / variants。
+只下载AI服务交付域名下的https地址，且域名解析到的地址必须是公网地址
+"""
+
+import asyncio
+import hashlib
+import ipaddress
+import logging
+import mimetypes
+import os
+import random
+import shutil
+import socket
+import tempfile
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+from sqlalchemy import update
+
+from ..core.config import settings
+from .http_client import http_client_registry
+from .image_variants import VariantRenderer, variant_renderer
+
+logger = logging.getLogger(__name__)
+
+# 已转存内容哈希的本地记录上限
+KNOWN_DIGESTS_MAX = 10000
+
+
+class IngestionError(Exception):
+    """图片转存错误"""
+    pass
+
+
+def is_allowed_source(url: str) -> bool:
+    """是否为允许转存的地址：https且主机为配置的交付域名或其子域名"""
+    parts = urlsplit(url)
+    host = (parts.hostname or "").rstrip(".").lower()
+    if parts.scheme != "https" or not host:
+        return False
+    allowed = [h.strip().lower() for h in settings.IMAGE_INGESTION_ALLOWED_HOSTS.split(",") if h.strip()]
+    return any(host == domain or host.endswith(f".{domain}") for domain in allowed)
+
+
+def is_public_address(address: str) -> bool:
+    """是否为公网地址（排除私有、回环、链路本地、保留和组播地址）"""
+    try:
+        ip = ipaddress.ip_address(address.split("%", 1)[0])
+    except ValueError:
+        return False
+    if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+async def resolve_host(host: str) -> List[str]:
+    """解析主机的全部地址"""
+    infos = await asyncio.get_running_loop().getaddrinfo(host, 443, type=socket.SOCK_STREAM)
+    return [info[4][0] for info in infos]
+
+
+def build_storage_key(digest: str, content_type: Optional[str]) -> str:
+    """按内容哈希生成存储路径，相同内容总是得到相同路径"""
+    extension = mimetypes.guess_extension((content_type or "").split(";")[0].strip()) or ".png"
+    if extension == ".jpe":
+        extension = ".jpg"
+    return f"{settings.IMAGE_STORAGE_PREFIX}/{digest[:2]}/{digest}{extension}"
+
+
+def build_variant_key(digest: str, width: int, fmt: str) -> str:
+    """衍生图片与原图存放在同一目录"""
+    return f"{settings.IMAGE_STORAGE_PREFIX}/{digest[:2]}/{digest}_{width}w.{fmt}"
+
+
+def build_swap_statements(image_id: str, task_id: Optional[str], source_url: str, durable_url: str,
+                          values: Optional[Dict[str, Any]] = None) -> list:
+    """仅当地址仍是原始地址时替换，避免覆盖期间发生的其他修改；values为同时写入的其他图片字段"""
+    from ..models.generation_task import GenerationTask
+    from ..models.image import Image
+
+    statements = [
+        update(Image.__table__).where(
+            Image.id == image_id, Image.image_url == source_url
+        ).values(image_url=durable_url, **(values or {}))
+    ]
+    if task_id:
+        statements.append(
+            update(GenerationTask.__table__).where(
+                GenerationTask.id == task_id, GenerationTask.result_url == source_url
+            ).values(result_url=durable_url)
+        )
+    return statements
+
+
+async def swap_image_url(image_id: str, task_id: Optional[str], source_url: str, durable_url: str,
+                         values: Optional[Dict[str, Any]] = None) -> bool:
+    """在一个事务中替换图片和任务的地址，返回图片地址是否被替换"""
+    from ..core.database import get_async_engine
+
+    statements = build_swap_statements(image_id, task_id, source_url, durable_url, values)
+    async with get_async_engine().begin() as conn:
+        results = [await conn.execute(stmt) for stmt in statements]
+    return results[0].rowcount == 1
+
+
+class SupabaseStorageBackend:
+    """Supabase Storage公开存储桶"""
+
+    name = "supabase"
+
+    def __init__(self, bucket: str):
+        self.bucket = bucket
+
+    def owns(self, url: str) -> bool:
+        return bool(settings.SUPABASE_URL) and url.startswith(
+            f"{settings.SUPABASE_URL.rstrip('/')}/storage/v1/object/public/{self.bucket}/"
+        )
+
+    async def upload(self, key: str, file_path: str, content_type: str, owner: Optional[str] = None) -> str:
+        from ..core.supabase import supabase_manager
+
+        # 传入文件路径，由存储客户端分块读取上传；路径由内容决定，重复上传直接覆盖
+        result = await supabase_manager.upload_file(
+            self.bucket,
+            key,
+            file_path,
+            content_type,
+            file_options={"x-upsert": "true", "cache-control": "31536000"},
+            owner=owner
+        )
+        if not result["success"]:
+            raise IngestionError(f"上传到Supabase Storage失败: {result['error']}")
+        return result["url"]
+
+
+class LocalStorageBackend:
+    """本地目录存储，用于开发和测试"""
+
+    name = "local"
+
+    def __init__(self, root: str, base_url: str):
+        self.root = root
+        self.base_url = base_url.rstrip("/")
+
+    def owns(self, url: str) -> bool:
+        return url.startswith(f"{self.base_url}/")
+
+    def _copy(self, key: str, file_path: str):
+        target = os.path.join(self.root, key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copyfile(file_path, target)
+
+    async def upload(self, key: str, file_path: str, content_type: str, owner: Optional[str] = None) -> str:
+        await asyncio.to_thread(self._copy, key, file_path)
+        return f"{self.base_url}/{key}"
+
+
+def create_storage_backend():
+    if settings.IMAGE_STORAGE_BACKEND == "local":
+        return LocalStorageBackend(settings.IMAGE_STORAGE_LOCAL_DIR, settings.IMAGE_STORAGE_LOCAL_BASE_URL)
+    return SupabaseStorageBackend(settings.IMAGE_STORAGE_BUCKET)
+
+
+# 地址替换函数: (image_id, task_id, source_url, durable_url, values) -> 是否替换
+SwapFunc = Callable[[str, Optional[str], str, str, Dict[str, Any]], Awaitable[bool]]
+
+# 域名解析函数: host -> 地址列表
+ResolveFunc = Callable[[str], Awaitable[List[str]]]
+
+
+class ImageIngestionPipeline:
+    """有界队列 + 固定数量worker的转存流水线"""
+
+    def __init__(
+        self,
+        backend=None,
+        client: Optional[httpx.AsyncClient] = None,
+        swap: SwapFunc = swap_image_url,
+        resolve: ResolveFunc = resolve_host,
+        renderer: Optional[VariantRenderer] = None,
+        workers: int = 4,
+        max_queue: int = 1000,
+        max_attempts: int = 3,
+        retry_base_delay: float = 1.0,
+        chunk_size: int = 64 * 1024,
+        max_bytes: int = 20 * 1024 * 1024
+    ):
+        self.backend = backend if backend is not None else create_storage_backend()
+        self._client = client
+        self.swap = swap
+        self.resolve = resolve
+        self.renderer = renderer if renderer is not None else variant_renderer
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_attempts = max_attempts
+        self.retry_base_delay = retry_base_delay
+        self.chunk_size = chunk_size
+        self.max_bytes = max_bytes
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._retry_tasks: set = set()
+        self._pending: set = set()
+        self._known: "OrderedDict[str, Tuple[str, Dict[str, Any]]]" = OrderedDict()
+        self.stats = {
+            "submitted": 0,
+            "skipped": 0,
+            "rejected": 0,
+            "dropped": 0,
+            "downloaded_bytes": 0,
+            "uploaded": 0,
+            "deduplicated": 0,
+            "variants_uploaded": 0,
+            "swapped": 0,
+            "conflicts": 0,
+            "retries": 0,
+            "failed": 0
+        }
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        return self._client or http_client_registry.get_client("ingestion")
+
+    def submit(self, images: Iterable[Tuple[str, str]], task_id: Optional[str] = None,
+               user_id: Optional[str] = None) -> int:
+        """提交 (image_id, image_url) 等待转存，不等待完成；返回入队数量。user_id为计入存储用量的用户"""
+        if not settings.IMAGE_INGESTION_ENABLED:
+            return 0
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            logger.warning("没有运行中的事件循环，跳过图片转存")
+            return 0
+        self.start()
+
+        queued = 0
+        for image_id, source_url in images:
+            image_id = str(image_id)
+            if not source_url.startswith(("http://", "https://")) or self.backend.owns(source_url):
+                self.stats["skipped"] += 1
+                continue
+            if not is_allowed_source(source_url):
+                # 非AI服务交付地址不下载，保留原地址
+                self.stats["rejected"] += 1
+                logger.warning(f"图片 {image_id} 的地址不在允许转存的域名内，跳过转存")
+                continue
+            if image_id in self._pending:
+                self.stats["skipped"] += 1
+                continue
+            job = {
+                "image_id": image_id,
+                "task_id": task_id,
+                "user_id": str(user_id) if user_id is not None else None,
+                "source_url": source_url,
+                "attempts": 0
+            }
+            try:
+                self._queue.put_nowait(job)
+            except asyncio.QueueFull:
+                # 队列满时放弃转存，图片仍可通过原始地址访问
+                self.stats["dropped"] += 1
+                continue
+            self._pending.add(image_id)
+            self.stats["submitted"] += 1
+            queued += 1
+        return queued
+
+    def start(self):
+        """启动worker（已启动时忽略）"""
+        if self._tasks and not all(task.done() for task in self._tasks):
+            return
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+
+    async def _worker(self, slot: int):
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._process(job)
+            except Exception as e:
+                logger.error(f"转存worker槽位 {slot} 处理失败: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _download(self, url: str, file) -> Tuple[str, Optional[str], int]:
+        """流式下载到文件并计算SHA-256，返回 (哈希, Content-Type, 字节数)"""
+        # 下载前检查解析结果，防止允许的域名被指向内网地址；客户端不跟随重定向
+        addresses = await self.resolve(urlsplit(url).hostname)
+        if not addresses or not all(is_public_address(address) for address in addresses):
+            raise IngestionError(f"图片地址解析到非公网地址: {url}")
+
+        digest = hashlib.sha256()
+        size = 0
+        async with self.client.stream("GET", url) as response:
+            response.raise_for_status()
+            content_type = response.headers.get("content-type")
+            async for chunk in response.aiter_bytes(self.chunk_size):
+                size += len(chunk)
+                if size > self.max_bytes:
+                    raise IngestionError(f"图片超过大小限制 {self.max_bytes} 字节")
+                digest.update(chunk)
+                file.write(chunk)
+        return digest.hexdigest(), content_type, size
+
+    async def _store_variants(self, digest: str, source_path: str, owner: Optional[str]) -> Dict[str, Any]:
+        """生成并上传衍生图片，返回写入图片记录的thumbnail_url与variants"""
+        output_dir = tempfile.mkdtemp(prefix="variants-")
+        try:
+            try:
+                variants = await self.renderer.render(source_path, output_dir)
+            except Exception as e:
+                # 无法解码的图片仍然转存原图，只是没有缩略图
+                logger.error(f"生成衍生图片失败({digest}): {e}")
+                return {}
+
+            urls: Dict[str, Dict[str, str]] = {}
+            for variant in variants:
+                url = await self.backend.upload(
+                    build_variant_key(digest, variant["width"], variant["format"]),
+                    variant["path"],
+                    f"image/{variant['format']}",
+                    owner
+                )
+                variant["url"] = url
+                urls.setdefault(variant["format"], {})[str(variant["width"])] = url
+                self.stats["variants_uploaded"] += 1
+
+            thumbnail = self.renderer.pick_thumbnail(variants)
+            return {
+                "thumbnail_url": thumbnail["url"] if thumbnail else None,
+                "variants": urls
+            }
+        finally:
+            shutil.rmtree(output_dir, ignore_errors=True)
+
+    async def _store(self, source_url: str, owner: Optional[str] = None) -> Tuple[str, Dict[str, Any]]:
+        """下载并上传原图和衍生图片，返回 (持久地址, 其他图片字段)"""
+        fd, tmp_path = tempfile.mkstemp(prefix="ingest-")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                digest, content_type, size = await self._download(source_url, file)
+            self.stats["downloaded_bytes"] += size
+
+            known = self._known.get(digest)
+            if known is not None:
+                self._known.move_to_end(digest)
+                self.stats["deduplicated"] += 1
+                return known
+
+            content_type = content_type or "image/png"
+            durable_url = await self.backend.upload(
+                build_storage_key(digest, content_type), tmp_path, content_type, owner
+            )
+            self.stats["uploaded"] += 1
+            values = await self._store_variants(digest, tmp_path, owner) if self.renderer.enabled else {}
+
+            self._known[digest] = (durable_url, values)
+            while len(self._known) > KNOWN_DIGESTS_MAX:
+                self._known.popitem(last=False)
+            return durable_url, values
+        finally:
+            os.unlink(tmp_path)
+
+    async def _process(self, job: Dict[str, Any]):
+        job["attempts"] += 1
+        try:
+            durable_url, values = await self._store(job["source_url"], job["user_id"])
+            swapped = await self.swap(job["image_id"], job["task_id"], job["source_url"], durable_url, values)
+        except Exception as e:
+            if job["attempts"] < self.max_attempts:
+                self.stats["retries"] += 1
+                delay = self.retry_base_delay * (2 ** (job["attempts"] - 1)) * random.uniform(0.5, 1.5)
+                retry = asyncio.create_task(self._retry_later(job, delay))
+                self._retry_tasks.add(retry)
+                retry.add_done_callback(self._retry_tasks.discard)
+                return
+            self._pending.discard(job["image_id"])
+            self.stats["failed"] += 1
+            logger.error(f"图片 {job['image_id']} 转存失败: {e}")
+            return
+
+        self._pending.discard(job["image_id"])
+        # 未替换说明图片已删除或地址已被修改
+        self.stats["swapped" if swapped else "conflicts"] += 1
+
+    async def _retry_later(self, job: Dict[str, Any], delay: float):
+        await asyncio.sleep(delay)
+        await self._queue.put(job)
+
+    async def drain(self):
+        """等待队列中和等待重试的任务全部完成"""
+        if self._queue is None:
+            return
+        await self._queue.join()
+        while self._retry_tasks:
+            await asyncio.gather(*self._retry_tasks, return_exceptions=True)
+            await self._queue.join()
+
+    async def stop(self, timeout: float = 10.0):
+        """停止worker，尽量先完成已入队的转存"""
+        try:
+            await asyncio.wait_for(self.drain(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning("图片转存队列未在关闭前处理完，剩余图片保留原始地址")
+        for task in [*self._tasks, *self._retry_tasks]:
+            task.cancel()
+        await asyncio.gather(*self._tasks, *self._retry_tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+        self._pending.clear()
+        await asyncio.to_thread(self.renderer.shutdown)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取转存统计"""
+        return {
+            **self.stats,
+            "backend": self.backend.name,
+            "variants": self.renderer.get_stats(),
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "in_progress": len(self._pending)
+        }
+
+
+# 全局图片转存流水线
+image_ingestion = ImageIngestionPipeline(
+    workers=settings.IMAGE_INGESTION_WORKERS,
+    max_queue=settings.IMAGE_INGESTION_QUEUE_SIZE,
+    max_attempts=settings.IMAGE_INGESTION_MAX_ATTEMPTS,
+    retry_base_delay=settings.IMAGE_INGESTION_RETRY_BASE_DELAY,
+    chunk_size=settings.IMAGE_INGESTION_CHUNK_SIZE,
+    max_bytes=settings.IMAGE_INGESTION_MAX_BYTES
+)
@@ -0,0 +1,145 @@
+"""
+图片衍生尺寸生成
+在进程池中用Pillow把原图缩放为缩略图和多种宽度的WebP/AVIF，避免图片编码占用事件循环。
+画廊网格使用缩略图，前端可按variants构造srcset
+"""
+
+import asyncio
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from PIL import Image as PILImage, features
+
+from ..core.config import settings
+
+logger = logging.getLogger(__name__)
+
+try:
+    # Pillow 11.2之前需要 pillow-avif-plugin 提供AVIF编码
+    import pillow_avif  # noqa: F401
+except ImportError:
+    pass
+
+
+def available_formats(formats: List[str]) -> List[str]:
+    """过滤掉当前Pillow无法编码的格式"""
+    PILImage.init()
+    result = []
+    for fmt in formats:
+        if fmt == "webp" and not features.check("webp"):
+            continue
+        if fmt.upper() not in PILImage.SAVE:
+            continue
+        result.append(fmt)
+    return result
+
+
+def parse_widths(value: str) -> List[int]:
+    return sorted({int(part) for part in value.split(",") if part.strip()})
+
+
+def render_variants(source_path: str, output_dir: str, widths: List[int],
+                    formats: List[str], quality: int) -> List[Dict[str, Any]]:
+    """
+    生成衍生图片并写入output_dir，返回每个文件的描述。
+    运行在子进程中，参数和返回值都需要可序列化
+    """
+    variants = []
+    with PILImage.open(source_path) as source:
+        source.load()
+        image = source.convert("RGBA" if source.mode in ("RGBA", "LA", "P") else "RGB")
+
+    # 不放大：比原图宽的尺寸跳过，但至少保留最小的一档
+    targets = [width for width in widths if width < image.width] or [min(widths[0], image.width)]
+    for width in targets:
+        height = max(1, round(image.height * width / image.width))
+        resized = image.resize((width, height), PILImage.LANCZOS)
+        for fmt in formats:
+            path = os.path.join(output_dir, f"{width}w.{fmt}")
+            resized.save(path, format=fmt.upper(), quality=quality)
+            variants.append({
+                "width": width,
+                "height": height,
+                "format": fmt,
+                "path": path,
+                "bytes": os.path.getsize(path)
+            })
+    return variants
+
+
+class VariantRenderer:
+    """进程池封装"""
+
+    def __init__(self, processes: int, widths: List[int], formats: List[str],
+                 quality: int, thumbnail_width: int):
+        self.processes = processes
+        self.widths = widths
+        self.formats = available_formats(formats)
+        self.quality = quality
+        self.thumbnail_width = thumbnail_width
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self.stats = {
+            "rendered": 0,
+            "errors": 0,
+            "output_bytes": 0
+        }
+        if len(self.formats) < len(formats):
+            logger.warning(f"部分图片格式无法编码，已跳过: {sorted(set(formats) - set(self.formats))}")
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.widths and self.formats)
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.processes)
+        return self._executor
+
+    async def render(self, source_path: str, output_dir: str) -> List[Dict[str, Any]]:
+        """在进程池中生成衍生图片"""
+        loop = asyncio.get_running_loop()
+        try:
+            variants = await loop.run_in_executor(
+                self._get_executor(), render_variants,
+                source_path, output_dir, self.widths, self.formats, self.quality
+            )
+        except Exception:
+            self.stats["errors"] += 1
+            raise
+        self.stats["rendered"] += 1
+        self.stats["output_bytes"] += sum(variant["bytes"] for variant in variants)
+        return variants
+
+    def pick_thumbnail(self, variants: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """缩略图取不小于thumbnail_width的最小一档（没有时取最大一档），优先首选格式"""
+        preferred = [variant for variant in variants if variant["format"] == self.formats[0]]
+        if not preferred:
+            return None
+        larger = [variant for variant in preferred if variant["width"] >= self.thumbnail_width]
+        if larger:
+            return min(larger, key=lambda variant: variant["width"])
+        return max(preferred, key=lambda variant: variant["width"])
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "formats": self.formats,
+            "widths": self.widths
+        }
+
+
+# 全局衍生图片生成器
+variant_renderer = VariantRenderer(
+    processes=settings.IMAGE_VARIANT_PROCESSES,
+    widths=parse_widths(settings.IMAGE_VARIANT_WIDTHS) if settings.IMAGE_VARIANTS_ENABLED else [],
+    formats=[part.strip() for part in settings.IMAGE_VARIANT_FORMATS.split(",") if part.strip()],
+    quality=settings.IMAGE_VARIANT_QUALITY,
+    thumbnail_width=settings.IMAGE_THUMBNAIL_WIDTH
+)
@@ -0,0 +1,354 @@
+"""
+持久化生成任务队列
+以GenerationTask.id为键的至少一次投递队列，支持可见性超时和带抖动的重试。
+生产环境使用Redis，本地和测试环境可使用SQLite（含:memory:）
+"""
+
+import asyncio
+import json
+import logging
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, Any, Optional, Callable, Awaitable
+
+from ..core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# 任务处理函数: (task_id, payload, final_attempt) -> None
+JobHandler = Callable[[str, Dict[str, Any], bool], Awaitable[None]]
+
+
+class JobQueueError(Exception):
+    """任务队列错误"""
+    pass
+
+
+class RedisJobQueueBackend:
+    """
+    基于Redis的队列后端（就绪有序集合 + 处理中有序集合 + 数据哈希 + 领取令牌哈希）
+
+    每次领取生成新的令牌，ack和retry在脚本内校验令牌，
+    可见性超时后已被其他worker重新领取的任务不会被原worker确认或重新入队
+    """
+
+    RESERVE_SCRIPT = """
+    local ids = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, 1)
+    if #ids == 0 then
+        return nil
+    end
+    local id = ids[1]
+    redis.call('ZREM', KEYS[1], id)
+    redis.call('ZADD', KEYS[2], ARGV[2], id)
+    redis.call('HSET', KEYS[5], id, ARGV[3])
+    local attempts = redis.call('HINCRBY', KEYS[4], id, 1)
+    return {id, redis.call('HGET', KEYS[3], id), attempts}
+    """
+
+    REQUEUE_SCRIPT = """
+    local ids = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1])
+    for _, id in ipairs(ids) do
+        redis.call('ZREM', KEYS[2], id)
+        redis.call('HDEL', KEYS[5], id)
+        redis.call('ZADD', KEYS[1], ARGV[1], id)
+    end
+    return #ids
+    """
+
+    ACK_SCRIPT = """
+    if redis.call('HGET', KEYS[5], ARGV[1]) ~= ARGV[2] then
+        return 0
+    end
+    redis.call('ZREM', KEYS[2], ARGV[1])
+    redis.call('HDEL', KEYS[3], ARGV[1])
+    redis.call('HDEL', KEYS[4], ARGV[1])
+    redis.call('HDEL', KEYS[5], ARGV[1])
+    return 1
+    """
+
+    RETRY_SCRIPT = """
+    if redis.call('HGET', KEYS[5], ARGV[1]) ~= ARGV[2] then
+        return 0
+    end
+    redis.call('ZREM', KEYS[2], ARGV[1])
+    redis.call('HDEL', KEYS[5], ARGV[1])
+    redis.call('ZADD', KEYS[1], ARGV[3], ARGV[1])
+    return 1
+    """
+
+    ENQUEUE_SCRIPT = """
+    if redis.call('HSETNX', KEYS[3], ARGV[1], ARGV[2]) == 0 then
+        return 0
+    end
+    redis.call('ZADD', KEYS[1], ARGV[3], ARGV[1])
+    return 1
+    """
+
+    def __init__(self, url: str, prefix: str = "ghibli:jobs"):
+        import redis.asyncio as aioredis
+
+        self.redis = aioredis.from_url(url, decode_responses=True)
+        self.ready_key = f"{prefix}:ready"
+        self.inflight_key = f"{prefix}:inflight"
+        self.data_key = f"{prefix}:data"
+        self.attempts_key = f"{prefix}:attempts"
+        self.tokens_key = f"{prefix}:tokens"
+        self._keys = [self.ready_key, self.inflight_key, self.data_key, self.attempts_key, self.tokens_key]
+        self._reserve = self.redis.register_script(self.RESERVE_SCRIPT)
+        self._requeue = self.redis.register_script(self.REQUEUE_SCRIPT)
+        self._enqueue = self.redis.register_script(self.ENQUEUE_SCRIPT)
+        self._ack = self.redis.register_script(self.ACK_SCRIPT)
+        self._retry = self.redis.register_script(self.RETRY_SCRIPT)
+
+    async def enqueue(self, job_id: str, data: Dict[str, Any], available_at: float) -> bool:
+        created = await self._enqueue(keys=self._keys, args=[job_id, json.dumps(data), available_at])
+        return bool(created)
+
+    async def reserve(self, visibility_timeout: float) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        token = uuid.uuid4().hex
+        result = await self._reserve(keys=self._keys, args=[now, now + visibility_timeout, token])
+        if not result:
+            return None
+        job_id, raw, attempts = result
+        data = json.loads(raw) if raw else {}
+        return {"id": job_id, "attempts": int(attempts), "token": token, **data}
+
+    async def ack(self, job_id: str, token: str) -> bool:
+        return bool(await self._ack(keys=self._keys, args=[job_id, token]))
+
+    async def retry(self, job_id: str, token: str, available_at: float) -> bool:
+        return bool(await self._retry(keys=self._keys, args=[job_id, token, available_at]))
+
+    async def requeue_expired(self) -> int:
+        return int(await self._requeue(keys=self._keys, args=[time.time()]))
+
+    async def stats(self) -> Dict[str, int]:
+        return {
+            "ready": await self.redis.zcard(self.ready_key),
+            "in_flight": await self.redis.zcard(self.inflight_key)
+        }
+
+    async def close(self):
+        await self.redis.close()
+
+
+class SQLiteJobQueueBackend:
+    """基于SQLite的队列后端，用于本地开发和测试（path=":memory:"时仅限单进程），领取令牌语义与Redis后端一致"""
+
+    def __init__(self, path: str = ":memory:"):
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS generation_jobs (
+                id TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                available_at REAL NOT NULL,
+                reserved_until REAL,
+                reservation_token TEXT
+            )
+        """)
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(generation_jobs)")]
+        if "reservation_token" not in columns:
+            self._conn.execute("ALTER TABLE generation_jobs ADD COLUMN reservation_token TEXT")
+
+    async def enqueue(self, job_id: str, data: Dict[str, Any], available_at: float) -> bool:
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO generation_jobs (id, data, available_at) VALUES (?, ?, ?)",
+                (job_id, json.dumps(data), available_at)
+            )
+            return cursor.rowcount == 1
+
+    async def reserve(self, visibility_timeout: float) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        token = uuid.uuid4().hex
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT id, data, attempts FROM generation_jobs "
+                    "WHERE reserved_until IS NULL AND available_at <= ? "
+                    "ORDER BY available_at LIMIT 1",
+                    (now,)
+                ).fetchone()
+                if row is None:
+                    self._conn.execute("COMMIT")
+                    return None
+                self._conn.execute(
+                    "UPDATE generation_jobs SET reserved_until = ?, reservation_token = ?, "
+                    "attempts = attempts + 1 WHERE id = ?",
+                    (now + visibility_timeout, token, row[0])
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return {"id": row[0], "attempts": row[2] + 1, "token": token, **json.loads(row[1])}
+
+    async def ack(self, job_id: str, token: str) -> bool:
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM generation_jobs WHERE id = ? AND reservation_token = ?",
+                (job_id, token)
+            )
+            return cursor.rowcount == 1
+
+    async def retry(self, job_id: str, token: str, available_at: float) -> bool:
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE generation_jobs SET reserved_until = NULL, reservation_token = NULL, available_at = ? "
+                "WHERE id = ? AND reservation_token = ?",
+                (available_at, job_id, token)
+            )
+            return cursor.rowcount == 1
+
+    async def requeue_expired(self) -> int:
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE generation_jobs SET reserved_until = NULL, reservation_token = NULL "
+                "WHERE reserved_until IS NOT NULL AND reserved_until <= ?",
+                (time.time(),)
+            )
+            return cursor.rowcount
+
+    async def stats(self) -> Dict[str, int]:
+        with self._lock:
+            ready = self._conn.execute(
+                "SELECT COUNT(*) FROM generation_jobs WHERE reserved_until IS NULL"
+            ).fetchone()[0]
+            in_flight = self._conn.execute(
+                "SELECT COUNT(*) FROM generation_jobs WHERE reserved_until IS NOT NULL"
+            ).fetchone()[0]
+        return {"ready": ready, "in_flight": in_flight}
+
+    async def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def create_job_queue_backend():
+    """根据配置创建队列后端"""
+    if settings.JOB_QUEUE_BACKEND == "redis":
+        return RedisJobQueueBackend(settings.REDIS_URL)
+    if settings.JOB_QUEUE_BACKEND == "sqlite":
+        return SQLiteJobQueueBackend(settings.JOB_QUEUE_SQLITE_PATH)
+    raise JobQueueError(f"不支持的任务队列后端: {settings.JOB_QUEUE_BACKEND}")
+
+
+class GenerationJobQueue:
+    """生成任务队列 - 至少一次投递，处理函数需按task_id幂等"""
+
+    def __init__(self, backend=None):
+        self._backend = backend
+        self.handlers: Dict[str, JobHandler] = {}
+        self.visibility_timeout = settings.JOB_QUEUE_VISIBILITY_TIMEOUT
+        self.max_attempts = settings.JOB_QUEUE_MAX_ATTEMPTS
+        self.retry_base_delay = settings.JOB_QUEUE_RETRY_BASE_DELAY
+        self.retry_max_delay = settings.JOB_QUEUE_RETRY_MAX_DELAY
+        self.stats = {
+            "enqueued": 0,
+            "duplicates": 0,
+            "succeeded": 0,
+            "retried": 0,
+            "dead_lettered": 0,
+            "requeued_expired": 0,
+            "lost_reservations": 0
+        }
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            self._backend = create_job_queue_backend()
+        return self._backend
+
+    def register_handler(self, kind: str, handler: JobHandler):
+        """注册任务类型的处理函数"""
+        self.handlers[kind] = handler
+
+    async def enqueue(self, task_id: str, kind: str, payload: Dict[str, Any], delay: float = 0) -> bool:
+        """提交任务，相同task_id重复提交会被忽略"""
+        created = await self.backend.enqueue(
+            task_id,
+            {"kind": kind, "payload": payload},
+            time.time() + delay
+        )
+        self.stats["enqueued" if created else "duplicates"] += 1
+        return created
+
+    def _retry_delay(self, attempts: int) -> float:
+        """指数退避加随机抖动"""
+        delay = min(self.retry_base_delay * (2 ** (attempts - 1)), self.retry_max_delay)
+        return delay * random.uniform(0.5, 1.5)
+
+    async def process_next(self) -> bool:
+        """领取并执行一个任务，队列为空时返回False"""
+        expired = await self.backend.requeue_expired()
+        if expired:
+            self.stats["requeued_expired"] += expired
+            logger.warning(f"{expired} 个任务可见性超时，已重新入队")
+
+        job = await self.backend.reserve(self.visibility_timeout)
+        if job is None:
+            return False
+
+        task_id = job["id"]
+        token = job["token"]
+        handler = self.handlers.get(job.get("kind"))
+        if handler is None:
+            logger.error(f"任务 {task_id} 类型未注册处理函数: {job.get('kind')}")
+            await self._ack(task_id, token)
+            self.stats["dead_lettered"] += 1
+            return True
+
+        final_attempt = job["attempts"] >= self.max_attempts
+        try:
+            await handler(task_id, job.get("payload", {}), final_attempt)
+            if await self._ack(task_id, token):
+                self.stats["succeeded"] += 1
+        except Exception as e:
+            if final_attempt:
+                logger.error(f"任务 {task_id} 第{job['attempts']}次执行失败，不再重试: {e}")
+                if await self._ack(task_id, token):
+                    self.stats["dead_lettered"] += 1
+            else:
+                delay = self._retry_delay(job["attempts"])
+                logger.warning(f"任务 {task_id} 第{job['attempts']}次执行失败，{delay:.1f}秒后重试: {e}")
+                if await self.backend.retry(task_id, token, time.time() + delay):
+                    self.stats["retried"] += 1
+                else:
+                    self._lost_reservation(task_id)
+        return True
+
+    async def _ack(self, task_id: str, token: str) -> bool:
+        """确认任务，领取已失效时返回False"""
+        if await self.backend.ack(task_id, token):
+            return True
+        self._lost_reservation(task_id)
+        return False
+
+    def _lost_reservation(self, task_id: str):
+        """可见性超时后任务已重新入队或被其他worker领取，本次结果不再生效"""
+        self.stats["lost_reservations"] += 1
+        logger.warning(f"任务 {task_id} 的领取已失效，忽略本次确认")
+
+    async def get_stats(self) -> Dict[str, Any]:
+        """获取队列统计"""
+        try:
+            backend_stats = await self.backend.stats()
+        except Exception as e:
+            backend_stats = {"error": str(e)}
+        return {**self.stats, **backend_stats}
+
+    async def close(self):
+        if self._backend is not None:
+            await self._backend.close()
+            self._backend = None
+
+
+# 全局生成任务队列
+generation_queue = GenerationJobQueue()
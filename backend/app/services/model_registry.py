@@ -0,0 +1,208 @@
+"""
+模型目录
+启动时把各服务的静态模型配置与 ReplicateConfig.available_models 合并为按ID索引的字典，
+并预先序列化各目录接口的响应体和强ETag；可选地在后台从服务商 /models 接口刷新。
+生成页每次加载都会请求这些接口，客户端与CDN按ETag/Cache-Control缓存
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from typing import Any, Dict, List, Optional
+
+from fastapi import Request, Response
+
+from ..config.replicate import replicate_config
+from ..core.config import settings
+from ..schemas.generation import ModelInfo
+from .replicate_service import replicate_service
+from .siliconflow_service import siliconflow_service
+
+logger = logging.getLogger(__name__)
+
+# Replicate模型ID与 ReplicateConfig.available_models 键的对应关系
+REPLICATE_CONFIG_KEYS = {
+    "replicate-flux-schnell": "flux-schnell",
+    "replicate-flux": "flux-dev",
+    "replicate-sdxl": "sdxl",
+    "replicate-playground": "playground-v2.5"
+}
+
+# 静态配置中的SiliconFlow模型ID与其 /models 接口发布的ID不同时的对应关系（比较时不区分大小写）
+SILICONFLOW_LIVE_IDS = {
+    "black-forest-labs/flux-schnell": "black-forest-labs/FLUX.1-schnell"
+}
+
+# 预序列化的响应
+CATALOG_ALL = "all"
+CATALOG_REPLICATE = "replicate"
+
+
+class CachedPayload:
+    """预序列化的JSON响应体及其强ETag"""
+
+    def __init__(self, data: Any):
+        self.body = json.dumps(data, ensure_ascii=False, sort_keys=True, separators=(",", ":")).encode("utf-8")
+        self.etag = f'"{hashlib.sha256(self.body).hexdigest()[:32]}"'
+
+
+def _matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+class ModelRegistry:
+    """按ID索引的模型目录"""
+
+    def __init__(self):
+        self._models: Dict[str, Dict[str, Any]] = {}
+        self._payloads: Dict[str, CachedPayload] = {}
+        self._model_payloads: Dict[str, CachedPayload] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.loaded_at: Optional[float] = None
+        self.stats = {
+            "served": 0,
+            "not_modified": 0,
+            "refreshes": 0,
+            "refresh_errors": 0
+        }
+
+    def load(self):
+        """从静态配置构建目录"""
+        models: Dict[str, Dict[str, Any]] = {}
+        for model in replicate_service.get_supported_models():
+            config = replicate_config.available_models.get(REPLICATE_CONFIG_KEYS.get(model["id"]), {})
+            models[model["id"]] = {
+                **model,
+                "provider": "replicate",
+                "version": config.get("version"),
+                # 服务商发布的最新版本，仅供展示；生成始终使用上面配置的version
+                "latest_version": None,
+                "available": True
+            }
+        for model in siliconflow_service.get_supported_models():
+            models[model["id"]] = {**model, "provider": "siliconflow", "available": True}
+        self._publish(models)
+
+    def _publish(self, models: Dict[str, Dict[str, Any]]):
+        """替换目录并重新生成响应体，内容不变时ETag也不变"""
+        catalog = [ModelInfo(**model).dict() for model in models.values()]
+        replicate_models = [model for model in models.values() if model["provider"] == "replicate"]
+        self._payloads = {
+            CATALOG_ALL: CachedPayload({"models": catalog, "total": len(catalog)}),
+            CATALOG_REPLICATE: CachedPayload({
+                "models": replicate_models,
+                "total": len(replicate_models),
+                "provider": "replicate"
+            })
+        }
+        self._model_payloads = {model_id: CachedPayload(model) for model_id, model in models.items()}
+        self._models = models
+        self.loaded_at = time.time()
+
+    def _ensure_loaded(self):
+        if not self._models:
+            self.load()
+
+    def get(self, model_id: str) -> Optional[Dict[str, Any]]:
+        """按ID获取模型"""
+        self._ensure_loaded()
+        return self._models.get(model_id)
+
+    def list(self, provider: Optional[str] = None) -> List[Dict[str, Any]]:
+        self._ensure_loaded()
+        return [model for model in self._models.values() if provider is None or model["provider"] == provider]
+
+    def _serve(self, request: Request, payload: CachedPayload) -> Response:
+        headers = {"ETag": payload.etag, "Cache-Control": settings.MODEL_CATALOG_CACHE_CONTROL}
+        if _matches(request.headers.get("if-none-match"), payload.etag):
+            self.stats["not_modified"] += 1
+            return Response(status_code=304, headers=headers)
+        self.stats["served"] += 1
+        return Response(content=payload.body, media_type="application/json", headers=headers)
+
+    def catalog_response(self, request: Request, catalog: str) -> Response:
+        """目录接口响应（带ETag与Cache-Control，支持304）"""
+        self._ensure_loaded()
+        return self._serve(request, self._payloads[catalog])
+
+    def model_response(self, request: Request, model_id: str, provider: Optional[str] = None) -> Optional[Response]:
+        """单个模型的响应；模型不存在或不属于provider时返回None"""
+        self._ensure_loaded()
+        model = self._models.get(model_id)
+        if model is None or (provider is not None and model["provider"] != provider):
+            return None
+        return self._serve(request, self._model_payloads[model_id])
+
+    async def refresh(self):
+        """从服务商接口刷新：SiliconFlow按 /models 标记可用性，Replicate记录最新版本（不改变生成使用的版本）"""
+        self._ensure_loaded()
+        models = {model_id: dict(model) for model_id, model in self._models.items()}
+
+        # 单个服务商或单个模型查询失败时保留原有信息，不影响其余模型的刷新
+        if settings.SILICONFLOW_API_KEY:
+            try:
+                live = {model["id"].lower() for model in await siliconflow_service.get_models()}
+            except Exception as e:
+                self.stats["refresh_errors"] += 1
+                logger.warning(f"获取SiliconFlow模型列表失败: {e}")
+            else:
+                for model in models.values():
+                    if model["provider"] == "siliconflow":
+                        model["available"] = SILICONFLOW_LIVE_IDS.get(model["id"], model["id"]).lower() in live
+
+        if settings.REPLICATE_API_TOKEN:
+            for model in models.values():
+                name = (model.get("version") or "").split(":")[0]
+                if model["provider"] != "replicate" or "/" not in name:
+                    continue
+                try:
+                    info = await replicate_service.get_model(name)
+                except Exception as e:
+                    self.stats["refresh_errors"] += 1
+                    logger.warning(f"获取Replicate模型 {name} 信息失败: {e}")
+                    continue
+                latest = (info.get("latest_version") or {}).get("id")
+                if latest:
+                    model["latest_version"] = f"{name}:{latest}"
+
+        self._publish(models)
+        self.stats["refreshes"] += 1
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(settings.MODEL_REGISTRY_REFRESH_INTERVAL)
+            try:
+                await self.refresh()
+            except Exception as e:
+                self.stats["refresh_errors"] += 1
+                logger.error(f"刷新模型目录失败: {e}")
+
+    def start(self):
+        """加载目录；配置了刷新间隔时启动后台刷新"""
+        self._ensure_loaded()
+        if settings.MODEL_REGISTRY_REFRESH_INTERVAL > 0 and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取目录统计"""
+        return {
+            **self.stats,
+            "models": len(self._models),
+            "loaded_at": self.loaded_at,
+            "etag": self._payloads[CATALOG_ALL].etag if self._payloads else None
+        }
+
+
+# 全局模型目录
+model_registry = ModelRegistry()
@@ -0,0 +1,257 @@
+"""
+预测轮询调度器
+单个后台协程统一跟踪所有进行中的预测，按模型预估耗时安排首次查询，
+之后指数退避，并在到期任务较多时通过list_predictions批量查询
+"""
+
+import asyncio
+import heapq
+import logging
+import time
+from typing import Dict, Any, Optional, List, Tuple, Callable
+
+from ..core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class PredictionPoller:
+    """进程内共享的自适应轮询调度器"""
+
+    ACTIVE_STATUSES = ("starting", "processing")
+    TERMINAL_STATUSES = ("succeeded", "failed", "canceled")
+
+    def __init__(self, service):
+        # service需提供get_prediction / list_predictions / get_supported_models
+        self.service = service
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._heap: List[Tuple[float, str]] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._throttle_until = 0.0
+        self._priors: Optional[Dict[str, float]] = None
+        self.stats = {
+            "watched": 0,
+            "single_lookups": 0,
+            "batch_lookups": 0,
+            "rate_limited": 0,
+            "errors": 0
+        }
+
+    def _expected_duration(self, model: Optional[str]) -> float:
+        """根据模型预估耗时（get_supported_models中的estimated_time）"""
+        if self._priors is None:
+            self._priors = {
+                m["id"]: float(m.get("estimated_time", settings.REPLICATE_POLL_DEFAULT_EXPECTED))
+                for m in self.service.get_supported_models()
+            }
+        return self._priors.get(model, float(settings.REPLICATE_POLL_DEFAULT_EXPECTED))
+
+    def _ensure_running(self):
+        """按需启动后台调度协程"""
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def _schedule(self, prediction_id: str, at: float):
+        entry = self._entries[prediction_id]
+        entry["next_poll"] = at
+        heapq.heappush(self._heap, (at, prediction_id))
+        self._wakeup.set()
+
+    def watch(
+        self,
+        prediction_id: str,
+        model: Optional[str] = None,
+        started_at: Optional[float] = None,
+        initial_interval: Optional[float] = None,
+        callback: Optional[Callable[[Dict[str, Any]], None]] = None
+    ) -> asyncio.Future:
+        """
+        开始跟踪预测，返回在预测结束时完成的Future。
+        同一预测共享一次轮询，但每个调用方得到各自的Future：取消自己的Future只会注销自己，
+        最后一个调用方离开时才停止轮询
+        """
+        self._ensure_running()
+
+        future = asyncio.get_running_loop().create_future()
+        entry = self._entries.get(prediction_id)
+        if entry is None:
+            now = time.time()
+            expected = self._expected_duration(model)
+            first_poll = (started_at or now) + expected * settings.REPLICATE_POLL_FIRST_RATIO
+            entry = {
+                "waiters": [],
+                "interval": initial_interval or settings.REPLICATE_POLL_MIN_INTERVAL,
+                "next_poll": 0.0,
+                "polls": 0
+            }
+            self._entries[prediction_id] = entry
+            self.stats["watched"] += 1
+            self._schedule(prediction_id, max(first_poll, now + settings.REPLICATE_POLL_MIN_INTERVAL))
+
+        entry["waiters"].append((future, callback))
+        future.add_done_callback(lambda done: self._release(prediction_id, done))
+        return future
+
+    def _release(self, prediction_id: str, future: asyncio.Future):
+        """调用方的Future结束后注销，无人等待时停止跟踪"""
+        entry = self._entries.get(prediction_id)
+        if entry is None:
+            return
+        entry["waiters"] = [waiter for waiter in entry["waiters"] if waiter[0] is not future]
+        if not entry["waiters"]:
+            self._entries.pop(prediction_id, None)
+
+    def unwatch(self, prediction_id: str, future: Optional[asyncio.Future] = None):
+        """停止跟踪预测；指定future时只注销该调用方"""
+        entry = self._entries.get(prediction_id)
+        if entry is None:
+            return
+        waiters = [future] if future is not None else [waiter for waiter, _ in entry["waiters"]]
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.cancel()
+
+    async def _run(self):
+        """调度主循环"""
+        while True:
+            self._wakeup.clear()
+
+            # 丢弃已被重新调度或已移除的过期堆项
+            while self._heap:
+                at, prediction_id = self._heap[0]
+                entry = self._entries.get(prediction_id)
+                if entry is not None and entry["next_poll"] == at:
+                    break
+                heapq.heappop(self._heap)
+
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+
+            now = time.time()
+            next_time = max(self._heap[0][0], self._throttle_until)
+            if next_time > now:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=next_time - now)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            due = []
+            while self._heap and self._heap[0][0] <= now:
+                at, prediction_id = heapq.heappop(self._heap)
+                entry = self._entries.get(prediction_id)
+                if entry is not None and entry["next_poll"] == at:
+                    due.append(prediction_id)
+
+            try:
+                await self._poll(due)
+            except Exception as e:
+                logger.error(f"预测轮询失败: {e}")
+                self.stats["errors"] += 1
+                for prediction_id in due:
+                    self._reschedule(prediction_id)
+
+    def _handle_lookup_error(self, error: Exception):
+        """处理查询错误，429时全局退避"""
+        if getattr(error, "status_code", None) == 429:
+            self.stats["rate_limited"] += 1
+            self._throttle_until = time.time() + settings.REPLICATE_POLL_MAX_INTERVAL
+            logger.warning("Replicate轮询触发速率限制，暂停查询")
+        else:
+            self.stats["errors"] += 1
+            logger.warning(f"查询预测状态失败: {error}")
+
+    async def _poll(self, due: List[str]):
+        """查询到期预测的状态"""
+        snapshots: Dict[str, Dict[str, Any]] = {}
+        need_fetch = list(due)
+
+        if len(due) >= settings.REPLICATE_POLL_BATCH_THRESHOLD:
+            # 批量列表仅用于确认仍在运行的预测，结束的预测再单独拉取完整结果
+            try:
+                self.stats["batch_lookups"] += 1
+                listing = await self.service.list_predictions(limit=100)
+                listed = {p.get("id"): p for p in listing.get("results", [])}
+                need_fetch = []
+                for prediction_id in due:
+                    prediction = listed.get(prediction_id)
+                    if prediction and prediction.get("status") in self.ACTIVE_STATUSES:
+                        snapshots[prediction_id] = prediction
+                    else:
+                        need_fetch.append(prediction_id)
+            except Exception as e:
+                self._handle_lookup_error(e)
+
+        if need_fetch and time.time() >= self._throttle_until:
+            self.stats["single_lookups"] += len(need_fetch)
+            results = await asyncio.gather(
+                *(self.service.get_prediction(prediction_id) for prediction_id in need_fetch),
+                return_exceptions=True
+            )
+            for prediction_id, result in zip(need_fetch, results):
+                if isinstance(result, Exception):
+                    self._handle_lookup_error(result)
+                else:
+                    snapshots[prediction_id] = result
+
+        for prediction_id in due:
+            entry = self._entries.get(prediction_id)
+            if entry is None:
+                continue
+
+            prediction = snapshots.get(prediction_id)
+            if prediction is not None:
+                entry["polls"] += 1
+                for _, callback in list(entry["waiters"]):
+                    if callback is None:
+                        continue
+                    try:
+                        callback(prediction)
+                    except Exception as e:
+                        logger.warning(f"预测回调执行失败: {e}")
+
+                if prediction.get("status") in self.TERMINAL_STATUSES:
+                    self._entries.pop(prediction_id, None)
+                    for future, _ in entry["waiters"]:
+                        if not future.done():
+                            future.set_result(prediction)
+                    continue
+
+            self._reschedule(prediction_id)
+
+    def _reschedule(self, prediction_id: str):
+        """指数退避安排下一次查询"""
+        entry = self._entries.get(prediction_id)
+        if entry is None:
+            return
+        at = max(time.time() + entry["interval"], self._throttle_until)
+        entry["interval"] = min(
+            entry["interval"] * settings.REPLICATE_POLL_BACKOFF,
+            settings.REPLICATE_POLL_MAX_INTERVAL
+        )
+        self._schedule(prediction_id, at)
+
+    async def stop(self):
+        """停止调度器并取消所有等待"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
+        for prediction_id in list(self._entries):
+            self.unwatch(prediction_id)
+        self._heap.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取调度器统计"""
+        return {
+            **self.stats,
+            "in_flight": len(self._entries),
+            "throttled": time.time() < self._throttle_until
+        }
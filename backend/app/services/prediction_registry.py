@@ -0,0 +1,108 @@
+"""
+预测完成注册表
+按预测ID登记等待者，由Replicate webhook回调直接唤醒，比轮询调度器更早取得结果
+"""
+
+import asyncio
+import logging
+import time
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class PredictionCompletionRegistry:
+    """预测完成通知注册表（进程内）"""
+
+    TERMINAL_STATUSES = ("succeeded", "failed", "canceled")
+
+    def __init__(self, early_result_ttl: int = 300):
+        self._futures: Dict[str, asyncio.Future] = {}
+        # webhook可能先于create_prediction返回到达，暂存结果
+        self._early_results: Dict[str, Dict[str, Any]] = {}
+        self._early_result_ttl = early_result_ttl
+        self.stats = {
+            "registered": 0,
+            "resolved_by_webhook": 0,
+            "resolved_by_polling": 0,
+            "early_results": 0
+        }
+
+    def _prune_early_results(self):
+        """清理过期的暂存结果"""
+        now = time.time()
+        expired = [
+            prediction_id for prediction_id, entry in self._early_results.items()
+            if now - entry["received_at"] > self._early_result_ttl
+        ]
+        for prediction_id in expired:
+            del self._early_results[prediction_id]
+
+    def register(self, prediction_id: str) -> asyncio.Future:
+        """登记等待者，返回对应的Future"""
+        future = self._futures.get(prediction_id)
+        if future is not None:
+            return future
+
+        future = asyncio.get_running_loop().create_future()
+        self._futures[prediction_id] = future
+        self.stats["registered"] += 1
+
+        early = self._early_results.pop(prediction_id, None)
+        if early is not None:
+            future.set_result(early["prediction"])
+        return future
+
+    def get(self, prediction_id: str) -> Optional[asyncio.Future]:
+        """获取已登记的Future"""
+        return self._futures.get(prediction_id)
+
+    def is_registered(self, prediction_id: str) -> bool:
+        """是否存在等待者"""
+        return prediction_id in self._futures
+
+    def resolve(self, prediction_id: str, prediction: Dict[str, Any]) -> bool:
+        """
+        由webhook唤醒等待者
+
+        Returns:
+            是否有本进程内的等待者接收了该结果
+        """
+        if prediction.get("status") not in self.TERMINAL_STATUSES:
+            return self.is_registered(prediction_id)
+
+        future = self._futures.get(prediction_id)
+        if future is None:
+            self._prune_early_results()
+            self._early_results[prediction_id] = {
+                "prediction": prediction,
+                "received_at": time.time()
+            }
+            self.stats["early_results"] += 1
+            return False
+
+        if not future.done():
+            future.set_result(prediction)
+            self.stats["resolved_by_webhook"] += 1
+        return True
+
+    def discard(self, prediction_id: str):
+        """移除等待者"""
+        future = self._futures.pop(prediction_id, None)
+        if future is not None and not future.done():
+            future.cancel()
+
+    def record_polled(self):
+        """记录一次轮询先于webhook取得结果"""
+        self.stats["resolved_by_polling"] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取注册表统计"""
+        return {
+            **self.stats,
+            "pending": sum(1 for f in self._futures.values() if not f.done())
+        }
+
+
+# 全局预测完成注册表
+prediction_registry = PredictionCompletionRegistry()
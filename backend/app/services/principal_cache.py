@@ -0,0 +1,189 @@
+"""
+认证主体缓存
+按令牌哈希缓存已验证的用户信息，命中时跳过JWT解码和用户查询。
+缓存时间不超过令牌剩余有效期；用户资料变更、删除或停用时按用户ID主动失效。
+memory后端的失效只作用于当前进程，其它进程中已缓存的用户最多在AUTH_CACHE_TTL后才失效，
+因此只允许单worker使用；多worker部署需使用redis后端
+"""
+
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Set
+
+from ..core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def token_cache_key(token: str) -> str:
+    """令牌本身不落入缓存，只使用其哈希"""
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+class MemoryPrincipalBackend:
+    """进程内LRU缓存，带按用户的反向索引以便失效"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._by_user: Dict[str, Set[str]] = {}
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        user_id = str(entry[1]["id"])
+        keys = self._by_user.get(user_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_user[user_id]
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, principal = entry
+        if expires_at <= time.time():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return principal
+
+    async def set(self, key: str, principal: Dict[str, Any], ttl: float):
+        self._remove(key)
+        self._entries[key] = (time.time() + ttl, principal)
+        self._by_user.setdefault(str(principal["id"]), set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    async def invalidate_user(self, user_id: str) -> int:
+        keys = list(self._by_user.get(user_id, ()))
+        for key in keys:
+            self._remove(key)
+        return len(keys)
+
+    def size(self) -> int:
+        return len(self._entries)
+
+
+class RedisPrincipalBackend:
+    """Redis缓存后端，失效对所有worker立即生效"""
+
+    def __init__(self, url: str, prefix: str = "ghibli:principal"):
+        import redis.asyncio as aioredis
+
+        self.redis = aioredis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        raw = await self.redis.get(f"{self.prefix}:{key}")
+        return json.loads(raw) if raw else None
+
+    async def set(self, key: str, principal: Dict[str, Any], ttl: float):
+        user_key = f"{self.prefix}:user:{principal['id']}"
+        ttl_ms = max(int(ttl * 1000), 1)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.set(f"{self.prefix}:{key}", json.dumps(principal, default=str), px=ttl_ms)
+            pipe.sadd(user_key, key)
+            # 索引的存活时间不短于其中任一条目
+            pipe.pexpire(user_key, int(settings.AUTH_CACHE_TTL * 1000))
+            await pipe.execute()
+
+    async def invalidate_user(self, user_id: str) -> int:
+        user_key = f"{self.prefix}:user:{user_id}"
+        keys = await self.redis.smembers(user_key)
+        await self.redis.delete(user_key, *(f"{self.prefix}:{key}" for key in keys))
+        return len(keys)
+
+    def size(self) -> Optional[int]:
+        return None
+
+
+class PrincipalCache:
+    """认证主体缓存"""
+
+    def __init__(self, backend=None):
+        self.backend = backend if backend is not None else self._create_backend()
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "invalidations": 0,
+            "errors": 0
+        }
+
+    @staticmethod
+    def _create_backend():
+        if settings.AUTH_CACHE_BACKEND == "redis":
+            return RedisPrincipalBackend(settings.REDIS_URL)
+        if settings.AUTH_CACHE_BACKEND == "memory":
+            if settings.WEB_CONCURRENCY > 1:
+                # 停用或封禁的用户会在其它worker上继续通过认证直到缓存过期
+                raise ValueError(
+                    f"AUTH_CACHE_BACKEND=memory 只支持单worker（WEB_CONCURRENCY={settings.WEB_CONCURRENCY}），"
+                    "请改用redis或none"
+                )
+            return MemoryPrincipalBackend(settings.AUTH_CACHE_MAX_ENTRIES)
+        return None
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend is not None
+
+    async def get(self, token: str) -> Optional[Dict[str, Any]]:
+        """按令牌查询已验证的用户信息"""
+        if not self.enabled:
+            return None
+        try:
+            principal = await self.backend.get(token_cache_key(token))
+        except Exception as e:
+            # 缓存故障时回退到完整验证
+            self.stats["errors"] += 1
+            logger.warning(f"读取认证缓存失败: {e}")
+            return None
+
+        self.stats["hits" if principal is not None else "misses"] += 1
+        return principal
+
+    async def set(self, token: str, principal: Dict[str, Any], expires_at: Optional[float] = None):
+        """写入缓存，有效期不超过令牌过期时间"""
+        if not self.enabled:
+            return
+        ttl = settings.AUTH_CACHE_TTL
+        if expires_at is not None:
+            ttl = min(ttl, expires_at - time.time())
+        if ttl <= 0:
+            return
+        try:
+            await self.backend.set(token_cache_key(token), principal, ttl)
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.warning(f"写入认证缓存失败: {e}")
+
+    async def invalidate_user(self, user_id: str):
+        """用户资料、状态或权限变化后调用，清除该用户所有令牌的缓存"""
+        if not self.enabled:
+            return
+        try:
+            removed = await self.backend.invalidate_user(str(user_id))
+            self.stats["invalidations"] += removed
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.error(f"清除用户 {user_id} 的认证缓存失败: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存统计"""
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "backend": settings.AUTH_CACHE_BACKEND,
+            "hit_ratio": self.stats["hits"] / lookups if lookups else 0.0,
+            "size": self.backend.size() if self.enabled else 0
+        }
+
+
+# 全局认证主体缓存
+principal_cache = PrincipalCache()
@@ -0,0 +1,331 @@
+"""
+生成进度推送
+将任务状态变化、Replicate日志中的进度百分比和最终图片URL发布到主题，
+同一主题的多个浏览器连接共享一个上游订阅（进程内扇出，可选Redis跨进程）
+"""
+
+import asyncio
+import json
+import logging
+import re
+import time
+from contextlib import suppress
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict, Any, Optional, Set, AsyncIterator
+
+from ..core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# 当前生成流程对应的推送主题，由任务处理函数设置
+progress_topic: ContextVar[Optional[str]] = ContextVar("progress_topic", default=None)
+
+TERMINAL_EVENT_TYPES = ("completed", "failed", "cancelled")
+# 本进程跟踪预测出错时发给订阅者的事件：结束当前连接但不记录，客户端重连后重新跟踪
+ERROR_EVENT_TYPE = "error"
+
+# diffusers/tqdm进度行，例如 " 45%|████▌     | 9/20 [00:02<00:02,  4.1it/s]"
+_PERCENT_PATTERN = re.compile(r"(\d{1,3})%\|")
+_STEP_PATTERN = re.compile(r"(\d+)/(\d+)\s*\[")
+
+
+def parse_progress(logs: Optional[str]) -> Optional[float]:
+    """从预测日志中解析最近的进度百分比"""
+    if not logs:
+        return None
+    for line in reversed(logs.strip().splitlines()):
+        match = _PERCENT_PATTERN.search(line)
+        if match:
+            return min(float(match.group(1)), 100.0)
+        match = _STEP_PATTERN.search(line)
+        if match and int(match.group(2)) > 0:
+            return round(int(match.group(1)) * 100.0 / int(match.group(2)), 1)
+    return None
+
+
+def prediction_to_event(prediction: Dict[str, Any]) -> Dict[str, Any]:
+    """将Replicate预测快照转换为推送事件"""
+    status = prediction.get("status")
+    event = {
+        "prediction_id": prediction.get("id"),
+        "status": status,
+        "timestamp": time.time()
+    }
+
+    if status == "succeeded":
+        output = prediction.get("output") or []
+        event["type"] = "completed"
+        event["progress"] = 100.0
+        event["images"] = output if isinstance(output, list) else [output]
+    elif status == "failed":
+        event["type"] = "failed"
+        event["error"] = prediction.get("error")
+    elif status == "canceled":
+        event["type"] = "cancelled"
+    else:
+        event["type"] = "progress"
+        event["progress"] = parse_progress(prediction.get("logs"))
+        logs = (prediction.get("logs") or "").strip().splitlines()
+        event["logs_tail"] = logs[-1] if logs else None
+    return event
+
+
+def task_topic(task_id: str) -> str:
+    """生成任务的推送主题"""
+    return f"task:{task_id}"
+
+
+def task_event(task_id: str, event_type: str, **fields) -> Dict[str, Any]:
+    """构造生成任务状态事件"""
+    return {
+        "type": event_type,
+        "task_id": task_id,
+        "timestamp": time.time(),
+        **fields
+    }
+
+
+class ProgressHub:
+    """进度事件发布/订阅中心"""
+
+    def __init__(self):
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self._upstreams: Dict[str, asyncio.Task] = {}
+        self._last_events: Dict[str, Dict[str, Any]] = {}
+        # 结束事件的过期时间（按写入顺序），过期前补发给完成后才订阅的客户端
+        self._terminal_expiry: Dict[str, float] = {}
+        self._redis = None
+        self.stats = {
+            "published": 0,
+            "delivered": 0,
+            "dropped": 0,
+            "upstreams_started": 0
+        }
+
+    @property
+    def use_redis(self) -> bool:
+        backend = settings.PROGRESS_PUBSUB_BACKEND or ("redis" if settings.JOB_QUEUE_BACKEND == "redis" else "memory")
+        return backend == "redis"
+
+    def _get_redis(self):
+        if self._redis is None:
+            import redis.asyncio as aioredis
+            self._redis = aioredis.from_url(settings.REDIS_URL, decode_responses=True)
+        return self._redis
+
+    @staticmethod
+    def _channel(topic: str) -> str:
+        return f"ghibli:progress:{topic}"
+
+    def _remember(self, topic: str, event: Dict[str, Any]):
+        """记录主题的最近事件；结束事件只保留PROGRESS_TERMINAL_EVENT_TTL"""
+        if event.get("type") == ERROR_EVENT_TYPE:
+            return
+        now = time.time()
+        while self._terminal_expiry:
+            expired, expires_at = next(iter(self._terminal_expiry.items()))
+            if expires_at > now:
+                break
+            del self._terminal_expiry[expired]
+            self._last_events.pop(expired, None)
+
+        self._last_events[topic] = event
+        self._terminal_expiry.pop(topic, None)
+        if event.get("type") in TERMINAL_EVENT_TYPES:
+            self._terminal_expiry[topic] = now + settings.PROGRESS_TERMINAL_EVENT_TTL
+
+    def _fan_out(self, topic: str, event: Dict[str, Any]):
+        """投递给本进程内该主题的所有订阅者"""
+        self._remember(topic, event)
+        for queue in self._subscribers.get(topic, ()):
+            if queue.full():
+                # 慢消费者丢弃最旧事件，只保证最新状态
+                try:
+                    queue.get_nowait()
+                    self.stats["dropped"] += 1
+                except asyncio.QueueEmpty:
+                    pass
+            queue.put_nowait(event)
+            self.stats["delivered"] += 1
+
+    async def publish(self, topic: str, event: Dict[str, Any]):
+        """发布事件"""
+        self.stats["published"] += 1
+        if self.use_redis:
+            try:
+                payload = json.dumps(event, ensure_ascii=False, default=str)
+                redis = self._get_redis()
+                await redis.set(f"{self._channel(topic)}:last", payload, ex=settings.PROGRESS_LAST_EVENT_TTL)
+                await redis.publish(self._channel(topic), payload)
+                return
+            except Exception as e:
+                logger.warning(f"发布进度事件到Redis失败，仅本地投递: {e}")
+        self._fan_out(topic, event)
+
+    def publish_nowait(self, topic: Optional[str], event: Dict[str, Any]):
+        """在同步回调中发布事件"""
+        if not topic:
+            return
+        try:
+            asyncio.get_running_loop().create_task(self.publish(topic, event))
+        except RuntimeError:
+            pass
+
+    async def _relay_redis(self, topic: str):
+        """每个主题在本进程只保持一个Redis订阅"""
+        pubsub = self._get_redis().pubsub()
+        await pubsub.subscribe(self._channel(topic))
+        try:
+            async for message in pubsub.listen():
+                if message.get("type") != "message":
+                    continue
+                try:
+                    self._fan_out(topic, json.loads(message["data"]))
+                except Exception as e:
+                    logger.warning(f"解析进度事件失败: {e}")
+        finally:
+            await pubsub.unsubscribe(self._channel(topic))
+            await pubsub.close()
+
+    async def _watch_prediction(self, topic: str, prediction_id: str):
+        """通过共享轮询调度器跟踪预测，把每次快照转发为事件；出错时通知订阅者后结束"""
+        from .replicate_service import replicate_service
+
+        def on_snapshot(prediction: Dict[str, Any]):
+            self.publish_nowait(topic, prediction_to_event(prediction))
+
+        future = None
+        try:
+            # 先取一次当前状态，已结束的预测无需进入调度
+            prediction = await replicate_service.get_prediction(prediction_id)
+            event = prediction_to_event(prediction)
+            await self.publish(topic, event)
+            if event["type"] in TERMINAL_EVENT_TYPES:
+                return
+
+            started_at = None
+            if prediction.get("created_at"):
+                try:
+                    started_at = datetime.fromisoformat(prediction["created_at"].replace("Z", "+00:00")).timestamp()
+                except ValueError:
+                    pass
+
+            # 调度器为每个调用方返回独立的Future，订阅者离开时取消它不影响同一预测的生成等待
+            future = replicate_service.poller.watch(
+                prediction_id,
+                started_at=started_at,
+                callback=on_snapshot
+            )
+            prediction = await future
+            await self.publish(topic, prediction_to_event(prediction))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"跟踪预测 {prediction_id} 失败: {e}")
+            # 上游只服务本进程的订阅者，错误事件只在本地投递
+            self._fan_out(topic, {
+                "type": ERROR_EVENT_TYPE,
+                "prediction_id": prediction_id,
+                "error": str(e),
+                "timestamp": time.time()
+            })
+        finally:
+            if future is not None:
+                replicate_service.poller.unwatch(prediction_id, future)
+
+    async def _run_upstream(self, topic: str, prediction_id: Optional[str]):
+        jobs = []
+        if self.use_redis:
+            jobs.append(self._relay_redis(topic))
+        if prediction_id:
+            jobs.append(self._watch_prediction(topic, prediction_id))
+        if jobs:
+            await asyncio.gather(*jobs)
+
+    async def _get_last_event(self, topic: str) -> Optional[Dict[str, Any]]:
+        if self._terminal_expiry.get(topic, float("inf")) <= time.time():
+            self._terminal_expiry.pop(topic, None)
+            self._last_events.pop(topic, None)
+        event = self._last_events.get(topic)
+        if event is None and self.use_redis:
+            try:
+                raw = await self._get_redis().get(f"{self._channel(topic)}:last")
+                event = json.loads(raw) if raw else None
+            except Exception as e:
+                logger.warning(f"读取最近进度事件失败: {e}")
+        return event
+
+    async def subscribe(
+        self,
+        topic: str,
+        prediction_id: Optional[str] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """订阅主题，产出事件直到任务结束或调用方断开"""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=settings.PROGRESS_SUBSCRIBER_QUEUE_SIZE)
+        subscribers = self._subscribers.setdefault(topic, set())
+        subscribers.add(queue)
+
+        upstream = self._upstreams.get(topic)
+        if upstream is None or upstream.done():
+            self._upstreams[topic] = asyncio.get_running_loop().create_task(
+                self._run_upstream(topic, prediction_id)
+            )
+            self.stats["upstreams_started"] += 1
+
+        try:
+            last_event = await self._get_last_event(topic)
+            if last_event is not None:
+                yield last_event
+                if last_event.get("type") in TERMINAL_EVENT_TYPES:
+                    return
+
+            while True:
+                event = await queue.get()
+                yield event
+                if event.get("type") in TERMINAL_EVENT_TYPES or event.get("type") == ERROR_EVENT_TYPE:
+                    return
+        finally:
+            subscribers.discard(queue)
+            if not subscribers:
+                # 最后一个订阅者离开时释放上游订阅
+                self._subscribers.pop(topic, None)
+                upstream = self._upstreams.pop(topic, None)
+                if upstream is not None:
+                    upstream.cancel()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取推送统计"""
+        return {
+            **self.stats,
+            "topics": len(self._subscribers),
+            "subscribers": sum(len(s) for s in self._subscribers.values())
+        }
+
+
+async def sse_events(events: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[str]:
+    """把事件流编码为Server-Sent Events，空闲时发送心跳注释"""
+    iterator = events.__aiter__()
+    next_event = asyncio.ensure_future(iterator.__anext__())
+    try:
+        while True:
+            done, _ = await asyncio.wait({next_event}, timeout=settings.PROGRESS_HEARTBEAT_INTERVAL)
+            if not done:
+                yield ": keep-alive\n\n"
+                continue
+            try:
+                event = next_event.result()
+            except StopAsyncIteration:
+                return
+            yield f"event: {event.get('type', 'message')}\ndata: {json.dumps(event, ensure_ascii=False, default=str)}\n\n"
+            next_event = asyncio.ensure_future(iterator.__anext__())
+    finally:
+        # 断开时__anext__可能仍在运行，等其结束后再关闭生成器
+        next_event.cancel()
+        with suppress(Exception, asyncio.CancelledError):
+            await next_event
+        await iterator.aclose()
+
+
+# 全局进度推送中心
+progress_hub = ProgressHub()
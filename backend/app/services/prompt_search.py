@@ -0,0 +1,196 @@
+"""
+提示词全文搜索
+PostgreSQL下使用 to_tsvector + GIN 做词项/前缀匹配，pg_trgm 处理模糊匹配和中文子串；
+其他数据库（SQLite开发/测试环境）使用进程内倒排索引
+"""
+
+import bisect
+import logging
+import math
+import re
+import time
+from collections import Counter
+from typing import Any, Collection, Dict, List, Optional, Tuple
+
+from sqlalchemy import case, false, func, literal, literal_column, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..core.config import settings
+from ..models.image import Image
+
+logger = logging.getLogger(__name__)
+
+# 搜索结果排序
+SORT_RELEVANCE = "relevance"
+SORT_RECENT = "recent"
+SORT_PATTERN = r"^(relevance|recent)$"
+
+# 与 migrations/004_prompt_search.sql 中的表达式索引一致
+TS_CONFIG = literal_column("'simple'")
+
+_WORD_RE = re.compile(r"[0-9a-z]+")
+_CJK_RE = re.compile(r"[぀-ヿ㐀-䶿一-鿿가-힯]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """拉丁字母/数字按词切分，中日韩文字按二元组切分（单字保留为一元组）"""
+    text = (text or "").lower()
+    tokens = _WORD_RE.findall(text)
+    for run in _CJK_RE.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def to_tsquery_text(query: str) -> Optional[str]:
+    """构造前缀匹配的tsquery文本，只保留单词字符以免触发tsquery语法错误"""
+    terms = re.findall(r"\w+", (query or "").lower())
+    if not terms:
+        return None
+    return " & ".join(f"{term}:*" for term in terms)
+
+
+def _escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+class InvertedIndex:
+    """进程内倒排索引，TF-IDF打分，查询词按前缀匹配"""
+
+    def __init__(self):
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._doc_lengths: Dict[str, int] = {}
+        self._vocabulary: List[str] = []
+        self._vocabulary_dirty = False
+
+    def __len__(self) -> int:
+        return len(self._doc_lengths)
+
+    def add(self, doc_id: str, text: str):
+        self.remove(doc_id)
+        counts = Counter(tokenize(text))
+        for term, count in counts.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = {}
+                self._vocabulary_dirty = True
+            postings[doc_id] = count
+        self._doc_lengths[doc_id] = max(sum(counts.values()), 1)
+
+    def remove(self, doc_id: str):
+        if self._doc_lengths.pop(doc_id, None) is None:
+            return
+        for term in [t for t, postings in self._postings.items() if doc_id in postings]:
+            del self._postings[term][doc_id]
+            if not self._postings[term]:
+                del self._postings[term]
+                self._vocabulary_dirty = True
+
+    def _expand(self, term: str) -> List[str]:
+        """前缀展开为索引中的词项"""
+        if self._vocabulary_dirty:
+            self._vocabulary = sorted(self._postings)
+            self._vocabulary_dirty = False
+        start = bisect.bisect_left(self._vocabulary, term)
+        matches = []
+        for candidate in self._vocabulary[start:]:
+            if not candidate.startswith(term):
+                break
+            matches.append(candidate)
+        return matches
+
+    def search(
+        self,
+        query: str,
+        limit: int,
+        candidates: Optional[Collection[str]] = None
+    ) -> List[Tuple[str, float]]:
+        """返回按得分降序的 (doc_id, score)，所有查询词都需匹配；candidates限定可返回的文档"""
+        terms = tokenize(query)
+        if not terms:
+            return []
+        total_docs = len(self._doc_lengths)
+        scores: Optional[Dict[str, float]] = None
+        for term in set(terms):
+            term_scores: Dict[str, float] = {}
+            for expanded in self._expand(term):
+                postings = self._postings[expanded]
+                idf = math.log(1 + total_docs / len(postings))
+                for doc_id, count in postings.items():
+                    if candidates is not None and doc_id not in candidates:
+                        continue
+                    tf = count / self._doc_lengths[doc_id]
+                    term_scores[doc_id] = max(term_scores.get(doc_id, 0.0), tf * idf)
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {doc_id: score + term_scores[doc_id] for doc_id, score in scores.items() if doc_id in term_scores}
+            if not scores:
+                return []
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return ranked[:limit]
+
+
+class PromptSearch:
+    """提示词搜索：为图片查询添加匹配条件并给出相关度表达式"""
+
+    def __init__(self):
+        self.index = InvertedIndex()
+        self._index_loaded_at = 0.0
+        self.stats = {
+            "fulltext_queries": 0,
+            "fallback_queries": 0,
+            "fallback_rebuilds": 0
+        }
+
+    async def _ensure_index(self, db: AsyncSession):
+        if time.monotonic() - self._index_loaded_at < settings.SEARCH_FALLBACK_REFRESH_SECONDS:
+            return
+        rows = (await db.execute(select(Image.id, Image.prompt))).all()
+        index = InvertedIndex()
+        for image_id, prompt in rows:
+            index.add(image_id, prompt)
+        self.index = index
+        self._index_loaded_at = time.monotonic()
+        self.stats["fallback_rebuilds"] += 1
+
+    async def apply(self, db: AsyncSession, stmt, query: str):
+        """返回 (添加搜索条件后的查询, 相关度表达式)"""
+        if db.bind.dialect.name == "postgresql":
+            self.stats["fulltext_queries"] += 1
+            conditions = [
+                # pg_trgm：模糊匹配，以及 'simple' 分词无法切分的中文子串
+                Image.prompt.op("%")(query),
+                Image.prompt.ilike(f"%{_escape_like(query)}%", escape="\\")
+            ]
+            rank = func.similarity(Image.prompt, query)
+            tsquery_text = to_tsquery_text(query)
+            if tsquery_text:
+                tsvector = func.to_tsvector(TS_CONFIG, Image.prompt)
+                tsquery = func.to_tsquery(TS_CONFIG, tsquery_text)
+                conditions.insert(0, tsvector.op("@@")(tsquery))
+                rank = func.greatest(func.ts_rank_cd(tsvector, tsquery), rank)
+            return stmt.where(or_(*conditions)), rank
+
+        self.stats["fallback_queries"] += 1
+        await self._ensure_index(db)
+        # 先按查询已有的条件（用户、公开、模型等）取候选，再截取前N个，避免被其他用户的匹配挤出
+        candidates = set((await db.execute(stmt.with_only_columns(Image.id).order_by(None))).scalars())
+        ranked = self.index.search(query, settings.SEARCH_FALLBACK_MAX_RESULTS, candidates=candidates)
+        if not ranked:
+            return stmt.where(false()), literal(0.0)
+        scores = dict(ranked)
+        return stmt.where(Image.id.in_(list(scores))), case(scores, value=Image.id, else_=0.0)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取搜索统计"""
+        return {
+            **self.stats,
+            "fallback_index_size": len(self.index)
+        }
+
+
+# 全局提示词搜索
+prompt_search = PromptSearch()
@@ -0,0 +1,146 @@
+"""
+服务商路由
+按真实生成请求维护每个服务商/模型的滚动延迟分位数和成功率，
+结合单次成本和延迟SLO为每个请求选择服务商
+"""
+
+import logging
+import random
+from collections import deque
+from typing import Dict, Any, List, Optional, Tuple, Deque
+
+from ..core.config import settings
+
+logger = logging.getLogger(__name__)
+
+Candidate = Tuple[str, str]  # (服务商, 模型)
+
+
+class LatencyWindow:
+    """单个服务商/模型的滚动统计，延迟只统计成功请求"""
+
+    def __init__(self, size: int):
+        self.latencies: Deque[float] = deque(maxlen=size)
+        self.outcomes: Deque[bool] = deque(maxlen=size)
+
+    def record(self, latency: Optional[float], success: bool):
+        self.outcomes.append(success)
+        if success and latency is not None:
+            self.latencies.append(latency)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+    def success_rate(self) -> float:
+        if not self.outcomes:
+            return 1.0
+        return sum(self.outcomes) / len(self.outcomes)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "samples": len(self.latencies),
+            "p50": self.percentile(0.50),
+            "p95": self.percentile(0.95),
+            "p99": self.percentile(0.99),
+            "success_rate": self.success_rate()
+        }
+
+
+class ProviderRouter:
+    """基于实时延迟、成功率和成本的服务商选择"""
+
+    def __init__(self):
+        self._windows: Dict[str, LatencyWindow] = {}
+        self.stats = {
+            "routed": 0,
+            "explored": 0,
+            "slo_violations": 0
+        }
+
+    @staticmethod
+    def _key(service: str, model: str) -> str:
+        return f"{service}:{model}"
+
+    def _window(self, service: str, model: str) -> LatencyWindow:
+        key = self._key(service, model)
+        window = self._windows.get(key)
+        if window is None:
+            window = LatencyWindow(settings.GENERATION_LATENCY_WINDOW)
+            self._windows[key] = window
+        return window
+
+    def record(self, service: str, model: str, latency: Optional[float], success: bool):
+        """记录一次真实生成的结果"""
+        self._window(service, model).record(latency, success)
+        if success and latency is not None and latency > settings.GENERATION_LATENCY_SLO:
+            self.stats["slo_violations"] += 1
+
+    def percentile(self, service: str, model: str, q: float, min_samples: int = 0) -> Optional[float]:
+        """延迟分位数，样本不足时返回None"""
+        window = self._windows.get(self._key(service, model))
+        if window is None or len(window.latencies) < max(min_samples, 1):
+            return None
+        return window.percentile(q)
+
+    def has_enough_samples(self, service: str, model: str) -> bool:
+        window = self._windows.get(self._key(service, model))
+        return window is not None and len(window.latencies) >= settings.ROUTING_MIN_SAMPLES
+
+    def score(self, service: str, model: str, cost: float) -> float:
+        """期望代价（秒）：中位延迟按成功率放大，超出SLO加罚，再折算成本"""
+        window = self._window(service, model)
+        p50 = window.percentile(0.50) or 0.0
+        p95 = window.percentile(0.95) or 0.0
+        # 失败后需要重试，期望耗时约为 延迟 / 成功率
+        score = p50 / max(window.success_rate(), 0.05)
+        if p95 > settings.GENERATION_LATENCY_SLO:
+            score += (p95 - settings.GENERATION_LATENCY_SLO) * 2
+        return score + cost * settings.ROUTING_COST_WEIGHT
+
+    def choose(self, candidates: List[Candidate], costs: Dict[str, float]) -> Candidate:
+        """
+        从候选中选择服务商，candidates需按静态优先级排序
+        样本不足时按优先级选择，并以一定概率探测冷门服务商以积累样本
+        """
+        strategy = settings.ROUTING_STRATEGY
+        if len(candidates) == 1 or strategy == "priority":
+            return candidates[0]
+
+        cold = [c for c in candidates if not self.has_enough_samples(*c)]
+        if cold:
+            if cold[0] != candidates[0] and random.random() < settings.ROUTING_EXPLORATION_RATE:
+                self.stats["explored"] += 1
+                return random.choice(cold)
+            return candidates[0]
+
+        def cost_of(candidate: Candidate) -> float:
+            return self.score(candidate[0], candidate[1], costs.get(candidate[0], 0.0))
+
+        if strategy == "p2c" and len(candidates) > 2:
+            # 随机取两个比较，避免所有请求同时涌向同一个"最快"服务商
+            return min(random.sample(candidates, 2), key=cost_of)
+        return min(candidates, key=cost_of)
+
+    def get_provider_stats(self, service: str) -> Dict[str, Any]:
+        """获取某个服务商各模型的延迟统计"""
+        prefix = f"{service}:"
+        return {
+            key[len(prefix):]: window.get_stats()
+            for key, window in self._windows.items()
+            if key.startswith(prefix)
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取路由统计"""
+        return {
+            **self.stats,
+            "strategy": settings.ROUTING_STRATEGY,
+            "providers": {key: window.get_stats() for key, window in self._windows.items()}
+        }
+
+
+# 全局服务商路由
+provider_router = ProviderRouter()
@@ -0,0 +1,213 @@
+"""
+每日生成配额账本
+按用户、配额范围和日期维护计数：提交任务前原子地检查并预占，任务失败或取消时归还。
+替代每次请求对generation_tasks的COUNT(*)扫描。
+后端故障时默认拒绝预占（QUOTA_BACKEND_FALLBACK=deny）；配置为memory时退回进程内计数
+"""
+
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional
+
+from ..core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# 配额范围
+SCOPE_GENERATION = "generation"
+SCOPE_REPLICATE = "replicate"
+
+# 计数保留两天，跨零点的任务仍可归还到预占当天
+COUNTER_TTL = 2 * 24 * 3600
+
+
+class QuotaUnavailableError(Exception):
+    """配额后端不可用（按配置拒绝预占）"""
+    pass
+
+
+class QuotaExceededError(Exception):
+    """超出配额"""
+    def __init__(self, message: str, limit: int, used: int):
+        self.message = message
+        self.limit = limit
+        self.used = used
+        super().__init__(self.message)
+
+
+def get_daily_limit(scope: str, subscription_type: Optional[str]) -> int:
+    """按订阅等级获取每日限额，未知等级按免费用户处理"""
+    limits = settings.REPLICATE_DAILY_LIMITS if scope == SCOPE_REPLICATE else settings.GENERATION_DAILY_LIMITS
+    return limits.get(subscription_type or "free", limits.get("free", 0))
+
+
+def scope_for_model(ai_model: Optional[str]) -> str:
+    """任务模型对应的配额范围"""
+    return SCOPE_REPLICATE if (ai_model or "").startswith("replicate-") else SCOPE_GENERATION
+
+
+def quota_day(at: Optional[datetime] = None) -> str:
+    """配额所属日期"""
+    return (at or datetime.now()).strftime("%Y%m%d")
+
+
+class MemoryQuotaBackend:
+    """进程内计数，仅适用于单worker或开发环境"""
+
+    def __init__(self):
+        self._counters: Dict[str, Dict[str, int]] = {}
+
+    def _day_counters(self, day: str) -> Dict[str, int]:
+        counters = self._counters.get(day)
+        if counters is None:
+            # 新的一天开始时丢弃过期日期
+            yesterday = quota_day(datetime.now() - timedelta(days=1))
+            for old_day in [d for d in self._counters if d < yesterday]:
+                del self._counters[old_day]
+            counters = self._counters[day] = {}
+        return counters
+
+    async def reserve(self, key: str, day: str, limit: int, amount: int):
+        counters = self._day_counters(day)
+        used = counters.get(key, 0)
+        if used + amount > limit:
+            return False, used
+        counters[key] = used + amount
+        return True, used + amount
+
+    async def release(self, key: str, day: str, amount: int) -> int:
+        counters = self._counters.get(day)
+        if not counters or key not in counters:
+            return 0
+        counters[key] = max(counters[key] - amount, 0)
+        return counters[key]
+
+    async def usage(self, key: str, day: str) -> int:
+        return self._counters.get(day, {}).get(key, 0)
+
+
+class RedisQuotaBackend:
+    """Redis计数，Lua脚本保证检查与预占原子执行"""
+
+    RESERVE_SCRIPT = """
+    local used = tonumber(redis.call('GET', KEYS[1]) or '0')
+    local amount = tonumber(ARGV[2])
+    if used + amount > tonumber(ARGV[1]) then
+        return {0, used}
+    end
+    used = redis.call('INCRBY', KEYS[1], amount)
+    if used == amount then
+        redis.call('EXPIRE', KEYS[1], ARGV[3])
+    end
+    return {1, used}
+    """
+
+    RELEASE_SCRIPT = """
+    if redis.call('EXISTS', KEYS[1]) == 0 then
+        return 0
+    end
+    local used = redis.call('DECRBY', KEYS[1], ARGV[1])
+    if used < 0 then
+        redis.call('SET', KEYS[1], 0, 'KEEPTTL')
+        return 0
+    end
+    return used
+    """
+
+    def __init__(self, url: str, prefix: str = "ghibli:quota"):
+        import redis.asyncio as aioredis
+
+        self.redis = aioredis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+        self._reserve = self.redis.register_script(self.RESERVE_SCRIPT)
+        self._release = self.redis.register_script(self.RELEASE_SCRIPT)
+
+    def _key(self, key: str, day: str) -> str:
+        return f"{self.prefix}:{day}:{key}"
+
+    async def reserve(self, key: str, day: str, limit: int, amount: int):
+        allowed, used = await self._reserve(keys=[self._key(key, day)], args=[limit, amount, COUNTER_TTL])
+        return bool(allowed), int(used)
+
+    async def release(self, key: str, day: str, amount: int) -> int:
+        return int(await self._release(keys=[self._key(key, day)], args=[amount]))
+
+    async def usage(self, key: str, day: str) -> int:
+        return int(await self.redis.get(self._key(key, day)) or 0)
+
+
+class QuotaLedger:
+    """每日配额账本"""
+
+    def __init__(self, backend=None):
+        self.backend = backend if backend is not None else self._create_backend()
+        self._fallback = MemoryQuotaBackend()
+        self.stats = {
+            "reserved": 0,
+            "rejected": 0,
+            "released": 0,
+            "backend_errors": 0,
+            "fallbacks": 0
+        }
+
+    @staticmethod
+    def _create_backend():
+        if settings.QUOTA_BACKEND == "redis":
+            return RedisQuotaBackend(settings.REDIS_URL)
+        return MemoryQuotaBackend()
+
+    @staticmethod
+    def _key(scope: str, user_id: str) -> str:
+        return f"{scope}:{user_id}"
+
+    async def _call(self, method: str, *args):
+        try:
+            return await getattr(self.backend, method)(*args)
+        except Exception as e:
+            self.stats["backend_errors"] += 1
+            if settings.QUOTA_BACKEND_FALLBACK != "memory":
+                logger.error(f"配额后端不可用，拒绝{method}: {e}")
+                raise QuotaUnavailableError("配额服务暂时不可用") from e
+            # 各进程各自计数，限额按进程生效
+            self.stats["fallbacks"] += 1
+            logger.error(f"配额后端不可用，使用进程内计数: {e}")
+            return await getattr(self._fallback, method)(*args)
+
+    async def reserve(self, user_id: str, scope: str, limit: int, amount: int = 1) -> str:
+        """预占配额，返回配额日期（归还时使用）；超出限额时抛出QuotaExceededError，后端不可用时抛出QuotaUnavailableError"""
+        day = quota_day()
+        allowed, used = await self._call("reserve", self._key(scope, str(user_id)), day, limit, amount)
+        if not allowed:
+            self.stats["rejected"] += 1
+            raise QuotaExceededError(f"已达到每日生成限制 ({limit} 次)", limit=limit, used=used)
+        self.stats["reserved"] += amount
+        return day
+
+    async def release(self, user_id: str, scope: str, day: Optional[str] = None, amount: int = 1):
+        """任务失败或取消时归还配额"""
+        try:
+            await self._call("release", self._key(scope, str(user_id)), day or quota_day(), amount)
+        except QuotaUnavailableError:
+            # 归还失败只会少给配额，不影响任务处理流程
+            return
+        self.stats["released"] += amount
+
+    async def release_task(self, task):
+        """按生成任务归还配额（任务创建当天，范围由模型决定）"""
+        await self.release(task.user_id, scope_for_model(task.ai_model), quota_day(task.created_at))
+
+    async def usage(self, user_id: str, scope: str, day: Optional[str] = None) -> int:
+        """查询当日已用配额"""
+        return await self._call("usage", self._key(scope, str(user_id)), day or quota_day())
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取配额统计"""
+        return {
+            **self.stats,
+            "backend": settings.QUOTA_BACKEND,
+            "fallback": settings.QUOTA_BACKEND_FALLBACK
+        }
+
+
+# 全局配额账本
+quota_ledger = QuotaLedger()
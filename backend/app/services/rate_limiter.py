@@ -0,0 +1,206 @@
+"""
+分布式速率限制
+采用GCRA（通用信元速率算法）：每个键只保存一个"理论到达时间"(TAT)，每次检查O(1)。
+Redis后端用Lua脚本原子更新，多worker共享计数；内存后端用时间轮淘汰过期键
+"""
+
+import logging
+import math
+import time
+from typing import Dict, Any, List, Optional, Set
+
+from ..core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimitResult:
+    """单次限流检查结果"""
+
+    def __init__(self, allowed: bool, limit: int, window: int, remaining: int, reset_after: float, retry_after: float):
+        self.allowed = allowed
+        self.limit = limit
+        self.window = window
+        self.remaining = remaining
+        self.reset_after = reset_after  # 配额完全恢复所需秒数
+        self.retry_after = retry_after  # 被拒绝时需等待的秒数
+
+    def headers(self) -> Dict[str, str]:
+        """RateLimit-*标准响应头（IETF draft-ietf-httpapi-ratelimit-headers）"""
+        headers = {
+            "RateLimit-Limit": str(self.limit),
+            "RateLimit-Remaining": str(self.remaining),
+            "RateLimit-Reset": str(math.ceil(self.reset_after)),
+            "RateLimit-Policy": f"{self.limit};w={self.window}"
+        }
+        if not self.allowed:
+            headers["Retry-After"] = str(math.ceil(self.retry_after))
+        return headers
+
+
+def gcra(tat: Optional[float], now: float, limit: int, window: float):
+    """
+    GCRA计算，返回 (是否放行, 新TAT, 剩余次数, 重置秒数, 重试秒数)
+    发射间隔 = window / limit，容忍度 = window - 发射间隔，即允许limit次突发
+    """
+    interval = window / limit
+    tat = max(tat or now, now)
+    new_tat = tat + interval
+    allow_at = new_tat - window
+    if now < allow_at:
+        return False, tat, 0, tat - now, allow_at - now
+    remaining = int((window - (new_tat - now)) / interval)
+    return True, new_tat, remaining, new_tat - now, 0.0
+
+
+class TimerWheel:
+    """单层时间轮，按过期秒数分槽，推进时只检查经过的槽位"""
+
+    def __init__(self, slots: int = 3600, resolution: float = 1.0):
+        self.slots = slots
+        self.resolution = resolution
+        self._wheel: List[Set[str]] = [set() for _ in range(slots)]
+        self._tick = None
+
+    def _slot_of(self, at: float) -> int:
+        return int(at / self.resolution)
+
+    def schedule(self, key: str, expires_at: float):
+        self._wheel[self._slot_of(expires_at) % self.slots].add(key)
+
+    def advance(self, now: float) -> List[str]:
+        """推进到now，返回到期槽位中的候选键（调用方需再次确认是否真正过期）"""
+        current = self._slot_of(now)
+        if self._tick is None:
+            self._tick = current
+            return []
+        due: List[str] = []
+        steps = min(current - self._tick, self.slots)
+        for offset in range(1, steps + 1):
+            bucket = self._wheel[(self._tick + offset) % self.slots]
+            if bucket:
+                due.extend(bucket)
+                bucket.clear()
+        self._tick = max(self._tick, current)
+        return due
+
+
+class MemoryRateLimitBackend:
+    """进程内限流后端，仅适用于单worker或开发环境"""
+
+    def __init__(self):
+        self._tats: Dict[str, float] = {}
+        self._wheel = TimerWheel()
+
+    def _evict(self, now: float):
+        for key in self._wheel.advance(now):
+            tat = self._tats.get(key)
+            if tat is None:
+                continue
+            if tat <= now:
+                del self._tats[key]
+            else:
+                # 超过时间轮跨度或已被续期，重新登记
+                self._wheel.schedule(key, tat)
+
+    async def check(self, key: str, limit: int, window: int) -> RateLimitResult:
+        now = time.time()
+        self._evict(now)
+        allowed, tat, remaining, reset_after, retry_after = gcra(self._tats.get(key), now, limit, window)
+        if allowed:
+            self._tats[key] = tat
+            self._wheel.schedule(key, tat)
+        return RateLimitResult(allowed, limit, window, remaining, reset_after, retry_after)
+
+    def size(self) -> int:
+        return len(self._tats)
+
+
+class RedisRateLimitBackend:
+    """Redis限流后端，使用Redis服务器时间，所有worker共享同一时钟和计数"""
+
+    # 时间单位为微秒，避免浮点数在Lua与Redis之间转换时丢失精度
+    GCRA_SCRIPT = """
+    if redis.replicate_commands then
+        redis.replicate_commands()
+    end
+    local t = redis.call('TIME')
+    local now = tonumber(t[1]) * 1000000 + tonumber(t[2])
+    local window = tonumber(ARGV[1])
+    local interval = tonumber(ARGV[2])
+    local tat = tonumber(redis.call('GET', KEYS[1]) or now)
+    if tat < now then
+        tat = now
+    end
+    local new_tat = tat + interval
+    local allow_at = new_tat - window
+    if now < allow_at then
+        return {0, 0, tat - now, allow_at - now}
+    end
+    redis.call('SET', KEYS[1], new_tat, 'PX', math.ceil((new_tat - now) / 1000))
+    return {1, math.floor((window - (new_tat - now)) / interval), new_tat - now, 0}
+    """
+
+    def __init__(self, url: str, prefix: str = "ghibli:ratelimit"):
+        import redis.asyncio as aioredis
+
+        self.redis = aioredis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+        self._gcra = self.redis.register_script(self.GCRA_SCRIPT)
+
+    async def check(self, key: str, limit: int, window: int) -> RateLimitResult:
+        window_us = window * 1_000_000
+        allowed, remaining, reset_us, retry_us = await self._gcra(
+            keys=[f"{self.prefix}:{key}"],
+            args=[window_us, window_us // limit]
+        )
+        return RateLimitResult(
+            bool(allowed), limit, window, int(remaining),
+            int(reset_us) / 1_000_000, int(retry_us) / 1_000_000
+        )
+
+    def size(self) -> Optional[int]:
+        return None
+
+
+class RateLimiter:
+    """速率限制器，Redis不可用时退回进程内限流"""
+
+    def __init__(self, backend=None):
+        self.backend = backend if backend is not None else self._create_backend()
+        self._fallback = MemoryRateLimitBackend()
+        self.stats = {
+            "allowed": 0,
+            "rejected": 0,
+            "backend_errors": 0
+        }
+
+    @staticmethod
+    def _create_backend():
+        if settings.RATE_LIMIT_BACKEND == "redis":
+            return RedisRateLimitBackend(settings.REDIS_URL)
+        return MemoryRateLimitBackend()
+
+    async def check(self, key: str, limit: int, window: int) -> RateLimitResult:
+        """检查并消耗一次配额"""
+        try:
+            result = await self.backend.check(key, limit, window)
+        except Exception as e:
+            self.stats["backend_errors"] += 1
+            logger.warning(f"限流后端不可用，使用进程内限流: {e}")
+            result = await self._fallback.check(key, limit, window)
+
+        self.stats["allowed" if result.allowed else "rejected"] += 1
+        return result
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取限流统计"""
+        return {
+            **self.stats,
+            "backend": settings.RATE_LIMIT_BACKEND,
+            "tracked_keys": self.backend.size()
+        }
+
+
+# 全局速率限制器
+rate_limiter = RateLimiter()
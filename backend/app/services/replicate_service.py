@@ -8,12 +8,19 @@ import asyncio
 import json
 import time
 import hashlib
-from typing import Dict, Any, Optional, List, Union, Callable
+from typing import Dict, Any, Optional, List, Union, Callable, AsyncIterator
 from datetime import datetime
 import logging
+from contextvars import ContextVar
 from urllib.parse import urlparse
 
 from ..core.config import settings
+from .http_client import http_client_registry
+from .prediction_registry import prediction_registry
+from .prediction_poller import PredictionPoller
+from .batch_engine import batch_engine
+from .single_flight import SingleFlight
+from .progress_stream import progress_hub, progress_topic, prediction_to_event
 
 logger = logging.getLogger(__name__)
 
@@ -25,15 +32,41 @@ class ReplicateError(Exception):
         self.error_code = error_code
         super().__init__(self.message)
 
+class TaskPrediction:
+    """队列任务对应的预测：任务级webhook地址、已创建的预测ID（重新投递时续接）及创建后的回调"""
+    
+    def __init__(
+        self,
+        webhook: Optional[str] = None,
+        prediction_id: Optional[str] = None,
+        on_created: Optional[Callable[[str], None]] = None
+    ):
+        self.webhook = webhook
+        self.prediction_id = prediction_id
+        self.on_created = on_created
+
+# 当前队列任务的预测信息，由任务处理函数设置
+task_prediction: ContextVar[Optional[TaskPrediction]] = ContextVar("task_prediction", default=None)
+
 class ReplicateService:
     """Replicate AI服务客户端 - 增强版"""
     
+    # 各模型使用的版本ID
+    MODEL_VERSIONS = {
+        "replicate-sdxl": "39ed52f2a78e934b3ba6e2a89f5b1c712de7dfea535525255b1aa35c5565e08b",
+        "replicate-flux-schnell": "black-forest-labs/flux-schnell",
+        "replicate-flux": "8beff3369e81422112d93b89ca01426147de542cd4684c244b673b105188fe5f"
+    }
+    
     def __init__(self):
         self.api_token = settings.REPLICATE_API_TOKEN
         self.base_url = "https://api.replicate.com/v1"
         self.timeout = 60.0
         self.max_retries = 3
         self.retry_delay = 1.0
+        self.poller = PredictionPoller(self)
+        self.single_flight = SingleFlight()
+        self._model_index: Optional[Dict[str, Dict[str, Any]]] = None
         
         if not self.api_token:
             logger.warning("Replicate API令牌未配置")
@@ -59,50 +92,54 @@ class ReplicateService:
         url = f"{self.base_url}/{endpoint.lstrip('/')}"
         headers = self._get_headers()
         
-        async with httpx.AsyncClient(timeout=timeout or self.timeout) as client:
-            for attempt in range(self.max_retries + 1):
-                try:
-                    if method.upper() == "GET":
-                        response = await client.get(url, headers=headers, params=params)
-                    elif method.upper() == "POST":
-                        response = await client.post(url, headers=headers, json=data, params=params)
-                    elif method.upper() == "PUT":
-                        response = await client.put(url, headers=headers, json=data)
-                    elif method.upper() == "DELETE":
-                        response = await client.delete(url, headers=headers)
-                    else:
-                        raise ValueError(f"不支持的HTTP方法: {method}")
+        client = http_client_registry.get_client("replicate")
+        request_timeout = timeout or self.timeout
+        
+        for attempt in range(self.max_retries + 1):
+            try:
+                if method.upper() == "GET":
+                    response = await client.get(url, headers=headers, params=params, timeout=request_timeout)
+                elif method.upper() == "POST":
+                    response = await client.post(url, headers=headers, json=data, params=params, timeout=request_timeout)
+                elif method.upper() == "PUT":
+                    response = await client.put(url, headers=headers, json=data, timeout=request_timeout)
+                elif method.upper() == "DELETE":
+                    response = await client.delete(url, headers=headers, timeout=request_timeout)
+                else:
+                    raise ValueError(f"不支持的HTTP方法: {method}")
+                
+                logger.info(f"Replicate API请求: {method} {url} - 状态码: {response.status_code}")
+                
+                if response.status_code in [200, 201]:
+                    return response.json()
+                elif response.status_code == 429 and attempt < self.max_retries:
+                    # 速率限制，等待后重试
+                    wait_time = self.retry_delay * (2 ** attempt)
+                    logger.warning(f"速率限制，等待{wait_time}秒后重试...")
+                    await asyncio.sleep(wait_time)
+                    continue
+                else:
+                    error_data = response.json() if response.content else {}
+                    error_message = error_data.get("detail", error_data.get("message", "未知错误"))
                     
-                    logger.info(f"Replicate API请求: {method} {url} - 状态码: {response.status_code}")
+                    raise ReplicateError(
+                        message=f"API请求失败: {error_message}",
+                        status_code=response.status_code
+                    )
                     
-                    if response.status_code in [200, 201]:
-                        return response.json()
-                    elif response.status_code == 429 and attempt < self.max_retries:
-                        # 速率限制，等待后重试
-                        wait_time = self.retry_delay * (2 ** attempt)
-                        logger.warning(f"速率限制，等待{wait_time}秒后重试...")
-                        await asyncio.sleep(wait_time)
-                        continue
-                    else:
-                        error_data = response.json() if response.content else {}
-                        error_message = error_data.get("detail", error_data.get("message", "未知错误"))
-                        
-                        raise ReplicateError(
-                            message=f"API请求失败: {error_message}",
-                            status_code=response.status_code
-                        )
-                        
-                except httpx.TimeoutException:
-                    if attempt < self.max_retries:
-                        await asyncio.sleep(self.retry_delay * (2 ** attempt))
-                        continue
-                    raise ReplicateError("请求超时")
-                except httpx.RequestError as e:
-                    if attempt < self.max_retries:
-                        await asyncio.sleep(self.retry_delay * (2 ** attempt))
-                        continue
-                    raise ReplicateError(f"网络请求错误: {str(e)}")
-    
+            except httpx.TimeoutException:
+                http_client_registry.record_error("replicate")
+                if attempt < self.max_retries:
+                    await asyncio.sleep(self.retry_delay * (2 ** attempt))
+                    continue
+                raise ReplicateError("请求超时")
+            except httpx.RequestError as e:
+                http_client_registry.record_error("replicate")
+                if attempt < self.max_retries:
+                    await asyncio.sleep(self.retry_delay * (2 ** attempt))
+                    continue
+                raise ReplicateError(f"网络请求错误: {str(e)}")
+
     async def create_prediction(
         self,
         model_version: str,
@@ -123,6 +160,9 @@ class ReplicateService:
         
         try:
             response = await self._make_request("POST", "/predictions", data=request_data)
+            # 登记等待者，由webhook回调唤醒
+            if webhook and response.get("id"):
+                prediction_registry.register(response["id"])
             return response
         except ReplicateError:
             raise
@@ -139,35 +179,153 @@ class ReplicateService:
         except Exception as e:
             raise ReplicateError(f"获取预测状态失败: {str(e)}")
     
+    def _check_terminal_status(self, prediction: Dict[str, Any]) -> bool:
+        """检查预测是否已结束，失败或取消时抛出异常"""
+        status = prediction.get("status")
+        if status == "succeeded":
+            return True
+        elif status == "failed":
+            error_message = prediction.get("error", "预测任务失败")
+            raise ReplicateError(f"预测失败: {error_message}")
+        elif status == "canceled":
+            raise ReplicateError("预测任务被取消")
+        return False
+    
     async def wait_for_prediction(
         self, 
         prediction_id: str, 
         max_wait_time: int = 300,
         poll_interval: int = 2,
-        callback: Optional[Callable[[Dict[str, Any]], None]] = None
+        callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+        model: Optional[str] = None
     ) -> Dict[str, Any]:
-        """等待预测任务完成 - 支持回调"""
+        """
+        等待预测任务完成 - 轮询调度器与webhook通知同时等待，先到者为准。
+        webhook可能投递到其它进程，因此始终由共享调度器按模型预估耗时和退避策略跟踪
+        """
         start_time = time.time()
+        future = prediction_registry.get(prediction_id)
+        polled = None
         
-        while time.time() - start_time < max_wait_time:
-            prediction = await self.get_prediction(prediction_id)
-            status = prediction.get("status")
+        try:
+            polled = self.poller.watch(
+                prediction_id,
+                model=model,
+                started_at=start_time,
+                initial_interval=poll_interval,
+                callback=callback
+            )
+            waiters = [polled]
+            if future is not None and not future.cancelled():
+                waiters.append(future)
             
-            if callback:
-                callback(prediction)
+            done, _ = await asyncio.wait(
+                waiters,
+                timeout=max_wait_time,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            if not done:
+                raise ReplicateError("预测任务超时")
             
-            if status == "succeeded":
+            if future is not None and future in done:
+                prediction = future.result()
+                if callback:
+                    callback(prediction)
+            else:
+                prediction = polled.result()
+                if future is not None:
+                    prediction_registry.record_polled()
+            if self._check_terminal_status(prediction):
                 return prediction
-            elif status == "failed":
-                error_message = prediction.get("error", "预测任务失败")
-                raise ReplicateError(f"预测失败: {error_message}")
-            elif status == "canceled":
-                raise ReplicateError("预测任务被取消")
+            raise ReplicateError("预测任务超时")
+        finally:
+            if polled is not None:
+                # 只注销本调用方，同一预测的其它等待者（如进度推送）继续跟踪
+                self.poller.unwatch(prediction_id, polled)
+            if future is not None:
+                prediction_registry.discard(prediction_id)
+    
+    async def _get_completion_webhook(self, task_id: Optional[str] = None) -> Optional[str]:
+        """获取完成通知webhook地址（未配置REPLICATE_WEBHOOK_URL或签名密钥时返回None）"""
+        if not settings.REPLICATE_WEBHOOK_URL or not settings.REPLICATE_WEBHOOK_SECRET:
+            return None
+        # 兼容配置为完整回调路径的情况（见.env.example）
+        base_url = settings.REPLICATE_WEBHOOK_URL.rstrip("/").removesuffix("/api/webhooks/replicate")
+        return await self.create_webhook_url(base_url, task_id or "sync")
+    
+    async def _run_prediction(
+        self,
+        model_version: str,
+        input_data: Dict[str, Any],
+        model: Optional[str] = None,
+        max_wait_time: int = 300
+    ) -> Dict[str, Any]:
+        """
+        创建预测并等待完成 - 显式seed的相同输入并发请求共享同一个预测；
+        队列任务使用任务级webhook，重新投递时续接已创建的预测而不是重复创建
+        """
+        current = task_prediction.get()
+        flight_key = None
+        if input_data.get("seed") is not None and current is None:
+            flight_key = self._hash_prediction_input(model_version, input_data)
+        
+        def publish(snapshot: Dict[str, Any]):
+            """推送预测进度：合并的请求推送给所有仍在等待的调用方"""
+            if flight_key is not None:
+                topics = self.single_flight.topics(flight_key)
+            else:
+                topics = [progress_topic.get()] if progress_topic.get() else []
+            event = prediction_to_event(snapshot)
+            for topic in topics:
+                progress_hub.publish_nowait(topic, event)
+        
+        async def run() -> Dict[str, Any]:
+            prediction = None
+            if current is not None and current.prediction_id:
+                prediction = await self.get_prediction(current.prediction_id)
+                if prediction.get("status") == "succeeded":
+                    return prediction
+                if prediction.get("status") in ("failed", "canceled"):
+                    # 上次的预测已失败，重试时重新创建
+                    prediction = None
             
-            # 等待后继续轮询
-            await asyncio.sleep(poll_interval)
-        
-        raise ReplicateError("预测任务超时")
+            if prediction is None:
+                if current is not None and current.webhook and settings.REPLICATE_WEBHOOK_SECRET:
+                    webhook = current.webhook
+                else:
+                    webhook = await self._get_completion_webhook()
+                prediction = await self.create_prediction(
+                    model_version,
+                    input_data,
+                    webhook=webhook,
+                    webhook_events_filter=["completed"] if webhook else None
+                )
+                if current is not None:
+                    current.prediction_id = prediction["id"]
+                    if current.on_created:
+                        current.on_created(prediction["id"])
+            publish(prediction)
+            
+            try:
+                return await self.wait_for_prediction(
+                    prediction["id"],
+                    max_wait_time=max_wait_time,
+                    callback=publish,
+                    model=model
+                )
+            except asyncio.CancelledError:
+                # 调用方都已离开时停止预测，避免继续计费（队列任务重新投递时会续接，不取消）
+                if current is None:
+                    try:
+                        await self.cancel_prediction(prediction["id"])
+                    except ReplicateError as e:
+                        logger.warning(f"取消预测 {prediction['id']} 失败: {e.message}")
+                raise
+        
+        if flight_key is None:
+            return await run()
+        
+        return await self.single_flight.do(flight_key, run, topic=progress_topic.get())
     
     async def stream_prediction(
         self, 
@@ -232,6 +390,34 @@ class ReplicateService:
         
         return validated
     
+    async def get_cache_key(self, model: str, input_data: Dict[str, Any]) -> Optional[str]:
+        """
+        计算确定性生成的缓存键
+        
+        仅在显式指定seed时可缓存，键为模型版本和校验后输入的规范化哈希
+        """
+        if input_data.get("seed") is None:
+            return None
+        
+        model_type = model if model.startswith("replicate-") else f"replicate-{model}"
+        model_version = self.MODEL_VERSIONS.get(model_type)
+        if model_version is None:
+            return None
+        
+        validated_input = await self.validate_input(input_data, model_type)
+        return self._hash_prediction_input(model_version, validated_input)
+    
+    def _hash_prediction_input(self, model_version: str, input_data: Dict[str, Any]) -> str:
+        """模型版本和输入的规范化哈希"""
+        canonical = json.dumps(
+            {"version": model_version, "input": input_data},
+            sort_keys=True,
+            separators=(",", ":"),
+            ensure_ascii=False,
+            default=str
+        )
+        return hashlib.sha256(canonical.encode()).hexdigest()
+    
     async def generate_image_sdxl(
         self,
         prompt: str,
@@ -259,7 +445,7 @@ class ReplicateService:
         }, "replicate-sdxl")
         
         # SDXL模型版本ID
-        model_version = "39ed52f2a78e934b3ba6e2a89f5b1c712de7dfea535525255b1aa35c5565e08b"
+        model_version = self.MODEL_VERSIONS["replicate-sdxl"]
         
         input_data = {
             "prompt": validated_input["prompt"],
@@ -284,12 +470,9 @@ class ReplicateService:
             logger.info(f"开始Replicate SDXL生成: {prompt[:50]}...")
             start_time = time.time()
             
-            # 创建预测任务
-            prediction = await self.create_prediction(model_version, input_data)
-            prediction_id = prediction["id"]
-            
-            # 等待任务完成
-            completed_prediction = await self.wait_for_prediction(prediction_id)
+            # 创建预测任务并等待完成
+            completed_prediction = await self._run_prediction(model_version, input_data, model="replicate-sdxl")
+            prediction_id = completed_prediction["id"]
             
             generation_time = time.time() - start_time
             logger.info(f"Replicate SDXL生成完成，耗时: {generation_time:.2f}秒")
@@ -351,7 +534,7 @@ class ReplicateService:
         }, "replicate-flux-schnell")
         
         # FLUX Schnell模型版本ID
-        model_version = "black-forest-labs/flux-schnell"
+        model_version = self.MODEL_VERSIONS["replicate-flux-schnell"]
         
         input_data = {
             "prompt": validated_input["prompt"],
@@ -368,12 +551,11 @@ class ReplicateService:
             logger.info(f"开始Replicate FLUX Schnell生成: {prompt[:50]}...")
             start_time = time.time()
             
-            # 创建预测任务
-            prediction = await self.create_prediction(model_version, input_data)
-            prediction_id = prediction["id"]
-            
-            # 等待任务完成
-            completed_prediction = await self.wait_for_prediction(prediction_id, max_wait_time=120)
+            # 创建预测任务并等待完成
+            completed_prediction = await self._run_prediction(
+                model_version, input_data, model="replicate-flux-schnell", max_wait_time=120
+            )
+            prediction_id = completed_prediction["id"]
             
             generation_time = time.time() - start_time
             logger.info(f"Replicate FLUX Schnell生成完成，耗时: {generation_time:.2f}秒")
@@ -434,7 +616,7 @@ class ReplicateService:
         }, "replicate-flux")
         
         # FLUX模型版本ID
-        model_version = "8beff3369e81422112d93b89ca01426147de542cd4684c244b673b105188fe5f"
+        model_version = self.MODEL_VERSIONS["replicate-flux"]
         
         input_data = {
             "prompt": validated_input["prompt"],
@@ -452,12 +634,9 @@ class ReplicateService:
             logger.info(f"开始Replicate FLUX生成: {prompt[:50]}...")
             start_time = time.time()
             
-            # 创建预测任务
-            prediction = await self.create_prediction(model_version, input_data)
-            prediction_id = prediction["id"]
-            
-            # 等待任务完成
-            completed_prediction = await self.wait_for_prediction(prediction_id)
+            # 创建预测任务并等待完成
+            completed_prediction = await self._run_prediction(model_version, input_data, model="replicate-flux")
+            prediction_id = completed_prediction["id"]
             
             generation_time = time.time() - start_time
             logger.info(f"Replicate FLUX生成完成，耗时: {generation_time:.2f}秒")
@@ -588,48 +767,49 @@ class ReplicateService:
         
         return enhanced_prompt
     
+    async def _generate_batch_item(self, request_data: Dict[str, Any]) -> Dict[str, Any]:
+        """按模型类型生成批次中的单项"""
+        params = {k: v for k, v in request_data.items() if k != "model"}
+        model = request_data.get("model", "flux-schnell")
+        
+        if model == "flux-schnell":
+            return await self.generate_image_flux_schnell(**params)
+        elif model == "flux":
+            return await self.generate_image_flux(**params)
+        elif model == "sdxl":
+            return await self.generate_image_sdxl(**params)
+        elif model == "playground":
+            return await self.generate_image_playground(**params)
+        else:
+            raise ReplicateError(f"不支持的模型: {model}")
+    
+    async def stream_batch_generate(
+        self,
+        requests: List[Dict[str, Any]],
+        item_timeout: Optional[float] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """批量生成图片 - 按完成顺序逐项返回结果"""
+        if len(requests) > 5:
+            raise ReplicateError("批量请求不能超过5个")
+        
+        async for item in batch_engine.stream(
+            "replicate", requests, self._generate_batch_item, item_timeout
+        ):
+            yield item
+    
     async def batch_generate(
         self,
         requests: List[Dict[str, Any]],
-        webhook_url: Optional[str] = None
+        webhook_url: Optional[str] = None,
+        item_timeout: Optional[float] = None
     ) -> List[Dict[str, Any]]:
-        """批量生成图片"""
+        """批量生成图片 - 并发执行，结果按请求顺序返回"""
         if len(requests) > 5:
             raise ReplicateError("批量请求不能超过5个")
         
-        predictions = []
-        
-        for i, request_data in enumerate(requests):
-            try:
-                # 根据模型类型选择生成方法
-                model = request_data.get("model", "flux-schnell")
-                
-                if model == "flux-schnell":
-                    result = await self.generate_image_flux_schnell(**request_data)
-                elif model == "flux":
-                    result = await self.generate_image_flux(**request_data)
-                elif model == "sdxl":
-                    result = await self.generate_image_sdxl(**request_data)
-                elif model == "playground":
-                    result = await self.generate_image_playground(**request_data)
-                else:
-                    raise ReplicateError(f"不支持的模型: {model}")
-                
-                predictions.append({
-                    "index": i,
-                    "status": "succeeded",
-                    "result": result
-                })
-                
-            except Exception as e:
-                predictions.append({
-                    "index": i,
-                    "status": "failed",
-                    "error": str(e)
-                })
-                logger.error(f"批量生成第{i}个请求失败: {e}")
-        
-        return predictions
+        return await batch_engine.run(
+            "replicate", requests, self._generate_batch_item, item_timeout
+        )
     
     async def estimate_generation_time(
         self, 
@@ -717,25 +897,61 @@ class ReplicateService:
     
     async def get_model_info(self, model_id: str) -> Dict[str, Any]:
         """获取模型详细信息"""
-        models = self.get_supported_models()
-        for model in models:
-            if model["id"] == model_id:
-                return model
-        raise ReplicateError(f"未找到模型: {model_id}")
+        if self._model_index is None:
+            self._model_index = {model["id"]: model for model in self.get_supported_models()}
+        model = self._model_index.get(model_id)
+        if model is None:
+            raise ReplicateError(f"未找到模型: {model_id}")
+        return model
+    
+    async def get_model(self, model_name: str) -> Dict[str, Any]:
+        """获取Replicate上的模型信息（owner/name），包含latest_version"""
+        try:
+            return await self._make_request("GET", f"/models/{model_name}")
+        except ReplicateError:
+            raise
+        except Exception as e:
+            raise ReplicateError(f"获取模型信息失败: {str(e)}")
     
     async def create_webhook_url(self, base_url: str, task_id: str) -> str:
         """创建webhook URL"""
         return f"{base_url}/api/webhooks/replicate/{task_id}"
     
-    async def verify_webhook_signature(self, payload: bytes, signature: str, secret: str) -> bool:
-        """验证webhook签名"""
+    async def verify_webhook_signature(
+        self,
+        payload: bytes,
+        signature: Optional[str],
+        secret: str,
+        webhook_id: Optional[str],
+        timestamp: Optional[str]
+    ) -> bool:
+        """
+        验证webhook签名
+        
+        Replicate对 "webhook-id.webhook-timestamp.原始请求体" 做HMAC-SHA256，
+        密钥为whsec_前缀后的base64内容，webhook-signature头为空格分隔的 "v1,<base64签名>"
+        """
+        import base64
+        import binascii
         import hmac
-        expected_signature = hmac.new(
-            secret.encode(),
-            payload,
-            hashlib.sha256
-        ).hexdigest()
-        return hmac.compare_digest(signature, expected_signature)
+        
+        if not (signature and secret and webhook_id and timestamp):
+            return False
+        try:
+            if abs(time.time() - int(timestamp)) > settings.REPLICATE_WEBHOOK_TOLERANCE:
+                return False
+            key = base64.b64decode(secret.split("_", 1)[1] if secret.startswith("whsec_") else secret)
+        except (ValueError, binascii.Error):
+            return False
+        
+        signed_content = f"{webhook_id}.{timestamp}.".encode() + payload
+        expected_signature = base64.b64encode(
+            hmac.new(key, signed_content, hashlib.sha256).digest()
+        ).decode()
+        return any(
+            hmac.compare_digest(candidate.split(",", 1)[-1], expected_signature)
+            for candidate in signature.split()
+        )
 
 # 全局服务实例
 replicate_service = ReplicateService()
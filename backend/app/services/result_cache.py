@@ -0,0 +1,144 @@
+"""
+确定性生成结果缓存
+显式指定seed时，同一模型版本和相同输入的生成结果是确定的，可直接复用
+"""
+
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+from ..core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryCacheBackend:
+    """进程内LRU缓存，带TTL和容量上限"""
+
+    def __init__(self, max_entries: int, ttl: int):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.evictions = 0
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: Dict[str, Any]):
+        self._entries[key] = (time.time() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def delete(self, key: str):
+        self._entries.pop(key, None)
+
+    def size(self) -> int:
+        return len(self._entries)
+
+
+class RedisCacheBackend:
+    """Redis缓存后端，多worker共享（容量由Redis maxmemory策略控制）"""
+
+    def __init__(self, url: str, ttl: int, prefix: str = "ghibli:result-cache"):
+        import redis.asyncio as aioredis
+
+        self.redis = aioredis.from_url(url, decode_responses=True)
+        self.ttl = ttl
+        self.prefix = prefix
+        self.evictions = 0
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        raw = await self.redis.get(f"{self.prefix}:{key}")
+        return json.loads(raw) if raw else None
+
+    async def set(self, key: str, value: Dict[str, Any]):
+        await self.redis.set(f"{self.prefix}:{key}", json.dumps(value, default=str), ex=self.ttl)
+
+    async def delete(self, key: str):
+        await self.redis.delete(f"{self.prefix}:{key}")
+
+    def size(self) -> Optional[int]:
+        return None
+
+
+class GenerationResultCache:
+    """生成结果缓存（按规范化输入哈希寻址）"""
+
+    def __init__(self, backend=None):
+        self.backend = backend if backend is not None else self._create_backend()
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "errors": 0,
+            "saved_cost": 0.0
+        }
+
+    @staticmethod
+    def _create_backend():
+        if settings.RESULT_CACHE_BACKEND == "redis":
+            return RedisCacheBackend(settings.REDIS_URL, settings.RESULT_CACHE_TTL)
+        if settings.RESULT_CACHE_BACKEND == "memory":
+            return MemoryCacheBackend(settings.RESULT_CACHE_MAX_ENTRIES, settings.RESULT_CACHE_TTL)
+        return None
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend is not None
+
+    async def get(self, key: str, cost: float = 0.0) -> Optional[Dict[str, Any]]:
+        """查询缓存，命中时累计节省的生成成本"""
+        if not self.enabled:
+            return None
+        try:
+            value = await self.backend.get(key)
+        except Exception as e:
+            # 缓存故障不影响生成
+            self.stats["errors"] += 1
+            logger.warning(f"读取生成结果缓存失败: {e}")
+            return None
+
+        if value is None:
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        self.stats["saved_cost"] += cost
+        return value
+
+    async def set(self, key: str, value: Dict[str, Any]):
+        """写入缓存"""
+        if not self.enabled:
+            return
+        try:
+            await self.backend.set(key, value)
+            self.stats["stores"] += 1
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.warning(f"写入生成结果缓存失败: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存统计"""
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "backend": settings.RESULT_CACHE_BACKEND,
+            "hit_ratio": self.stats["hits"] / lookups if lookups else 0.0,
+            "size": self.backend.size() if self.enabled else 0,
+            "evictions": self.backend.evictions if self.enabled else 0
+        }
+
+
+# 全局生成结果缓存
+result_cache = GenerationResultCache()
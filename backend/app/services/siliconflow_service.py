@@ -7,14 +7,25 @@ import httpx
 import asyncio
 import json
 import time
+import hashlib
 from typing import Dict, Any, Optional, List
 from datetime import datetime
 import logging
 
 from ..core.config import settings
+from .http_client import http_client_registry
+from .single_flight import SingleFlight
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_IMAGE_MODEL = "stabilityai/stable-diffusion-xl-base-1.0"
+
+# generate_image接受的生成参数，其余字段不参与缓存键
+GENERATION_PARAMS = (
+    "prompt", "model", "negative_prompt", "width", "height",
+    "steps", "guidance_scale", "seed", "batch_size"
+)
+
 class SiliconFlowError(Exception):
     """硅基流动API错误"""
     def __init__(self, message: str, status_code: Optional[int] = None, error_code: Optional[str] = None):
@@ -30,6 +41,7 @@ class SiliconFlowService:
         self.api_key = settings.SILICONFLOW_API_KEY
         self.base_url = "https://api.siliconflow.cn/v1"
         self.timeout = 60.0
+        self.single_flight = SingleFlight()
         
         if not self.api_key:
             logger.warning("硅基流动API密钥未配置")
@@ -54,35 +66,39 @@ class SiliconFlowService:
         url = f"{self.base_url}/{endpoint.lstrip('/')}"
         headers = self._get_headers()
         
-        async with httpx.AsyncClient(timeout=timeout or self.timeout) as client:
-            try:
-                if method.upper() == "GET":
-                    response = await client.get(url, headers=headers, params=params)
-                elif method.upper() == "POST":
-                    response = await client.post(url, headers=headers, json=data, params=params)
-                else:
-                    raise ValueError(f"不支持的HTTP方法: {method}")
+        client = http_client_registry.get_client("siliconflow")
+        request_timeout = timeout or self.timeout
+        
+        try:
+            if method.upper() == "GET":
+                response = await client.get(url, headers=headers, params=params, timeout=request_timeout)
+            elif method.upper() == "POST":
+                response = await client.post(url, headers=headers, json=data, params=params, timeout=request_timeout)
+            else:
+                raise ValueError(f"不支持的HTTP方法: {method}")
+            
+            # 记录请求日志
+            logger.info(f"硅基流动API请求: {method} {url} - 状态码: {response.status_code}")
+            
+            if response.status_code == 200:
+                return response.json()
+            else:
+                error_data = response.json() if response.content else {}
+                error_message = error_data.get("error", {}).get("message", "未知错误")
+                error_code = error_data.get("error", {}).get("code")
                 
-                # 记录请求日志
-                logger.info(f"硅基流动API请求: {method} {url} - 状态码: {response.status_code}")
+                raise SiliconFlowError(
+                    message=f"API请求失败: {error_message}",
+                    status_code=response.status_code,
+                    error_code=error_code
+                )
                 
-                if response.status_code == 200:
-                    return response.json()
-                else:
-                    error_data = response.json() if response.content else {}
-                    error_message = error_data.get("error", {}).get("message", "未知错误")
-                    error_code = error_data.get("error", {}).get("code")
-                    
-                    raise SiliconFlowError(
-                        message=f"API请求失败: {error_message}",
-                        status_code=response.status_code,
-                        error_code=error_code
-                    )
-                    
-            except httpx.TimeoutException:
-                raise SiliconFlowError("请求超时")
-            except httpx.RequestError as e:
-                raise SiliconFlowError(f"网络请求错误: {str(e)}")
+        except httpx.TimeoutException:
+            http_client_registry.record_error("siliconflow")
+            raise SiliconFlowError("请求超时")
+        except httpx.RequestError as e:
+            http_client_registry.record_error("siliconflow")
+            raise SiliconFlowError(f"网络请求错误: {str(e)}")
     
     async def get_models(self) -> List[Dict[str, Any]]:
         """获取可用的AI模型列表"""
@@ -105,10 +121,66 @@ class SiliconFlowService:
         except Exception as e:
             raise SiliconFlowError(f"获取模型列表失败: {str(e)}")
     
+    def build_request_data(
+        self,
+        prompt: str,
+        model: str = DEFAULT_IMAGE_MODEL,
+        negative_prompt: Optional[str] = None,
+        width: int = 1024,
+        height: int = 1024,
+        steps: int = 20,
+        guidance_scale: float = 7.5,
+        seed: Optional[int] = None,
+        batch_size: int = 1
+    ) -> Dict[str, Any]:
+        """构建发送给图片生成接口的规范化请求体"""
+        request_data = {
+            "model": model,
+            "prompt": prompt,
+            "width": int(width),
+            "height": int(height),
+            "num_inference_steps": int(steps),
+            "guidance_scale": float(guidance_scale),
+            "num_images_per_prompt": int(batch_size),
+            "response_format": "url"  # 返回图片URL而不是base64
+        }
+        
+        if negative_prompt:
+            request_data["negative_prompt"] = negative_prompt
+        
+        if seed is not None:
+            request_data["seed"] = int(seed)
+        
+        return request_data
+    
+    def get_cache_key(self, params: Dict[str, Any]) -> Optional[str]:
+        """
+        计算确定性生成的缓存键（仅在显式指定seed时可缓存）
+        
+        参数与generate_image一致，键为实际请求体的哈希，未识别的字段和显式传入的默认值不影响结果
+        """
+        if params.get("seed") is None:
+            return None
+        
+        options = {k: v for k, v in params.items() if k in GENERATION_PARAMS}
+        return self._hash_request_data(self.build_request_data(**options))
+    
+    @staticmethod
+    def _hash_request_data(request_data: Dict[str, Any]) -> str:
+        """请求体的规范化哈希"""
+        canonical = json.dumps(
+            {"provider": "siliconflow", "request": request_data},
+            sort_keys=True,
+            separators=(",", ":"),
+            ensure_ascii=False,
+            default=str
+        )
+        return hashlib.sha256(canonical.encode()).hexdigest()
+    
     async def generate_image(
         self,
         prompt: str,
-        model: str = "stabilityai/stable-diffusion-xl-base-1.0",
+        model: str = DEFAULT_IMAGE_MODEL,
         negative_prompt: Optional[str] = None,
         width: int = 1024,
         height: int = 1024,
@@ -138,33 +210,36 @@ class SiliconFlowService:
             raise SiliconFlowError("硅基流动API密钥未配置")
         
         # 构建请求数据
-        request_data = {
-            "model": model,
-            "prompt": prompt,
-            "width": width,
-            "height": height,
-            "num_inference_steps": steps,
-            "guidance_scale": guidance_scale,
-            "num_images_per_prompt": batch_size,
-            "response_format": "url"  # 返回图片URL而不是base64
-        }
-        
-        if negative_prompt:
-            request_data["negative_prompt"] = negative_prompt
-        
-        if seed is not None:
-            request_data["seed"] = seed
+        request_data = self.build_request_data(
+            prompt,
+            model=model,
+            negative_prompt=negative_prompt,
+            width=width,
+            height=height,
+            steps=steps,
+            guidance_scale=guidance_scale,
+            seed=seed,
+            batch_size=batch_size
+        )
         
         try:
             logger.info(f"开始生成图片: {prompt[:50]}...")
             start_time = time.time()
             
-            response = await self._make_request(
-                "POST", 
-                "/images/generations",
-                data=request_data,
-                timeout=120.0  # 图片生成需要更长时间
-            )
+            async def request_generation() -> Dict[str, Any]:
+                return await self._make_request(
+                    "POST", 
+                    "/images/generations",
+                    data=request_data,
+                    timeout=120.0  # 图片生成需要更长时间
+                )
+            
+            # 显式seed的相同请求并发时只调用一次API
+            if seed is not None:
+                flight_key = self._hash_request_data(request_data)
+                response = await self.single_flight.do(flight_key, request_generation)
+            else:
+                response = await request_generation()
             
             generation_time = time.time() - start_time
             logger.info(f"图片生成完成，耗时: {generation_time:.2f}秒")
@@ -0,0 +1,81 @@
+"""
+进行中请求合并（single-flight）
+相同键的并发调用共享同一次执行，所有调用方得到相同结果；
+所有调用方都离开时取消共享执行
+"""
+
+import asyncio
+import copy
+import logging
+from typing import Dict, Any, Callable, Awaitable, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+class _Flight:
+    """一次共享执行及其等待者"""
+
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.waiters = 0
+        # 各等待者的进度推送主题，共享执行过程中按当前等待者推送
+        self.topics: Set[str] = set()
+
+
+class SingleFlight:
+    """按键合并并发调用"""
+
+    def __init__(self):
+        self._calls: Dict[str, _Flight] = {}
+        self.stats = {
+            "executions": 0,
+            "coalesced": 0,
+            "cancelled": 0
+        }
+
+    def _forget(self, key: str, flight: _Flight):
+        if self._calls.get(key) is flight:
+            del self._calls[key]
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]], topic: Optional[str] = None) -> Any:
+        """执行fn，若相同key已在执行中则等待其结果；topic为调用方的进度推送主题"""
+        flight = self._calls.get(key)
+        if flight is not None:
+            self.stats["coalesced"] += 1
+            logger.info(f"合并重复请求: {key[:16]}")
+        else:
+            self.stats["executions"] += 1
+            flight = _Flight()
+            self._calls[key] = flight
+            # 独立任务执行，单个调用方被取消时不影响其它等待者
+            flight.task = asyncio.ensure_future(fn())
+            flight.task.add_done_callback(lambda _, flight=flight: self._forget(key, flight))
+
+        flight.waiters += 1
+        if topic:
+            flight.topics.add(topic)
+        try:
+            result = await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if topic:
+                flight.topics.discard(topic)
+            if flight.waiters == 0 and not flight.task.done():
+                # 所有调用方都已取消，不再为无人等待的结果继续执行
+                self._forget(key, flight)
+                flight.task.cancel()
+                self.stats["cancelled"] += 1
+        # 调用方可能修改返回的字典，各自持有副本
+        return copy.deepcopy(result)
+
+    def topics(self, key: str) -> Set[str]:
+        """当前等待该键的调用方的推送主题"""
+        flight = self._calls.get(key)
+        return set(flight.topics) if flight is not None else set()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取合并统计"""
+        return {
+            **self.stats,
+            "in_flight": len(self._calls)
+        }
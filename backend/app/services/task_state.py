@@ -0,0 +1,35 @@
+"""
+生成任务状态转换
+完成、失败、取消都以条件UPDATE写入：只有仍在进行中的任务会被转换，
+取消与完成/失败并发时只有一方生效，结果只保存一次、配额只归还一次。
+批量UPDATE不触发ORM事件，转换成功时显式标记用户统计在提交后失效
+"""
+
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from ..models.generation_task import GenerationTask
+from .user_stats import user_stats
+
+# 可被转换的进行中状态
+ACTIVE_TASK_STATUSES = ("pending", "processing")
+
+
+def transition_task(db: Session, task_id: str, status: str, **values) -> bool:
+    """
+    仅当任务仍处于进行中状态时更新（不提交，与同一事务内的其它写入一起提交）
+
+    Returns:
+        是否由本次调用完成了状态转换
+    """
+    rows = db.execute(
+        update(GenerationTask)
+        .where(GenerationTask.id == task_id, GenerationTask.status.in_(ACTIVE_TASK_STATUSES))
+        .values(status=status, **values)
+        .returning(GenerationTask.user_id)
+        .execution_options(synchronize_session=False)
+    ).all()
+    if len(rows) != 1:
+        return False
+    user_stats.mark_dirty(db, rows[0].user_id)
+    return True
@@ -0,0 +1,136 @@
+"""
+用户统计服务
+一次查询计算用户的任务、图片与收藏统计（COUNT ... FILTER），按用户缓存。
+生成任务、图片、收藏写入提交后通过ORM事件自动失效对应用户的缓存；批量UPDATE不触发ORM事件，
+需调用 mark_dirty（见 task_state.transition_task）。
+缓存在进程内，其他进程（worker.py、其它uvicorn worker）的写入只能等待过期，
+统计最多滞后 USER_STATS_CACHE_TTL 秒
+"""
+
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+from sqlalchemy import event, func, select, true
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, object_session
+
+from ..core.config import settings
+from ..models.generation_task import GenerationTask
+from ..models.image import Image
+from ..models.user_favorite import UserFavorite
+
+logger = logging.getLogger(__name__)
+
+# Session.info中记录本事务内统计需要失效的用户
+_DIRTY_USERS_KEY = "user_stats_dirty_users"
+
+
+def build_stats_query(user_id: str):
+    """单条语句计算用户全部统计：各表聚合为单行子查询后显式连接（均为单行，连接条件恒真）"""
+    tasks = select(
+        func.count().label("total_tasks"),
+        func.count().filter(GenerationTask.status == "completed").label("successful_generations"),
+        func.count().filter(GenerationTask.status == "failed").label("failed_generations"),
+        func.count().filter(GenerationTask.status.in_(["pending", "processing"])).label("pending_generations")
+    ).where(GenerationTask.user_id == user_id).subquery()
+
+    images = select(
+        func.count().label("total_images"),
+        func.count().filter(Image.is_public == True).label("public_images"),
+        func.coalesce(func.sum(Image.likes_count), 0).label("total_likes"),
+        func.coalesce(func.sum(Image.views_count), 0).label("total_views")
+    ).where(Image.user_id == user_id).subquery()
+
+    favorites = select(func.count()).select_from(UserFavorite).where(
+        UserFavorite.user_id == user_id
+    ).scalar_subquery()
+
+    most_used_model = select(GenerationTask.ai_model).where(
+        GenerationTask.user_id == user_id
+    ).group_by(GenerationTask.ai_model).order_by(
+        func.count().desc(), GenerationTask.ai_model
+    ).limit(1).scalar_subquery()
+
+    return select(
+        tasks,
+        images,
+        favorites.label("total_favorites"),
+        most_used_model.label("most_used_model")
+    ).select_from(tasks.join(images, true()))
+
+
+class UserStatsService:
+    """用户统计（带缓存）"""
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "invalidations": 0
+        }
+
+    async def get(self, db: AsyncSession, user_id: str) -> Dict[str, Any]:
+        """获取用户统计"""
+        user_id = str(user_id)
+        entry = self._entries.get(user_id)
+        if entry is not None and entry[0] > time.monotonic():
+            self._entries.move_to_end(user_id)
+            self.stats["hits"] += 1
+            return dict(entry[1])
+
+        self.stats["misses"] += 1
+        row = (await db.execute(build_stats_query(user_id))).mappings().one()
+        result = dict(row)
+        self._entries[user_id] = (time.monotonic() + self.ttl, result)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return dict(result)
+
+    def invalidate(self, user_id: Optional[str]):
+        """清除用户统计缓存"""
+        if user_id is not None and self._entries.pop(str(user_id), None) is not None:
+            self.stats["invalidations"] += 1
+
+    def mark_dirty(self, session: Session, user_id: Optional[str]):
+        """记录本事务修改了该用户的数据，提交后失效其统计"""
+        if user_id is not None:
+            session.info.setdefault(_DIRTY_USERS_KEY, set()).add(str(user_id))
+
+    def _mark_dirty(self, mapper, connection, target):
+        session = object_session(target)
+        if session is not None:
+            self.mark_dirty(session, target.user_id)
+
+    def _after_commit(self, session):
+        for user_id in session.info.pop(_DIRTY_USERS_KEY, ()):
+            self.invalidate(user_id)
+
+    def _after_rollback(self, session):
+        session.info.pop(_DIRTY_USERS_KEY, None)
+
+    def register_listeners(self):
+        """监听任务、图片、收藏的写入，提交后失效对应用户的统计"""
+        for model in (GenerationTask, Image, UserFavorite):
+            for name in ("after_insert", "after_update", "after_delete"):
+                event.listen(model, name, self._mark_dirty)
+        event.listen(Session, "after_commit", self._after_commit)
+        event.listen(Session, "after_rollback", self._after_rollback)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存统计"""
+        return {
+            **self.stats,
+            "size": len(self._entries),
+            "ttl": self.ttl
+        }
+
+
+# 全局用户统计服务
+user_stats = UserStatsService(settings.USER_STATS_CACHE_TTL, settings.USER_STATS_CACHE_MAX_ENTRIES)
+user_stats.register_listeners()
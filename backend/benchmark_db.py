@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+数据库访问基准测试
+对比同步Session（阻塞事件循环）与AsyncSession（asyncpg）在并发下的吞吐量
+
+用法:
+  # 进程内对比：以相同查询分别模拟改造前（同步）和改造后（异步）的路由
+  python benchmark_db.py inprocess --requests 500 --concurrency 50 [--task-id <任务ID>] [--slow-ms 20]
+
+  # HTTP压测：分别对改造前后的服务运行，比较requests/sec
+  python benchmark_db.py http --base-url http://localhost:8000 --token <JWT> --task-id <任务ID>
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from typing import Awaitable, Callable
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+async def run_load(name: str, total: int, concurrency: int, request: Callable[[], Awaitable[None]]):
+    """以固定并发执行total次请求并输出吞吐量和延迟"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def one():
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await request()
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(total)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1000
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000
+    print(f"{name:<32} {total / elapsed:>9.1f} req/s   p50 {p50:>7.1f}ms   p95 {p95:>7.1f}ms   错误 {errors}")
+
+
+async def benchmark_inprocess(args):
+    from sqlalchemy import select, func, text
+    from app.core.database import SessionLocal, AsyncSessionLocal, dispose_async_engine
+    from app.models.image import Image
+    from app.models.generation_task import GenerationTask
+
+    slow = f"SELECT pg_sleep({args.slow_ms / 1000})" if args.slow_ms else None
+
+    async def gallery_sync():
+        # 改造前：async路由中直接调用同步Session
+        db = SessionLocal()
+        try:
+            if slow:
+                db.execute(text(slow))
+            query = db.query(Image).filter(Image.is_public == True)
+            query.count()
+            query.order_by(Image.created_at.desc()).limit(20).all()
+        finally:
+            db.close()
+
+    async def gallery_async():
+        async with AsyncSessionLocal() as db:
+            if slow:
+                await db.execute(text(slow))
+            stmt = select(Image).where(Image.is_public == True)
+            await db.execute(select(func.count()).select_from(stmt.subquery()))
+            (await db.execute(stmt.order_by(Image.created_at.desc()).limit(20))).scalars().all()
+
+    async def task_sync():
+        db = SessionLocal()
+        try:
+            if slow:
+                db.execute(text(slow))
+            db.query(GenerationTask).filter(GenerationTask.id == args.task_id).first()
+        finally:
+            db.close()
+
+    async def task_async():
+        async with AsyncSessionLocal() as db:
+            if slow:
+                await db.execute(text(slow))
+            (await db.execute(select(GenerationTask).where(GenerationTask.id == args.task_id))).scalar_one_or_none()
+
+    print(f"🔍 进程内对比：{args.requests} 次请求，并发 {args.concurrency}")
+    await run_load("gallery（同步Session）", args.requests, args.concurrency, gallery_sync)
+    await run_load("gallery（AsyncSession）", args.requests, args.concurrency, gallery_async)
+    if args.task_id:
+        await run_load("task-status（同步Session）", args.requests, args.concurrency, task_sync)
+        await run_load("task-status（AsyncSession）", args.requests, args.concurrency, task_async)
+    await dispose_async_engine()
+
+
+async def benchmark_http(args):
+    import httpx
+
+    headers = {"Authorization": f"Bearer {args.token}"} if args.token else {}
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, headers=headers, limits=limits, timeout=30) as client:
+
+        async def gallery():
+            (await client.get("/api/images/public/gallery", params={"page": 1, "size": 20})).raise_for_status()
+
+        async def task_status():
+            (await client.get(f"/api/generate/tasks/{args.task_id}")).raise_for_status()
+
+        print(f"🔍 HTTP压测 {args.base_url}：{args.requests} 次请求，并发 {args.concurrency}")
+        await run_load("GET /api/images/public/gallery", args.requests, args.concurrency, gallery)
+        if args.task_id and args.token:
+            await run_load("GET /api/generate/tasks/{id}", args.requests, args.concurrency, task_status)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="数据库访问基准测试")
+    parser.add_argument("mode", choices=["inprocess", "http"])
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--task-id", default=None, help="用于任务状态查询的任务ID")
+    parser.add_argument("--slow-ms", type=int, default=0, help="每次请求附加的pg_sleep毫秒数，模拟慢查询")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--token", default=None, help="HTTP模式下的访问令牌")
+    args = parser.parse_args()
+
+    if args.mode == "inprocess":
+        asyncio.run(benchmark_inprocess(args))
+    else:
+        asyncio.run(benchmark_http(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,7 @@ FastAPI主应用程序
 吉卜力AI图片生成平台后端服务
 """
 
-from fastapi import FastAPI, Request, HTTPException
+from fastapi import FastAPI, Request, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
 from fastapi.responses import JSONResponse
@@ -12,8 +12,29 @@ import logging
 from contextlib import asynccontextmanager
 
 from app.core.config import settings
-from app.core.database import engine, Base, test_database_connection
+from app.core.auth import get_current_admin
+from app.core.database import engine, Base, test_database_connection, dispose_async_engine
+from app.core.pool_metrics import get_pool_stats
+from app.core.pagination import count_cache
 from app.core.supabase import supabase_manager
+from app.core.storage_accounting import storage_accounting
+from app.services.http_client import http_client_registry
+from app.services.prediction_registry import prediction_registry
+from app.services.replicate_service import replicate_service
+from app.services.job_queue import generation_queue
+from app.services.result_cache import result_cache
+from app.services.progress_stream import progress_hub
+from app.services.siliconflow_service import siliconflow_service
+from app.services.ai_service_manager import ai_service_manager
+from app.services.rate_limiter import rate_limiter
+from app.services.principal_cache import principal_cache
+from app.services.quota_ledger import quota_ledger
+from app.services.gallery_feed import gallery_feed
+from app.services.prompt_search import prompt_search
+from app.services.user_stats import user_stats
+from app.services.audit_log import audit_logger
+from app.services.image_ingestion import image_ingestion
+from app.services.model_registry import model_registry
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
@@ -50,11 +71,37 @@ async def lifespan(app: FastAPI):
     except Exception as e:
         logger.error(f"❌ 数据库初始化失败: {e}")
     
+    # 创建AI服务共享HTTP连接池
+    await http_client_registry.startup()
+    logger.info("✅ HTTP连接池已就绪")
+    
+    # 启动审计日志后台写入
+    audit_logger.start()
+    
+    # 启动生成图片转存worker
+    image_ingestion.start()
+    
+    # 加载模型目录
+    model_registry.start()
+    
+    # 后台校正存储用量计数
+    if settings.SUPABASE_URL:
+        storage_accounting.start(supabase_manager)
+    
     logger.info("🎉 服务启动完成!")
     yield
     
     # 关闭时执行
     logger.info("🛑 关闭吉卜力AI平台后端服务...")
+    await replicate_service.poller.stop()
+    await generation_queue.close()
+    await image_ingestion.stop()
+    await storage_accounting.stop()
+    await model_registry.stop()
+    await http_client_registry.shutdown()
+    await audit_logger.stop()
+    await dispose_async_engine()
+    supabase_manager.shutdown()
 
 # 创建FastAPI应用实例
 app = FastAPI(
@@ -89,6 +136,12 @@ async def add_process_time_header(request: Request, call_next):
     response = await call_next(request)
     process_time = time.time() - start_time
     response.headers["X-Process-Time"] = str(process_time)
+    
+    # 经过限流检查的请求附带RateLimit-*响应头
+    rate_limit = getattr(request.state, "rate_limit", None)
+    if rate_limit is not None:
+        for name, value in rate_limit.headers().items():
+            response.headers.setdefault(name, value)
     return response
 
 # 全局异常处理器
@@ -102,7 +155,8 @@ async def http_exception_handler(request: Request, exc: HTTPException):
             "message": exc.detail,
             "status_code": exc.status_code,
             "path": str(request.url)
-        }
+        },
+        headers=getattr(exc, "headers", None)
     )
 
 @app.exception_handler(Exception)
@@ -130,6 +184,38 @@ async def health_check():
         "timestamp": time.time()
     }
 
+# 运行指标端点（包含连接池、队列、存储和服务商等内部细节，仅限管理员）
+@app.get("/metrics", dependencies=[Depends(get_current_admin)])
+async def metrics():
+    """运行时指标"""
+    return {
+        "timestamp": time.time(),
+        "http_clients": http_client_registry.get_stats(),
+        "prediction_webhooks": prediction_registry.get_stats(),
+        "prediction_poller": replicate_service.poller.get_stats(),
+        "job_queue": await generation_queue.get_stats(),
+        "result_cache": result_cache.get_stats(),
+        "single_flight": {
+            "replicate": replicate_service.single_flight.get_stats(),
+            "siliconflow": siliconflow_service.single_flight.get_stats()
+        },
+        "progress_stream": progress_hub.get_stats(),
+        "ai_services": ai_service_manager.get_stats(),
+        "rate_limiter": rate_limiter.get_stats(),
+        "auth_cache": principal_cache.get_stats(),
+        "quota_ledger": quota_ledger.get_stats(),
+        "database": get_pool_stats(),
+        "pagination_count_cache": count_cache.get_stats(),
+        "gallery_feed": gallery_feed.get_stats(),
+        "prompt_search": prompt_search.get_stats(),
+        "user_stats": user_stats.get_stats(),
+        "audit_log": audit_logger.get_stats(),
+        "image_ingestion": image_ingestion.get_stats(),
+        "supabase": supabase_manager.get_stats(),
+        "storage": storage_accounting.get_stats(),
+        "model_registry": model_registry.get_stats()
+    }
+
 # 连接测试端点
 @app.get("/test-connections")
 async def test_connections():
@@ -187,7 +273,7 @@ async def root():
     }
 
 # 导入API路由
-from app.api import auth, users, generate, images, test_generate
+from app.api import auth, users, generate, images, test_generate, replicate_api
 
 # 注册API路由
 app.include_router(auth.router, prefix="/api/auth", tags=["认证"])
@@ -195,6 +281,8 @@ app.include_router(users.router, prefix="/api/users", tags=["用户管理"])
 app.include_router(generate.router, prefix="/api/generate", tags=["图片生成"])
 app.include_router(images.router, prefix="/api/images", tags=["图片管理"])
 app.include_router(test_generate.router, prefix="/api/test", tags=["测试接口"])
+app.include_router(replicate_api.router, prefix="/api/replicate", tags=["Replicate"])
+app.include_router(replicate_api.webhook_router, prefix="/api/webhooks/replicate", tags=["Replicate"])
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,9 @@
+-- 键集分页索引：列表按 (created_at, id) 倒序翻页
+-- 公开画廊只扫描公开图片
+CREATE INDEX IF NOT EXISTS idx_images_public_created_id ON images(created_at DESC, id DESC) WHERE is_public = TRUE;
+CREATE INDEX IF NOT EXISTS idx_images_user_created_id ON images(user_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_generation_tasks_user_created_id ON generation_tasks(user_id, created_at DESC, id DESC);
+
+-- 被复合索引覆盖的单列索引
+DROP INDEX IF EXISTS idx_images_user_id;
+DROP INDEX IF EXISTS idx_generation_tasks_user_id;
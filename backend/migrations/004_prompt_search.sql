@@ -0,0 +1,8 @@
+-- 提示词全文搜索索引
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- 词项与前缀匹配（与 app/services/prompt_search.py 中的表达式一致）
+CREATE INDEX IF NOT EXISTS idx_images_prompt_fts ON images USING GIN (to_tsvector('simple', prompt));
+
+-- 模糊匹配与ILIKE子串匹配（中文提示词）
+CREATE INDEX IF NOT EXISTS idx_images_prompt_trgm ON images USING GIN (prompt gin_trgm_ops);
@@ -0,0 +1,2 @@
+-- 缩略图与响应式尺寸（见 app/services/image_variants.py）
+ALTER TABLE images ADD COLUMN IF NOT EXISTS variants JSONB;
@@ -0,0 +1,93 @@
+"""
+审计日志写后缓冲测试
+"""
+
+import asyncio
+import json
+
+import pytest
+
+from app.services.audit_log import AuditLogger, DatabaseAuditSink, JsonlAuditSink, MAX_WRITE_ATTEMPTS
+
+
+class FailingSink:
+    name = "failing"
+
+    def __init__(self):
+        self.calls = 0
+
+    async def write(self, events):
+        self.calls += 1
+        raise RuntimeError("sink unavailable")
+
+
+@pytest.mark.asyncio
+async def test_log_is_buffered_and_flushed_in_batches(tmp_path):
+    path = tmp_path / "audit.jsonl"
+    audit = AuditLogger(sinks=[JsonlAuditSink(str(path))], batch_size=3, flush_interval=60)
+
+    for i in range(7):
+        assert audit.log({"action": "login", "user_id": str(i)})
+    assert not path.exists()
+
+    await audit.stop()
+
+    lines = [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+    assert [line["user_id"] for line in lines] == [str(i) for i in range(7)]
+    assert all(line["id"] and line["created_at"] for line in lines)
+    stats = audit.get_stats()
+    assert stats["written"] == 7
+    assert stats["queued"] == 0
+
+
+@pytest.mark.asyncio
+async def test_batch_size_wakes_background_writer(tmp_path):
+    path = tmp_path / "audit.jsonl"
+    audit = AuditLogger(sinks=[JsonlAuditSink(str(path))], batch_size=2, flush_interval=60)
+
+    audit.log({"action": "a"})
+    audit.log({"action": "b"})
+    for _ in range(50):
+        if audit.get_stats()["written"] == 2:
+            break
+        await asyncio.sleep(0.01)
+
+    assert audit.get_stats()["written"] == 2
+    await audit.stop()
+
+
+@pytest.mark.asyncio
+async def test_full_buffer_and_failed_writes_are_dropped():
+    sink = FailingSink()
+    audit = AuditLogger(sinks=[sink], max_queue=2, batch_size=10, flush_interval=60)
+
+    assert audit.log({"action": "a"})
+    assert audit.log({"action": "b"})
+    assert not audit.log({"action": "c"})
+    assert audit.get_stats()["dropped"] == 1
+
+    # 失败的批次放回缓冲区重试，达到最大次数后丢弃
+    for _ in range(MAX_WRITE_ATTEMPTS - 1):
+        await audit.flush()
+        assert audit.get_stats()["queued"] == 2
+    await audit.flush()
+
+    stats = audit.get_stats()
+    assert sink.calls == MAX_WRITE_ATTEMPTS
+    assert stats["queued"] == 0
+    assert stats["dropped"] == 3
+    assert stats["write_errors"] == MAX_WRITE_ATTEMPTS
+    await audit.stop()
+
+
+def test_database_rows_keep_invalid_typed_values_in_details():
+    row = DatabaseAuditSink._row({
+        "action": "batch_generate",
+        "resource_id": "batch",
+        "details": {"count": 2},
+        "ip_address": "testclient"
+    })
+
+    assert row["resource_id"] is None
+    assert row["details"] == {"count": 2, "resource_id": "batch"}
+    assert row["ip_address"] is None
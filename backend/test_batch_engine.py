@@ -0,0 +1,68 @@
+"""
+批量生成并发引擎测试
+"""
+
+import asyncio
+import pytest
+
+from app.services.batch_engine import BatchEngine
+
+
+class FakeAuthError(Exception):
+    """模拟认证失败"""
+    status_code = 401
+
+@pytest.mark.asyncio
+async def test_batch_runs_concurrently_within_provider_limit():
+    """测试批次并发执行且不超过服务商并发上限"""
+    engine = BatchEngine()
+    engine.concurrency_limits["fake"] = 2
+    running = 0
+    peak = 0
+    
+    async def runner(request_data):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.05)
+        running -= 1
+        return {"prompt": request_data["prompt"]}
+    
+    requests = [{"prompt": f"image {i}"} for i in range(4)]
+    results = await engine.run("fake", requests, runner)
+    
+    assert [r["index"] for r in results] == [0, 1, 2, 3]
+    assert all(r["status"] == "succeeded" for r in results)
+    assert peak == 2
+
+@pytest.mark.asyncio
+async def test_batch_item_timeout_is_reported():
+    """测试单项超时不影响其它请求"""
+    engine = BatchEngine()
+    
+    async def runner(request_data):
+        await asyncio.sleep(request_data["delay"])
+        return {}
+    
+    results = await engine.run("fake", [{"delay": 0}, {"delay": 1}], runner, item_timeout=0.05)
+    
+    assert results[0]["status"] == "succeeded"
+    assert results[1]["status"] == "failed"
+
+@pytest.mark.asyncio
+async def test_fatal_error_cancels_siblings():
+    """测试认证失败时取消同批次其余请求"""
+    engine = BatchEngine()
+    
+    async def runner(request_data):
+        if request_data["fail"]:
+            raise FakeAuthError("API令牌无效")
+        await asyncio.sleep(1)
+        return {}
+    
+    results = await engine.run("fake", [{"fail": False}, {"fail": True}, {"fail": False}], runner)
+    
+    assert results[1]["status"] == "failed"
+    assert results[1]["fatal"] is True
+    assert results[0]["status"] == "cancelled"
+    assert results[2]["status"] == "cancelled"
@@ -0,0 +1,81 @@
+"""
+公开画廊信息流测试
+"""
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app.core.config import settings
+
+# 信息流依赖图片模型，导入模型会创建数据库引擎（不会建立连接）
+if not settings.POSTGRES_URL_NON_POOLING:
+    settings.POSTGRES_URL_NON_POOLING = "sqlite://"
+
+from app.schemas.image import ImageResponse
+from app.services.gallery_feed import FeedFacet, GalleryFeed, ALL_MODELS
+
+BASE = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def make_image(i: int, ai_model: str = "flux", is_public: bool = True, user_id: str = "user-1") -> ImageResponse:
+    return ImageResponse(
+        id=f"img-{i:02d}", user_id=user_id, prompt="p", ai_model=ai_model, image_url="u",
+        status="completed", is_public=is_public, created_at=BASE + timedelta(minutes=i)
+    )
+
+
+def loaded_feed(images, limit: int = 5) -> GalleryFeed:
+    feed = GalleryFeed()
+    facet = feed.facets[ALL_MODELS] = FeedFacet(ALL_MODELS, limit)
+    facet.replace(sorted(images, key=lambda img: (img.created_at, img.id), reverse=True)[:limit])
+    return feed
+
+
+@pytest.mark.asyncio
+async def test_feed_pages_and_falls_back_beyond_window():
+    """测试内存分页、游标续页以及超出窗口时回退数据库"""
+    feed = loaded_feed([make_image(i) for i in range(10)], limit=5)
+
+    images, next_cursor, _ = await feed.get_page(None, None, None, 0, 2)
+    assert [img.id for img in images] == ["img-09", "img-08"]
+
+    images, next_cursor, _ = await feed.get_page(None, None, next_cursor, 0, 2)
+    assert [img.id for img in images] == ["img-07", "img-06"]
+
+    # 第三页需要窗口外的记录判断是否还有下一页
+    assert await feed.get_page(None, None, next_cursor, 0, 2) is None
+    assert feed.stats["hits"] == 2 and feed.stats["fallbacks"] == 1
+
+
+@pytest.mark.asyncio
+async def test_feed_incremental_updates():
+    """测试公开、取消公开和删除的增量更新"""
+    feed = loaded_feed([make_image(i) for i in range(3)], limit=5)
+    facet = feed.facets[ALL_MODELS]
+    assert facet.exhaustive
+
+    feed.on_image_changed(make_image(1, is_public=False))
+    feed.on_image_changed(make_image(7))
+    feed.on_image_deleted("img-00")
+    assert [img.id for img in facet.items] == ["img-07", "img-02"]
+
+    images, next_cursor, _ = await feed.get_page(None, None, None, 0, 10)
+    assert len(images) == 2 and next_cursor is None
+
+    feed.on_user_deleted("user-1")
+    assert facet.items == []
+
+
+def test_conditional_request_headers():
+    """测试ETag与Last-Modified条件请求"""
+    feed = GalleryFeed()
+    etag = feed.etag({"images": ["img-01"], "total": 1})
+    assert etag == feed.etag({"total": 1, "images": ["img-01"]})
+    last_modified = BASE
+    headers = feed.cache_headers(etag, last_modified)
+
+    assert feed.is_not_modified({"if-none-match": etag.removeprefix("W/")}, etag, last_modified)
+    assert not feed.is_not_modified({"if-none-match": 'W/"other"'}, etag, last_modified)
+    assert feed.is_not_modified({"if-modified-since": headers["Last-Modified"]}, etag, last_modified)
+    assert not feed.is_not_modified({"if-modified-since": "garbage"}, etag, last_modified)
@@ -0,0 +1,104 @@
+"""
+共享HTTP客户端测试
+使用本地keep-alive服务器验证连接复用统计与客户端生命周期
+"""
+
+import asyncio
+
+import pytest
+
+from app.services.http_client import HTTPClientRegistry
+
+
+async def _start_server():
+    """极简HTTP/1.1服务器，记录建立的TCP连接数"""
+    connections = []
+
+    async def handle(reader, writer):
+        connections.append(writer)
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                if not head:
+                    break
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\nContent-Type: text/plain\r\n\r\nok")
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    return server, f"http://127.0.0.1:{port}", connections
+
+
+def _create_registry() -> HTTPClientRegistry:
+    registry = HTTPClientRegistry()
+    registry.register("test", max_connections=2, max_keepalive_connections=2, timeout=5.0, http2=False)
+    return registry
+
+
+@pytest.mark.asyncio
+async def test_sequential_requests_reuse_one_connection():
+    """测试顺序请求复用同一连接，统计与服务端连接数一致"""
+    server, base_url, connections = await _start_server()
+    registry = _create_registry()
+
+    client = registry.get_client("test")
+    for _ in range(5):
+        response = await client.get(f"{base_url}/ping")
+        assert response.text == "ok"
+
+    stats = registry.get_stats()["test"]
+    assert len(connections) == 1
+    assert stats["requests"] == 5
+    assert stats["new_connections"] == 1
+    assert stats["reused_connections"] == 4
+
+    await registry.shutdown()
+    server.close()
+    await server.wait_closed()
+
+
+@pytest.mark.asyncio
+async def test_concurrent_requests_open_at_most_pool_size_connections():
+    """测试并发请求受连接池上限约束"""
+    server, base_url, connections = await _start_server()
+    registry = _create_registry()
+
+    client = registry.get_client("test")
+    await asyncio.gather(*(client.get(f"{base_url}/ping") for _ in range(6)))
+
+    stats = registry.get_stats()["test"]
+    assert stats["requests"] == 6
+    assert stats["new_connections"] == len(connections) <= 2
+    assert stats["reused_connections"] == 6 - stats["new_connections"]
+
+    await registry.shutdown()
+    server.close()
+    await server.wait_closed()
+
+
+@pytest.mark.asyncio
+async def test_clients_are_created_lazily_and_closed_on_shutdown():
+    """测试客户端按需创建、启动时预建、关闭后释放且可重新创建"""
+    registry = _create_registry()
+    assert registry.get_stats()["test"]["active"] is False
+
+    await registry.startup()
+    client = registry.get_client("test")
+    assert registry.get_stats()["test"]["active"] is True
+    assert registry.get_client("test") is client
+
+    await registry.shutdown()
+    assert client.is_closed
+    assert registry.get_stats()["test"]["active"] is False
+
+    # 关闭后再次获取会重新创建
+    recreated = registry.get_client("test")
+    assert recreated is not client and not recreated.is_closed
+    await registry.shutdown()
+
+    with pytest.raises(KeyError):
+        registry.get_client("unknown")
@@ -0,0 +1,244 @@
+"""
+生成图片转存测试（本地存储后端 + 模拟下载源）
+"""
+
+from app.core.config import settings
+
+# 地址替换语句依赖数据模型，导入模型会创建数据库引擎（不会建立连接）
+if not settings.POSTGRES_URL_NON_POOLING:
+    settings.POSTGRES_URL_NON_POOLING = "sqlite://"
+
+import hashlib
+import io
+
+import httpx
+import pytest
+from PIL import Image as PILImage
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from app.models.generation_task import GenerationTask
+from app.models.image import Image
+from app.services.image_ingestion import (
+    ImageIngestionPipeline, LocalStorageBackend, build_storage_key, build_swap_statements,
+    is_allowed_source, is_public_address
+)
+from app.services.image_variants import VariantRenderer
+
+
+def make_png(width: int = 1024, height: int = 768) -> bytes:
+    buffer = io.BytesIO()
+    PILImage.linear_gradient("L").resize((width, height)).convert("RGB").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+PNG = make_png()
+
+
+class FakeOrigin:
+    """模拟AI服务的图片地址，前若干次请求返回503"""
+
+    def __init__(self, failures: int = 0):
+        self.failures = failures
+        self.requests = 0
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        if self.requests <= self.failures:
+            return httpx.Response(503)
+        if request.url.path == "/big.png":
+            return httpx.Response(200, content=b"x" * 2048, headers={"content-type": "image/png"})
+        return httpx.Response(200, content=PNG, headers={"content-type": "image/png"})
+
+
+async def public_resolve(host):
+    """模拟域名解析到公网地址，测试不访问网络"""
+    return ["93.184.216.34"]
+
+
+def make_pipeline(tmp_path, origin, swaps, **kwargs):
+    async def swap(image_id, task_id, source_url, durable_url, values):
+        swaps.append((image_id, task_id, source_url, durable_url))
+        return True
+
+    return ImageIngestionPipeline(
+        backend=LocalStorageBackend(str(tmp_path / "storage"), "https://cdn.test/storage"),
+        client=httpx.AsyncClient(transport=httpx.MockTransport(origin)),
+        swap=swap,
+        resolve=kwargs.pop("resolve", public_resolve),
+        renderer=VariantRenderer(processes=1, widths=[], formats=["webp"], quality=80, thumbnail_width=256),
+        workers=2,
+        retry_base_delay=0.01,
+        chunk_size=4096,
+        **kwargs
+    )
+
+
+@pytest.mark.asyncio
+async def test_outputs_are_stored_once_per_content_and_swapped(tmp_path):
+    swaps = []
+    pipeline = make_pipeline(tmp_path, FakeOrigin(), swaps)
+
+    queued = pipeline.submit([
+        ("img-1", "https://replicate.delivery/a/out-0.png"),
+        ("img-2", "https://replicate.delivery/b/out-0.png"),
+        ("img-3", "data:image/png;base64,AAAA")
+    ], task_id="task-1")
+    await pipeline.drain()
+
+    assert queued == 2
+    key = build_storage_key(hashlib.sha256(PNG).hexdigest(), "image/png")
+    assert (tmp_path / "storage" / key).read_bytes() == PNG
+    assert sorted(swaps) == [
+        ("img-1", "task-1", "https://replicate.delivery/a/out-0.png", f"https://cdn.test/storage/{key}"),
+        ("img-2", "task-1", "https://replicate.delivery/b/out-0.png", f"https://cdn.test/storage/{key}")
+    ]
+    stats = pipeline.get_stats()
+    assert stats["uploaded"] + stats["deduplicated"] == 2
+    assert stats["skipped"] == 1
+    assert stats["in_progress"] == 0
+
+    # 已是持久地址的图片不再转存
+    assert pipeline.submit([("img-1", f"https://cdn.test/storage/{key}")]) == 0
+    await pipeline.stop()
+
+
+@pytest.mark.asyncio
+async def test_failed_downloads_are_retried_then_given_up(tmp_path):
+    swaps = []
+    origin = FakeOrigin(failures=2)
+    pipeline = make_pipeline(tmp_path, origin, swaps, max_attempts=3)
+
+    pipeline.submit([("img-1", "https://replicate.delivery/a/out-0.png")])
+    await pipeline.drain()
+    assert len(swaps) == 1
+    assert pipeline.get_stats()["retries"] == 2
+
+    origin.failures, origin.requests = 10, 0
+    pipeline.submit([("img-2", "https://replicate.delivery/c/out-0.png")])
+    await pipeline.drain()
+    assert origin.requests == 3
+    assert pipeline.get_stats()["failed"] == 1
+    assert len(swaps) == 1
+    await pipeline.stop()
+
+
+@pytest.mark.asyncio
+async def test_oversized_images_are_rejected(tmp_path):
+    swaps = []
+    pipeline = make_pipeline(tmp_path, FakeOrigin(), swaps, max_attempts=1, max_bytes=1024)
+
+    pipeline.submit([("img-1", "https://replicate.delivery/big.png")])
+    await pipeline.drain()
+
+    assert swaps == []
+    assert pipeline.get_stats()["failed"] == 1
+    assert not (tmp_path / "storage").exists()
+    await pipeline.stop()
+
+
+def test_only_provider_delivery_urls_are_allowed():
+    """测试只允许AI服务交付域名（含子域名）下的https地址"""
+    assert is_allowed_source("https://replicate.delivery/a/out-0.png")
+    assert is_allowed_source("https://pbxt.replicate.delivery/a/out-0.png")
+    assert is_allowed_source("https://sc-maas.oss-cn-shanghai.aliyuncs.com/outputs/a.png")
+    assert not is_allowed_source("http://replicate.delivery/a/out-0.png")
+    assert not is_allowed_source("https://replicate.delivery.evil.com/a.png")
+    assert not is_allowed_source("https://evilreplicate.delivery/a.png")
+    assert not is_allowed_source("https://169.254.169.254/latest/meta-data/")
+    assert not is_allowed_source("https://localhost/a.png")
+    assert not is_allowed_source("file:///etc/passwd")
+
+
+def test_private_and_link_local_addresses_are_not_public():
+    """测试私有、回环、链路本地地址被识别为非公网地址"""
+    for address in ("10.0.0.5", "172.16.0.1", "192.168.1.1", "127.0.0.1", "169.254.169.254",
+                    "100.64.0.1", "0.0.0.0", "::1", "fe80::1%eth0", "fd00::1", "::ffff:127.0.0.1", "224.0.0.1"):
+        assert not is_public_address(address), address
+    assert is_public_address("93.184.216.34")
+    assert is_public_address("2606:4700::6810:85e5")
+
+
+@pytest.mark.asyncio
+async def test_disallowed_and_private_targets_are_not_downloaded(tmp_path):
+    """测试非交付域名不入队，解析到内网地址的交付域名不下载"""
+    swaps = []
+    origin = FakeOrigin()
+
+    async def private_resolve(host):
+        return ["93.184.216.34", "169.254.169.254"]
+
+    pipeline = make_pipeline(tmp_path, origin, swaps, max_attempts=1, resolve=private_resolve)
+    assert pipeline.submit([
+        ("img-1", "http://169.254.169.254/latest/meta-data/"),
+        ("img-2", "https://internal.example.com/a.png")
+    ]) == 0
+    assert pipeline.get_stats()["rejected"] == 2
+
+    pipeline.submit([("img-3", "https://replicate.delivery/a/out-0.png")])
+    await pipeline.drain()
+    assert origin.requests == 0
+    assert swaps == []
+    assert pipeline.get_stats()["failed"] == 1
+    await pipeline.stop()
+
+
+def test_swap_only_replaces_unchanged_urls(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'swap.db'}")
+    for model in (Image, GenerationTask):
+        model.__table__.create(engine)
+    with Session(engine) as db:
+        db.add(Image(id="img-1", user_id="u1", prompt="p", ai_model="m", image_url="https://old/1.png"))
+        db.add(Image(id="img-2", user_id="u1", prompt="p", ai_model="m", image_url="https://edited/2.png"))
+        db.add(GenerationTask(id="task-1", user_id="u1", prompt="p", ai_model="m", result_url="https://old/1.png"))
+        db.commit()
+
+        first = [db.execute(stmt) for stmt in build_swap_statements(
+            "img-1", "task-1", "https://old/1.png", "https://cdn/1.png",
+            {"thumbnail_url": "https://cdn/1_256w.webp", "variants": {"webp": {"256": "https://cdn/1_256w.webp"}}}
+        )]
+        second = [db.execute(stmt) for stmt in build_swap_statements("img-2", None, "https://old/2.png", "https://cdn/2.png")]
+        db.commit()
+
+        assert first[0].rowcount == 1 and second[0].rowcount == 0
+        assert db.get(Image, "img-1").image_url == "https://cdn/1.png"
+        assert db.get(Image, "img-1").thumbnail_url == "https://cdn/1_256w.webp"
+        assert db.get(Image, "img-2").image_url == "https://edited/2.png"
+        assert db.get(GenerationTask, "task-1").result_url == "https://cdn/1.png"
+    engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_thumbnail_and_variants_are_stored_next_to_original(tmp_path):
+    updates = []
+
+    async def swap(image_id, task_id, source_url, durable_url, values):
+        updates.append(values)
+        return True
+
+    renderer = VariantRenderer(processes=1, widths=[256, 512, 2048], formats=["webp"], quality=80, thumbnail_width=256)
+    pipeline = ImageIngestionPipeline(
+        backend=LocalStorageBackend(str(tmp_path / "storage"), "https://cdn.test/storage"),
+        client=httpx.AsyncClient(transport=httpx.MockTransport(FakeOrigin())),
+        swap=swap,
+        resolve=public_resolve,
+        renderer=renderer,
+        workers=1
+    )
+
+    pipeline.submit([("img-1", "https://replicate.delivery/a/out-0.png")])
+    await pipeline.drain()
+
+    digest = hashlib.sha256(PNG).hexdigest()
+    values = updates[0]
+    # 2048超过原图宽度，不放大
+    assert sorted(values["variants"]["webp"]) == ["256", "512"]
+    assert values["thumbnail_url"] == values["variants"]["webp"]["256"]
+    assert values["thumbnail_url"].endswith(f"/{digest}_256w.webp")
+
+    thumbnail = tmp_path / "storage" / values["thumbnail_url"].removeprefix("https://cdn.test/storage/")
+    with PILImage.open(thumbnail) as image:
+        assert image.format == "WEBP"
+        assert image.size == (256, 192)
+    assert thumbnail.stat().st_size * 10 < len(PNG)
+    await pipeline.stop()
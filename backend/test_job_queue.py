@@ -0,0 +1,131 @@
+"""
+生成任务队列测试
+使用SQLite内存后端验证去重、重试、可见性超时和领取令牌
+"""
+
+import asyncio
+import uuid
+
+import pytest
+
+from app.services.job_queue import GenerationJobQueue, SQLiteJobQueueBackend
+
+
+def _create_queue() -> GenerationJobQueue:
+    queue = GenerationJobQueue(backend=SQLiteJobQueueBackend(":memory:"))
+    queue.retry_base_delay = 0
+    queue.max_attempts = 3
+    return queue
+
+@pytest.mark.asyncio
+async def test_enqueue_is_idempotent_per_task_id():
+    """测试同一task_id只入队一次"""
+    queue = _create_queue()
+    
+    assert await queue.enqueue("task-1", "generation", {"prompt": "a cat"})
+    assert not await queue.enqueue("task-1", "generation", {"prompt": "a cat"})
+    
+    stats = await queue.get_stats()
+    assert stats["ready"] == 1
+    assert stats["duplicates"] == 1
+
+@pytest.mark.asyncio
+async def test_failed_job_is_retried_until_success():
+    """测试失败任务会重试，最终尝试标记正确"""
+    queue = _create_queue()
+    calls = []
+    
+    async def handler(task_id, payload, final_attempt):
+        calls.append(final_attempt)
+        if len(calls) < 2:
+            raise RuntimeError("temporary failure")
+    
+    queue.register_handler("generation", handler)
+    await queue.enqueue("task-2", "generation", {})
+    
+    assert await queue.process_next()
+    assert await queue.process_next()
+    assert not await queue.process_next()
+    
+    assert calls == [False, False]
+    assert queue.stats["retried"] == 1
+    assert queue.stats["succeeded"] == 1
+
+@pytest.mark.asyncio
+async def test_expired_reservation_is_redelivered():
+    """测试可见性超时后任务重新投递"""
+    queue = _create_queue()
+    queue.visibility_timeout = 0
+    
+    await queue.enqueue("task-3", "generation", {})
+    job = await queue.backend.reserve(queue.visibility_timeout)
+    assert job["attempts"] == 1
+    
+    await asyncio.sleep(0.01)
+    assert await queue.backend.requeue_expired() == 1
+    
+    job = await queue.backend.reserve(60)
+    assert job["id"] == "task-3"
+    assert job["attempts"] == 2
+
+async def _assert_stale_reservation_is_rejected(backend):
+    await backend.enqueue("task-4", {"kind": "generation", "payload": {}}, 0)
+    stale = await backend.reserve(0)
+    
+    await asyncio.sleep(0.01)
+    assert await backend.requeue_expired() == 1
+    fresh = await backend.reserve(60)
+    assert fresh["token"] != stale["token"]
+    
+    # 原worker的领取已失效，不能确认或重新入队其他worker持有的任务
+    assert not await backend.retry("task-4", stale["token"], 0)
+    assert not await backend.ack("task-4", stale["token"])
+    assert await backend.stats() == {"ready": 0, "in_flight": 1}
+    
+    assert await backend.ack("task-4", fresh["token"])
+    assert await backend.stats() == {"ready": 0, "in_flight": 0}
+
+@pytest.mark.asyncio
+async def test_stale_reservation_cannot_ack_or_retry():
+    """测试可见性超时后原领取令牌失效"""
+    await _assert_stale_reservation_is_rejected(SQLiteJobQueueBackend(":memory:"))
+
+@pytest.mark.asyncio
+async def test_redis_stale_reservation_cannot_ack_or_retry():
+    """测试Redis脚本校验领取令牌（需要可访问的Redis）"""
+    from app.core.config import settings
+    from app.services.job_queue import RedisJobQueueBackend
+    
+    backend = RedisJobQueueBackend(settings.REDIS_URL, prefix=f"test:jobs:{uuid.uuid4().hex}")
+    try:
+        await backend.redis.ping()
+    except Exception:
+        await backend.close()
+        pytest.skip("Redis不可用")
+    
+    try:
+        await _assert_stale_reservation_is_rejected(backend)
+    finally:
+        await backend.redis.delete(*backend._keys)
+        await backend.close()
+
+@pytest.mark.asyncio
+async def test_slow_worker_result_is_ignored_after_redelivery():
+    """测试超时的worker完成后不会确认已被重新领取的任务"""
+    queue = _create_queue()
+    queue.visibility_timeout = 0
+    
+    async def slow_handler(task_id, payload, final_attempt):
+        await asyncio.sleep(0.01)
+        # 处理期间任务超时，被其他worker重新领取
+        assert await queue.backend.requeue_expired() == 1
+        assert await queue.backend.reserve(60) is not None
+    
+    queue.register_handler("generation", slow_handler)
+    await queue.enqueue("task-5", "generation", {})
+    
+    assert await queue.process_next()
+    
+    assert queue.stats["succeeded"] == 0
+    assert queue.stats["lost_reservations"] == 1
+    assert (await queue.backend.stats())["in_flight"] == 1
@@ -0,0 +1,50 @@
+"""
+运行指标端点测试
+"""
+
+from app.core.config import settings
+
+# 导入主应用会创建数据库引擎（不会建立连接）
+if not settings.POSTGRES_URL_NON_POOLING:
+    settings.POSTGRES_URL_NON_POOLING = "sqlite://"
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.core.auth import get_current_user
+from main import app
+
+
+@pytest.fixture
+def client():
+    # 不进入上下文管理器，不触发lifespan启动逻辑
+    yield TestClient(app, base_url="http://localhost")
+    app.dependency_overrides.clear()
+
+def _login_as(is_admin: bool):
+    app.dependency_overrides[get_current_user] = lambda: {"id": "user-1", "is_admin": is_admin}
+
+def test_metrics_requires_credentials(client):
+    """测试未认证请求不能读取运行指标"""
+    response = client.get("/metrics")
+    
+    assert response.status_code in (401, 403)
+    assert "database" not in response.json()
+
+def test_metrics_rejects_non_admin(client):
+    """测试普通用户不能读取运行指标"""
+    _login_as(is_admin=False)
+    
+    response = client.get("/metrics")
+    
+    assert response.status_code == 403
+    assert "storage" not in response.json()
+
+def test_metrics_available_to_admin(client):
+    """测试管理员可以读取运行指标"""
+    _login_as(is_admin=True)
+    
+    response = client.get("/metrics")
+    
+    assert response.status_code == 200
+    assert "database" in response.json()
@@ -0,0 +1,140 @@
+"""
+模型目录缓存测试
+"""
+
+import json
+
+import pytest
+
+from app.config.replicate import replicate_config
+from app.core.config import settings
+from app.services.model_registry import CATALOG_ALL, CATALOG_REPLICATE, ModelRegistry
+from app.services.replicate_service import replicate_service
+from app.services.siliconflow_service import siliconflow_service
+
+
+class FakeRequest:
+    def __init__(self, if_none_match: str = None):
+        self.headers = {"if-none-match": if_none_match} if if_none_match else {}
+
+
+def test_catalog_merges_services_and_config():
+    registry = ModelRegistry()
+    registry.load()
+
+    flux = registry.get("replicate-flux-schnell")
+    assert flux["provider"] == "replicate"
+    assert flux["version"] == replicate_config.available_models["flux-schnell"]["version"]
+    assert registry.list("siliconflow")
+    assert registry.get("unknown") is None
+
+    body = json.loads(registry.catalog_response(FakeRequest(), CATALOG_ALL).body)
+    assert body["total"] == len(registry.list())
+    replicate = json.loads(registry.catalog_response(FakeRequest(), CATALOG_REPLICATE).body)
+    assert replicate["provider"] == "replicate"
+    assert {model["id"] for model in replicate["models"]} == {model["id"] for model in registry.list("replicate")}
+
+
+def test_etag_is_stable_and_revalidates_with_304():
+    registry = ModelRegistry()
+    first = registry.catalog_response(FakeRequest(), CATALOG_ALL)
+    etag = first.headers["etag"]
+    assert first.headers["cache-control"] == settings.MODEL_CATALOG_CACHE_CONTROL
+
+    # 内容不变时重新加载ETag不变
+    registry.load()
+    assert registry.catalog_response(FakeRequest(), CATALOG_ALL).headers["etag"] == etag
+
+    cached = registry.catalog_response(FakeRequest(f'W/{etag}, "other"'), CATALOG_ALL)
+    assert cached.status_code == 304
+    assert cached.body == b""
+    assert cached.headers["etag"] == etag
+
+    model = registry.model_response(FakeRequest(), "replicate-sdxl")
+    assert json.loads(model.body)["id"] == "replicate-sdxl"
+    assert registry.model_response(FakeRequest(model.headers["etag"]), "replicate-sdxl").status_code == 304
+    assert registry.model_response(FakeRequest(), "unknown") is None
+    # Replicate接口只返回Replicate模型
+    siliconflow_id = registry.list("siliconflow")[0]["id"]
+    assert registry.model_response(FakeRequest(), siliconflow_id, provider="replicate") is None
+    assert registry.model_response(FakeRequest(model.headers["etag"]), "replicate-sdxl", provider="replicate").status_code == 304
+
+    stats = registry.get_stats()
+    assert stats["served"] == 3 and stats["not_modified"] == 3
+
+
+@pytest.mark.asyncio
+async def test_refresh_marks_unavailable_models_and_changes_etag(monkeypatch):
+    registry = ModelRegistry()
+    registry.load()
+    etag = registry.catalog_response(FakeRequest(), CATALOG_ALL).headers["etag"]
+    models = registry.list("siliconflow")
+
+    async def get_models():
+        return [{"id": models[0]["id"]}]
+
+    monkeypatch.setattr(settings, "SILICONFLOW_API_KEY", "test-key")
+    monkeypatch.setattr(settings, "REPLICATE_API_TOKEN", "")
+    monkeypatch.setattr(siliconflow_service, "get_models", get_models)
+    await registry.refresh()
+
+    assert registry.get(models[0]["id"])["available"]
+    assert all(not registry.get(model["id"])["available"] for model in models[1:])
+    assert registry.catalog_response(FakeRequest(etag), CATALOG_ALL).status_code == 200
+    assert registry.get_stats()["refreshes"] == 1
+
+
+@pytest.mark.asyncio
+async def test_refresh_keeps_the_version_used_for_generation(monkeypatch):
+    """测试刷新只记录最新版本，目录中的version仍是生成实际使用的版本"""
+    registry = ModelRegistry()
+    registry.load()
+    configured = registry.get("replicate-sdxl")["version"]
+    name = configured.split(":")[0]
+
+    async def get_model(model_name):
+        return {"latest_version": {"id": "newer"}}
+
+    monkeypatch.setattr(settings, "SILICONFLOW_API_KEY", "")
+    monkeypatch.setattr(settings, "REPLICATE_API_TOKEN", "test-token")
+    monkeypatch.setattr(replicate_service, "get_model", get_model)
+    await registry.refresh()
+
+    model = registry.get("replicate-sdxl")
+    assert model["version"] == configured
+    assert model["latest_version"] == f"{name}:newer"
+    body = json.loads(registry.catalog_response(FakeRequest(), CATALOG_REPLICATE).body)
+    assert {m["id"]: m["version"] for m in body["models"]}["replicate-sdxl"] == configured
+
+
+@pytest.mark.asyncio
+async def test_refresh_maps_live_ids_and_survives_lookup_errors(monkeypatch):
+    """测试SiliconFlow发布的ID按对应表不区分大小写匹配，单个模型查询失败不影响其余模型"""
+    registry = ModelRegistry()
+    registry.load()
+    replicate_names = [m["version"].split(":")[0] for m in registry.list("replicate") if "/" in (m["version"] or "")]
+    failing = replicate_names[0]
+
+    async def get_models():
+        return [{"id": "black-forest-labs/FLUX.1-schnell"}, {"id": "StabilityAI/Stable-Diffusion-XL-Base-1.0"}]
+
+    async def get_model(name):
+        if name == failing:
+            raise RuntimeError("timeout")
+        return {"latest_version": {"id": "newer"}}
+
+    monkeypatch.setattr(settings, "SILICONFLOW_API_KEY", "test-key")
+    monkeypatch.setattr(settings, "REPLICATE_API_TOKEN", "test-token")
+    monkeypatch.setattr(siliconflow_service, "get_models", get_models)
+    monkeypatch.setattr(replicate_service, "get_model", get_model)
+    await registry.refresh()
+
+    assert registry.get("black-forest-labs/flux-schnell")["available"]
+    assert registry.get("stabilityai/stable-diffusion-xl-base-1.0")["available"]
+    assert not registry.get("stabilityai/stable-diffusion-2-1")["available"]
+
+    latest = {m["version"].split(":")[0]: m["latest_version"] for m in registry.list("replicate") if "/" in (m["version"] or "")}
+    assert len(latest) > 1 and latest[failing] is None
+    assert all(value == f"{name}:newer" for name, value in latest.items() if name != failing)
+    stats = registry.get_stats()
+    assert stats["refreshes"] == 1 and stats["refresh_errors"] == len([n for n in replicate_names if n == failing])
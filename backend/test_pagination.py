@@ -0,0 +1,75 @@
+"""
+键集分页测试
+"""
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import Boolean, Column, DateTime, String, create_engine, select
+from sqlalchemy.orm import Session, declarative_base
+
+from app.core.pagination import (
+    CountCache, InvalidCursorError, apply_keyset, decode_cursor, encode_cursor, split_page
+)
+Base = declarative_base()
+
+
+class Image(Base):
+    """与images表排序列一致的最小模型"""
+    __tablename__ = "images"
+
+    id = Column(String, primary_key=True)
+    is_public = Column(Boolean, nullable=False)
+    created_at = Column(DateTime, nullable=False)
+
+
+def test_cursor_round_trip_and_rejects_garbage():
+    """测试游标编解码以及无效游标"""
+    created_at = datetime(2024, 5, 1, 12, 30, 15, 123456, tzinfo=timezone.utc)
+    cursor = encode_cursor(created_at, "image-1")
+    assert decode_cursor(cursor) == (created_at, "image-1")
+
+    with pytest.raises(InvalidCursorError):
+        decode_cursor("not-a-cursor")
+
+
+def test_keyset_pages_cover_all_rows_with_tied_timestamps(tmp_path):
+    """测试相同created_at的记录按id稳定翻页，不重复不遗漏"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'pagination.db'}")
+    Image.__table__.create(engine)
+    base = datetime(2024, 1, 1)
+    with Session(engine) as db:
+        for i in range(7):
+            db.add(Image(id=f"img-{i}", is_public=True, created_at=base + timedelta(minutes=i // 3)))
+        db.commit()
+
+        seen, cursor = [], None
+        stmt = select(Image).where(Image.is_public == True)
+        while True:
+            rows = db.execute(apply_keyset(stmt, Image.created_at, Image.id, cursor, size=3)).scalars().all()
+            page, cursor = split_page(rows, 3)
+            seen.extend(img.id for img in page)
+            if cursor is None:
+                break
+
+    assert seen == ["img-6", "img-5", "img-4", "img-3", "img-2", "img-1", "img-0"]
+    engine.dispose()
+
+
+def test_count_cache_expires_and_evicts(monkeypatch):
+    """测试计数缓存过期与容量淘汰"""
+    from app.core import pagination
+
+    now = [100.0]
+    monkeypatch.setattr(pagination.time, "monotonic", lambda: now[0])
+    cache = CountCache(ttl=10, max_entries=2)
+
+    cache.set("a", 5)
+    assert cache.get("a") == 5
+    now[0] += 11
+    assert cache.get("a") is None
+
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.set("c", 3)
+    assert cache.get("a") is None and cache.get("c") == 3
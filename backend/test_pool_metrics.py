@@ -0,0 +1,53 @@
+"""
+数据库连接池指标测试
+"""
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+from app.core.pool_metrics import InstrumentedQueuePool, instrument_engine
+
+
+def test_pool_metrics_track_checkouts_overflow_and_timeouts(tmp_path):
+    """测试借出、溢出与等待超时被记录"""
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'pool.db'}",
+        poolclass=InstrumentedQueuePool,
+        pool_size=1,
+        max_overflow=1,
+        pool_timeout=0.05
+    )
+    metrics = instrument_engine(engine, "test")
+
+    first = engine.connect()
+    second = engine.connect()
+    first.execute(text("SELECT 1"))
+
+    stats = metrics.get_stats()
+    assert stats["checked_out"] == 2
+    assert stats["overflow"] == 1
+    assert stats["max_checked_out"] == 2
+
+    with pytest.raises(PoolTimeoutError):
+        engine.connect()
+
+    first.close()
+    second.close()
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+
+    stats = metrics.get_stats()
+    assert stats["checked_out"] == 0
+    assert stats["checkouts"] == 3
+    assert stats["checkins"] == 3
+    assert stats["waits"] == 1 and stats["timeouts"] == 1
+    assert stats["wait_time"]["max_ms"] >= 50
+    assert stats["checkout_latency"]["p95_ms"] >= stats["checkout_latency"]["p50_ms"]
+
+    # dispose后重建的连接池继续上报到同一指标
+    engine.dispose()
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+    assert metrics.get_stats()["checkouts"] == 4
+    engine.dispose()
@@ -0,0 +1,78 @@
+"""
+认证主体缓存测试
+"""
+
+import time
+import pytest
+
+from app.core.config import settings
+from app.services.principal_cache import PrincipalCache, MemoryPrincipalBackend
+
+
+@pytest.mark.asyncio
+async def test_principal_cache_hit_and_user_invalidation():
+    """测试命中缓存以及按用户失效其所有令牌"""
+    cache = PrincipalCache(backend=MemoryPrincipalBackend(max_entries=100))
+    principal = {"id": "user-1", "email": "a@example.com", "is_admin": False}
+
+    assert await cache.get("token-a") is None
+    await cache.set("token-a", principal)
+    await cache.set("token-b", principal)
+    await cache.set("token-c", {"id": "user-2"})
+
+    assert await cache.get("token-a") == principal
+    await cache.invalidate_user("user-1")
+    assert await cache.get("token-a") is None
+    assert await cache.get("token-b") is None
+    assert await cache.get("token-c") == {"id": "user-2"}
+
+    stats = cache.get_stats()
+    assert stats["invalidations"] == 2
+    assert stats["hits"] == 2 and stats["misses"] == 3
+
+
+@pytest.mark.asyncio
+async def test_principal_cache_ttl_bounded_by_token_expiry():
+    """测试缓存时间不超过令牌过期时间"""
+    cache = PrincipalCache(backend=MemoryPrincipalBackend(max_entries=100))
+
+    await cache.set("expired", {"id": "user-1"}, expires_at=time.time() - 1)
+    assert await cache.get("expired") is None
+
+    await cache.set("short", {"id": "user-1"}, expires_at=time.time() + 0.05)
+    assert await cache.get("short") is not None
+    time.sleep(0.06)
+    assert await cache.get("short") is None
+
+
+@pytest.mark.asyncio
+async def test_memory_invalidation_reaches_other_workers_only_after_ttl(monkeypatch):
+    """测试memory后端：其它进程的失效不可见，已缓存的用户最多在AUTH_CACHE_TTL后失效"""
+    monkeypatch.setattr(settings, "AUTH_CACHE_TTL", 0.1)
+    this_worker = PrincipalCache(backend=MemoryPrincipalBackend(max_entries=100))
+    other_worker = PrincipalCache(backend=MemoryPrincipalBackend(max_entries=100))
+    principal = {"id": "user-1", "is_active": True}
+
+    await this_worker.set("token-a", principal)
+    await other_worker.set("token-a", principal)
+    await this_worker.invalidate_user("user-1")
+
+    assert await this_worker.get("token-a") is None
+    assert await other_worker.get("token-a") == principal
+    time.sleep(0.11)
+    assert await other_worker.get("token-a") is None
+
+
+def test_memory_backend_rejected_with_several_workers(monkeypatch):
+    """测试多worker时拒绝memory后端"""
+    monkeypatch.setattr(settings, "AUTH_CACHE_BACKEND", "memory")
+    monkeypatch.setattr(settings, "WEB_CONCURRENCY", 4)
+    with pytest.raises(ValueError):
+        PrincipalCache()
+
+    monkeypatch.setattr(settings, "AUTH_CACHE_BACKEND", "none")
+    assert not PrincipalCache().enabled
+
+    monkeypatch.setattr(settings, "AUTH_CACHE_BACKEND", "memory")
+    monkeypatch.setattr(settings, "WEB_CONCURRENCY", 1)
+    assert PrincipalCache().enabled
@@ -0,0 +1,102 @@
+"""
+提示词搜索测试
+"""
+
+from app.core.config import settings
+
+# 搜索服务依赖图片模型，导入模型会创建数据库引擎（不会建立连接）
+if not settings.POSTGRES_URL_NON_POOLING:
+    settings.POSTGRES_URL_NON_POOLING = "sqlite://"
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql
+
+from app.models.image import Image
+from app.services.prompt_search import InvertedIndex, tokenize, to_tsquery_text
+
+
+def test_tokenize_words_and_cjk_bigrams():
+    """测试拉丁词切分与中文二元组"""
+    assert tokenize("Totoro, in the FOREST!") == ["totoro", "in", "the", "forest"]
+    assert tokenize("龙猫森林") == ["龙猫", "猫森", "森林"]
+    assert tokenize("猫") == ["猫"]
+
+
+def test_inverted_index_ranks_prefix_matches_and_requires_all_terms():
+    """测试前缀匹配、全部词项匹配与排序"""
+    index = InvertedIndex()
+    index.add("a", "totoro in the forest")
+    index.add("b", "totoro totoro")
+    index.add("c", "castle in the sky")
+    index.add("d", "宫崎骏的龙猫")
+
+    assert [doc for doc, _ in index.search("totoro", 10)] == ["b", "a"]
+    assert [doc for doc, _ in index.search("tot fore", 10)] == ["a"]
+    assert [doc for doc, _ in index.search("龙猫", 10)] == ["d"]
+    assert index.search("castle forest", 10) == []
+
+    index.remove("b")
+    assert [doc for doc, _ in index.search("totoro", 10)] == ["a"]
+    assert len(index) == 3
+
+
+def test_tsquery_text_is_sanitized():
+    """测试tsquery文本只包含词项与前缀标记"""
+    assert to_tsquery_text("Spirited  away!") == "spirited:* & away:*"
+    assert to_tsquery_text("a & b | !c:*") == "a:* & b:* & c:*"
+    assert to_tsquery_text("&|!") is None
+
+
+def test_fulltext_expression_matches_index_definition():
+    """测试查询表达式与迁移中的表达式索引一致"""
+    from app.services.prompt_search import TS_CONFIG
+    from sqlalchemy import func
+
+    compiled = str(select(Image.id).where(
+        func.to_tsvector(TS_CONFIG, Image.prompt).op("@@")(func.to_tsquery(TS_CONFIG, "x:*"))
+    ).compile(dialect=postgresql.dialect()))
+    assert "to_tsvector('simple', images.prompt)" in compiled
+
+
+def test_inverted_index_limits_to_candidates():
+    """测试候选集合在截取前N个之前生效"""
+    index = InvertedIndex()
+    index.add("a", "totoro totoro")
+    index.add("b", "totoro in the forest")
+    index.add("c", "totoro")
+
+    assert [doc for doc, _ in index.search("totoro", 1)] == ["a"]
+    assert [doc for doc, _ in index.search("totoro", 1, candidates={"b"})] == ["b"]
+    assert index.search("totoro", 10, candidates=set()) == []
+
+
+@pytest.mark.asyncio
+async def test_fallback_apply_filters_before_limit(tmp_path, monkeypatch):
+    """测试SQLite回退搜索：其他用户的高分匹配不会挤掉当前用户的结果"""
+    from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+    from app.services.prompt_search import PromptSearch
+
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'search.db'}")
+    async with engine.begin() as conn:
+        await conn.run_sync(Image.__table__.create)
+
+    monkeypatch.setattr(settings, "SEARCH_FALLBACK_MAX_RESULTS", 2)
+    search = PromptSearch()
+    async with AsyncSession(engine) as db:
+        # 其他用户的图片得分更高，数量超过前N个的上限
+        for i in range(3):
+            db.add(Image(id=f"other-{i}", user_id="u2", prompt="totoro totoro", ai_model="m", image_url="x"))
+        db.add(Image(id="mine", user_id="u1", prompt="totoro in the forest", ai_model="m", image_url="x"))
+        db.add(Image(id="mine-private-cat", user_id="u1", prompt="a cat", ai_model="m", image_url="x"))
+        await db.commit()
+
+        stmt, rank = await search.apply(db, select(Image).where(Image.user_id == "u1"), "totoro")
+        rows = (await db.execute(stmt.add_columns(rank).order_by(rank.desc()))).all()
+        assert [(image.id, score > 0) for image, score in rows] == [("mine", True)]
+
+        stmt, _ = await search.apply(db, select(Image).where(Image.user_id == "u1"), "castle")
+        assert (await db.execute(stmt)).all() == []
+
+    assert search.get_stats()["fallback_queries"] == 2
+    await engine.dispose()
@@ -0,0 +1,101 @@
+"""
+每日配额账本测试
+"""
+
+import asyncio
+import pytest
+from types import SimpleNamespace
+from datetime import datetime
+
+from app.core.config import settings
+from app.services.quota_ledger import (
+    QuotaLedger, MemoryQuotaBackend, QuotaExceededError, QuotaUnavailableError,
+    get_daily_limit, SCOPE_GENERATION, SCOPE_REPLICATE
+)
+
+
+@pytest.mark.asyncio
+async def test_concurrent_reservations_never_exceed_limit():
+    """测试并发提交时预占不会超过每日限额"""
+    ledger = QuotaLedger(backend=MemoryQuotaBackend())
+
+    results = await asyncio.gather(
+        *(ledger.reserve("user-1", SCOPE_REPLICATE, limit=3) for _ in range(5)),
+        return_exceptions=True
+    )
+
+    assert sum(1 for r in results if isinstance(r, str)) == 3
+    assert sum(1 for r in results if isinstance(r, QuotaExceededError)) == 2
+    assert await ledger.usage("user-1", SCOPE_REPLICATE) == 3
+    # 不同范围、不同用户互不影响
+    assert await ledger.usage("user-1", SCOPE_GENERATION) == 0
+    await ledger.reserve("user-2", SCOPE_REPLICATE, limit=3)
+
+
+@pytest.mark.asyncio
+async def test_failed_task_releases_quota():
+    """测试任务失败时按任务创建日期和模型归还配额"""
+    ledger = QuotaLedger(backend=MemoryQuotaBackend())
+    await ledger.reserve("user-1", SCOPE_REPLICATE, limit=1)
+
+    with pytest.raises(QuotaExceededError):
+        await ledger.reserve("user-1", SCOPE_REPLICATE, limit=1)
+
+    task = SimpleNamespace(user_id="user-1", ai_model="replicate-flux", created_at=datetime.now())
+    await ledger.release_task(task)
+    await ledger.release_task(task)
+    assert await ledger.usage("user-1", SCOPE_REPLICATE) == 0
+    await ledger.reserve("user-1", SCOPE_REPLICATE, limit=1)
+
+
+def test_daily_limits_come_from_settings(monkeypatch):
+    """测试等级限额来自配置，未知等级按免费用户处理"""
+    monkeypatch.setattr(settings, "REPLICATE_DAILY_LIMITS", {"free": 2, "pro": 20})
+    assert get_daily_limit(SCOPE_REPLICATE, "pro") == 20
+    assert get_daily_limit(SCOPE_REPLICATE, "unknown") == 2
+    assert get_daily_limit(SCOPE_GENERATION, "premium") == settings.GENERATION_DAILY_LIMITS["premium"]
+
+
+class FailingQuotaBackend:
+    """模拟Redis不可用"""
+
+    async def reserve(self, key, day, limit, amount):
+        raise ConnectionError("redis down")
+
+    async def release(self, key, day, amount):
+        raise ConnectionError("redis down")
+
+    async def usage(self, key, day):
+        raise ConnectionError("redis down")
+
+
+@pytest.mark.asyncio
+async def test_backend_failure_denies_reservations_by_default(monkeypatch, caplog):
+    """测试后端故障时默认拒绝预占（各进程不再各自计数），归还失败不抛出"""
+    monkeypatch.setattr(settings, "QUOTA_BACKEND_FALLBACK", "deny")
+    ledger = QuotaLedger(backend=FailingQuotaBackend())
+
+    with caplog.at_level("ERROR"):
+        with pytest.raises(QuotaUnavailableError):
+            await ledger.reserve("user-1", SCOPE_REPLICATE, limit=3)
+    assert any(record.levelname == "ERROR" for record in caplog.records)
+
+    await ledger.release("user-1", SCOPE_REPLICATE)
+    stats = ledger.get_stats()
+    assert stats["backend_errors"] == 2 and stats["fallbacks"] == 0
+    assert stats["reserved"] == 0 and stats["released"] == 0
+    assert stats["fallback"] == "deny"
+
+
+@pytest.mark.asyncio
+async def test_backend_failure_can_fall_back_to_process_counters(monkeypatch):
+    """测试配置为memory时退回进程内计数并计入统计"""
+    monkeypatch.setattr(settings, "QUOTA_BACKEND_FALLBACK", "memory")
+    ledger = QuotaLedger(backend=FailingQuotaBackend())
+
+    await ledger.reserve("user-1", SCOPE_REPLICATE, limit=1)
+    with pytest.raises(QuotaExceededError):
+        await ledger.reserve("user-1", SCOPE_REPLICATE, limit=1)
+
+    stats = ledger.get_stats()
+    assert stats["fallbacks"] == 2 and stats["backend_errors"] == 2
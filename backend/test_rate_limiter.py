@@ -0,0 +1,53 @@
+"""
+速率限制测试
+"""
+
+import pytest
+
+from app.services import rate_limiter as rl
+from app.services.rate_limiter import MemoryRateLimitBackend, RateLimiter
+
+
+@pytest.mark.asyncio
+async def test_gcra_allows_burst_then_rejects(monkeypatch):
+    """测试GCRA允许limit次突发，之后按发射间隔恢复"""
+    now = [1000.0]
+    monkeypatch.setattr(rl.time, "time", lambda: now[0])
+    limiter = RateLimiter(backend=MemoryRateLimitBackend())
+
+    results = [await limiter.check("user-1", limit=3, window=30) for _ in range(3)]
+    assert all(r.allowed for r in results)
+    assert [r.remaining for r in results] == [2, 1, 0]
+
+    rejected = await limiter.check("user-1", limit=3, window=30)
+    assert not rejected.allowed
+    assert rejected.retry_after == pytest.approx(10.0)
+    assert rejected.headers()["Retry-After"] == "10"
+    assert rejected.headers()["RateLimit-Policy"] == "3;w=30"
+
+    # 其他用户不受影响
+    assert (await limiter.check("user-2", limit=3, window=30)).allowed
+
+    now[0] += 10
+    assert (await limiter.check("user-1", limit=3, window=30)).allowed
+    assert limiter.stats == {"allowed": 5, "rejected": 1, "backend_errors": 0}
+
+
+@pytest.mark.asyncio
+async def test_memory_backend_evicts_expired_keys_with_timer_wheel(monkeypatch):
+    """测试时间轮只淘汰已过期的键"""
+    now = [1000.0]
+    monkeypatch.setattr(rl.time, "time", lambda: now[0])
+    backend = MemoryRateLimitBackend()
+
+    await backend.check("short", limit=10, window=10)
+    await backend.check("long", limit=1, window=100)
+    assert backend.size() == 2
+
+    now[0] += 5
+    await backend.check("other", limit=10, window=10)
+    assert backend.size() == 2
+
+    now[0] += 100
+    await backend.check("other", limit=10, window=10)
+    assert backend.size() == 1
@@ -276,6 +276,662 @@ async def test_replicate_model_info():
     except ReplicateError as e:
         pytest.fail(f"获取模型信息失败: {e}")
 
+@pytest.mark.asyncio
+async def test_replicate_webhook_resolves_waiter():
+    """测试webhook回调直接唤醒等待中的预测"""
+    from app.services.prediction_registry import prediction_registry
+    
+    prediction_id = "webhook-test-prediction"
+    prediction_registry.register(prediction_id)
+    
+    async def deliver_webhook():
+        await asyncio.sleep(0.01)
+        assert prediction_registry.resolve(prediction_id, {
+            "id": prediction_id,
+            "status": "succeeded",
+            "output": ["https://example.com/image.png"]
+        })
+    
+    asyncio.create_task(deliver_webhook())
+    prediction = await replicate_service.wait_for_prediction(prediction_id, max_wait_time=5)
+    
+    assert prediction["output"] == ["https://example.com/image.png"]
+    assert not prediction_registry.is_registered(prediction_id)
+
+def _sign_webhook(secret_key: bytes, body: bytes, webhook_id: str = "msg_1", timestamp: int = None):
+    """按Replicate的方式签名webhook"""
+    import base64
+    import hashlib
+    import hmac
+    import time
+    
+    timestamp = str(int(time.time()) if timestamp is None else timestamp)
+    digest = hmac.new(secret_key, f"{webhook_id}.{timestamp}.".encode() + body, hashlib.sha256).digest()
+    return {
+        "webhook-id": webhook_id,
+        "webhook-timestamp": timestamp,
+        "webhook-signature": f"v1,{base64.b64encode(digest).decode()}"
+    }
+
+@pytest.mark.asyncio
+async def test_webhook_signature_verification():
+    """测试webhook签名校验（篡改、过期、缺失均拒绝）"""
+    import base64
+    
+    secret = "whsec_" + base64.b64encode(b"test-signing-key").decode()
+    body = b'{"id": "p1", "status": "succeeded"}'
+    headers = _sign_webhook(b"test-signing-key", body)
+    
+    async def verify(payload, signature, webhook_id="msg_1", timestamp=headers["webhook-timestamp"]):
+        return await replicate_service.verify_webhook_signature(payload, signature, secret, webhook_id, timestamp)
+    
+    assert await verify(body, headers["webhook-signature"])
+    assert await verify(body, "v1,bogus " + headers["webhook-signature"])
+    assert not await verify(body + b" ", headers["webhook-signature"])
+    assert not await verify(body, headers["webhook-signature"], webhook_id="msg_2")
+    assert not await verify(body, None)
+    
+    stale = _sign_webhook(b"test-signing-key", body, timestamp=1)
+    assert not await verify(body, stale["webhook-signature"], timestamp=stale["webhook-timestamp"])
+
+def test_webhook_route_rejects_unsigned_requests(monkeypatch):
+    """测试未签名的webhook被拒绝，其它进程等待的同步预测返回2xx"""
+    import base64
+    import json
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    
+    if not settings.POSTGRES_URL_NON_POOLING:
+        monkeypatch.setattr(settings, "POSTGRES_URL_NON_POOLING", "sqlite://")
+    from app.api.replicate_api import webhook_router
+    from app.core.database import get_db
+    from app.services.prediction_registry import prediction_registry
+    
+    monkeypatch.setattr(settings, "REPLICATE_WEBHOOK_SECRET", "whsec_" + base64.b64encode(b"route-key").decode())
+    app = FastAPI()
+    app.include_router(webhook_router, prefix="/api/webhooks/replicate")
+    app.dependency_overrides[get_db] = lambda: None
+    client = TestClient(app)
+    
+    body = json.dumps({"id": "remote-prediction", "status": "succeeded", "output": ["https://evil.test/a.png"]}).encode()
+    assert client.post("/api/webhooks/replicate/sync", content=body).status_code == 401
+    assert client.post(
+        "/api/webhooks/replicate/sync",
+        content=body,
+        headers=_sign_webhook(b"wrong-key", body)
+    ).status_code == 401
+    
+    response = client.post("/api/webhooks/replicate/sync", content=body, headers=_sign_webhook(b"route-key", body))
+    assert response.status_code == 200
+    assert response.json() == {"status": "ignored"}
+    prediction_registry._early_results.pop("remote-prediction", None)
+
+def test_webhook_updates_task_through_async_session(monkeypatch, tmp_path):
+    """测试webhook在AsyncSession上完成任务：保存图片、更新用户统计，重复投递被忽略"""
+    import base64
+    import json
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from sqlalchemy import create_engine
+    from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+    
+    if not settings.POSTGRES_URL_NON_POOLING:
+        monkeypatch.setattr(settings, "POSTGRES_URL_NON_POOLING", "sqlite://")
+    import app.api.replicate_api as replicate_api
+    from app.core.database import get_async_db
+    from app.models.generation_task import GenerationTask
+    from app.models.image import Image
+    from app.models.user import User
+    
+    path = tmp_path / "webhook.db"
+    engine = create_engine(f"sqlite:///{path}")
+    for model in (GenerationTask, Image, User):
+        model.__table__.create(engine)
+    with Session(engine) as session:
+        session.add(User(id="u1", email="u1@example.com"))
+        session.add(GenerationTask(id="t1", user_id="u1", prompt="p", ai_model="replicate-flux", status="processing"))
+        session.add(GenerationTask(id="t2", user_id="u1", prompt="p", ai_model="replicate-flux", status="processing"))
+        session.commit()
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    
+    async def get_test_db():
+        async with AsyncSession(async_engine, expire_on_commit=False) as db:
+            yield db
+    
+    released, submitted = [], []
+    
+    async def release_task(task):
+        released.append(task.id)
+    
+    monkeypatch.setattr(settings, "REPLICATE_WEBHOOK_SECRET", "whsec_" + base64.b64encode(b"route-key").decode())
+    monkeypatch.setattr(replicate_api.quota_ledger, "release_task", release_task)
+    monkeypatch.setattr(replicate_api.image_ingestion, "submit", lambda images, **kwargs: submitted.extend(images))
+    app = FastAPI()
+    app.include_router(replicate_api.webhook_router, prefix="/api/webhooks/replicate")
+    app.dependency_overrides[get_async_db] = get_test_db
+    client = TestClient(app)
+    
+    def deliver(task_id, payload):
+        body = json.dumps(payload).encode()
+        return client.post(f"/api/webhooks/replicate/{task_id}", content=body, headers=_sign_webhook(b"route-key", body))
+    
+    succeeded = {"id": "p1", "status": "succeeded", "output": ["https://replicate.delivery/a.png"]}
+    assert deliver("t1", succeeded).json() == {"status": "processed"}
+    assert deliver("t1", succeeded).json() == {"status": "ignored"}
+    assert deliver("t2", {"id": "p2", "status": "failed", "error": "nsfw"}).json() == {"status": "processed"}
+    assert deliver("missing", succeeded).status_code == 404
+    
+    with Session(engine) as session:
+        assert session.get(GenerationTask, "t1").status == "completed"
+        assert session.get(GenerationTask, "t2").status == "failed"
+        assert session.get(User, "u1").generation_count == 1
+        assert [image.image_url for image in session.query(Image)] == ["https://replicate.delivery/a.png"]
+    assert len(submitted) == 1
+    assert released == ["t2"]
+    engine.dispose()
+
+@pytest.mark.asyncio
+async def test_poller_completes_wait_when_webhook_goes_elsewhere(monkeypatch):
+    """测试webhook投递到其它进程时，轮询调度器仍能及时完成等待"""
+    from app.services.prediction_poller import PredictionPoller
+    from app.services.prediction_registry import prediction_registry
+    
+    monkeypatch.setattr(settings, "REPLICATE_POLL_MIN_INTERVAL", 0.01)
+    monkeypatch.setattr(settings, "REPLICATE_POLL_FIRST_RATIO", 0.0)
+    
+    class FakeService:
+        def get_supported_models(self):
+            return [{"id": "fake-model", "estimated_time": 0}]
+        
+        async def get_prediction(self, prediction_id):
+            return {"id": prediction_id, "status": "succeeded", "output": ["https://example.com/p.png"]}
+        
+        async def list_predictions(self, limit=100):
+            return {"results": []}
+    
+    poller = PredictionPoller(FakeService())
+    monkeypatch.setattr(replicate_service, "poller", poller)
+    before = prediction_registry.get_stats()["resolved_by_polling"]
+    prediction_registry.register("remote-webhook-prediction")
+    try:
+        prediction = await replicate_service.wait_for_prediction(
+            "remote-webhook-prediction", max_wait_time=2, model="fake-model"
+        )
+    finally:
+        await poller.stop()
+    
+    assert prediction["output"] == ["https://example.com/p.png"]
+    assert prediction_registry.get_stats()["resolved_by_polling"] == before + 1
+    assert not prediction_registry.is_registered("remote-webhook-prediction")
+
+@pytest.mark.asyncio
+async def test_prediction_poller_backoff_until_completion(monkeypatch):
+    """测试轮询调度器在预测结束时唤醒等待者"""
+    from app.services.prediction_poller import PredictionPoller
+    
+    monkeypatch.setattr(settings, "REPLICATE_POLL_MIN_INTERVAL", 0.01)
+    monkeypatch.setattr(settings, "REPLICATE_POLL_FIRST_RATIO", 0.0)
+    
+    class FakeService:
+        def __init__(self):
+            self.calls = 0
+        
+        def get_supported_models(self):
+            return [{"id": "fake-model", "estimated_time": 0}]
+        
+        async def get_prediction(self, prediction_id):
+            self.calls += 1
+            status = "succeeded" if self.calls >= 3 else "processing"
+            return {"id": prediction_id, "status": status}
+        
+        async def list_predictions(self, limit=100):
+            return {"results": []}
+    
+    service = FakeService()
+    poller = PredictionPoller(service)
+    try:
+        prediction = await asyncio.wait_for(poller.watch("poll-test", model="fake-model"), timeout=5)
+    finally:
+        await poller.stop()
+    
+    assert prediction["status"] == "succeeded"
+    assert service.calls == 3
+    assert poller.get_stats()["in_flight"] == 0
+
+@pytest.mark.asyncio
+async def test_viewer_disconnect_does_not_cancel_generation_wait(monkeypatch):
+    """测试进度订阅者断开时，同一预测上仍在等待的生成不受影响"""
+    from app.services.prediction_poller import PredictionPoller
+    from app.services.progress_stream import ProgressHub
+    
+    monkeypatch.setattr(settings, "PROGRESS_PUBSUB_BACKEND", "memory")
+    monkeypatch.setattr(settings, "REPLICATE_POLL_MIN_INTERVAL", 0.01)
+    monkeypatch.setattr(settings, "REPLICATE_POLL_MAX_INTERVAL", 0.02)
+    monkeypatch.setattr(settings, "REPLICATE_POLL_FIRST_RATIO", 0.0)
+    
+    class FakeService:
+        finished = False
+        
+        def get_supported_models(self):
+            return [{"id": "fake-model", "estimated_time": 0}]
+        
+        async def get_prediction(self, prediction_id):
+            status = "succeeded" if self.finished else "processing"
+            return {"id": prediction_id, "status": status, "output": ["https://example.com/s.png"]}
+        
+        async def list_predictions(self, limit=100):
+            return {"results": []}
+    
+    service = FakeService()
+    poller = PredictionPoller(service)
+    monkeypatch.setattr(replicate_service, "poller", poller)
+    monkeypatch.setattr(replicate_service, "get_prediction", service.get_prediction)
+    hub = ProgressHub()
+    
+    try:
+        waiter = asyncio.create_task(replicate_service.wait_for_prediction("shared", max_wait_time=5, model="fake-model"))
+        events = hub.subscribe("prediction:shared", prediction_id="shared")
+        assert (await events.__anext__())["type"] == "progress"
+        await asyncio.sleep(0.05)
+        
+        # 最后一个订阅者断开，取消上游跟踪
+        await events.aclose()
+        await asyncio.sleep(0.05)
+        assert not waiter.done()
+        
+        service.finished = True
+        prediction = await asyncio.wait_for(waiter, timeout=5)
+    finally:
+        await poller.stop()
+    
+    assert prediction["status"] == "succeeded"
+    assert poller.get_stats()["in_flight"] == 0
+
+@pytest.mark.asyncio
+async def test_watch_error_ends_subscription_with_error_event(monkeypatch):
+    """测试上游查询预测出错时订阅者收到错误事件并结束，错误不会补发给重连的客户端"""
+    from app.services.progress_stream import ProgressHub
+    
+    monkeypatch.setattr(settings, "PROGRESS_PUBSUB_BACKEND", "memory")
+    
+    async def get_prediction(prediction_id):
+        raise ReplicateError("upstream unavailable")
+    
+    monkeypatch.setattr(replicate_service, "get_prediction", get_prediction)
+    hub = ProgressHub()
+    
+    async def collect():
+        return [event async for event in hub.subscribe("prediction:broken", prediction_id="broken")]
+    
+    events = await asyncio.wait_for(collect(), timeout=5)
+    assert [event["type"] for event in events] == ["error"]
+    assert "upstream unavailable" in events[0]["error"]
+    assert await hub._get_last_event("prediction:broken") is None
+    assert hub.get_stats()["subscribers"] == 0
+
+@pytest.mark.asyncio
+async def test_seeded_generation_served_from_result_cache(monkeypatch):
+    """测试显式seed的重复生成命中结果缓存"""
+    from app.services.result_cache import GenerationResultCache, MemoryCacheBackend
+    import app.services.ai_service_manager as manager_module
+    
+    cache = GenerationResultCache(backend=MemoryCacheBackend(max_entries=10, ttl=60))
+    monkeypatch.setattr(manager_module, "result_cache", cache)
+    monkeypatch.setitem(ai_service_manager.services["replicate"], "health_status", "healthy")
+    
+    calls = []
+    
+    async def fake_generate(**kwargs):
+        calls.append(kwargs)
+        return {"success": True, "images": ["https://example.com/cached.png"]}
+    
+    monkeypatch.setattr(replicate_service, "generate_image_flux_schnell", fake_generate)
+    
+    first = await ai_service_manager.generate_image(TEST_PROMPT, service="replicate", seed=42)
+    second = await ai_service_manager.generate_image(TEST_PROMPT, service="replicate", seed=42)
+    await ai_service_manager.generate_image(TEST_PROMPT, service="replicate")
+    
+    assert len(calls) == 2
+    assert "cache_hit" not in first
+    assert second["cache_hit"] is True
+    assert second["images"] == first["images"]
+    assert cache.stats["hits"] == 1
+
+def test_siliconflow_cache_key_uses_normalized_request():
+    """测试等价的硅基流动请求得到相同缓存键"""
+    from app.services.siliconflow_service import siliconflow_service
+    
+    base = siliconflow_service.get_cache_key({"prompt": TEST_PROMPT, "seed": 42})
+    
+    assert base is not None
+    # 显式传入默认值、字符串形式的数值、空负面提示词和无关字段不影响缓存键
+    assert siliconflow_service.get_cache_key({
+        "prompt": TEST_PROMPT,
+        "seed": "42",
+        "width": "1024",
+        "height": 1024,
+        "steps": 20,
+        "guidance_scale": 7.5,
+        "batch_size": 1,
+        "negative_prompt": "",
+        "model": "stabilityai/stable-diffusion-xl-base-1.0",
+        "style": "ghibli"
+    }) == base
+    assert siliconflow_service.get_cache_key({"prompt": TEST_PROMPT, "seed": 43}) != base
+    assert siliconflow_service.get_cache_key({"prompt": TEST_PROMPT, "seed": 42, "steps": 30}) != base
+    assert siliconflow_service.get_cache_key({"prompt": TEST_PROMPT}) is None
+
+@pytest.mark.asyncio
+async def test_result_cache_hit_does_not_depend_on_routed_provider(monkeypatch):
+    """测试自动路由选择了另一个服务商时仍命中已缓存的结果"""
+    from app.services.ai_service_manager import AIServiceManager
+    from app.services.result_cache import GenerationResultCache, MemoryCacheBackend
+    import app.services.ai_service_manager as manager_module
+    
+    cache = GenerationResultCache(backend=MemoryCacheBackend(max_entries=10, ttl=60))
+    monkeypatch.setattr(manager_module, "result_cache", cache)
+    monkeypatch.setattr(settings, "GENERATION_HEDGING_ENABLED", False)
+    
+    manager = AIServiceManager()
+    for config in manager.services.values():
+        config["health_status"] = "healthy"
+    
+    routed = iter(["siliconflow", "replicate"])
+    calls = []
+    
+    async def fake_select(service=None, model=None):
+        return next(routed)
+    
+    async def fake_call(service_name, prompt, params):
+        calls.append(service_name)
+        return {"success": True, "images": ["https://example.com/routed.png"]}
+    
+    monkeypatch.setattr(manager, "select_best_service", fake_select)
+    monkeypatch.setattr(manager, "_call_service", fake_call)
+    
+    first = await manager.generate_image(TEST_PROMPT, seed=42)
+    second = await manager.generate_image(TEST_PROMPT, seed=42)
+    
+    assert calls == ["siliconflow"]
+    assert first["service_used"] == "siliconflow"
+    assert second["cache_hit"] is True
+    assert second["images"] == first["images"]
+
+@pytest.mark.asyncio
+async def test_concurrent_identical_predictions_are_coalesced(monkeypatch):
+    """测试相同输入的并发请求共享同一个预测"""
+    created = []
+    
+    async def fake_create(model_version, input_data, webhook=None, webhook_events_filter=None):
+        created.append(input_data)
+        await asyncio.sleep(0.05)
+        return {"id": f"prediction-{len(created)}"}
+    
+    async def fake_wait(prediction_id, max_wait_time=300, callback=None, model=None):
+        return {"id": prediction_id, "status": "succeeded", "output": ["https://example.com/a.png"]}
+    
+    monkeypatch.setattr(replicate_service, "create_prediction", fake_create)
+    monkeypatch.setattr(replicate_service, "wait_for_prediction", fake_wait)
+    
+    input_data = {"prompt": TEST_PROMPT, "seed": 7}
+    results = await asyncio.gather(*(
+        replicate_service._run_prediction("test-version", dict(input_data)) for _ in range(3)
+    ))
+    
+    assert len(created) == 1
+    assert all(r["id"] == "prediction-1" for r in results)
+    assert replicate_service.single_flight.stats["coalesced"] >= 2
+
+@pytest.mark.asyncio
+async def test_coalesced_callers_all_receive_progress(monkeypatch):
+    """测试合并的请求都能收到预测进度事件"""
+    from app.services.progress_stream import progress_hub, progress_topic
+    
+    released = asyncio.Event()
+    published = []
+    
+    async def fake_create(model_version, input_data, webhook=None, webhook_events_filter=None):
+        return {"id": "shared-prediction", "status": "starting"}
+    
+    async def fake_wait(prediction_id, max_wait_time=300, callback=None, model=None):
+        await released.wait()
+        callback({"id": prediction_id, "status": "processing", "logs": "50%|█████     | 10/20 ["})
+        return {"id": prediction_id, "status": "succeeded", "output": ["https://replicate.delivery/a.png"]}
+    
+    monkeypatch.setattr(replicate_service, "create_prediction", fake_create)
+    monkeypatch.setattr(replicate_service, "wait_for_prediction", fake_wait)
+    monkeypatch.setattr(progress_hub, "publish_nowait", lambda topic, event: published.append((topic, event["type"])))
+    
+    async def call(topic):
+        progress_topic.set(topic)
+        return await replicate_service._run_prediction("test-version", {"prompt": TEST_PROMPT, "seed": 11})
+    
+    callers = [asyncio.create_task(call(f"task:{i}")) for i in range(3)]
+    await asyncio.sleep(0.01)
+    released.set()
+    await asyncio.gather(*callers)
+    
+    assert {topic for topic, event_type in published if event_type == "progress"} == {"task:0", "task:1", "task:2"}
+
+@pytest.mark.asyncio
+async def test_shared_prediction_cancelled_when_all_callers_leave(monkeypatch):
+    """测试所有合并的调用方都取消时停止共享预测"""
+    cancelled = []
+    
+    async def fake_create(model_version, input_data, webhook=None, webhook_events_filter=None):
+        return {"id": "abandoned-prediction", "status": "starting"}
+    
+    async def fake_wait(prediction_id, max_wait_time=300, callback=None, model=None):
+        await asyncio.sleep(60)
+    
+    async def fake_cancel(prediction_id):
+        cancelled.append(prediction_id)
+        return {"id": prediction_id, "status": "canceled"}
+    
+    monkeypatch.setattr(replicate_service, "create_prediction", fake_create)
+    monkeypatch.setattr(replicate_service, "wait_for_prediction", fake_wait)
+    monkeypatch.setattr(replicate_service, "cancel_prediction", fake_cancel)
+    before = replicate_service.single_flight.stats["cancelled"]
+    
+    callers = [
+        asyncio.create_task(replicate_service._run_prediction("test-version", {"prompt": TEST_PROMPT, "seed": 12}))
+        for _ in range(2)
+    ]
+    await asyncio.sleep(0.01)
+    callers[0].cancel()
+    await asyncio.sleep(0.01)
+    # 仍有调用方等待时继续执行
+    assert cancelled == []
+    
+    callers[1].cancel()
+    await asyncio.gather(*callers, return_exceptions=True)
+    await asyncio.sleep(0.01)
+    
+    assert cancelled == ["abandoned-prediction"]
+    assert replicate_service.single_flight.stats["cancelled"] == before + 1
+    assert replicate_service.single_flight.get_stats()["in_flight"] == 0
+
+@pytest.mark.asyncio
+async def test_redelivered_task_resumes_recorded_prediction(monkeypatch):
+    """测试队列任务使用任务级webhook并记录预测ID，重新投递时续接而不重复创建"""
+    from app.services.replicate_service import TaskPrediction, task_prediction
+    
+    created = []
+    
+    async def fake_create(model_version, input_data, webhook=None, webhook_events_filter=None):
+        created.append(webhook)
+        return {"id": "task-prediction", "status": "starting"}
+    
+    async def fake_get(prediction_id):
+        return {"id": prediction_id, "status": "processing"}
+    
+    async def fake_wait(prediction_id, max_wait_time=300, callback=None, model=None):
+        return {"id": prediction_id, "status": "succeeded", "output": ["https://replicate.delivery/a.png"]}
+    
+    monkeypatch.setattr(settings, "REPLICATE_WEBHOOK_SECRET", "whsec_dGVzdA==")
+    monkeypatch.setattr(replicate_service, "create_prediction", fake_create)
+    monkeypatch.setattr(replicate_service, "get_prediction", fake_get)
+    monkeypatch.setattr(replicate_service, "wait_for_prediction", fake_wait)
+    
+    recorded = []
+    webhook = "https://app.test/api/webhooks/replicate/task-1"
+    token = task_prediction.set(TaskPrediction(webhook=webhook, on_created=recorded.append))
+    try:
+        first = await replicate_service._run_prediction("test-version", {"prompt": TEST_PROMPT, "seed": 1})
+    finally:
+        task_prediction.reset(token)
+    
+    assert created == [webhook]
+    assert recorded == ["task-prediction"]
+    
+    # 重新投递：续接记录的预测
+    token = task_prediction.set(TaskPrediction(webhook=webhook, prediction_id="task-prediction"))
+    try:
+        second = await replicate_service._run_prediction("test-version", {"prompt": TEST_PROMPT, "seed": 1})
+    finally:
+        task_prediction.reset(token)
+    
+    assert len(created) == 1
+    assert first["id"] == second["id"] == "task-prediction"
+
+@pytest.mark.asyncio
+async def test_progress_events_fan_out_to_subscribers(monkeypatch):
+    """测试进度事件解析以及同一主题多个订阅者的扇出"""
+    from app.services.progress_stream import ProgressHub, parse_progress, task_event
+    
+    monkeypatch.setattr(settings, "PROGRESS_PUBSUB_BACKEND", "memory")
+    assert parse_progress(" 45%|████▌     | 9/20 [00:02<00:02,  4.1it/s]") == 45.0
+    assert parse_progress("step 5/20 [00:01<00:03]") == 25.0
+    assert parse_progress("loading model") is None
+    
+    hub = ProgressHub()
+    
+    async def collect():
+        return [event async for event in hub.subscribe("task:test")]
+    
+    subscribers = [asyncio.create_task(collect()) for _ in range(2)]
+    await asyncio.sleep(0)
+    await hub.publish("task:test", task_event("test", "processing"))
+    await hub.publish("task:test", task_event("test", "completed", images=["https://example.com/a.png"]))
+    
+    results = await asyncio.gather(*subscribers)
+    assert [[e["type"] for e in events] for events in results] == [["processing", "completed"]] * 2
+    assert hub.get_stats()["subscribers"] == 0
+
+@pytest.mark.asyncio
+async def test_sse_disconnect_while_idle_closes_cleanly(monkeypatch):
+    """测试空闲时客户端断开（__anext__仍在等待）能正常关闭SSE流并释放订阅"""
+    from app.services.progress_stream import ProgressHub, sse_events
+    
+    monkeypatch.setattr(settings, "PROGRESS_PUBSUB_BACKEND", "memory")
+    monkeypatch.setattr(settings, "PROGRESS_HEARTBEAT_INTERVAL", 0.01)
+    hub = ProgressHub()
+    
+    stream = sse_events(hub.subscribe("task:idle"))
+    assert await stream.__anext__() == ": keep-alive\n\n"
+    assert hub.get_stats()["subscribers"] == 1
+    
+    await stream.aclose()
+    assert hub.get_stats()["subscribers"] == 0
+
+@pytest.mark.asyncio
+async def test_terminal_event_replayed_to_late_subscriber(monkeypatch):
+    """测试任务结束后才订阅的客户端能收到结束事件，过期后不再补发"""
+    from app.services.progress_stream import ProgressHub, task_event
+    
+    monkeypatch.setattr(settings, "PROGRESS_PUBSUB_BACKEND", "memory")
+    hub = ProgressHub()
+    await hub.publish("task:done", task_event("done", "completed", result_url="https://example.com/a.png"))
+    
+    events = [event async for event in hub.subscribe("task:done")]
+    assert [event["type"] for event in events] == ["completed"]
+    
+    monkeypatch.setattr(settings, "PROGRESS_TERMINAL_EVENT_TTL", 0)
+    await hub.publish("task:expired", task_event("expired", "failed"))
+    assert await hub._get_last_event("task:expired") is None
+
+def test_circuit_breaker_opens_and_recovers(monkeypatch):
+    """测试熔断器按错误率打开、超时后半开探测并恢复"""
+    from app.services import circuit_breaker as cb
+    
+    now = [1000.0]
+    monkeypatch.setattr(cb.time, "monotonic", lambda: now[0])
+    breaker = cb.CircuitBreaker("test", window_seconds=60, min_requests=4, error_rate_threshold=0.5, open_seconds=30)
+    
+    breaker.record_success()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == cb.STATE_CLOSED
+    breaker.record_failure()
+    assert breaker.state == cb.STATE_OPEN
+    assert breaker.allow_request() is False
+    
+    now[0] += 31
+    assert breaker.allow_request() is True
+    assert breaker.state == cb.STATE_HALF_OPEN
+    assert breaker.allow_request() is False
+    breaker.record_success()
+    assert breaker.state == cb.STATE_CLOSED
+
+@pytest.mark.asyncio
+async def test_slow_primary_is_hedged_to_secondary(monkeypatch):
+    """测试主服务超过p95延迟时对冲到备用服务并取消落败请求"""
+    from app.services.ai_service_manager import AIServiceManager
+    
+    from app.services.provider_router import ProviderRouter
+    
+    manager = AIServiceManager()
+    manager.router = ProviderRouter()
+    for config in manager.services.values():
+        config["health_status"] = "healthy"
+    for _ in range(settings.GENERATION_HEDGE_MIN_SAMPLES):
+        manager.router.record("replicate", "flux-schnell", 0.01, True)
+    monkeypatch.setattr(settings, "ROUTING_STRATEGY", "priority")
+    monkeypatch.setattr(settings, "GENERATION_HEDGING_ENABLED", True)
+    monkeypatch.setattr(settings, "GENERATION_HEDGE_MIN_DELAY", 0.05)
+    
+    cancelled = []
+    
+    async def fake_call(service_name, prompt, params):
+        if service_name == "replicate":
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append(service_name)
+                raise
+        return {"success": True, "images": ["https://example.com/b.png"]}
+    
+    monkeypatch.setattr(manager, "_call_service", fake_call)
+    result = await manager.generate_image(TEST_PROMPT)
+    await asyncio.sleep(0)
+    
+    assert result["service_used"] == "siliconflow"
+    assert manager.stats["hedged"] == 1 and manager.stats["hedge_wins"] == 1
+    assert cancelled == ["replicate"]
+
+@pytest.mark.asyncio
+async def test_router_prefers_faster_provider_from_live_latency(monkeypatch):
+    """测试路由按真实生成延迟和成功率选择服务商，样本不足时按优先级"""
+    from app.services.ai_service_manager import AIServiceManager
+    from app.services.provider_router import ProviderRouter
+    
+    manager = AIServiceManager()
+    manager.router = ProviderRouter()
+    for config in manager.services.values():
+        config["health_status"] = "healthy"
+    monkeypatch.setattr(settings, "ROUTING_STRATEGY", "least_latency")
+    monkeypatch.setattr(settings, "ROUTING_EXPLORATION_RATE", 0.0)
+    
+    assert await manager.select_best_service() == "replicate"
+    
+    for _ in range(settings.ROUTING_MIN_SAMPLES):
+        manager.router.record("replicate", "flux-schnell", 40.0, True)
+        manager.router.record("siliconflow", "stabilityai/stable-diffusion-xl-base-1.0", 8.0, True)
+    
+    assert await manager.select_best_service() == "siliconflow"
+    stats = manager.router.get_provider_stats("replicate")["flux-schnell"]
+    assert stats["p50"] == 40.0 and stats["success_rate"] == 1.0
+
 if __name__ == "__main__":
     # 运行测试
     asyncio.run(test_replicate_service_initialization())
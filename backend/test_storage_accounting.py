@@ -0,0 +1,108 @@
+"""
+存储用量增量统计测试
+"""
+
+import asyncio
+
+import pytest
+
+from app.core.storage_accounting import StorageAccounting
+from app.core.supabase import SupabaseManager
+
+
+def test_counters_follow_uploads_overwrites_and_deletes():
+    accounting = StorageAccounting()
+
+    accounting.record_upload("images", "a.png", 100, owner="u1")
+    accounting.record_upload("images", "b.png", 50, owner="u2")
+    accounting.record_upload("avatars", "c.png", 10)
+    # 覆盖上传只计算差值，归属不变
+    accounting.record_upload("images", "a.png", 120)
+    accounting.record_delete("images", "b.png")
+    accounting.record_delete("images", "missing.png")
+
+    stats = accounting.get_stats()
+    assert (stats["files"], stats["total_size"]) == (2, 130)
+    assert stats["by_bucket"]["images"] == {"objects": 1, "bytes": 120}
+    assert accounting.get_user_usage("u1") == {"objects": 1, "bytes": 120}
+    assert accounting.get_user_usage("u2") == {"objects": 0, "bytes": 0}
+
+
+class FakeListing:
+    """列举期间模拟其他请求写入"""
+
+    def __init__(self, accounting, objects):
+        self.accounting = accounting
+        self.objects = objects
+
+    async def list_buckets(self):
+        return list(self.objects)
+
+    async def list_objects(self, bucket):
+        await asyncio.sleep(0)
+        if bucket == "images":
+            self.accounting.record_upload("images", "new.png", 7, owner="u1")
+            self.accounting.record_delete("images", "gone.png")
+        return self.objects[bucket]
+
+
+@pytest.mark.asyncio
+async def test_reconcile_corrects_drift_and_replays_concurrent_writes():
+    accounting = StorageAccounting()
+    accounting.record_upload("images", "a.png", 100, owner="u1")
+    accounting.record_upload("images", "gone.png", 5, owner="u1")
+
+    source = FakeListing(accounting, {
+        "images": [("a.png", 90), ("gone.png", 5), ("other-worker.png", 30)],
+        "avatars": []
+    })
+    await accounting.reconcile(source)
+
+    stats = accounting.get_stats()
+    assert stats["by_bucket"] == {"images": {"objects": 3, "bytes": 127}, "avatars": {"objects": 0, "bytes": 0}}
+    assert accounting.get_user_usage("u1") == {"objects": 2, "bytes": 97}
+    assert stats["reconciliations"] == 1
+    assert stats["reconciled_at"] is not None
+
+
+class FakeBucket:
+    def __init__(self):
+        self.removed = []
+
+    def upload(self, path, file, options):
+        return {"Key": path}
+
+    def remove(self, paths):
+        self.removed.extend(paths)
+
+    def get_public_url(self, path):
+        return f"https://example.supabase.co/storage/v1/object/public/images/{path}"
+
+
+class FakeClient:
+    def __init__(self):
+        bucket = FakeBucket()
+        self.storage = type("FakeStorage", (), {"from_": lambda self, name: bucket})()
+
+
+@pytest.mark.asyncio
+async def test_manager_records_uploads_and_deletes(tmp_path, monkeypatch):
+    from app.core import supabase
+
+    accounting = StorageAccounting()
+    monkeypatch.setattr(supabase, "storage_accounting", accounting)
+    manager = SupabaseManager()
+    manager.client = manager.admin_client = FakeClient()
+    manager._initialized = True
+
+    path = tmp_path / "file.png"
+    path.write_bytes(b"x" * 300)
+    await manager.upload_file("images", "u1/a.png", b"x" * 100, owner="u1")
+    await manager.upload_file("images", "u1/b.png", str(path), owner="u1")
+    await manager.delete_file("images", "u1/a.png")
+
+    stats = await manager.get_storage_stats()
+    assert stats["success"]
+    assert (stats["files"], stats["total_size"]) == (1, 300)
+    assert accounting.get_user_usage("u1") == {"objects": 1, "bytes": 300}
+    manager.shutdown()
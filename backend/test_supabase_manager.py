@@ -0,0 +1,99 @@
+"""
+Supabase非阻塞调用测试
+"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app.core.supabase import SupabaseManager, SupabaseTimeoutError
+
+
+class FakeBucket:
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.threads = []
+
+    def upload(self, path, file, options):
+        self.threads.append(threading.current_thread().name)
+        time.sleep(self.delay)
+        return {"Key": path}
+
+    def get_public_url(self, path):
+        return f"https://example.supabase.co/storage/v1/object/public/images/{path}"
+
+
+class FakeStorage:
+    def __init__(self, bucket: FakeBucket):
+        self.bucket = bucket
+
+    def from_(self, name):
+        return self.bucket
+
+
+class FakeClient:
+    def __init__(self, delay: float = 0.0):
+        self.bucket = FakeBucket(delay)
+        self.storage = FakeStorage(self.bucket)
+
+
+def make_manager(delay: float = 0.0, **kwargs) -> SupabaseManager:
+    manager = SupabaseManager(**kwargs)
+    manager.client = manager.admin_client = FakeClient(delay)
+    manager._initialized = True
+    return manager
+
+
+@pytest.mark.asyncio
+async def test_slow_upload_does_not_block_event_loop():
+    manager = make_manager(delay=0.2, max_workers=2)
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.01)
+            ticks += 1
+
+    task = asyncio.create_task(ticker())
+    result = await manager.upload_file("images", "a.png", b"data", "image/png")
+    task.cancel()
+
+    assert result["success"] and result["url"].endswith("/a.png")
+    assert ticks >= 10
+    assert manager.admin_client.bucket.threads[0].startswith("supabase")
+    stats = manager.get_stats()["operations"]["upload_file"]
+    assert stats["calls"] == 1 and stats["errors"] == 0
+    assert stats["max_ms"] >= 200
+    manager.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_calls_time_out_and_are_counted():
+    manager = make_manager(delay=0.3, max_workers=1, upload_timeout=0.05)
+
+    result = await manager.upload_file("images", "a.png", b"data")
+
+    assert not result["success"]
+    assert "超时" in result["error"]
+    assert manager.get_stats()["operations"]["upload_file"]["timeouts"] == 1
+
+    with pytest.raises(SupabaseTimeoutError):
+        await manager.run("slow", lambda: time.sleep(0.3), timeout=0.05)
+    manager.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_errors_propagate_from_run():
+    manager = make_manager()
+
+    def fail():
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        await manager.run("fail", fail)
+    assert manager.get_stats()["operations"]["fail"]["errors"] == 1
+    assert manager.get_stats()["in_flight"] == 0
+    manager.shutdown()
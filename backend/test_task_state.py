@@ -0,0 +1,98 @@
+"""
+生成任务状态转换测试
+取消与完成/失败并发时只有一方生效，已取消任务的结果不会被保存、配额不会重复归还
+"""
+
+from app.core.config import settings
+
+# 处理流程依赖数据模型，导入模型会创建数据库引擎（不会建立连接）
+if not settings.POSTGRES_URL_NON_POOLING:
+    settings.POSTGRES_URL_NON_POOLING = "sqlite://"
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+import app.api.generate as generate_api
+from app.models.generation_task import GenerationTask
+from app.models.image import Image
+from app.models.user import User
+from app.schemas.generation import GenerationRequest
+from app.services.task_state import transition_task
+
+
+@pytest.fixture
+def db(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'tasks.db'}")
+    for model in (GenerationTask, Image, User):
+        model.__table__.create(engine)
+    with Session(engine) as session:
+        session.add(GenerationTask(id="t1", user_id="u1", prompt="p", ai_model="siliconflow-sdxl", status="pending"))
+        session.commit()
+        yield session
+    engine.dispose()
+
+
+def test_only_active_tasks_transition(db):
+    """测试只有进行中的任务会被转换，先到者生效"""
+    assert transition_task(db, "t1", "processing")
+    assert transition_task(db, "t1", "cancelled")
+    db.commit()
+
+    assert not transition_task(db, "t1", "completed", result_url="https://example.com/a.png")
+    assert not transition_task(db, "t1", "failed", error_message="boom")
+    assert not transition_task(db, "t1", "cancelled")
+    assert not transition_task(db, "missing", "cancelled")
+    db.commit()
+
+    task = db.get(GenerationTask, "t1")
+    assert task.status == "cancelled"
+    assert task.result_url is None and task.error_message is None
+
+
+@pytest.mark.asyncio
+async def test_results_of_cancelled_task_are_discarded(db, monkeypatch):
+    """测试生成期间被取消的任务不保存图片，也不再归还配额"""
+    released = []
+
+    async def generate_then_cancel(**kwargs):
+        # 模拟用户在生成期间取消（取消接口已归还配额）
+        assert transition_task(db, "t1", "cancelled")
+        db.commit()
+        return {"success": True, "images": ["https://example.com/a.png"]}
+
+    async def release_task(task):
+        released.append(task.id)
+
+    monkeypatch.setattr(generate_api.ai_service_manager, "generate_image_with_fallback", generate_then_cancel, raising=False)
+    monkeypatch.setattr(generate_api.quota_ledger, "release_task", release_task)
+
+    await generate_api.process_generation_task("t1", GenerationRequest(prompt="a cat"), db)
+
+    db.expire_all()
+    assert db.get(GenerationTask, "t1").status == "cancelled"
+    assert db.query(Image).count() == 0
+    assert released == []
+
+
+@pytest.mark.asyncio
+async def test_failure_after_cancel_does_not_refund_again(db, monkeypatch):
+    """测试取消后的失败不会把状态覆盖为failed，也不会再次归还配额"""
+    released = []
+
+    async def fail_after_cancel(**kwargs):
+        assert transition_task(db, "t1", "cancelled")
+        db.commit()
+        raise RuntimeError("provider error")
+
+    async def release_task(task):
+        released.append(task.id)
+
+    monkeypatch.setattr(generate_api.ai_service_manager, "generate_image_with_fallback", fail_after_cancel, raising=False)
+    monkeypatch.setattr(generate_api.quota_ledger, "release_task", release_task)
+
+    await generate_api.process_generation_task("t1", GenerationRequest(prompt="a cat"), db)
+
+    db.expire_all()
+    assert db.get(GenerationTask, "t1").status == "cancelled"
+    assert released == []
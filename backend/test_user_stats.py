@@ -0,0 +1,128 @@
+"""
+用户统计服务测试
+"""
+
+from app.core.config import settings
+
+# 统计服务依赖数据模型，导入模型会创建数据库引擎（不会建立连接）
+if not settings.POSTGRES_URL_NON_POOLING:
+    settings.POSTGRES_URL_NON_POOLING = "sqlite://"
+
+import warnings
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.exc import SAWarning
+from sqlalchemy.orm import Session
+
+from app.models.generation_task import GenerationTask
+from app.models.image import Image
+from app.models.user_favorite import UserFavorite
+from app.services.task_state import transition_task
+from app.services.user_stats import UserStatsService, build_stats_query, user_stats
+
+
+@pytest.fixture
+def db(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'stats.db'}")
+    for model in (GenerationTask, Image, UserFavorite):
+        model.__table__.create(engine)
+    with Session(engine) as session:
+        yield session
+    engine.dispose()
+
+
+def test_stats_query_aggregates_in_one_statement(db):
+    """测试单条语句得到全部统计"""
+    for i, (status, model) in enumerate([
+        ("completed", "flux"), ("completed", "flux"), ("failed", "sdxl"), ("processing", "flux")
+    ]):
+        db.add(GenerationTask(id=f"t{i}", user_id="u1", prompt="p", ai_model=model, status=status))
+    db.add(GenerationTask(id="other", user_id="u2", prompt="p", ai_model="sdxl", status="completed"))
+    db.add(Image(id="i1", user_id="u1", prompt="p", ai_model="flux", image_url="x", is_public=True, likes_count=3, views_count=10))
+    db.add(Image(id="i2", user_id="u1", prompt="p", ai_model="flux", image_url="x", is_public=False, likes_count=1, views_count=5))
+    db.add(UserFavorite(id="f1", user_id="u1", image_id="i9"))
+    db.commit()
+
+    # 子查询显式连接，不应触发笛卡尔积警告
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", SAWarning)
+        row = dict(db.execute(build_stats_query("u1")).mappings().one())
+    assert row == {
+        "total_tasks": 4,
+        "successful_generations": 2,
+        "failed_generations": 1,
+        "pending_generations": 1,
+        "total_images": 2,
+        "public_images": 1,
+        "total_likes": 4,
+        "total_views": 15,
+        "total_favorites": 1,
+        "most_used_model": "flux"
+    }
+
+    empty = dict(db.execute(build_stats_query("nobody")).mappings().one())
+    assert empty["total_tasks"] == 0 and empty["total_likes"] == 0 and empty["most_used_model"] is None
+
+
+def test_commit_invalidates_cached_user(db):
+    """测试写入提交后失效对应用户缓存，回滚不失效"""
+    user_stats._entries["u1"] = (float("inf"), {"total_tasks": 0})
+    user_stats._entries["u2"] = (float("inf"), {"total_tasks": 0})
+
+    db.add(GenerationTask(id="t1", user_id="u1", prompt="p", ai_model="flux"))
+    db.flush()
+    db.rollback()
+    assert "u1" in user_stats._entries
+
+    db.add(GenerationTask(id="t1", user_id="u1", prompt="p", ai_model="flux"))
+    db.commit()
+    assert "u1" not in user_stats._entries
+    assert "u2" in user_stats._entries
+    user_stats._entries.clear()
+
+
+def test_bulk_transition_invalidates_cached_user(db):
+    """测试条件UPDATE（不触发ORM事件）转换成功并提交后失效对应用户缓存"""
+    db.add(GenerationTask(id="t1", user_id="u1", prompt="p", ai_model="flux", status="processing"))
+    db.commit()
+    user_stats._entries["u1"] = (float("inf"), {"pending_generations": 1})
+
+    assert transition_task(db, "t1", "cancelled")
+    assert "u1" in user_stats._entries
+    db.commit()
+    assert "u1" not in user_stats._entries
+
+    # 未转换时不失效
+    user_stats._entries["u1"] = (float("inf"), {"pending_generations": 0})
+    assert not transition_task(db, "t1", "completed")
+    db.commit()
+    assert "u1" in user_stats._entries
+    user_stats._entries.clear()
+
+
+@pytest.mark.asyncio
+async def test_writes_from_other_processes_are_visible_after_ttl(tmp_path):
+    """测试其他进程的写入（不经过本进程Session）最多滞后TTL"""
+    import asyncio
+    from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'ttl.db'}")
+    async with engine.begin() as conn:
+        for model in (GenerationTask, Image, UserFavorite):
+            await conn.run_sync(model.__table__.create)
+
+    service = UserStatsService(ttl=0.2, max_entries=10)
+    async with AsyncSession(engine) as session:
+        assert (await service.get(session, "u1"))["total_tasks"] == 0
+
+        # 模拟worker进程直接写库：本进程的提交事件不会触发
+        async with engine.begin() as conn:
+            await conn.execute(GenerationTask.__table__.insert().values(
+                id="t1", user_id="u1", prompt="p", ai_model="flux", status="completed"
+            ))
+        assert (await service.get(session, "u1"))["total_tasks"] == 0
+
+        await asyncio.sleep(0.25)
+        assert (await service.get(session, "u1"))["total_tasks"] == 1
+    await engine.dispose()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+生成任务worker入口
+用法: python worker.py --processes 2 --concurrency 4
+"""
+
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def run_worker_process(concurrency: int):
+    """单个worker进程"""
+    from app.core.config import settings
+    from app.services.generation_worker import GenerationWorker
+    from app.services.image_ingestion import image_ingestion
+
+    worker = GenerationWorker(concurrency=concurrency or settings.WORKER_CONCURRENCY)
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, worker.stop)
+        try:
+            await worker.run()
+        finally:
+            # 完成本进程提交的图片转存
+            await image_ingestion.stop()
+
+    asyncio.run(main())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="吉卜力AI平台生成任务worker")
+    parser.add_argument("--processes", type=int, default=1, help="worker进程数")
+    parser.add_argument("--concurrency", type=int, default=0, help="每个进程的并发任务数")
+    args = parser.parse_args()
+
+    if args.processes <= 1:
+        run_worker_process(args.concurrency)
+        return
+
+    processes = [
+        multiprocessing.Process(target=run_worker_process, args=(args.concurrency,))
+        for _ in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+    logger.info(f"已启动 {len(processes)} 个worker进程")
+
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+
+
+if __name__ == "__main__":
+    main()
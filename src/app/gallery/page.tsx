@@ -128,7 +128,7 @@ export default function GalleryPage() {
                 <div className="relative aspect-square rounded-lg overflow-hidden bg-gray-100 mb-4">
                   {image.image_url ? (
                     <Image
-                      src={image.image_url}
+                      src={image.thumbnail_url || image.image_url}
                       alt={image.prompt}
                       fill
                       className="object-cover"
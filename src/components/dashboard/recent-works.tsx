@@ -101,7 +101,7 @@ export function RecentWorks({
                 <div className="relative aspect-square rounded-lg overflow-hidden bg-gray-100 mb-3">
                   {image.image_url ? (
                     <Image
-                      src={image.image_url}
+                      src={image.thumbnail_url || image.image_url}
                       alt={image.prompt}
                       fill
                       className="object-cover transition-transform duration-200 group-hover:scale-105"
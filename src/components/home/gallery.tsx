@@ -60,7 +60,7 @@ export function Gallery() {
                 <div className="relative aspect-square rounded-lg overflow-hidden bg-gray-100 mb-4">
                   {image.image_url ? (
                     <Image
-                      src={image.image_url}
+                      src={image.thumbnail_url || image.image_url}
                       alt={image.prompt}
                       fill
                       className="object-cover group-hover:scale-105 transition-transform duration-300"
@@ -17,6 +17,7 @@ export interface Image {
   ai_model: string
   image_url: string
   thumbnail_url?: string
+  variants?: Record<string, Record<string, string>>
   width?: number
   height?: number
   generation_params?: Record<string, any>